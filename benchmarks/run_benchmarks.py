@@ -0,0 +1,434 @@
+"""Benchmark suite of mikaia_plugin_api against a local MockSlideService(no MIKAIA instance required).
+
+Measures the tile throughput, the annotation upload/download rates and the I/O of the example pipelines.
+The results are saved as JSON, so runs on different commits can be compared:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    ... change the code ...
+    python benchmarks/run_benchmarks.py --compare before.json
+
+All values are throughputs(higher is better). They include the time spent by the mock server, which is the
+same for all commits, and are only comparable between runs on the same machine with the same settings.
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.batch_preprocessor import BatchPreprocessor, scaleToMinusOneOne
+from mikaia_plugin_api.batch_runner import BatchRunner
+from mikaia_plugin_api.coarse_to_fine import CoarseToFine
+from mikaia_plugin_api.feature_store import FeatureStore
+from mikaia_plugin_api.roi_tiler import RoiTiler
+from mikaia_plugin_api.seam_stitcher import SeamStitcher, overlappedTiling
+from mikaia_plugin_api.shard_coordinator import ShardCoordinator
+
+
+class MockServerProcess(object):
+    """MockServerProcess Runs the MockSlideService in a separate process, so it doesn't compete with the client for the GIL"""
+
+    def __init__(self, latency_ms=0.0, bandwidth_mbps=0.0, cache_mb=1024):
+        env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        self._process = subprocess.Popen([sys.executable, '-m', 'mikaia_plugin_api.mock_slide_service', '--port', '0',
+                                          '--latency-ms', str(latency_ms), '--bandwidth-mbps', str(bandwidth_mbps),
+                                          '--cache-mb', str(cache_mb)],
+                                         stdout=subprocess.PIPE, text=True, env=env)
+        line = self._process.stdout.readline()
+        if not line.startswith('Mock SlideService listening on '):
+            self.close()
+            raise Exception('Mock SlideService failed to start.')
+        self.url = line.split()[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._process.terminate()
+        self._process.wait()
+        self._process.stdout.close()
+
+
+# Returns 'count' random polygons(list of (n, 1, 2) float32 arrays, like cv2.findContours()) within the slide.
+def randomPolygons(count, slide_w_um, slide_h_um, vertices=32, seed=0):
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0.0, 2.0 * np.pi, vertices, endpoint=False)
+    centers = rng.uniform(0.1, 0.9, (count, 2)) * (slide_w_um, slide_h_um)
+    radii = rng.uniform(3.0, 8.0, (count, 1)) * rng.uniform(0.8, 1.2, (count, vertices))
+    x = centers[:, :1] + radii * np.cos(angles)
+    y = centers[:, 1:] + radii * np.sin(angles)
+    points = np.stack([x, y], axis=-1).astype(np.float32)
+    return [p.reshape(-1, 1, 2) for p in points]
+
+
+# Returns 'count' tissue tiles of the analysis ROI(repeated if there aren't enough).
+def tissueTiles(ss, count, tile_px):
+    res = ss.getSlideInfo().nativeResolution.width
+    tiles = RoiTiler(ss, tile_px * res).tiles()
+    return [tiles[i % len(tiles)] for i in range(count)]
+
+
+def benchTiles(server, count, tile_px, raw_pixels, max_in_flight):
+    ss = mikaia_api.SlideService(server.url)
+    tiles = tissueTiles(ss, count, tile_px)
+    if not raw_pixels:
+        # only accept encoded images
+        ss._pixelArrayHeaders = {'Accept': 'image/png, image/*;q=0.8'}
+    # warm up the response cache of the server, so the client side is measured
+    for tile, img in ss.iterTiles(tiles, tile_px, tile_px, max_in_flight=8):
+        pass
+    start = time.perf_counter()
+    received = 0
+    if max_in_flight > 0:
+        for tile, img in ss.iterTiles(tiles, tile_px, tile_px, max_in_flight=max_in_flight):
+            received += img.nbytes
+    else:
+        for tile in tiles:
+            received += ss.getNativeROIArray(tile[0][0], tile[0][1], tile_px, tile_px).nbytes
+    seconds = time.perf_counter() - start
+    ss.close()
+    return {'value': count / seconds, 'unit': 'tiles/s', 'seconds': seconds,
+            'mb_per_s': received / seconds / 1e6}
+
+
+def benchAnnotationUpload(server, count, method):
+    ss = mikaia_api.SlideService(server.url)
+    info = ss.getSlideInfo()
+    polygons = randomPolygons(count, info.slideRect.width, info.slideRect.height)
+    start = time.perf_counter()
+    if method == 'batch':
+        batch = AnnotationBatch.fromContours(polygons, 'Cells')
+        ss.addAnnotationBatch(batch)
+    else:
+        annotations = [ss.createAnnotation('Polygon', p.reshape(-1, 2).tolist(), class_name='Cells') for p in polygons]
+        for first in range(0, count, 5000):
+            ss.addAnnotations(annotations[first:first + 5000])
+    seconds = time.perf_counter() - start
+    ss.close()
+    return {'value': count / seconds, 'unit': 'annotations/s', 'seconds': seconds}
+
+
+def benchAnnotationDownload(server, count):
+    ss = mikaia_api.SlideService(server.url)
+    info = ss.getSlideInfo()
+    ss.addAnnotationBatch(AnnotationBatch.fromContours(
+        randomPolygons(count, info.slideRect.width, info.slideRect.height), 'Cells'))
+    start = time.perf_counter()
+    annotations = ss.getAnnotations()
+    seconds = time.perf_counter() - start
+    ss.close()
+    return {'value': len(annotations) / seconds, 'unit': 'annotations/s', 'seconds': seconds}
+
+
+# Reclassify 'count' annotations with updateAnnotations()('bulk') or one updateAnnotation() per annotation('single').
+def benchAnnotationUpdate(server, count, method):
+    ss = mikaia_api.SlideService(server.url)
+    annotations = ss.addAnnotations([ss.createAnnotation('Rectangle', [[i, 0], [i + 1, 1]], class_name='Tiles')
+                                     for i in range(count)])
+    for anno in annotations:
+        anno.className = 'Tiles smoothed'
+    start = time.perf_counter()
+    if method == 'bulk':
+        ss.updateAnnotations(annotations)
+    else:
+        for anno in annotations:
+            ss.updateAnnotation(anno)
+    seconds = time.perf_counter() - start
+    ss.close()
+    return {'value': count / seconds, 'unit': 'annotations/s', 'seconds': seconds}
+
+
+# I/O of examples/TensorFlowClassificationPlugin.py without the model: 224 px tiles in batches of 32
+# normalized to [-1, 1] by BatchPreprocessor, one rectangle annotation per tile.
+# workers: preprocessing worker processes, 0 for threads of the benchmark process.
+def benchPipelineTensorFlow(server, max_tiles, workers=None):
+    ss = mikaia_api.SlideService(server.url)
+    start = time.perf_counter()
+    res = ss.getSlideInfo().nativeResolution
+    tiler = RoiTiler(ss, 224 * res.width, 224 * res.height, rois=ss.getAnalysisRoi().roi)
+    tiles = tiler.tiles()[:max_tiles]
+    labels = ['Tumor Cells', 'Inflammation', 'Connective/Fat', 'Muscle', 'Mucosa', 'Mucus', 'Necrosis']
+    ss.addAnnotationClasses([ss.createAnnotationClass(label) for label in labels])
+    batch_size = 32
+    batches = BatchPreprocessor(ss, tiles, batch_size, 224, 224, transform=scaleToMinusOneOne, workers=workers)
+    for index, (batch_tiles, batch, ok) in enumerate(batches):
+        ss.sendProgress(index / len(batches), 0, 'Batch {}'.format(index + 1))
+        predicted = ((batch.mean(axis=(1, 2, 3)) + 1.0) * 3.5).astype(int) % len(labels)
+        ss.addAnnotations([ss.createAnnotation('Rectangle', tile, class_name=labels[p])
+                           for tile, p, tile_ok in zip(batch_tiles, predicted, ok) if tile_ok])
+    ss.sendProgress(1.0, 0, 'Classification finished')
+    ss.close()
+    seconds = time.perf_counter() - start
+    return {'value': len(tiles) / seconds, 'unit': 'tiles/s', 'seconds': seconds}
+
+
+# I/O of examples/example_cellpose_segmentation_in_mikaia.py without the model: 1024 px tiles in batches of 4
+# run by BatchRunner, 200 cell polygons per tile uploaded as AnnotationBatch.
+def benchPipelineCellpose(server, max_tiles):
+    ss = mikaia_api.SlideService(server.url)
+    start = time.perf_counter()
+    info = ss.getSlideInfo()
+    res = info.nativeResolution
+    tiler = RoiTiler(ss, 1024 * res.width, 1024 * res.height, min_coverage=0.05, slide_info=info)
+    tiles = tiler.tiles()[:max_tiles]
+
+    def toAnnotations(batch_tiles, results):
+        contours = []
+        for tile in batch_tiles:
+            polygons = randomPolygons(200, 1024 * res.width, 1024 * res.height, seed=int(tile[0][0] + tile[0][1]))
+            contours += [p + np.array(tile[0], dtype=np.float32) for p in polygons]
+        return AnnotationBatch.fromContours(contours, class_name='Cells')
+
+    runner = BatchRunner(ss, lambda batch: batch, postprocess=toAnnotations, batch_size=4, px_width_um=res.width,
+                         px_height_um=res.height, max_in_flight=4)
+    count = runner.run(tiles)
+    ss.close()
+    seconds = time.perf_counter() - start
+    return {'value': count / seconds, 'unit': 'tiles/s', 'seconds': seconds}
+
+
+# Coarse pass of CoarseToFine over the whole slide(224 px tiles, no thumbnail tissue mask): candidate tiles
+# scored per second. 'saved' is the fraction of the native pixel traffic that the fine pass doesn't need to read.
+def benchCoarseToFine(server):
+    ss = mikaia_api.SlideService(server.url)
+    start = time.perf_counter()
+    res = ss.getSlideInfo().nativeResolution
+    selection = CoarseToFine(ss, 224 * res.width, 224 * res.height, tissue=False)
+    ss.close()
+    seconds = time.perf_counter() - start
+    stats = selection.stats()
+    return {'value': stats['candidates'] / seconds, 'unit': 'tiles/s', 'seconds': seconds, 'saved': stats['saved']}
+
+
+# Worker of benchPipelineCellposeSharded(): reads the tiles at native resolution and returns 200 cell polygons
+# per tile as AnnotationBatch.
+def setupCellposeIo(ss):
+    res = ss.getSlideInfo().nativeResolution
+
+    def process(tiles):
+        batch = AnnotationBatch()
+        for tile, pixels in ss.iterTiles(tiles, px_width_um=res.width, px_height_um=res.height, max_in_flight=4):
+            polygons = randomPolygons(200, 1024 * res.width, 1024 * res.height, seed=int(tile[0][0] + tile[0][1]))
+            batch.addContours([p + np.array(tile[0], dtype=np.float32) for p in polygons], class_name='Cells')
+        return batch
+    return process
+
+
+# I/O of the cellpose pipeline sharded over local worker processes by ShardCoordinator.
+def benchPipelineCellposeSharded(server, max_tiles, workers):
+    ss = mikaia_api.SlideService(server.url)
+    start = time.perf_counter()
+    info = ss.getSlideInfo()
+    res = info.nativeResolution
+    tiles = RoiTiler(ss, 1024 * res.width, 1024 * res.height, min_coverage=0.05, slide_info=info).tiles()[:max_tiles]
+    with ShardCoordinator(ss, setupCellposeIo, workers=workers, chunk_tiles=2) as coordinator:
+        count = coordinator.run(tiles)
+    ss.close()
+    seconds = time.perf_counter() - start
+    return {'value': count / seconds, 'unit': 'tiles/s', 'seconds': seconds}
+
+
+# SeamStitcher over a 10 x 10 grid of overlapping 1024 px tiles(64 px margin) with 2000 cells per tile:
+# instances stitched per second.
+def benchSeamStitcher(server):
+    tile_w, tile_h, stride_w, stride_h = overlappedTiling(1024.0, 1024.0, 64.0)
+    tiles = [[[x * stride_w, y * stride_h], [x * stride_w + tile_w, y * stride_h + tile_h]]
+             for y in range(10) for x in range(10)]
+    rng = np.random.default_rng(0)
+    square = np.array([[0, 0], [12, 0], [12, 12], [0, 12]], dtype=np.float32)
+    batches = [AnnotationBatch.fromContours(square + rng.uniform(tile[0], np.subtract(tile[1], 12), size=(2000, 1, 2))
+                                            .astype(np.float32), 'Cells') for tile in tiles]
+    start = time.perf_counter()
+    stitcher = SeamStitcher(tiles, 64.0)
+    for tile, batch in zip(tiles, batches):
+        stitcher.add(tile, batch)
+    stitcher.flush()
+    seconds = time.perf_counter() - start
+    return {'value': stitcher.stats()['instances'] / seconds, 'unit': 'instances/s', 'seconds': seconds}
+
+
+# Metadata lookups of per-tile helper code(resolution conversion and class lookup) with and without the session
+# metadata cache of SlideService: lookups per second.
+def benchMetadataLookups(server, count, cached):
+    ss = mikaia_api.SlideService(server.url, metadata_cache=cached)
+    start = time.perf_counter()
+    for i in range(count):
+        ss.getSlideInfo().nativeResolution
+        {anno_class.className: anno_class.id for anno_class in ss.getAnnotationClasses()}.get('Cells')
+    seconds = time.perf_counter() - start
+    avoided = ss.getMetadataCacheStats()['avoided_requests']
+    ss.close()
+    return {'value': 2 * count / seconds, 'unit': 'lookups/s', 'seconds': seconds, 'avoided_requests': avoided}
+
+
+# FeatureStore of 1024 float16 features per tile: rows appended per second in batches of 64(what='append'),
+# rows clustered per second by kmeans() with 16 clusters(what='kmeans') and query rows per second of nearest().
+def benchFeatureStore(server, rows, what):
+    directory = tempfile.mkdtemp()
+    try:
+        features = np.random.default_rng(0).normal(size=(rows, 1024)).astype(np.float16)
+        tiles = [[[i * 100.0, 0.0], [i * 100.0 + 100.0, 100.0]] for i in range(rows)]
+        start = time.perf_counter()
+        with FeatureStore(directory, dims=1024) as store:
+            if what != 'append':
+                store.append(tiles, features)
+                start = time.perf_counter()
+            if what == 'append':
+                for first in range(0, rows, 64):
+                    store.append(tiles[first:first + 64], features[first:first + 64])
+                store.flush()
+            elif what == 'kmeans':
+                store.kmeans(16, iterations=20)
+            else:
+                store.nearest(features[:64], k=10)
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+    count = 64 if what == 'nearest' else rows
+    return {'value': count / seconds, 'unit': 'queries/s' if what == 'nearest' else 'rows/s', 'seconds': seconds}
+
+
+# Run an example script end to end against the mock server. Skipped if its dependencies aren't installed.
+def benchExample(server, script, modules):
+    missing = [m for m in modules if importlib.util.find_spec(m) is None]
+    if missing:
+        return {'skipped': 'not installed: ' + ', '.join(missing)}
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, script, server.url], cwd=os.path.join(ROOT, 'examples'), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - start
+    if result.returncode != 0:
+        return {'skipped': 'failed: ' + result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+    return {'value': 1.0 / seconds, 'unit': 'runs/s', 'seconds': seconds}
+
+
+def benchmarks(quick):
+    tiles = 64 if quick else 512
+    ret = [
+        ('tiles_native_raw_512px', lambda server: benchTiles(server, tiles, 512, True, 8)),
+        ('tiles_native_png_512px', lambda server: benchTiles(server, tiles, 512, False, 8)),
+        ('tiles_native_raw_512px_sequential', lambda server: benchTiles(server, tiles // 2, 512, True, 0)),
+        ('tiles_native_raw_224px', lambda server: benchTiles(server, tiles * 4, 224, True, 16)),
+        ('annotations_upload_10k_batch', lambda server: benchAnnotationUpload(server, 10000, 'batch')),
+        ('annotations_upload_10k_list', lambda server: benchAnnotationUpload(server, 10000, 'list')),
+        ('annotations_download_10k', lambda server: benchAnnotationDownload(server, 10000)),
+        ('annotations_update_10k_bulk', lambda server: benchAnnotationUpdate(server, 10000, 'bulk')),
+        ('annotations_update_2k_single', lambda server: benchAnnotationUpdate(server, 2000, 'single')),
+    ]
+    if not quick:
+        ret += [
+            ('annotations_upload_100k_batch', lambda server: benchAnnotationUpload(server, 100000, 'batch')),
+            ('annotations_download_100k', lambda server: benchAnnotationDownload(server, 100000)),
+        ]
+    ret += [
+        ('pipeline_tensorflow_io', lambda server: benchPipelineTensorFlow(server, 256 if quick else 2048)),
+        ('pipeline_tensorflow_io_threads', lambda server: benchPipelineTensorFlow(server, 256 if quick else 2048, 0)),
+        ('coarse_to_fine_224px', benchCoarseToFine),
+        ('pipeline_cellpose_io', lambda server: benchPipelineCellpose(server, 8 if quick else 48)),
+        ('pipeline_cellpose_io_sharded', lambda server: benchPipelineCellposeSharded(server, 8 if quick else 48, 2)),
+        ('seam_stitcher_200k', benchSeamStitcher),
+        ('metadata_lookups_cached', lambda server: benchMetadataLookups(server, 20000, True)),
+        ('metadata_lookups_uncached', lambda server: benchMetadataLookups(server, 200, False)),
+        ('features_append_1024d', lambda server: benchFeatureStore(server, 20000 if quick else 100000, 'append')),
+        ('features_kmeans_1024d', lambda server: benchFeatureStore(server, 20000 if quick else 100000, 'kmeans')),
+        ('features_nearest_1024d', lambda server: benchFeatureStore(server, 20000 if quick else 100000, 'nearest')),
+        ('example_tensorflow', lambda server: benchExample(server, 'TensorFlowClassificationPlugin.py',
+                                                           ['tensorflow'])),
+        ('example_cellpose', lambda server: benchExample(server, 'example_cellpose_segmentation_in_mikaia.py',
+                                                         ['cellpose', 'cv2', 'skimage'])),
+    ]
+    return ret
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results, previous):
+    print('\n{:<36} {:>14} {:>14} {:>9}'.format('benchmark', 'previous', 'current', 'change'))
+    for name, result in results['results'].items():
+        old = previous['results'].get(name, {})
+        if 'value' not in result or 'value' not in old:
+            continue
+        change = (result['value'] - old['value']) / old['value'] * 100.0
+        print('{:<36} {:>14.1f} {:>14.1f} {:>+8.1f}%'.format(name, old['value'], result['value'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of mikaia_plugin_api against a local mock SlideService.')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads, one repetition')
+    parser.add_argument('--repeat', type=int, default=0, help='repetitions per benchmark(the best is reported)')
+    parser.add_argument('--only', default='', help='comma separated name prefixes of the benchmarks to run')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='latency added by the mock server')
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0, help='bandwidth limit of the mock server')
+    parser.add_argument('--output', default='', help='result file. Default: benchmarks/results/<commit>-<time>.json')
+    parser.add_argument('--compare', default='', help='result file of a previous run to compare with')
+    args = parser.parse_args()
+    repeat = args.repeat if args.repeat > 0 else (1 if args.quick else 3)
+    only = [prefix for prefix in args.only.split(',') if prefix]
+
+    results = {'commit': gitCommit(),
+               'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'settings': {'quick': args.quick, 'repeat': repeat, 'latency_ms': args.latency_ms,
+                            'bandwidth_mbps': args.bandwidth_mbps},
+               'results': {}}
+    for name, bench in benchmarks(args.quick):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        runs = []
+        for i in range(repeat):
+            # a new server per run, so uploaded annotations don't accumulate
+            with MockServerProcess(args.latency_ms, args.bandwidth_mbps) as server:
+                runs.append(bench(server))
+            if 'skipped' in runs[-1]:
+                break
+        if 'skipped' in runs[-1]:
+            result = runs[-1]
+            print('{:<36} skipped ({})'.format(name, result['skipped']))
+        else:
+            result = dict(max(runs, key=lambda r: r['value']))
+            result['median'] = statistics.median(r['value'] for r in runs)
+            print('{:<36} {:>12.1f} {}'.format(name, result['value'], result['unit']))
+        results['results'][name] = result
+
+    output = args.output
+    if not output:
+        output = os.path.join(ROOT, 'benchmarks', 'results', '{}-{}.json'.format(
+            results['commit'] or 'nocommit', datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved to {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
-import tensorflow as tf
 import numpy as np
 import sys
 from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.batch_preprocessor import BatchPreprocessor, scaleToMinusOneOne
+from mikaia_plugin_api.roi_tiler import RoiTiler
+from mikaia_plugin_api.run_journal import RunJournal
 
 def main():
     
@@ -32,17 +34,35 @@ def main():
     #slideServiceAndSessIdUrl = 'http://10.54.73.31:9980/MIKAIA/SlideService/v1/000002fadf6ea300'  
     
     #initialize the MIKAIA Slide Service client
-    progress_0to1 = 0.01
     print("Connecting to MIKAIA SlideService '{}' ...".format(slideServiceAndSessIdUrl)) 
     ss = mikaia_api.SlideService(slideServiceAndSessIdUrl)
+    init()
+    run(ss)
+
+
+# the tensorflow model is loaded once per process.
+# if the MIKAIA Script Service runs this plugin in a resident worker process, init() is called once
+# when the worker starts and run() for every execution, so the model isn't loaded again for each run.
+# MIKAIA_RESIDENT_WORKER opts in to resident worker processes.
+MIKAIA_RESIDENT_WORKER = True
+model = None
+
+def init():
+    global model
+    # tensorflow is imported here and not at the top of the script: the tile preprocessing worker processes
+    # import this script again and don't need it.
+    import tensorflow as tf
+    #load the tensorflow model
+    # you can use your own AI model instead.
+    model = tf.keras.models.load_model("./zoo/colon_classifier_effnet_b0")
+
+
+def run(ss):
+    progress_0to1 = 0.01
     ss.sendProgress(progress_0to1, 0, 'Running TensorFlow classification sample...') 
     slideInfo = ss.getSlideInfo()
 
-    #load the tensorflow model and define model-specific parameters
-    # you can use your own AI model instead.
-    progress_0to1 = 0.05
-    ss.sendProgress(progress_0to1, 0, 'Loading TensorFlow model...') 
-    model = tf.keras.models.load_model("./zoo/colon_classifier_effnet_b0")
+    #define model-specific parameters
     labels = ["Tumor Cells", "Inflammation", "Connective/Fat", "Muscle", "Mucosa", "Mucus", "Necrosis"]
     patchWidth_px = 224
     batchSize = 32
@@ -50,22 +70,24 @@ def main():
     progress_0to1 = 0.10
     ss.sendProgress(progress_0to1, 0, 'Calculate patch size and number of tiles...') 
     
-    #calculate the target input width in um, so that the tiles can be retrieved from MIKAIA in the correct size
-    patchWidth_um, patchHeigh_um = px2um(patchWidth_px, slideInfo)
-
-    # get ROIs to analyze from retrieved SlideInfo object
-    rois =slideInfo.roi
+    # get ROIs to analyze from the analysis ROI of the session
+    rois = ss.getAnalysisRoi().roi
     
     # Alternatively retrieve the ROIs from the slide (annotations of a certain class e.g. "roi", "Tissue", ...). 
     # rois = ss.getAnnotations("", "roi")
 
-    #go through each roi and calculate the tile coordinates
-    tiles = calculateTilesFromRois(rois, patchWidth_um, patchHeigh_um)
-    msg = "{} ROI(s) splitted into {} tiles".format(len(rois), len(tiles))
+    #split the ROIs(incl. polygons and holes) into a grid of patches.
+    #patches that lie mostly outside of the ROIs or on glass(tissue mask from the slide thumbnail) are skipped
+    patchWidth_um = patchWidth_px * slideInfo.nativeResolution.width
+    patchHeight_um = patchWidth_px * slideInfo.nativeResolution.height
+    tiler = RoiTiler(ss, patchWidth_um, patchHeight_um, rois=rois, min_coverage=0.5, slide_info=slideInfo)
+    tiles = tiler.tiles()
+    numTiles = len(tiles)
+    msg = "{} ROI(s) splitted into {} tiles({} tiles skipped)".format(len(rois), numTiles, tiler.gridTileCount() - numTiles)
     print(msg)
     ss.sendMessage(msg) 
 
-    if len(tiles) == 0:
+    if numTiles == 0:
         ss.sendMessage("ERROR: ROI absent or too small.") 
         sys.exit("ROI absent or too small.")
         
@@ -82,93 +104,64 @@ def main():
     annoClasses.append(ss.createAnnotationClass('Necrosis', 'Necrosis', 3, '#ff660000' ))
     ss.addAnnotationClasses(annoClasses)
 
+    # the progress of every tile is recorded in a local journal. if a previous run on this slide was interrupted,
+    # its classified tiles are skipped and results that never reached MIKAIA are uploaded without classifying again
+    journal = RunJournal.forRun(ss, params={'model': 'colon_classifier_effnet_b0', 'patch_px': patchWidth_px,
+                                            'min_coverage': 0.5, 'rois': [roi.to_json() for roi in rois]})
+    journal.resumeUploads(ss)
+    tiles = journal.remaining(tiles)
+    numTiles = len(tiles)
+    print(journal.summary())
+    ss.sendMessage(journal.summary())
+
     #set batch-related parameters
     currentBatch = 0 #the batch currently being processed
-    numBatches = np.ceil(len(tiles)/batchSize).astype(int) #the number of total batches needed to process all of the tiles
+    numBatches = np.ceil(numTiles/batchSize).astype(int) #the number of total batches needed to process all of the tiles
 
     #iterate through the tiles of each batch, retrieve the tile images, feed them into the model for classification, and send the results back to MIKAIA as annotations
     msg = "Start classification - {} batches a {} tiles".format(numBatches, batchSize)
     print(msg)
     ss.sendMessage(msg)
     
-    progressStep = (0.95 - progress_0to1) / (2*numBatches)
-    while currentBatch < numBatches:
-        # retrieve the tile images for the current batch from MIKAIA and prepare them for classification
-        # (for performance reasons, it would be better to retrieve a larger ROI and then split it here into patches)
+    # the tiles are fetched, decoded and normalized to the range used by the model([-1,1]) in worker processes.
+    # they write the batches directly into shared memory, the next batches are prepared while the current one is classified
+    # neighbouring patches of a batch are read with one region request and sliced locally(like GridReader does),
+    # so a batch of 32 patches costs one or two requests instead of 32
+    batches = BatchPreprocessor(ss, tiles, batchSize, patchWidth_px, patchWidth_px, transform=scaleToMinusOneOne,
+                                dtype='float32')
+
+    progressStep = (0.95 - progress_0to1) / max(numBatches, 1)
+    failedTiles = 0
+    for batchTiles, batch, ok in batches:
         progress_0to1 += progressStep
-        ss.sendProgress(progress_0to1, 0, 'Batch {} of {}: retrieve tiles...'.format(currentBatch + 1, numBatches)) 
-
-        batch = np.empty(shape=(batchSize, patchWidth_px, patchWidth_px, 3))
-        tilesInBatch = batchSize
-        for i in range(batchSize):
-            tileNumber = currentBatch * batchSize + i
-            if tileNumber >= len(tiles):
-                #this is the last batch and it is not full
-                tilesInBatch = i
-                break
-            tilecoords = tiles[tileNumber]
-            tileImage = ss.getNativeROI(tilecoords[0][0], tilecoords[0][1], patchWidth_px, patchWidth_px)
-            batch[i] = np.array(tileImage)[np.newaxis, ...]
-
-        #normalize batch to range used by model: [-1,1]
-        batch = (batch/127.5) - 1.0
+        ss.sendProgress(progress_0to1, 0, 'Batch {} of {}: classify tiles...'.format(currentBatch + 1, numBatches)) 
+        currentBatch += 1
+        # tiles that couldn't be read are zero-filled: they aren't classified and not recorded in the journal,
+        # so a rerun tries them again
+        okTiles = [tile for tile, tileOk in zip(batchTiles, ok) if tileOk]
+        failedTiles += len(batchTiles) - len(okTiles)
+        if not okTiles:
+            continue
 
         #predict 
-        progress_0to1 += progressStep
-        ss.sendProgress(progress_0to1, 0, 'Batch {} of {}: classify tiles...'.format(currentBatch + 1, numBatches)) 
-        results = model.predict(batch)
+        with ss.span('model.predict', batch=len(okTiles)):
+            results = model.predict(batch if ok.all() else batch[ok])
 
         # go through the results (softmax), match the result to the label and create the annotation in MIKAIA
         newAnnos = []
-        for resultIndex in range(tilesInBatch):
+        for resultIndex in range(len(okTiles)):
             highestIndex = np.argmax(results[resultIndex])
             label = labels[highestIndex]
-            rect_anno = ss.createAnnotation("Rectangle", tiles[currentBatch * batchSize + resultIndex], label)
+            rect_anno = ss.createAnnotation("Rectangle", okTiles[resultIndex], label)
             newAnnos.append(rect_anno)
         
-        ss.addAnnotations(newAnnos)
+        journal.upload(ss, okTiles, newAnnos)
+    journal.close()
+    if failedTiles > 0:
+        ss.sendMessage("{} tiles couldn't be read, run the plugin again to classify them".format(failedTiles))
 
-        currentBatch += 1
-        
     progress_0to1 = 1.0
-    ss.sendProgress(progress_0to1, 0, 'Classification finished - {} tiles processed'.format(len(tiles))) 
-
-def px2um(patchWidth_px, slideInfo):
-    res = slideInfo.nativeResolution #resolution in um/px
-    patchWidth_um = patchWidth_px * res.width
-    patchHeigh_um = patchWidth_px * res.height
-    return patchWidth_um, patchHeigh_um 
-
-def calculateTilesFromRois(rois, patchWidth_um, patchHeigh_um):
-    tiles = []
-    for roi in rois:
-
-        # TODO: support other types, in particular Polygon and Path
-        if roi.shapeType != 'Rectangle':
-            print("NOTE: Tiling isn't accurate for ROIs of type '{}': We use the bounding rectangle here!".format(roi.shapeType)) 
-        
-        br = roi.boundingRect()
-        roiX_um = br.x
-        roiY_um = br.y
-        roiWidth_um = br.width
-        roiHeight_um = br.height
-
-        #calculate the number of tiles needed to fill the roi
-        numTilesWidth = np.ceil(roiWidth_um/patchWidth_um).astype(int)
-        numTilesHeight = np.ceil(roiHeight_um/patchHeigh_um).astype(int)
-
-        #calculate and collect the tile coordinates
-        currentCorner = mikaia_api.PointF(roiX_um, roiY_um) #top left corner of current tile
-        for y in range(numTilesHeight):
-            for x in range(numTilesWidth):
-                tile = [[currentCorner.x, currentCorner.y], [currentCorner.x + patchWidth_um, currentCorner.y + patchHeigh_um]]
-                tiles.append(tile)
-                currentCorner.x +=  patchWidth_um
-
-            currentCorner.x = roiX_um
-            currentCorner.y += patchHeigh_um 
-    return tiles
-
+    ss.sendProgress(progress_0to1, 0, 'Classification finished - {} tiles processed'.format(numTiles - failedTiles)) 
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,14 +3,19 @@ This script provides a simple integration of Cellpose segmentation with the MIKA
 It processes a whole slide image by tiling, applies a two-stain preprocessing, runs Cellpose instance segmentation,
 and creates polygon annotations for each detected cell instance in MIKAIA.
 Don't forget to install the required packages:
-pip install cellpose opencv-python scikit-image tqdm numpy
+pip install cellpose opencv-python scikit-image numpy
 mikaia_plugin_api can be installed from the MIKAIA plugin repository, use wheel file
 """
 import cv2
 import sys
-import tqdm
 import numpy as np
 from mikaia_plugin_api import mikaia_api as miaapi
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.batch_runner import BatchRunner
+from mikaia_plugin_api.coarse_to_fine import CoarseToFine
+from mikaia_plugin_api.result_aggregator import ResultAggregator
+from mikaia_plugin_api.run_journal import RunJournal
+from mikaia_plugin_api.seam_stitcher import SeamStitcher, overlappedTiling
 from cellpose import models
 
 
@@ -29,45 +34,6 @@ def calculate_input_in_um(input_width_px, slide_info):
     return input_width_um, input_height_um
 
 
-def calculate_tiles_from_rois(rois, input_width_um, input_height_um):
-    """
-    Split each ROI into tiles of the given size in micrometers.
-    Args:
-        rois (list): List of ROI objects.
-        input_width_um (float): Tile width in micrometers.
-        input_height_um (float): Tile height in micrometers.
-    Returns:
-        list: List of tile coordinates [[x0, y0], [x1, y1]] in micrometers.
-    """
-    tiles = []
-    for roi in rois:
-        if isinstance(roi, miaapi.RectF):
-            roi_x_um = roi.x
-            roi_y_um = roi.y
-            roi_width_um = roi.width
-            roi_height_um = roi.height
-        else:
-            br = roi.boundingRect()
-            roi_x_um = br.x
-            roi_y_um = br.y
-            roi_width_um = br.width
-            roi_height_um = br.height
-
-        num_tiles_width = int(np.ceil(roi_width_um / input_width_um))
-        num_tiles_height = int(np.ceil(roi_height_um / input_height_um))
-
-        current_corner = miaapi.PointF(roi_x_um, roi_y_um)
-        for y in range(num_tiles_height):
-            for x in range(num_tiles_width):
-                tile = [[current_corner.x, current_corner.y],
-                        [current_corner.x + input_width_um, current_corner.y + input_height_um]]
-                tiles.append(tile)
-                current_corner.x += input_width_um
-            current_corner.x = roi_x_um
-            current_corner.y += input_height_um
-    return tiles
-
-
 def find_instance_contour(inst_map, correction_factor_h, correction_factor_w, tile_coordinates, pad=0):
     """
     Find contours for each instance in the instance mask and map them to slide coordinates.
@@ -78,7 +44,7 @@ def find_instance_contour(inst_map, correction_factor_h, correction_factor_w, ti
         tile_coordinates (list): Top-left coordinates of the tile in micrometers.
         pad (int): Optional padding for contour coordinates.
     Returns:
-        list: List of contours (each a list of [x, y] points in slide micrometers).
+        list: List of contours (each a (N, 2) float32 array of [x, y] points in slide micrometers).
     """
     from skimage.measure import regionprops
     props = regionprops(inst_map)
@@ -96,12 +62,12 @@ def find_instance_contour(inst_map, correction_factor_h, correction_factor_w, ti
         cnt = cnt.astype('float32')
         cnt[:, 0] = cnt[:, 0] * correction_factor_h + x_tile
         cnt[:, 1] = cnt[:, 1] * correction_factor_w + y_tile
-        result.append(cnt.tolist())
+        result.append(cnt)
     return result
 
 
 def cellpose_mikaia_simple_pipeline(cur_slide_service, checkpoint_path, cellpose_channels,
-                                    input_width_px=1500, scale_factor=1.):
+                                    input_width_px=1500, scale_factor=1., max_tiles=0, overlap_px=64):
     """
     Main pipeline for Cellpose segmentation and annotation in MIKAIA.
     Args:
@@ -110,6 +76,8 @@ def cellpose_mikaia_simple_pipeline(cur_slide_service, checkpoint_path, cellpose
         cellpose_channels: Channel configuration for Cellpose.
         input_width_px (int): Tile width in pixels.
         scale_factor (float): Optional scaling factor for resolution.
+        max_tiles (int): Maximum number of tiles to segment(those with the most tissue), 0 for no limit.
+        overlap_px (int): Overlap of neighbouring tiles on each side in pixels, at least the largest cell diameter.
     """
     class_list = ["Cells"]
     color_list = ["#FFFF0000"]
@@ -145,52 +113,86 @@ def cellpose_mikaia_simple_pipeline(cur_slide_service, checkpoint_path, cellpose
     cur_model = models.CellposeModel(gpu=True, pretrained_model=checkpoint_path)
     slide_info = cur_slide_service.getSlideInfo()
     input_width_um, input_height_um = calculate_input_in_um(input_width_px, slide_info)
-    slide_rect = slide_info.slideRect
-    rois = cur_slide_service.getAnalysisRoi().roi
-    if len(rois) == 0:
-        rois = [slide_rect]
-    if not isinstance(rois, list):
-        rois = [rois]
-    tiles = calculate_tiles_from_rois(rois, input_width_um, input_height_um)
-    _ = [cur_slide_service.createAnnotationClass(
+    # tiles outside of the ROI shapes(or of the whole slide if there is no ROI) and on glass are skipped.
+    # a low coverage threshold keeps the tiles at the tissue border, where cells can still be found.
+    # the remaining tiles are checked again at low resolution(64 x 64 pixels per tile, a few requests for all tiles):
+    # only tiles with at least 2 % tissue pixels are read at full resolution and segmented.
+    # neighbouring tiles overlap by 2 * overlap_px: cells cut by a tile border are segmented completely by the
+    # neighbouring tile, the stitcher keeps each cell exactly once.
+    margin_um = overlap_px * slide_info.nativeResolution.width
+    tile_w_um, tile_h_um, stride_w_um, stride_h_um = overlappedTiling(input_width_um, input_height_um, margin_um)
+    selection = CoarseToFine(cur_slide_service, tile_w_um, tile_h_um, threshold=0.02, max_tiles=max_tiles,
+                             coarse_tile_px=64, stride_w_um=stride_w_um, stride_h_um=stride_h_um, min_coverage=0.05,
+                             slide_info=slide_info)
+    tiles = selection.tiles()
+    print("Processing {} of {} tiles, skipping background".format(len(tiles), selection.tiler().gridTileCount()))
+    print(selection.summary())
+    # the class is only added if the slide doesn't have it yet, the class table is cached for the session.
+    cur_slide_service.ensureAnnotationClasses([cur_slide_service.createAnnotationClass(
         class_name=class_list[0], description=class_list[0],
         group_name="Cell segmentation", line_width_px=3,
-        line_color=color_list[0], fill_color=color_list[0], opacity=0.3)]
-    for tile_coords in tqdm.tqdm(tiles, desc="Processing tiles", total=len(tiles)):
-        tile_img = cur_slide_service.getROI(
-            tile_coords[0][0], tile_coords[0][1], input_width_um, input_height_um,
-            slide_info.nativeResolution.width * scale_factor, slide_info.nativeResolution.height * scale_factor, px_format="RGB")
-        inst_mask = process_tile_cellpose(cur_model, preprocess_func(tile_img), cellpose_channels)
-        correction_factor_h = input_width_um / inst_mask.shape[1]
-        correction_factor_w = input_height_um / inst_mask.shape[0]
-        contours = find_instance_contour(inst_mask.astype(np.int32), correction_factor_h, correction_factor_w, tile_coords)
-        annotations = []
-        for cnt in contours:
-            if len(cnt) < 3:
-                continue
-            cnt_flat = np.array(cnt).flatten().tolist()
-            annotations.append(cur_slide_service.createAnnotation(
-                "Polygon", outline=[cnt_flat], class_name=class_list[0]))
-        if annotations:
-            cur_slide_service.addAnnotations(annotations)
+        line_color=color_list[0], fill_color=color_list[0], opacity=0.3)])
+    def to_annotations(batch_tiles, inst_masks):
+        """
+        Postprocessing: map the cell instances of a batch of tiles to polygon annotations.
+        Args:
+            batch_tiles (list): Tile coordinates [[x0_um, y0_um], [x1_um, y1_um]].
+            inst_masks (list): Instance masks (H, W) of the tiles.
+        Returns:
+            AnnotationBatch: Cell polygons in slide coordinates, without cut and duplicate cells at the tile seams.
+        """
+        cells = AnnotationBatch()
+        for tile_coords, inst_mask in zip(batch_tiles, inst_masks):
+            correction_factor_h = input_width_um / inst_mask.shape[1]
+            correction_factor_w = input_height_um / inst_mask.shape[0]
+            contours = find_instance_contour(np.asarray(inst_mask, dtype=np.int32), correction_factor_h,
+                                             correction_factor_w, tile_coords)
+            contours = [cnt for cnt in contours if len(cnt) >= 3]
+            cells.extend(stitcher.add(tile_coords, AnnotationBatch.fromContours(contours, class_name=class_list[0])))
+        return cells
+
+    # the tiles are fetched and preprocessed in the background and batched for cellpose,
+    # the contours of the previous batch are extracted and uploaded while cellpose processes the current one.
+    # the journal records the progress of every tile: a rerun after an interruption skips the segmented tiles.
+    journal = RunJournal.forRun(cur_slide_service, params={'checkpoint': checkpoint_path, 'tile_px': input_width_px,
+                                                           'scale_factor': scale_factor, 'channels': cellpose_channels,
+                                                           'overlap_px': overlap_px})
+    # the cells along a seam are uploaded once both tiles are segmented. A rerun passes the tiles segmented before
+    # as done: the remaining tiles take over the cells along their seams, which were never uploaded.
+    remaining = set(RunJournal.tileKey(tile) for tile in journal.remaining(tiles))
+    done = [tile for tile in tiles if RunJournal.tileKey(tile) not in remaining]
+    stitcher = SeamStitcher(tiles, margin_um, done=done)
+    # cell counts, areas and size histograms are updated with every uploaded batch and shown in MIKAIA
+    # as result diagrams and CSV table while the slide is processed.
+    aggregator = ResultAggregator(cur_slide_service, title="Cell segmentation")
+    runner = BatchRunner(cur_slide_service, lambda batch: process_batch_cellpose(cur_model, batch, cellpose_channels),
+                         preprocess=preprocess_func, postprocess=to_annotations, batch_size=4,
+                         px_width_um=slide_info.nativeResolution.width * scale_factor,
+                         px_height_um=slide_info.nativeResolution.height * scale_factor, px_format="RGB",
+                         max_in_flight=4, progress=(0.0, 1.0), journal=journal, aggregator=aggregator)
+    with journal:
+        runner.run(tiles)
+    print(journal.summary())
+    print(runner.summary())
+    print(stitcher.summary())
+    print(aggregator.summary())
     print("End of pipeline, annotations added to slide.")
 
 
-def process_tile_cellpose(cur_model, input_image, cellpose_channels):
+def process_batch_cellpose(cur_model, input_images, cellpose_channels):
     """
-    Run Cellpose model on a preprocessed tile image.
+    Run Cellpose model on a batch of preprocessed tile images.
     Args:
         cur_model: Cellpose model object.
-        input_image (ndarray): Preprocessed image (2, H, W) float32.
+        input_images (ndarray): Preprocessed images (N, 2, H, W) float32.
         cellpose_channels: Channel configuration for Cellpose.
     Returns:
-        ndarray: Instance mask (H, W) with unique labels per cell.
+        list: Instance masks (H, W) with unique labels per cell, one per image.
     """
-    input_image = np.array(input_image)
-    cell_inst_map = cur_model.eval(input_image, channels=cellpose_channels, normalize=False, rescale=1.0, bsize=224,
-                                   tile_overlap=0.2, niter=300,
-                                   flow_threshold=0.4)[0]
-    return cell_inst_map
+    cell_inst_maps = cur_model.eval(list(input_images), channels=cellpose_channels, normalize=False, rescale=1.0,
+                                    bsize=224, tile_overlap=0.2, niter=300,
+                                    flow_threshold=0.4)[0]
+    return cell_inst_maps
 
 
 def main(stop=False):
@@ -208,7 +210,7 @@ def main(stop=False):
     ss = miaapi.SlideService(slide_service_path)
     cellpose_weights = "YOUR_CELLPOSE_WEIGHTS_PATH"  # Replace with your Cellpose model weights path
     cellpose_mikaia_simple_pipeline(cur_slide_service=ss, checkpoint_path=cellpose_weights, cellpose_channels=None,
-                                    input_width_px=2048, scale_factor=1)
+                                    input_width_px=1024, scale_factor=1)
 
 if __name__ == "__main__":
     main()
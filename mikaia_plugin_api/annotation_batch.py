@@ -0,0 +1,326 @@
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# shape types supported by AnnotationBatch('Mask' annotations are added with SlideService.addAnnotations())
+SHAPE_TYPES = ['Point', 'Line', 'Rectangle', 'Ellipse', 'Polygon', 'PathWithHoles']
+
+
+#######################################################
+## Columnar annotation batch for bulk annotation I/O ##
+#######################################################
+class AnnotationBatch(object):
+    """AnnotationBatch Many annotations stored column by column in a few NumPy arrays.
+
+    Instead of one Annotation object(with Python float lists) per shape, all annotations of a batch share:
+    - shapeTypes: uint8 index into SHAPE_TYPES per annotation
+    - classIndices: int32 index into classNames per annotation
+    - classNames: list of the annotation class names used in the batch
+    - coordinates: flat float32 buffer [x1, y1, x2, y2, ...] with the points of all contours(in 'um')
+    - contourOffsets: int64 array, contour i consists of the points contourOffsets[i] to contourOffsets[i + 1] - 1
+    - annotationOffsets: int64 array, annotation j consists of the contours annotationOffsets[j] to
+                         annotationOffsets[j + 1] - 1. The first contour is the outline, all further ones are holes.
+    - ids: int64 MIKAIA-IDs per annotation(-1 until the batch has been added to the slide)
+
+    Use SlideService.addAnnotationBatch() to add all annotations of a batch to the slide.
+    Note: float32 coordinates have a precision of about 0.01 um for slides up to 10 cm.
+    """
+
+    def __init__(self):
+        self.classNames = []
+        self._classIndex = {}  # class name -> index into classNames
+        self._pending = []  # (shape type codes, class indices, coordinates, contour lengths, contours per annotation)
+        self._shapeTypes = np.empty(0, dtype=np.uint8)
+        self._classIndices = np.empty(0, dtype=np.int32)
+        self._coordinates = np.empty(0, dtype=np.float32)
+        self._contourOffsets = np.zeros(1, dtype=np.int64)
+        self._annotationOffsets = np.zeros(1, dtype=np.int64)
+        self._ids = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._shapeTypes) + sum(len(item[0]) for item in self._pending)
+
+    def __str__(self):
+        self._consolidate()
+        return '{}(annotations={}, contours={}, points={}, classes={})'.format(
+            self.__class__.__name__, len(self), len(self._contourOffsets) - 1, len(self._coordinates) // 2,
+            len(self.classNames))
+
+    @property
+    def shapeTypes(self):
+        self._consolidate()
+        return self._shapeTypes
+
+    @property
+    def classIndices(self):
+        self._consolidate()
+        return self._classIndices
+
+    @property
+    def coordinates(self):
+        self._consolidate()
+        return self._coordinates
+
+    @property
+    def contourOffsets(self):
+        self._consolidate()
+        return self._contourOffsets
+
+    @property
+    def annotationOffsets(self):
+        self._consolidate()
+        return self._annotationOffsets
+
+    @property
+    def ids(self):
+        self._consolidate()
+        return self._ids
+
+    # Create a batch with one annotation per contour.
+    # See addContours() for the parameters.
+    @classmethod
+    def fromContours(cls, contours, class_name='', shape_type='Polygon'):
+        batch = cls()
+        batch.addContours(contours, class_name, shape_type)
+        return batch
+
+    # Create a batch from a list of 'Annotation' instances('Mask' annotations are not supported).
+    @classmethod
+    def fromAnnotations(cls, annotations):
+        batch = cls()
+        for anno in annotations:
+            contours = [np.asarray(coord_list, dtype=np.float32) for coord_list in anno.coordinates]
+            batch._append([anno.shapeType], [anno.className], contours, [len(contours)])
+        return batch
+
+    # Add one annotation per contour, without holes.
+    # contours: list of point arrays, each of shape (n, 2) or (n, 1, 2)(as returned by cv2.findContours()),
+    #           or one array of shape (count, n, 2) with contours of equal length. Coordinates in 'um'.
+    # class_name: annotation class of all added annotations.
+    # shape_type: shape type of all added annotations.
+    def addContours(self, contours, class_name='', shape_type='Polygon'):
+        if isinstance(contours, np.ndarray) and contours.ndim == 3:
+            contours = list(contours)
+        count = len(contours)
+        self._append([shape_type] * count, [class_name] * count, contours, np.ones(count, dtype=np.int64))
+
+    # Add one annotation.
+    # shape_type: one of SHAPE_TYPES.
+    # outline: outline contour as point array of shape (n, 2) or list of [x, y] points(in 'um').
+    # holes: list of hole contours(only used for 'PathWithHoles').
+    # class_name: optional name of the annotation class.
+    def addAnnotation(self, shape_type, outline, holes=(), class_name=''):
+        contours = [outline] + list(holes)
+        self._append([shape_type], [class_name], contours, [len(contours)])
+
+    # Append all annotations of another batch(without their ids), e.g. to merge the results of several tiles
+    # into a single upload. Returns this batch.
+    def extend(self, other):
+        other._consolidate()
+        if len(other) == 0:
+            return self
+        mapping = np.empty(len(other.classNames), dtype=np.int32)
+        for i, class_name in enumerate(other.classNames):
+            index = self._classIndex.get(class_name)
+            if index is None:
+                index = self._classIndex[class_name] = len(self.classNames)
+                self.classNames.append(class_name)
+            mapping[i] = index
+        self._pending.append((other._shapeTypes.copy(), mapping[other._classIndices], other._coordinates.copy(),
+                              np.diff(other._contourOffsets), np.diff(other._annotationOffsets)))
+        return self
+
+    # Returns the contours of annotation 'index' as list of (n, 2) float32 arrays(outline first, then holes).
+    def contours(self, index):
+        self._consolidate()
+        first, last = self._annotationOffsets[index], self._annotationOffsets[index + 1]
+        points = self._coordinates.reshape(-1, 2)
+        return [points[self._contourOffsets[i]:self._contourOffsets[i + 1]] for i in range(first, last)]
+
+    # Returns the area of every annotation in um^2 as float64 array, computed for the whole batch at once.
+    # Same rules as Annotation.area(): outline area minus the area of the holes, the bounding rectangle for
+    # 'Rectangle' and 'Ellipse', no area for 'Point' and 'Line'.
+    def areas(self):
+        self._consolidate()
+        annotation_count = len(self._shapeTypes)
+        points = self._coordinates.reshape(-1, 2).astype(np.float64)
+        lengths = np.diff(self._contourOffsets)
+        contour_count = len(lengths)
+        starts = self._contourOffsets[:-1][lengths > 0]
+        ends = self._contourOffsets[1:][lengths > 0]
+        # shoelace formula per contour, the last point of a contour is connected to its first one
+        following = np.arange(1, len(points) + 1)
+        following[ends - 1] = starts
+        x, y = points[:, 0], points[:, 1]
+        cross = x * y[following] - x[following] * y
+        contour_of_point = np.repeat(np.arange(contour_count), lengths)
+        contour_areas = np.abs(np.bincount(contour_of_point, weights=cross, minlength=contour_count)) / 2.0
+        counts = np.diff(self._annotationOffsets)
+        outlines = self._annotationOffsets[:-1][counts > 0]
+        signs = -np.ones(contour_count)
+        signs[outlines] = 1.0
+        annotation_of_contour = np.repeat(np.arange(annotation_count), counts)
+        areas = np.bincount(annotation_of_contour, weights=contour_areas * signs, minlength=annotation_count)
+        areas[(self._shapeTypes != SHAPE_TYPES.index('Polygon'))
+              & (self._shapeTypes != SHAPE_TYPES.index('PathWithHoles'))] = 0.0
+        rectangles = self._shapeTypes == SHAPE_TYPES.index('Rectangle')
+        ellipses = self._shapeTypes == SHAPE_TYPES.index('Ellipse')
+        if np.any(rectangles | ellipses):
+            boxes = self.boundingBoxes()
+            extent = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            areas[rectangles] = extent[rectangles]
+            areas[ellipses] = extent[ellipses] * np.pi / 4.0
+        return areas
+
+    # Returns the bounding box [min_x, min_y, max_x, max_y] of the outline of every annotation as (n, 4) float64 array
+    # (zeros for annotations without outline points).
+    def boundingBoxes(self):
+        self._consolidate()
+        boxes = np.zeros((len(self._shapeTypes), 4), dtype=np.float64)
+        outlines = self._annotationOffsets[:-1]
+        valid = np.diff(self._annotationOffsets) > 0
+        valid[valid] = np.diff(self._contourOffsets)[outlines[valid]] > 0
+        if np.any(valid):
+            # one extra point, so reduceat() can reduce up to the end of the last outline
+            points = np.concatenate([self._coordinates.reshape(-1, 2).astype(np.float64), np.zeros((1, 2))])
+            first = outlines[valid]
+            bounds = np.stack([self._contourOffsets[first], self._contourOffsets[first + 1]], axis=1)
+            boxes[valid, :2] = np.minimum.reduceat(points, bounds.reshape(-1), axis=0)[::2]
+            boxes[valid, 2:] = np.maximum.reduceat(points, bounds.reshape(-1), axis=0)[::2]
+        return boxes
+
+    # Returns a new batch with the annotations 'indices'(in this order, without their ids).
+    def select(self, indices):
+        self._consolidate()
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        batch = AnnotationBatch()
+        if len(indices) == 0:
+            return batch
+        counts = np.diff(self._annotationOffsets)[indices]
+        contours = self._ranges(self._annotationOffsets[indices], counts)
+        lengths = np.diff(self._contourOffsets)[contours]
+        points = self._ranges(self._contourOffsets[contours], lengths)
+        used, class_indices = np.unique(self._classIndices[indices], return_inverse=True)
+        batch.classNames = [self.classNames[i] for i in used]
+        batch._classIndex = {class_name: i for i, class_name in enumerate(batch.classNames)}
+        batch._pending.append((self._shapeTypes[indices], class_indices.astype(np.int32),
+                               self._coordinates.reshape(-1, 2)[points].reshape(-1), lengths, counts))
+        return batch
+
+    # Returns the batch as list of 'Annotation' instances.
+    def toAnnotations(self):
+        from mikaia_plugin_api.mikaia_api import Annotation
+        self._consolidate()
+        annotations = []
+        for index in range(len(self._shapeTypes)):
+            anno = Annotation(shapeType=SHAPE_TYPES[self._shapeTypes[index]],
+                              coordinates=[contour.reshape(-1).tolist() for contour in self.contours(index)],
+                              id=int(self._ids[index]),
+                              className=self.classNames[self._classIndices[index]])
+            annotations.append(anno)
+        return annotations
+
+    # Returns the whole batch as JSON document(bytes) in the format of Annotation.list_to_json().
+    def toJson(self):
+        return self._encode(0, len(self))
+
+    # Split the batch into JSON documents of bounded size for separate POST requests.
+    # max_chunk_bytes: approximate maximum size of a JSON document.
+    # max_chunk_annotations: maximum number of annotations per JSON document.
+    # Yields tuples (first, end, json_bytes) with the annotations first to end - 1 of the batch.
+    def iterJsonChunks(self, max_chunk_bytes=4 * 1024 * 1024, max_chunk_annotations=20000):
+        self._consolidate()
+        count = len(self._shapeTypes)
+        if count == 0:
+            return
+        # estimate the JSON size of each annotation: ~12 bytes per coordinate plus the fixed fields
+        point_ends = self._contourOffsets[self._annotationOffsets]
+        name_lengths = np.array([len(name) for name in self.classNames], dtype=np.int64)
+        sizes = np.diff(point_ends) * 24 + 120 + name_lengths[self._classIndices]
+        cumulative = np.cumsum(sizes)
+        first = 0
+        while first < count:
+            base = cumulative[first - 1] if first > 0 else 0
+            end = int(np.searchsorted(cumulative, base + max_chunk_bytes, side='right'))
+            end = min(max(end, first + 1), first + max_chunk_annotations, count)
+            yield first, end, self._encode(first, end)
+            first = end
+
+    # Set the MIKAIA-IDs of the annotations first to first + len(ids) - 1.
+    def setIds(self, first, ids):
+        self._consolidate()
+        self._ids[first:first + len(ids)] = ids
+
+    def _encode(self, first, end):
+        self._consolidate()
+        points = self._coordinates
+        contour_offsets = self._contourOffsets * 2
+        if orjson is not None:
+            items = []
+            for index in range(first, end):
+                c0, c1 = self._annotationOffsets[index], self._annotationOffsets[index + 1]
+                items.append({'shapeType': SHAPE_TYPES[self._shapeTypes[index]],
+                              'mask': [], 'maskSizeInPx': [], 'labelMap': [],
+                              'coordinates': [points[contour_offsets[i]:contour_offsets[i + 1]] for i in range(c0, c1)],
+                              'id': int(self._ids[index]),
+                              'className': self.classNames[self._classIndices[index]]})
+            return orjson.dumps(items, option=orjson.OPT_SERIALIZE_NUMPY)
+
+        # streaming writer without orjson: all coordinates are converted to strings in one go
+        p0 = contour_offsets[self._annotationOffsets[first]]
+        p1 = contour_offsets[self._annotationOffsets[end]]
+        texts = points[p0:p1].astype(str)
+        names = [json.dumps(name) for name in self.classNames]
+        parts = []
+        for index in range(first, end):
+            c0, c1 = self._annotationOffsets[index], self._annotationOffsets[index + 1]
+            coordinate_lists = ','.join('[' + ','.join(texts[contour_offsets[i] - p0:contour_offsets[i + 1] - p0]) + ']'
+                                        for i in range(c0, c1))
+            parts.append('{"shapeType":"%s","mask":[],"maskSizeInPx":[],"labelMap":[],"coordinates":[%s],'
+                         '"id":%d,"className":%s}' % (SHAPE_TYPES[self._shapeTypes[index]], coordinate_lists,
+                                                      self._ids[index], names[self._classIndices[index]]))
+        return ('[' + ','.join(parts) + ']').encode('utf-8')
+
+    def _append(self, shape_types, class_names, contours, contour_counts):
+        codes = np.empty(len(shape_types), dtype=np.uint8)
+        for i, shape_type in enumerate(shape_types):
+            if shape_type not in SHAPE_TYPES:
+                raise Exception("Unknown or unsupported shapeType '" + shape_type + "'.")
+            codes[i] = SHAPE_TYPES.index(shape_type)
+        indices = np.empty(len(class_names), dtype=np.int32)
+        for i, class_name in enumerate(class_names):
+            index = self._classIndex.get(class_name)
+            if index is None:
+                index = self._classIndex[class_name] = len(self.classNames)
+                self.classNames.append(class_name)
+            indices[i] = index
+        flat = [np.asarray(contour, dtype=np.float32).reshape(-1) for contour in contours]
+        coordinates = np.concatenate(flat) if flat else np.empty(0, dtype=np.float32)
+        lengths = np.fromiter((len(contour) // 2 for contour in flat), dtype=np.int64, count=len(flat))
+        self._pending.append((codes, indices, coordinates, lengths, np.asarray(contour_counts, dtype=np.int64)))
+
+    # concatenated index ranges [starts[i], starts[i] + lengths[i])
+    @staticmethod
+    def _ranges(starts, lengths):
+        ends = np.cumsum(lengths)
+        return np.repeat(starts - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+    # move the pending additions into the column arrays
+    def _consolidate(self):
+        if not self._pending:
+            return
+        codes, indices, coordinates, lengths, counts = (list(column) for column in zip(*self._pending))
+        self._pending = []
+        new_annotations = sum(len(c) for c in codes)
+        self._shapeTypes = np.concatenate([self._shapeTypes] + codes)
+        self._classIndices = np.concatenate([self._classIndices] + indices)
+        self._coordinates = np.concatenate([self._coordinates] + coordinates)
+        self._contourOffsets = np.concatenate([self._contourOffsets, self._contourOffsets[-1] + np.cumsum(np.concatenate(lengths))])
+        self._annotationOffsets = np.concatenate([self._annotationOffsets, self._annotationOffsets[-1] + np.cumsum(np.concatenate(counts))])
+        self._ids = np.concatenate([self._ids, np.full(new_annotations, -1, dtype=np.int64)])
@@ -0,0 +1,131 @@
+import numpy as np
+
+
+##########################################
+## Spatial index over annotation shapes ##
+##########################################
+class AnnotationIndex(object):
+    """AnnotationIndex Static R-tree over the bounding boxes of annotations(STR bulk loading).
+
+    Build it once from the result of SlideService.getAnnotations() and use it to answer
+    "which annotations overlap this tile?" or "which annotation contains this point?"
+    without testing every annotation.
+    The tree is stored level by level in NumPy arrays and queried level by level with vectorized
+    box tests, so a query touches only a few small arrays even for hundreds of thousands of shapes.
+    """
+
+    # annotations: list of 'Annotation' instances. The index refers to the annotations by their position in this list.
+    # node_capacity: maximum number of children per tree node.
+    def __init__(self, annotations, node_capacity=16):
+        self._annotations = list(annotations)
+        boxes = np.empty((len(self._annotations), 4), dtype=np.float64)
+        for i, anno in enumerate(self._annotations):
+            br = anno.boundingRect()
+            boxes[i] = (br.x, br.y, br.x + br.width, br.y + br.height)
+        self._build(boxes, node_capacity)
+
+    # Create an index over bounding boxes only.
+    # boxes: (n, 4) array of [min_x, min_y, max_x, max_y] rows.
+    # Queries return indices into 'boxes', the methods that return annotations can't be used.
+    @classmethod
+    def fromBoxes(cls, boxes, node_capacity=16):
+        index = cls.__new__(cls)
+        index._annotations = None
+        index._build(np.asarray(boxes, dtype=np.float64).reshape(-1, 4), node_capacity)
+        return index
+
+    def __len__(self):
+        return len(self._order)
+
+    def __str__(self):
+        return '{}(entries={}, levels={})'.format(self.__class__.__name__, len(self), len(self._levels))
+
+    # Returns the indices of all entries whose bounding box intersects the rectangle(in 'um').
+    def queryRectIndices(self, x_um, y_um, w_um, h_um):
+        return self._query(x_um, y_um, x_um + w_um, y_um + h_um)
+
+    # Returns all annotations whose bounding box intersects the rectangle(in 'um').
+    def queryRect(self, x_um, y_um, w_um, h_um):
+        return [self._annotations[i] for i in self.queryRectIndices(x_um, y_um, w_um, h_um)]
+
+    # Returns the indices of all entries whose shape contains the point(x_um, y_um).
+    # exact: if False, only the bounding boxes are tested.
+    def queryPointIndices(self, x_um, y_um, exact=True):
+        candidates = self._query(x_um, y_um, x_um, y_um)
+        if not exact or self._annotations is None:
+            return candidates
+        keep = [i for i in candidates if self._annotations[i].containsPoint(x_um, y_um)]
+        return np.array(keep, dtype=np.int64)
+
+    # Returns all annotations which contain the point(x_um, y_um).
+    def queryPoint(self, x_um, y_um, exact=True):
+        return [self._annotations[i] for i in self.queryPointIndices(x_um, y_um, exact)]
+
+    def _build(self, boxes, node_capacity):
+        if node_capacity < 2:
+            raise Exception("Parameter 'node_capacity' shall be at least 2.")
+        self._order = self._strOrder(boxes, node_capacity)
+        self._boxes = boxes[self._order]
+
+        # levels[0] are the leaves, each covering up to 'node_capacity' consecutive entries.
+        # The children of the nodes of each level are packed consecutively, so a node is fully
+        # described by its bounding box and the index range [start, end) of its children.
+        self._levels = []
+        child_boxes = self._boxes
+        while True:
+            count = len(child_boxes)
+            if count == 0:
+                break
+            starts = np.arange(0, count, node_capacity, dtype=np.int64)
+            node_boxes = np.empty((len(starts), 4), dtype=np.float64)
+            node_boxes[:, 0] = np.minimum.reduceat(child_boxes[:, 0], starts)
+            node_boxes[:, 1] = np.minimum.reduceat(child_boxes[:, 1], starts)
+            node_boxes[:, 2] = np.maximum.reduceat(child_boxes[:, 2], starts)
+            node_boxes[:, 3] = np.maximum.reduceat(child_boxes[:, 3], starts)
+            ends = np.minimum(starts + node_capacity, count)
+            self._levels.append((node_boxes, starts, ends))
+            if len(starts) == 1:
+                break
+            # sort the nodes of this level in sort-tile-recursive order, so that the next level
+            # can group spatially close nodes(its children stay consecutive)
+            order = self._strOrder(node_boxes, node_capacity)
+            node_boxes, starts, ends = node_boxes[order], starts[order], ends[order]
+            self._levels[-1] = (node_boxes, starts, ends)
+            child_boxes = node_boxes
+
+    def _query(self, min_x, min_y, max_x, max_y):
+        if len(self._levels) == 0:
+            return np.empty(0, dtype=np.int64)
+        nodes = np.arange(len(self._levels[-1][0]), dtype=np.int64)
+        for level in range(len(self._levels) - 1, -1, -1):
+            node_boxes, starts, ends = self._levels[level]
+            boxes = node_boxes[nodes]
+            hit = nodes[(boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)]
+            if len(hit) == 0:
+                return np.empty(0, dtype=np.int64)
+            nodes = self._ranges(starts[hit], ends[hit])
+        boxes = self._boxes[nodes]
+        hit = nodes[(boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)]
+        return np.sort(self._order[hit])
+
+    # concatenation of the index ranges [starts[i], ends[i])
+    @staticmethod
+    def _ranges(starts, ends):
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+
+    # sort-tile-recursive order: sort by x center into vertical slices, then by y center within each slice
+    @staticmethod
+    def _strOrder(boxes, node_capacity):
+        count = len(boxes)
+        if count <= node_capacity:
+            return np.arange(count, dtype=np.int64)
+        centers_x = boxes[:, 0] + boxes[:, 2]
+        centers_y = boxes[:, 1] + boxes[:, 3]
+        node_count = int(np.ceil(count / node_capacity))
+        slice_size = int(np.ceil(np.sqrt(node_count))) * node_capacity
+        by_x = np.argsort(centers_x, kind='stable')
+        slice_ids = np.empty(count, dtype=np.int64)
+        slice_ids[by_x] = np.arange(count) // slice_size
+        return np.lexsort((centers_y, slice_ids))
@@ -0,0 +1,322 @@
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Tile transforms: transform(pixels, out) writes the preprocessed uint8 tile 'pixels' into 'out'
+# (one entry of a batch buffer). They run in the worker processes, so they have to be top level functions.
+
+# Copies the pixels, converted to the dtype of 'out'.
+def castPixels(pixels, out):
+    np.copyto(out, pixels, casting='unsafe')
+
+
+# Scales the pixels to [0, 1].
+def scaleToZeroOne(pixels, out):
+    np.multiply(pixels, np.float32(1.0 / 255.0), out=out, casting='unsafe')
+
+
+# Scales the pixels to [-1, 1], e.g. for EfficientNet/MobileNet models.
+def scaleToMinusOneOne(pixels, out):
+    np.multiply(pixels, np.float32(1.0 / 127.5), out=out, casting='unsafe')
+    out -= out.dtype.type(1.0)
+
+
+#########################################################
+## Tile preprocessing in worker processes into batches ##
+#########################################################
+class BatchPreprocessor(object):
+    """BatchPreprocessor Fetches, decodes and transforms tiles in worker processes into shared memory batches.
+
+    Every worker process has its own SlideService connection. It reads the tiles of a batch, decodes
+    them and writes the transformed pixels directly into a batch buffer in shared memory, so neither
+    the decoding nor the preprocessing runs under the GIL of the calling process and no pixel data is
+    pickled. The caller gets each finished batch as ndarray view of its shared buffer.
+    Neighbouring tiles of a batch in the same row(e.g. the grid tiles of RoiTiler) are read with a single
+    region request and sliced locally, like GridReader does, so a batch costs a few requests instead of
+    one per tile.
+    'buffers' batch buffers are reused round robin: while the caller processes one batch, the workers
+    fill the next ones.
+
+    Usage:
+        with BatchPreprocessor(ss, tiles, 32, 224, 224, transform=scaleToMinusOneOne) as batches:
+            for batch_tiles, batch, ok in batches:
+                results = model.predict(batch)
+
+    The content of a batch array is only valid until the next batch is requested(its buffer is filled
+    again), copy it if it is needed longer. The arrays stay readable after the iteration and close():
+    the shared memory is unmapped when the last array that uses it is released.
+    In a daemonic process(e.g. a resident script worker) no child processes can be started, there
+    the tiles are processed by threads of the calling process instead.
+    """
+
+    # slide_service: SlideService instance. The worker processes connect to the same session.
+    # tiles: list of tile coordinates [[x0_um, y0_um], [x1_um, y1_um]](top left and bottom right corner in um).
+    # batch_size: number of tiles per batch. The last batch may be smaller.
+    # w_px, h_px, px_width_um, px_height_um, px_format, channel_idx: how tiles are read, as for SlideService.iterTiles().
+    # transform: transform(pixels, out) function that writes the preprocessed tile into 'out'. Default: castPixels.
+    #            Must be a top level function(it is passed to the worker processes).
+    # out_shape: shape of one preprocessed tile. Default: shape of the tile pixels, e.g. (h_px, w_px, 3).
+    # dtype: dtype of the batch buffers, e.g. 'uint8', 'float16' or 'float32'.
+    # workers: number of worker processes. 0 processes the tiles in threads of the calling process.
+    # threads: number of tiles read at the same time(split over the worker processes).
+    # buffers: number of batch buffers(at least 2).
+    # region_tiles: maximum number of neighbouring tiles read with one region request, 0 for no limit(up to a batch),
+    #               1 reads every tile with its own request.
+    def __init__(self, slide_service, tiles, batch_size, w_px=0, h_px=0, px_width_um=0, px_height_um=0,
+                 px_format='RGB', channel_idx=-1, transform=None, out_shape=None, dtype='float32', workers=None,
+                 threads=8, buffers=3, region_tiles=0):
+        if px_width_um <= 0 and (w_px <= 0 or h_px <= 0):
+            raise Exception("Either the tile size 'w_px', 'h_px' or the pixel resolution 'px_width_um' shall be provided.")
+        if batch_size < 1:
+            raise Exception("Parameter 'batch_size' shall be at least 1.")
+        if buffers < 2:
+            raise Exception("Parameter 'buffers' shall be at least 2.")
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        if workers > 0 and multiprocessing.current_process().daemon:
+            workers = 0
+
+        self._tiles = [tile for tile in tiles]
+        self._batchSize = batch_size
+        self._regionTiles = region_tiles if region_tiles > 0 else batch_size
+        if px_height_um <= 0:
+            px_height_um = px_width_um
+        fetch = (w_px, h_px, px_width_um, px_height_um, px_format, channel_idx)
+        if out_shape is None:
+            out_shape = self._tileShape(self._tiles[0] if self._tiles else None, fetch)
+        self._outShape = tuple(out_shape)
+        self._dtype = np.dtype(dtype)
+        self._closed = False
+        self._workers = []
+        self._loops = 0
+        self._buffers = []
+        self._sharedMemory = []
+
+        batch_shape = (batch_size,) + self._outShape
+        nbytes = max(1, int(np.prod(batch_shape)) * self._dtype.itemsize)
+        transform = transform if transform is not None else castPixels
+        if workers > 0:
+            context = multiprocessing.get_context('spawn')
+            self._tasks = context.Queue()
+            self._results = context.Queue()
+            for i in range(buffers):
+                shm = shared_memory.SharedMemory(create=True, size=nbytes)
+                self._sharedMemory.append(shm)
+                self._buffers.append(np.asarray(_SharedBuffer(shm, batch_shape, self._dtype)))
+            names = [shm.name for shm in self._sharedMemory]
+            for i in range(workers):
+                loops = max(1, threads // workers + (1 if i < threads % workers else 0))
+                self._loops += loops
+                process = context.Process(target=_preprocessMain,
+                                          args=(slide_service._rootPath, names, batch_shape, self._dtype.str, fetch,
+                                                transform, self._tasks, self._results, loops),
+                                          name='BatchPreprocessor-{}'.format(i), daemon=True)
+                process.start()
+                self._workers.append(process)
+        else:
+            self._tasks = queue.Queue()
+            self._results = queue.Queue()
+            self._buffers = [np.empty(batch_shape, dtype=self._dtype) for i in range(buffers)]
+            self._loops = max(1, threads)
+            for i in range(self._loops):
+                thread = threading.Thread(target=_preprocessLoop,
+                                          args=(slide_service, self._buffers, fetch, transform, self._tasks,
+                                                self._results),
+                                          name='BatchPreprocessor-{}'.format(i), daemon=True)
+                thread.start()
+                self._workers.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return math.ceil(len(self._tiles) / self._batchSize)
+
+    def __str__(self):
+        return '{}(tiles={}, batch_size={}, out_shape={}, dtype={}, workers={}, buffers={})'.format(
+            self.__class__.__name__, len(self._tiles), self._batchSize, self._outShape, self._dtype,
+            len(self._workers), len(self._buffers))
+
+    # Yields (batch tiles, batch array, ok) for all batches in order.
+    # ok: boolean array, False for tiles that couldn't be read(their entries are zero).
+    def __iter__(self):
+        try:
+            batch_count = len(self)
+            free = list(range(len(self._buffers)))
+            pending = {}  # buffer index -> [batch index, remaining tiles, ok]
+            next_batch = 0
+            for batch in range(batch_count):
+                # keep all buffers but the one returned to the caller busy
+                while next_batch < batch_count and free:
+                    self._submit(next_batch, free.pop(0), pending)
+                    next_batch += 1
+                buffer = next(index for index, state in pending.items() if state[0] == batch)
+                while pending[buffer][1] > 0:
+                    self._collect(pending)
+                first = batch * self._batchSize
+                batch_tiles = self._tiles[first:first + self._batchSize]
+                ok = pending.pop(buffer)[2]
+                yield batch_tiles, self._buffers[buffer][:len(batch_tiles)], ok
+                free.append(buffer)
+        finally:
+            self.close()
+
+    # Stop the workers and release the batch buffers. Called at the end of the iteration.
+    # Batch arrays returned before stay valid, they keep their shared memory mapped.
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for i in range(self._loops):
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join(5.0)
+            if isinstance(worker, multiprocessing.process.BaseProcess) and worker.is_alive():
+                worker.terminate()
+                worker.join(5.0)
+        self._buffers = []
+        for shm in self._sharedMemory:
+            shm.unlink()
+        self._sharedMemory = []
+
+    def _submit(self, batch, buffer, pending):
+        first = batch * self._batchSize
+        batch_tiles = self._tiles[first:first + self._batchSize]
+        pending[buffer] = [batch, len(batch_tiles), np.ones(len(batch_tiles), dtype=bool)]
+        for first, end in self._regions(batch_tiles):
+            self._tasks.put((buffer, first, batch_tiles[first:end]))
+
+    # Splits the tiles of a batch into runs [first, end) of at most 'region_tiles' tiles that are horizontal
+    # neighbours of the same height, each run is read with one region request.
+    def _regions(self, batch_tiles):
+        runs = []
+        first = 0
+        for i in range(1, len(batch_tiles) + 1):
+            if i == len(batch_tiles) or i - first >= self._regionTiles or \
+                    not self._isRightNeighbour(batch_tiles[i - 1], batch_tiles[i]):
+                runs.append((first, i))
+                first = i
+        return runs
+
+    @staticmethod
+    def _isRightNeighbour(tile, other):
+        return (math.isclose(other[0][0], tile[1][0], abs_tol=1e-6)
+                and math.isclose(other[0][1], tile[0][1], abs_tol=1e-6)
+                and math.isclose(other[1][1], tile[1][1], abs_tol=1e-6)
+                and math.isclose(other[1][0] - other[0][0], tile[1][0] - tile[0][0], abs_tol=1e-6))
+
+    def _collect(self, pending):
+        while True:
+            try:
+                buffer, first, ok, error = self._results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                dead = [w for w in self._workers if not w.is_alive()]
+                if dead:
+                    raise Exception('BatchPreprocessor worker {} died.'.format(dead[0].name))
+        if error is not None:
+            raise Exception('BatchPreprocessor worker failed: {}'.format(error))
+        state = pending[buffer]
+        state[1] -= len(ok)
+        state[2][first:first + len(ok)] = ok
+
+    @staticmethod
+    def _tileShape(tile, fetch):
+        w_px, h_px, px_width_um, px_height_um, px_format, channel_idx = fetch
+        if px_width_um > 0 and tile is not None:
+            w_px = int(round((tile[1][0] - tile[0][0]) / px_width_um))
+            h_px = int(round((tile[1][1] - tile[0][1]) / px_height_um))
+        if px_format == 'Gray' or channel_idx >= 0:
+            return (h_px, w_px)
+        return (h_px, w_px, 3)
+
+
+class _SharedBuffer(object):
+    """_SharedBuffer Batch buffer in shared memory, the base of the batch arrays
+
+    np.asarray() of it creates an array that references this object, so the shared memory is only unmapped
+    (by SharedMemory.__del__) when the last array that uses it is released.
+    """
+
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.__array_interface__ = np.ndarray(shape, dtype=dtype, buffer=shm.buf).__array_interface__
+
+
+# Entry point of the worker processes, runs 'loops' _preprocessLoop() threads.
+def _preprocessMain(slide_path, shm_names, batch_shape, dtype, fetch, transform, tasks, results, loops):
+    from mikaia_plugin_api import mikaia_api
+    shared = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    buffers = [np.ndarray(batch_shape, dtype=np.dtype(dtype), buffer=shm.buf) for shm in shared]
+    ss = mikaia_api.SlideService(slide_path, telemetry_rate_hz=0)
+    try:
+        threads = [threading.Thread(target=_preprocessLoop, args=(ss, buffers, fetch, transform, tasks, results),
+                                    daemon=True) for i in range(loops - 1)]
+        for thread in threads:
+            thread.start()
+        _preprocessLoop(ss, buffers, fetch, transform, tasks, results)
+        for thread in threads:
+            thread.join()
+    finally:
+        ss.close()
+        del buffers
+        for shm in shared:
+            shm.close()
+
+
+# Reads, decodes and transforms tiles until a None task is received.
+# task: (buffer index, first slot index, neighbouring tiles of the slots first, first + 1, ...),
+# result: (buffer index, first slot index, ok per tile, error message or None).
+def _preprocessLoop(ss, buffers, fetch, transform, tasks, results):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        buffer, first, tiles = task
+        ok = np.zeros(len(tiles), dtype=bool)
+        try:
+            for slot, pixels in enumerate(_readTiles(ss, tiles, fetch)):
+                out = buffers[buffer][first + slot]
+                if pixels is None:
+                    out.fill(0)
+                else:
+                    transform(pixels, out)
+                    ok[slot] = True
+            results.put((buffer, first, ok, None))
+        except Exception:
+            results.put((buffer, first, ok, traceback.format_exc()))
+
+
+# Reads a row of neighbouring tiles with one region request and returns the pixels of every tile(views into
+# the region). Falls back to one request per tile if the region doesn't have the expected size.
+def _readTiles(ss, tiles, fetch):
+    w_px, h_px, px_width_um, px_height_um, px_format, channel_idx = fetch
+
+    def read(x0_um, y0_um, x1_um, y1_um, width_px):
+        if px_width_um > 0:
+            return ss.getROIArray(x0_um, y0_um, x1_um - x0_um, y1_um - y0_um, px_width_um, px_height_um, px_format,
+                                  channel_idx)
+        return ss.getNativeROIArray(x0_um, y0_um, width_px, h_px, px_format, channel_idx)
+
+    if px_width_um > 0:
+        widths = [int(round((tile[1][0] - tile[0][0]) / px_width_um)) for tile in tiles]
+        height_px = int(round((tiles[0][1][1] - tiles[0][0][1]) / px_height_um))
+    else:
+        widths = [w_px] * len(tiles)
+        height_px = h_px
+    if len(tiles) > 1:
+        region = read(tiles[0][0][0], tiles[0][0][1], tiles[-1][1][0], tiles[0][1][1], sum(widths))
+        if region is not None and region.shape[:2] == (height_px, sum(widths)):
+            offsets = np.cumsum([0] + widths)
+            return [region[:, offsets[i]:offsets[i + 1]] for i in range(len(tiles))]
+    return [read(tile[0][0], tile[0][1], tile[1][0], tile[1][1], w_px) for tile in tiles]
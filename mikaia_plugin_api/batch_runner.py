@@ -0,0 +1,334 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+
+_END = object()
+
+
+class _Stage(object):
+    """_Stage Throughput statistics of one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.tiles = 0
+        self.busyS = 0.0  # processing
+        self.idleS = 0.0  # waiting for input from the previous stage
+        self.blockedS = 0.0  # waiting for room in the queue to the next stage
+
+    def toDict(self):
+        return {'items': self.items, 'tiles': self.tiles, 'busy_s': self.busyS, 'idle_s': self.idleS,
+                'blocked_s': self.blockedS, 'tiles_per_s': self.tiles / self.busyS if self.busyS > 0 else 0.0}
+
+
+##########################################################
+## Batched inference pipeline from tiles to annotations ##
+##########################################################
+class BatchRunner(object):
+    """BatchRunner Runs a model on all tiles of a slide in batches and uploads the results.
+
+    The work is split into pipeline stages that run at the same time, each in its own thread and
+    connected by bounded queues:
+        fetch        reads the tile images from the SlideService(several requests in flight)
+        preprocess   preprocess(pixels) for every tile, collects the tiles into batches
+        predict      model(batch), in the calling thread
+        postprocess  postprocess(batch_tiles, results) -> annotations
+        upload       SlideService.addAnnotations()/addAnnotationBatch()
+    Batches are formed across all ROIs, so only the very last batch can be smaller than
+    'batch_size'(with pad=True it is padded to full size, e.g. for models with a fixed batch dimension).
+    stats() shows for each stage how long it was busy, waited for input(idle) or for the next stage(blocked):
+    the stage with the highest busy time is the bottleneck.
+
+    With a RunJournal the progress of every tile is recorded, so a run that was interrupted can be started again
+    and continues where it stopped(see RunJournal).
+
+    Usage:
+        runner = BatchRunner(ss, model.predict, postprocess=toAnnotations, batch_size=32, w_px=224, h_px=224,
+                             preprocess=lambda pixels: pixels / 127.5 - 1.0)
+        runner.run(RoiTiler(ss, tile_w_um, tile_h_um))
+        print(runner.summary())
+    """
+
+    # slide_service: SlideService instance.
+    # model: callable(batch) -> results. 'batch' is an ndarray of shape (n, ...) with the preprocessed tiles,
+    #        results[i] belongs to tile i.
+    # preprocess: callable(pixels) -> ndarray, applied to every tile image. Default: the pixels unchanged.
+    # postprocess: callable(batch_tiles, results) -> list of Annotation items, AnnotationBatch or None.
+    #              Default: nothing is uploaded, run() returns the results instead.
+    # batch_size: number of tiles per batch.
+    # w_px, h_px, px_width_um, px_height_um, px_format, channel_idx: how tiles are read, as for SlideService.iterTiles().
+    # pad: if True the last batch is padded with zeros to 'batch_size' tiles. The results of padding tiles are dropped.
+    # dtype: dtype of the batches. Default: dtype returned by 'preprocess'.
+    # queue_size: number of batches each stage can work ahead of the next one.
+    # max_in_flight: number of tile requests in flight.
+    # progress: (start, end) range of the progress updates sent while running, or None for no progress updates.
+    # journal: RunJournal of the run, or None. Tiles completed by a previous run are skipped, results that were
+    #          never uploaded are uploaded first. Requires 'postprocess'.
+    # aggregator: ResultAggregator that is fed with the uploaded annotations, or None. Its final result is sent at the
+    #             end of run().
+    def __init__(self, slide_service, model, preprocess=None, postprocess=None, batch_size=32, w_px=0, h_px=0,
+                 px_width_um=0, px_height_um=0, px_format='RGB', channel_idx=-1, pad=False, dtype=None, queue_size=2,
+                 max_in_flight=None, progress=None, journal=None, aggregator=None):
+        if journal is not None and postprocess is None:
+            raise Exception("Parameter 'journal' requires a 'postprocess' that returns the annotations to upload.")
+        if px_width_um <= 0 and (w_px <= 0 or h_px <= 0):
+            raise Exception("Either the tile size 'w_px', 'h_px' or the pixel resolution 'px_width_um' shall be provided.")
+        if batch_size < 1:
+            raise Exception("Parameter 'batch_size' shall be at least 1.")
+        if queue_size < 1:
+            raise Exception("Parameter 'queue_size' shall be at least 1.")
+        self._ss = slide_service
+        self._model = model
+        self._preprocess = preprocess
+        self._postprocess = postprocess
+        self._batchSize = batch_size
+        self._fetch = dict(w_px=w_px, h_px=h_px, px_width_um=px_width_um, px_height_um=px_height_um,
+                           px_format=px_format, channel_idx=channel_idx)
+        self._pad = pad
+        self._dtype = np.dtype(dtype) if dtype is not None else None
+        self._queueSize = queue_size
+        self._maxInFlight = max_in_flight or min(2 * batch_size, 64)
+        self._progress = progress
+        self._journal = journal
+        self._aggregator = aggregator
+        self._stages = []
+        self._failedTiles = []
+        self._wallS = 0.0
+        self._stop = threading.Event()
+        self._errors = []
+
+    def __str__(self):
+        return '{}(batch_size={}, queue_size={}, max_in_flight={})'.format(self.__class__.__name__, self._batchSize,
+                                                                          self._queueSize, self._maxInFlight)
+
+    # Process all tiles.
+    # tiles: list of tile coordinates [[x0_um, y0_um], [x1_um, y1_um]] or any iterable of them, e.g. a RoiTiler.
+    # Returns the number of processed tiles, or the list of model results per tile if no postprocess is set.
+    # Tiles that couldn't be read are skipped(see failedTiles()), with a journal a rerun processes them.
+    # Exceptions raised by a stage stop the pipeline and are raised again here. Without a journal a failed upload
+    # raises an exception, too(with a journal the results stay pending and are uploaded by the next run).
+    def run(self, tiles):
+        self._stop.clear()
+        self._errors = []
+        self._failedTiles = []
+        names = ['fetch', 'preprocess', 'predict', 'postprocess', 'upload']
+        self._stages = [_Stage(name) for name in names]
+        fetch, preprocess, predict, postprocess, upload = self._stages
+        done = 0
+        if self._journal is not None:
+            self._journal.resumeUploads(self._ss)
+            all_tiles = list(tiles)
+            tiles = self._journal.remaining(all_tiles)
+            done = len(all_tiles) - len(tiles)
+        total = done + len(tiles) if hasattr(tiles, '__len__') else 0
+        collected = []
+        tile_queue = queue.Queue(self._maxInFlight)
+        batch_queue = queue.Queue(self._queueSize)
+        result_queue = queue.Queue(self._queueSize)
+        upload_queue = queue.Queue(self._queueSize)
+
+        threads = [
+            threading.Thread(target=self._guard, args=(self._fetchTiles, fetch, tiles, tile_queue),
+                             name='BatchRunner-fetch', daemon=True),
+            threading.Thread(target=self._guard, args=(self._batchTiles, preprocess, tile_queue, batch_queue),
+                             name='BatchRunner-preprocess', daemon=True),
+            threading.Thread(target=self._guard, args=(self._postprocessBatches, postprocess, result_queue,
+                                                       upload_queue, collected),
+                             name='BatchRunner-postprocess', daemon=True),
+            threading.Thread(target=self._guard, args=(self._uploadResults, upload, upload_queue, done, total),
+                             name='BatchRunner-upload', daemon=True),
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            self._guard(self._predictBatches, predict, batch_queue, result_queue)
+        finally:
+            if self._errors:
+                self._stop.set()
+            for thread in threads:
+                thread.join()
+            self._wallS = time.perf_counter() - start
+        if self._errors:
+            raise self._errors[0]
+        if self._aggregator is not None:
+            self._aggregator.finish()
+        return collected if self._postprocess is None else upload.tiles
+
+    # Statistics per stage: items(tiles or batches), tiles, busy_s, idle_s, blocked_s and tiles_per_s(while busy),
+    # plus 'wall_s', 'tiles_per_s' of the whole run, the number of 'failed_tiles' that couldn't be read and the
+    # name of the 'bottleneck' stage.
+    def stats(self):
+        stages = {stage.name: stage.toDict() for stage in self._stages}
+        tiles = self._stages[-1].tiles if self._stages else 0
+        bottleneck = max(self._stages, key=lambda stage: stage.busyS).name if self._stages else ''
+        return {'stages': stages, 'wall_s': self._wallS, 'tiles': tiles,
+                'tiles_per_s': tiles / self._wallS if self._wallS > 0 else 0.0,
+                'failed_tiles': len(self._failedTiles), 'bottleneck': bottleneck}
+
+    # Returns the tiles of the last run that couldn't be read and were skipped.
+    def failedTiles(self):
+        return list(self._failedTiles)
+
+    # One-line summary of stats().
+    def summary(self):
+        stats = self.stats()
+        parts = ['{} {:.1f} tiles/s busy {:.2f} s idle {:.2f} s blocked {:.2f} s'.format(
+            name, s['tiles_per_s'], s['busy_s'], s['idle_s'], s['blocked_s']) for name, s in stats['stages'].items()]
+        return '{} tiles in {:.2f} s({:.1f} tiles/s), {} failed, bottleneck: {} | {}'.format(
+            stats['tiles'], stats['wall_s'], stats['tiles_per_s'], stats['failed_tiles'], stats['bottleneck'],
+            ' | '.join(parts))
+
+    ############
+    ## Stages ##
+    ############
+
+    def _fetchTiles(self, stage, tiles, out):
+        reader = self._ss.iterTiles(tiles, max_in_flight=self._maxInFlight, **self._fetch)
+        try:
+            for item in self._timed(stage, reader):
+                stage.items += 1
+                stage.tiles += 1
+                self._put(stage, out, item)
+        finally:
+            reader.close()
+        self._put(stage, out, _END)
+
+    def _batchTiles(self, stage, tiles, out):
+        batch_tiles = []
+        batch = None
+        for tile, pixels in self._iterQueue(stage, tiles):
+            if pixels is None:
+                # not marked fetched: a rerun with the journal tries it again
+                self._failedTiles.append(tile)
+                continue
+            start = time.perf_counter()
+            pixels = self._preprocess(pixels) if self._preprocess is not None else pixels
+            if batch is None:
+                batch = np.empty((self._batchSize,) + pixels.shape, dtype=self._dtype or pixels.dtype)
+            batch[len(batch_tiles)] = pixels
+            batch_tiles.append(tile)
+            stage.items += 1
+            stage.tiles += 1
+            stage.busyS += time.perf_counter() - start
+            if len(batch_tiles) == self._batchSize:
+                if self._journal is not None:
+                    self._journal.markFetched(batch_tiles)
+                self._put(stage, out, (batch_tiles, batch))
+                batch_tiles = []
+                batch = None
+        if batch_tiles:
+            start = time.perf_counter()
+            if self._pad:
+                batch[len(batch_tiles):] = 0
+            else:
+                batch = batch[:len(batch_tiles)]
+            if self._journal is not None:
+                self._journal.markFetched(batch_tiles)
+            stage.busyS += time.perf_counter() - start
+            self._put(stage, out, (batch_tiles, batch))
+        self._put(stage, out, _END)
+
+    def _predictBatches(self, stage, batches, out):
+        for batch_tiles, batch in self._iterQueue(stage, batches):
+            start = time.perf_counter()
+            with self._ss.span('BatchRunner.predict', batch=len(batch_tiles)):
+                results = self._model(batch)
+            stage.busyS += time.perf_counter() - start
+            stage.items += 1
+            stage.tiles += len(batch_tiles)
+            self._put(stage, out, (batch_tiles, results))
+        self._put(stage, out, _END)
+
+    def _postprocessBatches(self, stage, results, out, collected):
+        for batch_tiles, batch_results in self._iterQueue(stage, results):
+            start = time.perf_counter()
+            if self._postprocess is None:
+                collected.extend(batch_results[i] for i in range(len(batch_tiles)))
+                annotations = None
+            else:
+                annotations = self._postprocess(batch_tiles, batch_results[:len(batch_tiles)])
+            number = self._journal.markInferred(batch_tiles, annotations) if self._journal is not None else None
+            stage.busyS += time.perf_counter() - start
+            stage.items += 1
+            stage.tiles += len(batch_tiles)
+            self._put(stage, out, (len(batch_tiles), annotations, number))
+        self._put(stage, out, _END)
+
+    def _uploadResults(self, stage, results, done, total):
+        for tile_count, annotations, number in self._iterQueue(stage, results):
+            start = time.perf_counter()
+            if number is not None:
+                # failed uploads stay pending in the journal and are uploaded by the next run
+                self._journal.uploadInferred(self._ss, number, annotations)
+            elif isinstance(annotations, AnnotationBatch):
+                if len(annotations) > 0 and self._ss.addAnnotationBatch(annotations) is None:
+                    raise Exception('Upload of {} annotations failed.'.format(len(annotations)))
+            elif annotations:
+                if self._ss.addAnnotations(list(annotations)) is None:
+                    raise Exception('Upload of {} annotations failed.'.format(len(annotations)))
+            if self._aggregator is not None:
+                self._aggregator.add(annotations, tiles=tile_count)
+            stage.items += 1
+            stage.tiles += tile_count
+            if self._progress is not None and total > 0:
+                progress_start, progress_end = self._progress
+                processed = done + stage.tiles
+                self._ss.sendProgress(progress_start + (progress_end - progress_start) * processed / total, 0,
+                                      '{} of {} tiles processed'.format(processed, total))
+            stage.busyS += time.perf_counter() - start
+
+    #############
+    ## Helpers ##
+    #############
+
+    # Runs a stage and stops the whole pipeline if it fails.
+    def _guard(self, func, stage, *args):
+        try:
+            func(stage, *args)
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    # Yields the items of an iterator, the time spent waiting for them is counted as busy(fetching is the work).
+    def _timed(self, stage, iterator):
+        iterator = iter(iterator)
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            item = next(iterator, _END)
+            stage.busyS += time.perf_counter() - start
+            if item is _END:
+                return
+            yield item
+
+    # Yields the items of the input queue of a stage until the end marker or a stop.
+    def _iterQueue(self, stage, input_queue):
+        while True:
+            start = time.perf_counter()
+            item = self._get(input_queue)
+            stage.idleS += time.perf_counter() - start
+            if item is _END:
+                return
+            yield item
+
+    def _get(self, input_queue):
+        while not self._stop.is_set():
+            try:
+                return input_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+    def _put(self, stage, output_queue, item):
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                output_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        stage.blockedS += time.perf_counter() - start
@@ -0,0 +1,196 @@
+import math
+
+import numpy as np
+
+from mikaia_plugin_api.roi_tiler import RoiTiler
+
+
+# Default score of the coarse pass: fraction(0..1) of the pixels of every tile thumbnail that look like tissue,
+# i.e. whose color saturation exceeds 'min_saturation'(0..255).
+# thumbnails: uint8 ndarray of shape (n, height, width, channels) with color channels. Returns n scores.
+# Single channel thumbnails(gray or a fluorescence channel) have no saturation and raise an exception.
+def tissueFraction(thumbnails, min_saturation=20):
+    pixels = np.asarray(thumbnails, dtype=np.int32)
+    if pixels.ndim != 4 or pixels.shape[3] < 3:
+        raise Exception('tissueFraction() needs color thumbnails, pass a score function for single channel images.')
+    max_value = pixels.max(axis=3)
+    min_value = pixels.min(axis=3)
+    saturation = (max_value - min_value) * 255 // np.maximum(max_value, 1)
+    return (saturation > min_saturation).mean(axis=(1, 2))
+
+
+######################################################
+## Coarse-to-fine selection of the tiles to analyze ##
+######################################################
+class CoarseToFine(object):
+    """CoarseToFine Selects the tiles to analyze at native resolution with a cheap pass at low resolution.
+
+    The tiles of the ROIs(see RoiTiler) are first read as small thumbnails: neighbouring tiles are
+    fetched together as one low resolution region and split locally, so the coarse pass needs only
+    a few small requests. A score function rates every thumbnail(a cheap model or a heuristic such
+    as the tissue fraction). Only tiles whose score reaches 'threshold' are kept for the fine pass;
+    with a classifier score(e.g. the probability of the class of interest) this keeps the positive
+    and uncertain tiles and drops the confident negatives. 'max_tiles' limits the fine pass to the
+    tiles with the highest scores.
+    Tile coordinates use the same format as the tile lists of the examples:
+    [[x0_um, y0_um], [x1_um, y1_um]] (top left and bottom right corner in um).
+
+    Usage:
+        selection = CoarseToFine(ss, 224 * res.width, 224 * res.height, max_tiles=5000)
+        print(selection.summary())
+        runner.run(selection.tiles())
+    """
+
+    # slide_service: SlideService instance.
+    # tile_w_um, tile_h_um: tile size in um. tile_h_um defaults to tile_w_um.
+    # score: callable(thumbnails) -> scores. 'thumbnails' is a uint8 ndarray of shape
+    #        (n, coarse_tile_px, coarse_tile_px, channels), the result has one score per thumbnail.
+    #        Default: tissueFraction(), which needs color thumbnails('RGB' or 'BGR', all channels).
+    # threshold: tiles with a score below 'threshold' are dropped.
+    # max_tiles: maximum number of tiles of the fine pass(the tiles with the highest scores), 0 for no limit.
+    # coarse_tile_px: size of the tile thumbnails in pixels. Sets the resolution of the coarse pass.
+    # block_tiles: neighbouring tiles read with a single request in the coarse pass, per dimension.
+    # px_format, channel_idx: see SlideService.getROI(). Applies to the coarse pass.
+    # max_in_flight: number of coarse requests in flight.
+    # stride_w_um, stride_h_um, rois, min_coverage, tissue, slide_info: see RoiTiler.
+    def __init__(self, slide_service, tile_w_um, tile_h_um=0, score=None, threshold=0.05, max_tiles=0,
+                 coarse_tile_px=16, block_tiles=16, px_format='RGB', channel_idx=-1, max_in_flight=4,
+                 stride_w_um=0, stride_h_um=0, rois=None, min_coverage=0.5, tissue=True, slide_info=None):
+        if coarse_tile_px < 1 or block_tiles < 1:
+            raise Exception("Parameters 'coarse_tile_px' and 'block_tiles' shall be at least 1.")
+        if score is None and (px_format == 'Gray' or channel_idx >= 0):
+            raise Exception("The default score needs color thumbnails, pass a 'score' function for px_format='Gray' "
+                            "or channel_idx >= 0.")
+        if slide_info is None:
+            slide_info = slide_service.getSlideInfo()
+        self._tiler = RoiTiler(slide_service, tile_w_um, tile_h_um, stride_w_um, stride_h_um, rois=rois,
+                               min_coverage=min_coverage, tissue=tissue, slide_info=slide_info)
+        self._ss = slide_service
+        self._score = score if score is not None else tissueFraction
+        self._threshold = threshold
+        self._maxTiles = max_tiles
+        self._tilePx = coarse_tile_px
+        self._blockTiles = block_tiles
+        self._pxFormat = px_format
+        self._channelIdx = channel_idx
+        self._maxInFlight = max_in_flight
+
+        candidates = self._tiler.tiles()
+        self._tileW = candidates[0][1][0] - candidates[0][0][0] if candidates else float(tile_w_um)
+        self._tileH = candidates[0][1][1] - candidates[0][0][1] if candidates else self._tileW
+        self._pxWidthUm = self._tileW / coarse_tile_px
+        self._pxHeightUm = self._tileH / coarse_tile_px
+        res = slide_info.nativeResolution
+        self._nativeTilePx = int(round(self._tileW / res.width)) * int(round(self._tileH / res.height))
+        self._coarseRequests = 0
+        self._coarsePx = 0
+
+        self._candidates = candidates
+        self._candidateScores = self._coarsePass(candidates, self._tiler.gridIndices())
+        self._scoreMap = np.full(self._tiler.coverageMap().shape, np.nan)
+        for (row, col), tile_score in zip(self._tiler.gridIndices(), self._candidateScores):
+            self._scoreMap[row, col] = tile_score
+        self._scoreMap.flags.writeable = False
+
+        selected = np.nonzero(self._candidateScores >= self._threshold)[0]
+        self._aboveThreshold = len(selected)
+        if 0 < self._maxTiles < len(selected):
+            # highest scores first, ties in row-major order
+            order = np.argsort(-self._candidateScores[selected], kind='stable')
+            selected = np.sort(selected[order[:self._maxTiles]])
+        self._selected = selected.tolist()
+
+    def __len__(self):
+        return len(self._selected)
+
+    def __str__(self):
+        return '{}(tiles={}, candidates={}, coarse requests={})'.format(
+            self.__class__.__name__, len(self), len(self._candidates), self._coarseRequests)
+
+    # Yields tuples (tile, score) of the selected tiles in row-major order.
+    def __iter__(self):
+        for index in self._selected:
+            yield self._candidates[index], float(self._candidateScores[index])
+
+    # Returns the coordinates of the tiles selected for the fine pass [[x0_um, y0_um], [x1_um, y1_um]] in
+    # row-major order.
+    def tiles(self):
+        return [self._candidates[index] for index in self._selected]
+
+    # Returns the coarse scores of the selected tiles(in the order of tiles()).
+    def scores(self):
+        return [float(self._candidateScores[index]) for index in self._selected]
+
+    # Returns the coarse score of every tile of the RoiTiler grid as read-only ndarray of shape (rows, cols).
+    # Tiles outside of the ROIs or the tissue are NaN.
+    def scoreMap(self):
+        return self._scoreMap
+
+    # Returns the RoiTiler that provides the candidate tiles.
+    def tiler(self):
+        return self._tiler
+
+    # Statistics of the selection: number of 'candidates'(tiles of the RoiTiler), tiles 'above_threshold' and
+    # 'selected' tiles, 'coarse_requests' and 'coarse_px' read by the coarse pass, 'fine_px' to read by the
+    # fine pass, 'native_px' to read without the coarse pass and the 'saved' fraction of the pixel traffic.
+    def stats(self):
+        fine_px = len(self._selected) * self._nativeTilePx
+        native_px = len(self._candidates) * self._nativeTilePx
+        return {'candidates': len(self._candidates), 'above_threshold': self._aboveThreshold,
+                'selected': len(self._selected), 'coarse_requests': self._coarseRequests,
+                'coarse_px': self._coarsePx, 'fine_px': fine_px, 'native_px': native_px,
+                'saved': 1.0 - (self._coarsePx + fine_px) / native_px if native_px > 0 else 0.0}
+
+    # One-line summary of stats().
+    def summary(self):
+        stats = self.stats()
+        limited = stats['above_threshold'] - stats['selected']
+        return '{} of {} tiles selected{}, {} coarse requests, {:.1f} % less pixels read'.format(
+            stats['selected'], stats['candidates'],
+            '({} more above the threshold, limited by max_tiles)'.format(limited) if limited > 0 else '',
+            stats['coarse_requests'], stats['saved'] * 100.0)
+
+    # read the candidates block by block at low resolution and score their thumbnails
+    def _coarsePass(self, candidates, indices):
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        blocks = {}
+        for index, (row, col) in enumerate(indices):
+            blocks.setdefault((row // self._blockTiles, col // self._blockTiles), []).append(index)
+        blocks = [blocks[key] for key in sorted(blocks)]
+        regions = []
+        for members in blocks:
+            x0 = min(candidates[index][0][0] for index in members)
+            y0 = min(candidates[index][0][1] for index in members)
+            x1 = max(candidates[index][1][0] for index in members)
+            y1 = max(candidates[index][1][1] for index in members)
+            regions.append([[x0, y0], [x1, y1]])
+
+        reader = self._ss.iterTiles(regions, px_width_um=self._pxWidthUm, px_height_um=self._pxHeightUm,
+                                    px_format=self._pxFormat, channel_idx=self._channelIdx,
+                                    max_in_flight=self._maxInFlight)
+        try:
+            for members, (region, pixels) in zip(blocks, reader):
+                if pixels is None:
+                    raise Exception('Region {} of the coarse pass could not be read.'.format(region))
+                pixels = pixels.reshape(pixels.shape[0], pixels.shape[1], -1)
+                self._coarseRequests += 1
+                self._coarsePx += pixels.shape[0] * pixels.shape[1]
+                thumbnails = np.stack([self._thumbnail(pixels, region, candidates[index]) for index in members])
+                block_scores = np.asarray(self._score(thumbnails), dtype=np.float64).reshape(-1)
+                if len(block_scores) != len(members):
+                    raise Exception('The score function returned {} scores for {} thumbnails.'.format(
+                        len(block_scores), len(members)))
+                scores[members] = block_scores
+        finally:
+            reader.close()
+        return scores
+
+    # cut the thumbnail of a tile from the region image, padded at the border if rounding made the region smaller
+    def _thumbnail(self, pixels, region, tile):
+        left = int(math.floor((tile[0][0] - region[0][0]) / self._pxWidthUm + 0.5))
+        top = int(math.floor((tile[0][1] - region[0][1]) / self._pxHeightUm + 0.5))
+        thumbnail = pixels[top:top + self._tilePx, left:left + self._tilePx]
+        if thumbnail.shape[0] != self._tilePx or thumbnail.shape[1] != self._tilePx:
+            thumbnail = np.pad(thumbnail, ((0, self._tilePx - thumbnail.shape[0]),
+                                           (0, self._tilePx - thumbnail.shape[1]), (0, 0)), mode='edge')
+        return thumbnail
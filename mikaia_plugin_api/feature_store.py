@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+# the mapped files grow by at least this many rows
+_GROW_ROWS = 4096
+
+
+# Default directory of the feature stores: ~/.mikaia_plugin/features
+def defaultFeatureDirectory():
+    return os.path.join(os.path.expanduser('~'), '.mikaia_plugin', 'features')
+
+
+#####################################################
+## Memory-mapped store of per-tile feature vectors ##
+#####################################################
+class FeatureStore(object):
+    """FeatureStore Append-only store of per-tile feature vectors(embeddings) in memory-mapped files.
+
+    A store is a directory with three files:
+        features.bin  float16 or float32 matrix, one row of 'dims' values per tile
+        tiles.bin     float64 tile coordinates x0, y0, x1, y1(um) per row
+        meta.json     dims, dtype, number of rows and a description of the run
+    Both matrices are mapped, not loaded: rows are appended in batches straight from the inference
+    loop, and nearest() and kmeans() go over the rows chunk by chunk, so stores with hundreds of
+    thousands of tiles don't have to fit into memory. The number of rows is committed to meta.json
+    by flush()(called every 'flush_rows' rows and by close()); rows appended after the last flush
+    are lost if the process crashes.
+
+    Usage:
+        with FeatureStore.forSlide(ss, params={'model': 'UNI', 'tile_px': 224}, dims=1024) as store:
+            tiles = store.remaining(tiles)
+            for batch_tiles, batch, ok in BatchPreprocessor(ss, tiles, 64, 224, 224):
+                store.append(batch_tiles, model(batch))
+            centers, labels = store.kmeans(8)
+            store.exportClusters(ss, labels)
+    """
+
+    # path: directory of the store. Created if it doesn't exist, otherwise the stored rows are mapped.
+    # dims: number of features per tile. Required for a new store.
+    # dtype: 'float16' or 'float32', dtype of the stored features of a new store.
+    # header: optional dict that describes the run, stored in meta.json of a new store.
+    # flush_rows: number of appended rows after which the row count is committed.
+    def __init__(self, path, dims=None, dtype='float16', header=None, flush_rows=4096):
+        self._path = os.path.abspath(path)
+        self._metaPath = os.path.join(self._path, 'meta.json')
+        self._lock = threading.Lock()
+        self._flushRows = flush_rows
+        self._rowIndex = None  # tile key -> row, built on demand
+        if os.path.exists(self._metaPath):
+            with open(self._metaPath, 'r', encoding='utf-8') as f:
+                self._meta = json.load(f)
+            if dims is not None and dims != self._meta['dims']:
+                raise Exception('The feature store {} has {} dims, not {}.'.format(self._path, self._meta['dims'], dims))
+        else:
+            if dims is None:
+                raise Exception("Parameter 'dims' is required to create a new feature store.")
+            if np.dtype(dtype) not in (np.float16, np.float32):
+                raise Exception("Parameter 'dtype' shall be 'float16' or 'float32'.")
+            os.makedirs(self._path, exist_ok=True)
+            self._meta = {'dims': int(dims), 'dtype': np.dtype(dtype).name, 'rows': 0, 'run': header or {}}
+            for name in ('features.bin', 'tiles.bin'):
+                open(os.path.join(self._path, name), 'wb').close()
+            self._writeMeta()
+        self._dims = self._meta['dims']
+        self._dtype = np.dtype(self._meta['dtype'])
+        self._rows = self._meta['rows']
+        self._unflushed = 0
+        self._capacity = 0
+        self._features = None
+        self._tiles = None
+        self._map(max(self._rows, 1))
+
+    # Open the feature store of a run. The store is named after the slide identity and the parameters(model, tile
+    # size, ...), so the features of the same slide and model are found again by later runs.
+    # slide_service: SlideService instance of the slide.
+    # params: dict of everything that changes the features, e.g. model name and version, tile size, resolution.
+    # dims, dtype: see __init__().
+    # directory: directory of the stores. Default: defaultFeatureDirectory().
+    @classmethod
+    def forSlide(cls, slide_service, params=None, dims=None, dtype='float16', directory=None):
+        slide = slide_service.slideIdentity()
+        if slide is None:
+            raise Exception('The slide identity could not be read from the SlideService.')
+        header = {'slide': slide, 'params': params or {}}
+        key = hashlib.sha1(json.dumps(header, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20]
+        return cls(os.path.join(directory or defaultFeatureDirectory(), key), dims, dtype, header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._rows
+
+    def __str__(self):
+        return '{}(path={}, rows={}, dims={}, dtype={})'.format(self.__class__.__name__, self._path, self._rows,
+                                                                self._dims, self._dtype)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def dims(self):
+        return self._dims
+
+    def close(self):
+        with self._lock:
+            if self._features is None:
+                return
+            self._flush()
+            self._features = None
+            self._tiles = None
+
+    # Commit the appended rows.
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    # Append the features of a batch of tiles.
+    # tiles: list of tile coordinates [[x0_um, y0_um], [x1_um, y1_um]].
+    # features: array of shape (len(tiles), dims), e.g. the output of the model. Converted to the dtype of the store.
+    # Returns the row of the first appended tile.
+    def append(self, tiles, features):
+        features = np.asarray(features)
+        if features.ndim != 2 or features.shape[0] != len(tiles) or features.shape[1] != self._dims:
+            raise Exception('Expected features of shape ({}, {}), got {}.'.format(len(tiles), self._dims,
+                                                                                  features.shape))
+        coordinates = np.asarray(tiles, dtype=np.float64).reshape(len(tiles), 4)
+        with self._lock:
+            first = self._rows
+            end = first + len(tiles)
+            if end > self._capacity:
+                self._map(max(end, self._capacity * 2, _GROW_ROWS))
+            self._features[first:end] = features
+            self._tiles[first:end] = coordinates
+            self._rows = end
+            if self._rowIndex is not None:
+                for row, key in enumerate(map(self._tileKey, coordinates), first):
+                    self._rowIndex[key] = row
+            self._unflushed += len(tiles)
+            if self._unflushed >= self._flushRows:
+                self._flush()
+        return first
+
+    # Returns the features as read-only array of shape (rows, dims)(mapped, not loaded).
+    # start, end: range of rows. Default: all rows.
+    def features(self, start=0, end=None):
+        view = self._features[start:self._rows if end is None else min(end, self._rows)]
+        view.flags.writeable = False
+        return view
+
+    # Returns the tile coordinates of the rows [[x0_um, y0_um], [x1_um, y1_um]].
+    def tiles(self, rows=None):
+        coordinates = self._tiles[:self._rows] if rows is None else self._tiles[np.asarray(rows)]
+        return [[[x0, y0], [x1, y1]] for x0, y0, x1, y1 in coordinates.tolist()]
+
+    # Returns the row of the tile or -1 if the tile isn't in the store.
+    def rowOf(self, tile):
+        return self._index().get(self._tileKey(np.asarray(tile, dtype=np.float64).reshape(4)), -1)
+
+    # Returns the tiles that aren't in the store yet.
+    def remaining(self, tiles):
+        index = self._index()
+        return [tile for tile in tiles if self._tileKey(np.asarray(tile, dtype=np.float64).reshape(4)) not in index]
+
+    # k nearest rows of every query vector.
+    # queries: array of shape (dims,) or (n, dims).
+    # metric: 'cosine' or 'l2'(squared euclidean distance).
+    # chunk_rows: number of rows compared at once.
+    # Returns (rows, distances), both of shape (n, k) sorted by distance. For 'cosine' the distance is 1 - similarity.
+    def nearest(self, queries, k=10, metric='cosine', chunk_rows=65536):
+        if metric not in ('cosine', 'l2'):
+            raise Exception("Unknown metric '{}'.".format(metric))
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if metric == 'cosine':
+            queries = self._normalize(queries)
+        k = min(k, self._rows)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, self._rows, chunk_rows):
+            chunk = np.asarray(self._features[start:min(start + chunk_rows, self._rows)], dtype=np.float32)
+            distances = self._distances(queries, chunk, metric)
+            rows = np.broadcast_to(np.arange(start, start + len(chunk)), distances.shape)
+            distances = np.concatenate([best_distances, distances], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            keep = np.argpartition(distances, k - 1, axis=1)[:, :k] if distances.shape[1] > k else \
+                np.argsort(distances, axis=1)
+            best_distances = np.take_along_axis(distances, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+        order = np.argsort(best_distances, axis=1, kind='stable')
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_distances, order, axis=1)
+
+    # Mini-batch k-means(Sculley 2010) over the stored features: every iteration moves the centers towards a
+    # random batch of rows, so only 'batch_size' rows are read per iteration.
+    # k: number of clusters.
+    # metric: 'l2' or 'cosine'(spherical k-means on the normalized features).
+    # iterations: number of mini-batches. Stops earlier once the centers move less than 'tolerance'.
+    # Returns (centers as (k, dims) float32 array, cluster label of every row as int32 array).
+    def kmeans(self, k, batch_size=4096, iterations=100, metric='l2', tolerance=1e-4, seed=0, chunk_rows=65536):
+        if metric not in ('cosine', 'l2'):
+            raise Exception("Unknown metric '{}'.".format(metric))
+        if not 0 < k <= self._rows:
+            raise Exception('k shall be between 1 and the number of rows({}).'.format(self._rows))
+        rng = np.random.default_rng(seed)
+        centers = self._kmeansPlusPlus(self._sample(rng, min(self._rows, max(batch_size, 10 * k)), metric), k, rng)
+        counts = np.zeros(k, dtype=np.int64)
+        for iteration in range(iterations):
+            batch = self._sample(rng, min(batch_size, self._rows), metric)
+            labels = np.argmin(self._distances(batch, centers, 'l2'), axis=1)
+            previous = centers.copy()
+            for center in np.unique(labels):
+                members = batch[labels == center]
+                counts[center] += len(members)
+                # per center learning rate 1/count: the center is the running mean of all rows assigned to it
+                centers[center] += (members.sum(axis=0) - len(members) * centers[center]) / counts[center]
+            if metric == 'cosine':
+                centers = self._normalize(centers)
+            if np.max(np.sum((centers - previous) ** 2, axis=1)) < tolerance:
+                break
+        labels = np.empty(self._rows, dtype=np.int32)
+        for start in range(0, self._rows, chunk_rows):
+            chunk = np.asarray(self._features[start:min(start + chunk_rows, self._rows)], dtype=np.float32)
+            if metric == 'cosine':
+                chunk = self._normalize(chunk)
+            labels[start:start + len(chunk)] = np.argmin(self._distances(chunk, centers, 'l2'), axis=1)
+        return centers, labels
+
+    # Add the cluster assignments to the slide as one rectangle annotation per tile.
+    # labels: cluster label per row, e.g. the result of kmeans().
+    # class_names: annotation class name per cluster label. Default: 'Cluster 0', 'Cluster 1', ...
+    # rows: rows to export. Default: all rows.
+    # max_chunk_annotations: maximum number of annotations per addAnnotations() request.
+    # Returns the number of added annotations.
+    def exportClusters(self, slide_service, labels, class_names=None, rows=None, max_chunk_annotations=5000):
+        labels = np.asarray(labels)
+        rows = np.arange(self._rows) if rows is None else np.asarray(rows)
+        count = 0
+        for start in range(0, len(rows), max_chunk_annotations):
+            chunk = rows[start:start + max_chunk_annotations]
+            annotations = []
+            for row, tile in zip(chunk.tolist(), self.tiles(chunk)):
+                label = int(labels[row])
+                class_name = class_names[label] if class_names is not None else 'Cluster {}'.format(label)
+                annotations.append(slide_service.createAnnotation('Rectangle', tile, class_name=class_name))
+            if annotations and slide_service.addAnnotations(annotations) is None:
+                raise Exception('Upload of {} cluster annotations failed.'.format(len(annotations)))
+            count += len(annotations)
+        return count
+
+    def _map(self, capacity):
+        # flush the current mapping before the files are resized and mapped again
+        if self._features is not None:
+            self._features.flush()
+            self._tiles.flush()
+        self._features = self._tiles = None
+        for name, row_bytes in (('features.bin', self._dims * self._dtype.itemsize), ('tiles.bin', 32)):
+            file_path = os.path.join(self._path, name)
+            if os.path.getsize(file_path) < capacity * row_bytes:
+                with open(file_path, 'r+b') as f:
+                    f.truncate(capacity * row_bytes)
+        self._capacity = capacity
+        self._features = np.memmap(os.path.join(self._path, 'features.bin'), dtype=self._dtype, mode='r+',
+                                   shape=(capacity, self._dims))
+        self._tiles = np.memmap(os.path.join(self._path, 'tiles.bin'), dtype=np.float64, mode='r+',
+                                shape=(capacity, 4))
+
+    def _flush(self):
+        self._features.flush()
+        self._tiles.flush()
+        self._meta['rows'] = self._rows
+        self._writeMeta()
+        self._unflushed = 0
+
+    def _writeMeta(self):
+        temp_path = self._metaPath + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._meta, f)
+        os.replace(temp_path, self._metaPath)
+
+    def _index(self):
+        with self._lock:
+            if self._rowIndex is None:
+                self._rowIndex = {self._tileKey(coordinates): row
+                                  for row, coordinates in enumerate(self._tiles[:self._rows])}
+            return self._rowIndex
+
+    @staticmethod
+    def _tileKey(coordinates):
+        return coordinates.astype(np.float64).tobytes()
+
+    # random rows as float32(sorted, so the mapped file is read front to back)
+    def _sample(self, rng, count, metric):
+        rows = np.sort(rng.choice(self._rows, size=count, replace=False))
+        sample = np.asarray(self._features[rows], dtype=np.float32)
+        return self._normalize(sample) if metric == 'cosine' else sample
+
+    @staticmethod
+    def _kmeansPlusPlus(sample, k, rng):
+        centers = [sample[rng.integers(len(sample))]]
+        closest = np.sum((sample - centers[0]) ** 2, axis=1)
+        for i in range(1, k):
+            total = closest.sum()
+            index = rng.choice(len(sample), p=closest / total) if total > 0 else rng.integers(len(sample))
+            centers.append(sample[index])
+            closest = np.minimum(closest, np.sum((sample - sample[index]) ** 2, axis=1))
+        return np.array(centers, dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors):
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    @staticmethod
+    def _distances(queries, rows, metric):
+        if metric == 'cosine':
+            return 1.0 - queries @ FeatureStore._normalize(rows).T
+        distances = (np.sum(queries ** 2, axis=1)[:, None] - 2.0 * (queries @ rows.T)
+                     + np.sum(rows ** 2, axis=1)[None, :])
+        return np.maximum(distances, 0.0)
@@ -0,0 +1,165 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from mikaia_plugin_api.tile_reader import TileReader
+
+
+#######################################################
+## Grid patch reader based on few large ROI requests ##
+#######################################################
+class GridReader(object):
+    """GridReader Splits a ROI into a regular grid of patches using only a few large ROI requests.
+
+    Instead of one request per patch, the ROI is read as a few large regions whose size is bounded
+    by 'memory_budget_mb'. The patches are returned as read-only strided views into these regions,
+    so splitting a region into patches doesn't copy any pixels.
+    Patch coordinates use the same format as the tile lists of the examples:
+    [[x0_um, y0_um], [x1_um, y1_um]] (top left and bottom right corner in um).
+
+    Usage:
+        for tile, patch in GridReader(ss, roi, 224):
+            ...
+    """
+
+    # slide_service: SlideService instance.
+    # roi: area to analyze as RectF or Annotation(its bounding rectangle is used).
+    # patch_px: patch size in pixels as int or (width, height).
+    # stride_px: distance between neighbouring patches in pixels as int or (x, y). Default: patch size(no overlap).
+    # px_width_um, px_height_um: pixel resolution of the patches in um/pixel. Default: native slide resolution.
+    # px_format, channel_idx: see SlideService.getROI().
+    # memory_budget_mb: maximum size of a single region request in MB.
+    # max_in_flight: number of regions that are requested in advance(memory use is up to
+    #                (max_in_flight + 1) * memory_budget_mb).
+    # slide_info: SlideInfo of the slide. Only required for native resolution, fetched if not provided.
+    def __init__(self, slide_service, roi, patch_px, stride_px=None, px_width_um=0, px_height_um=0, px_format='RGB',
+                 channel_idx=-1, memory_budget_mb=32, max_in_flight=2, slide_info=None):
+        self._ss = slide_service
+        self._pxFormat = px_format
+        self._channelIdx = channel_idx
+        self._maxInFlight = max_in_flight
+        self._channels = 1 if px_format == 'Gray' or channel_idx >= 0 else 3
+
+        self._patchW, self._patchH = self._toSize(patch_px)
+        self._strideX, self._strideY = self._toSize(stride_px if stride_px is not None else patch_px)
+        if min(self._patchW, self._patchH, self._strideX, self._strideY) <= 0:
+            raise Exception("Patch size and stride shall be positive.")
+
+        self._native = px_width_um <= 0
+        if self._native:
+            if slide_info is None:
+                slide_info = slide_service.getSlideInfo()
+            px_width_um = slide_info.nativeResolution.width
+            px_height_um = slide_info.nativeResolution.height
+        elif px_height_um <= 0:
+            px_height_um = px_width_um
+        self._pxWidthUm = px_width_um
+        self._pxHeightUm = px_height_um
+
+        rect = roi.boundingRect() if hasattr(roi, 'boundingRect') else roi
+        self._x0 = rect.x
+        self._y0 = rect.y
+        self._cols = self._patchCount(rect.width / px_width_um, self._patchW, self._strideX)
+        self._rows = self._patchCount(rect.height / px_height_um, self._patchH, self._strideY)
+
+        # region size in patches, bounded by the memory budget
+        max_px = max(1, int(memory_budget_mb * 1024 * 1024) // self._channels)
+        side_px = int(math.sqrt(max_px))
+        self._regionCols = self._fittingPatches(side_px, self._patchW, self._strideX, self._cols)
+        width_px = (self._regionCols - 1) * self._strideX + self._patchW
+        self._regionRows = self._fittingPatches(max_px // width_px, self._patchH, self._strideY, self._rows)
+
+    def __len__(self):
+        return self._rows * self._cols
+
+    def __str__(self):
+        return '{}(patches={}x{}, regions={}, patches per region={}x{})'.format(
+            self.__class__.__name__, self._cols, self._rows, len(self.regions()), self._regionCols, self._regionRows)
+
+    # Yields tuples (tile, patch) region by region. Within a region the patches are in row-major order.
+    def __iter__(self):
+        for region, tiles, patches in self.iterRegions():
+            for row in range(patches.shape[0]):
+                for col in range(patches.shape[1]):
+                    yield tiles[row][col], patches[row, col]
+
+    # Returns the coordinates of all patches [[x0_um, y0_um], [x1_um, y1_um]] in row-major order.
+    def tiles(self):
+        return [self._tile(row, col) for row in range(self._rows) for col in range(self._cols)]
+
+    # Returns the regions that are requested from the server as tuples (first_row, first_col, rows, cols)
+    # in patch units.
+    def regions(self):
+        regions = []
+        for row in range(0, self._rows, self._regionRows):
+            for col in range(0, self._cols, self._regionCols):
+                regions.append((row, col, min(self._regionRows, self._rows - row), min(self._regionCols, self._cols - col)))
+        return regions
+
+    # Iterate over the regions. Yields tuples (region, tiles, patches) where
+    # region: (first_row, first_col, rows, cols) in patch units(see regions()),
+    # tiles: rows x cols nested list of patch coordinates,
+    # patches: read-only ndarray view of shape (rows, cols, patch_height, patch_width[, channels]).
+    #          Use patches.reshape(-1, ...) to get a contiguous batch of patches.
+    # Regions that couldn't be read are skipped.
+    def iterRegions(self):
+        with TileReader(self._fetchRegion, self.regions(), max_in_flight=self._maxInFlight) as reader:
+            for region, pixels in reader:
+                if pixels is None:
+                    continue
+                first_row, first_col, rows, cols = region
+                tiles = [[self._tile(first_row + r, first_col + c) for c in range(cols)] for r in range(rows)]
+                yield region, tiles, self._patchViews(pixels, rows, cols)
+
+    def _fetchRegion(self, region):
+        first_row, first_col, rows, cols = region
+        width_px = (cols - 1) * self._strideX + self._patchW
+        height_px = (rows - 1) * self._strideY + self._patchH
+        x_um = self._x0 + first_col * self._strideX * self._pxWidthUm
+        y_um = self._y0 + first_row * self._strideY * self._pxHeightUm
+        if self._native:
+            pixels = self._ss.getNativeROIArray(x_um, y_um, width_px, height_px, self._pxFormat, self._channelIdx)
+        else:
+            pixels = self._ss.getROIArray(x_um, y_um, width_px * self._pxWidthUm, height_px * self._pxHeightUm,
+                                          self._pxWidthUm, self._pxHeightUm, self._pxFormat, self._channelIdx)
+        if pixels is None or pixels.shape[:2] == (height_px, width_px):
+            return pixels
+        # the server rounded the region size differently or clipped it at the slide border:
+        # crop or zero-pad to the requested size, the patch views must not reach beyond the pixels
+        fitted = np.zeros((height_px, width_px) + pixels.shape[2:], dtype=pixels.dtype)
+        h = min(height_px, pixels.shape[0])
+        w = min(width_px, pixels.shape[1])
+        fitted[:h, :w] = pixels[:h, :w]
+        return fitted
+
+    def _patchViews(self, pixels, rows, cols):
+        row_stride, col_stride = pixels.strides[:2]
+        shape = (rows, cols, self._patchH, self._patchW) + pixels.shape[2:]
+        strides = (row_stride * self._strideY, col_stride * self._strideX, row_stride, col_stride) + pixels.strides[2:]
+        return as_strided(pixels, shape=shape, strides=strides, writeable=False)
+
+    def _tile(self, row, col):
+        x_um = self._x0 + col * self._strideX * self._pxWidthUm
+        y_um = self._y0 + row * self._strideY * self._pxHeightUm
+        return [[x_um, y_um], [x_um + self._patchW * self._pxWidthUm, y_um + self._patchH * self._pxHeightUm]]
+
+    @staticmethod
+    def _toSize(value):
+        if isinstance(value, (tuple, list)):
+            return int(value[0]), int(value[1])
+        return int(value), int(value)
+
+    # number of patches needed to cover 'length_px'
+    @staticmethod
+    def _patchCount(length_px, patch, stride):
+        if length_px <= patch:
+            return 1
+        return int(math.ceil((length_px - patch) / stride - 1e-9)) + 1
+
+    # number of patches(at least 1, at most 'total') that fit into 'length_px'
+    @staticmethod
+    def _fittingPatches(length_px, patch, stride, total):
+        if length_px <= patch:
+            return 1
+        return max(1, min(total, (length_px - patch) // stride + 1))
@@ -0,0 +1,97 @@
+import gzip
+import threading
+
+from mikaia_plugin_api.lazy_module import LazyModule
+
+# requests is imported when the first transport is created
+requests = LazyModule('requests')
+urllib3_retry = LazyModule('urllib3.util.retry')
+
+
+###########################################################
+## Pooled keep-alive HTTP transport for the SlideService ##
+###########################################################
+class HttpTransport(object):
+    """HttpTransport Persistent, pooled HTTP client used by SlideService.
+
+    All requests go through one requests.Session, so TCP connections to the MIKAIA
+    REST server are kept alive and reused instead of being opened once per tile.
+    The connection pool is shared by all threads using the same transport.
+    """
+
+    # HTTP status codes that are considered transient and are retried
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+    # pool_size: maximum number of kept-alive connections to the MIKAIA server.
+    #            Should be at least the number of threads sharing this transport.
+    # timeout: (connect timeout, read timeout) in seconds, or a single value for both. None waits forever.
+    # retries: number of retries on connection errors and transient 5xx responses.
+    # backoff_factor: retry delay is backoff_factor * (2 ** (retry_number - 1)) seconds.
+    # retry_methods: HTTP methods which are retried. By default only the idempotent GET requests.
+    # gzip_requests: compress request bodies(e.g. large annotation lists) with gzip.
+    #                Only enable this if the MIKAIA server accepts 'Content-Encoding: gzip'.
+    # gzip_min_size: request bodies smaller than this(in bytes) are sent uncompressed.
+    # gzip_level: gzip compression level(1 = fastest ... 9 = smallest).
+    def __init__(self, pool_size=10, timeout=(10.0, 600.0), retries=3, backoff_factor=0.2,
+                 retry_methods=('GET',), gzip_requests=False, gzip_min_size=16384, gzip_level=1):
+        self._timeout = timeout
+        self._gzipRequests = gzip_requests
+        self._gzipMinSize = gzip_min_size
+        self._gzipLevel = gzip_level
+        self._closed = False
+        self._lock = threading.Lock()
+
+        retry = urllib3_retry.Retry(total=retries,
+                                    connect=retries,
+                                    read=retries,
+                                    status=retries,
+                                    backoff_factor=backoff_factor,
+                                    status_forcelist=self.RETRY_STATUS_CODES,
+                                    allowed_methods=frozenset(m.upper() for m in retry_methods),
+                                    raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def __str__(self):
+        return '{}(timeout={}, gzip_requests={})'.format(self.__class__.__name__, self._timeout, self._gzipRequests)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Send a GET request.
+    # headers: optional additional request headers.
+    # stream: if True the response body isn't read in advance, it can be read from response.raw.
+    def get(self, url, params=None, headers=None, stream=False):
+        return self._session.get(url, params=params, headers=headers, stream=stream, timeout=self._timeout)
+
+    # Send a POST request. data: str or bytes.
+    def post(self, url, data=None):
+        data, headers = self._encodeBody(data)
+        return self._session.post(url, data=data, headers=headers, timeout=self._timeout)
+
+    # Send a PATCH request. data: str or bytes.
+    def patch(self, url, data=None):
+        data, headers = self._encodeBody(data)
+        return self._session.patch(url, data=data, headers=headers, timeout=self._timeout)
+
+    # Close all pooled connections. The transport must not be used afterwards.
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._session.close()
+
+    def _encodeBody(self, data):
+        if not self._gzipRequests or data is None:
+            return data, None
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if len(data) < self._gzipMinSize:
+            return data, None
+        return gzip.compress(data, compresslevel=self._gzipLevel), {'Content-Encoding': 'gzip'}
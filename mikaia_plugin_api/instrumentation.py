@@ -0,0 +1,310 @@
+import atexit
+import collections
+import itertools
+import json
+import math
+import os
+import threading
+import time
+import weakref
+
+# latency histogram: bucket i counts durations <= HISTOGRAM_MIN_MS * 2 ** (i / 2), the last bucket counts the rest
+HISTOGRAM_MIN_MS = 0.125
+HISTOGRAM_BUCKETS = 42
+
+# the live instances that report at interpreter exit, see _reportAtExit()
+_atExitInstances = weakref.WeakSet()
+_atExitLock = threading.Lock()
+_atExitRegistered = False
+_sequence = itertools.count()
+
+
+class _Stats(object):
+    """_Stats Aggregated timings of one endpoint or span"""
+
+    __slots__ = ('count', 'errors', 'totalS', 'minS', 'maxS', 'bytesSent', 'bytesReceived', 'decodeS', 'serializeS',
+                 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.totalS = 0.0
+        self.minS = math.inf
+        self.maxS = 0.0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.decodeS = 0.0
+        self.serializeS = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, duration):
+        self.count += 1
+        self.totalS += duration
+        self.minS = min(self.minS, duration)
+        self.maxS = max(self.maxS, duration)
+        ms = duration * 1000.0
+        bucket = 0 if ms <= HISTOGRAM_MIN_MS else int(math.ceil(2.0 * math.log2(ms / HISTOGRAM_MIN_MS)))
+        self.histogram[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    # Estimated percentile(upper bound of the histogram bucket, at most the maximum) in milliseconds.
+    def percentileMs(self, q):
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.histogram):
+            cumulative += n
+            if cumulative >= rank and n > 0:
+                return min(HISTOGRAM_MIN_MS * 2.0 ** (i / 2.0), self.maxS * 1000.0)
+        return self.maxS * 1000.0
+
+    def toDict(self):
+        ret = {'count': self.count,
+               'errors': self.errors,
+               'total_s': self.totalS,
+               'mean_ms': self.totalS * 1000.0 / self.count if self.count else 0.0,
+               'min_ms': self.minS * 1000.0 if self.count else 0.0,
+               'p50_ms': self.percentileMs(0.5),
+               'p90_ms': self.percentileMs(0.9),
+               'p99_ms': self.percentileMs(0.99),
+               'max_ms': self.maxS * 1000.0,
+               'bytes_sent': self.bytesSent,
+               'bytes_received': self.bytesReceived,
+               'decode_s': self.decodeS,
+               'serialize_s': self.serializeS}
+        # non-empty buckets as [upper bound in ms(None for the overflow bucket), count]
+        ret['histogram'] = [[HISTOGRAM_MIN_MS * 2.0 ** (i / 2.0) if i < HISTOGRAM_BUCKETS - 1 else None, n]
+                            for i, n in enumerate(self.histogram) if n > 0]
+        return ret
+
+
+##############################################
+## Request instrumentation and trace export ##
+##############################################
+class Instrumentation(object):
+    """Instrumentation Per-endpoint request statistics and a timeline of requests and custom spans.
+
+    SlideService records every request(count, latency histogram, bytes sent and received) and the
+    client side time spent to serialize request bodies and decode responses, keyed by method and
+    endpoint, e.g. 'GET /roi' or 'POST /annotation'. Plugins add their own spans, e.g.
+
+        with ss.span('model.predict'):
+            predictions = model.predict(batch)
+
+    so fetch, inference and upload times can be compared directly. The timeline can be exported
+    in Chrome trace format(open it in chrome://tracing or https://ui.perfetto.dev).
+    One instance can be shared by several SlideService instances and threads.
+    """
+
+    # trace_capacity: maximum number of timeline events kept(the oldest are dropped). 0 disables the timeline.
+    # summary_at_exit: print summary() at interpreter exit. Default: environment variable MIKAIA_PLUGIN_STATS=1.
+    # trace_at_exit: path of a Chrome trace file written at interpreter exit. The timelines of all instances with the
+    #                same path that still exist at exit are merged into one file.
+    #                Default: environment variable MIKAIA_PLUGIN_TRACE.
+    def __init__(self, trace_capacity=100000, summary_at_exit=None, trace_at_exit=None):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._spans = {}
+        self._events = collections.deque(maxlen=trace_capacity) if trace_capacity > 0 else None
+        self._origin = time.perf_counter()
+        self._createdAt = time.perf_counter()
+        if summary_at_exit is None:
+            summary_at_exit = os.environ.get('MIKAIA_PLUGIN_STATS', '') not in ('', '0')
+        if trace_at_exit is None:
+            trace_at_exit = os.environ.get('MIKAIA_PLUGIN_TRACE') or None
+        self._summaryAtExit = summary_at_exit
+        self._traceAtExit = trace_at_exit
+        self._sequence = next(_sequence)
+        if summary_at_exit or trace_at_exit:
+            _registerAtExit(self)
+
+    def __str__(self):
+        return self.summary()
+
+    # Record a request to 'key'(e.g. 'GET /roi') that started at 'start'(time.perf_counter()) and took 'duration' s.
+    def recordRequest(self, key, start, duration, bytes_sent=0, bytes_received=0, error=False):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Stats()
+            stats.add(duration)
+            stats.bytesSent += bytes_sent
+            stats.bytesReceived += bytes_received
+            if error:
+                stats.errors += 1
+            if self._events is not None:
+                self._events.append((key, 'request', start, duration, threading.get_ident(),
+                                     {'bytes_sent': bytes_sent, 'bytes_received': bytes_received, 'error': error}))
+
+    # Record client side processing of the request 'key'. phase: 'serialize' or 'decode'.
+    def recordPhase(self, key, phase, start, duration):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Stats()
+            if phase == 'serialize':
+                stats.serializeS += duration
+            else:
+                stats.decodeS += duration
+            if self._events is not None:
+                self._events.append(('{} {}'.format(phase, key), phase, start, duration, threading.get_ident(), None))
+
+    # Record a custom span 'name' that started at 'start'(time.perf_counter()) and took 'duration' s.
+    def recordSpan(self, name, start, duration, args=None, error=False):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = _Stats()
+            stats.add(duration)
+            if error:
+                stats.errors += 1
+            if self._events is not None:
+                self._events.append((name, 'span', start, duration, threading.get_ident(), args))
+
+    # Context manager that measures the client side processing of the request 'key'.
+    def measure(self, key, phase):
+        return _Timer(self.recordPhase, key, phase)
+
+    # Context manager that records a custom span, e.g. with instrumentation.span('model.predict', batch=32): ...
+    # args: optional values shown with the span in the trace viewer.
+    def span(self, name, **args):
+        return _SpanTimer(self.recordSpan, name, args or None)
+
+    # Returns the statistics as dict: {'requests': {key: stats}, 'spans': {name: stats}, 'elapsed_s': ...}.
+    # Every stats entry is a dict with count, errors, total_s, mean_ms, min_ms, p50_ms, p90_ms, p99_ms, max_ms,
+    # bytes_sent, bytes_received, decode_s, serialize_s and the non-empty latency histogram buckets.
+    # reset: reset the statistics after taking the snapshot.
+    def snapshot(self, reset=False):
+        with self._lock:
+            ret = {'elapsed_s': time.perf_counter() - self._createdAt,
+                   'requests': {key: stats.toDict() for key, stats in sorted(self._stats.items())},
+                   'spans': {name: stats.toDict() for name, stats in sorted(self._spans.items())}}
+            if reset:
+                self._reset()
+        return ret
+
+    # Clear all statistics and the timeline.
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._stats = {}
+        self._spans = {}
+        self._createdAt = time.perf_counter()
+        if self._events is not None:
+            self._events.clear()
+
+    # Returns the timeline as list of Chrome trace 'complete' events(timestamps in us).
+    def traceEvents(self):
+        return self._traceEvents(self._origin)
+
+    # timestamps relative to 'origin'(time.perf_counter())
+    def _traceEvents(self, origin):
+        with self._lock:
+            events = list(self._events) if self._events is not None else []
+        pid = os.getpid()
+        ret = []
+        for name, category, start, duration, tid, args in events:
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round((start - origin) * 1e6, 3), 'dur': round(duration * 1e6, 3)}
+            if args:
+                event['args'] = args
+            ret.append(event)
+        return ret
+
+    # Write the timeline in Chrome trace format to 'path'.
+    def exportChromeTrace(self, path):
+        _writeTrace(path, self.traceEvents())
+
+    # Write snapshot() as JSON to 'path'.
+    def exportStats(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    # Returns a one-line summary, e.g.
+    # '120 requests in 3.2 s, 45.1 MB in, 0.2 MB out | GET /roi 100x p50 21.0 ms p99 48.0 ms | model.predict 10x 1.9 s'
+    def summary(self):
+        snapshot = self.snapshot()
+        requests = snapshot['requests']
+        count = sum(s['count'] for s in requests.values())
+        total = sum(s['total_s'] for s in requests.values())
+        errors = sum(s['errors'] for s in requests.values())
+        parts = ['{} requests in {:.1f} s{}, {:.1f} MB in, {:.1f} MB out'.format(
+            count, total, ' ({} failed)'.format(errors) if errors else '',
+            sum(s['bytes_received'] for s in requests.values()) / 1e6,
+            sum(s['bytes_sent'] for s in requests.values()) / 1e6)]
+        for key, s in sorted(requests.items(), key=lambda item: -item[1]['total_s']):
+            if s['count'] > 0:
+                parts.append('{} {}x p50 {:.1f} ms p99 {:.1f} ms'.format(key, s['count'], s['p50_ms'], s['p99_ms']))
+        for name, s in sorted(snapshot['spans'].items(), key=lambda item: -item[1]['total_s']):
+            parts.append('{} {}x {:.1f} s'.format(name, s['count'], s['total_s']))
+        return ' | '.join(parts)
+
+
+def _writeTrace(path, events):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+# One atexit handler for all instances: the instances are only referenced weakly, so the statistics and timelines
+# of instances that were released(e.g. per execution of a resident script worker) don't accumulate until exit.
+def _registerAtExit(instrumentation):
+    global _atExitRegistered
+    with _atExitLock:
+        _atExitInstances.add(instrumentation)
+        if not _atExitRegistered:
+            atexit.register(_reportAtExit)
+            _atExitRegistered = True
+
+
+# Prints the summaries of the live instances and writes their timelines, merged per trace file.
+def _reportAtExit():
+    with _atExitLock:
+        instances = sorted(_atExitInstances, key=lambda instrumentation: instrumentation._sequence)
+    traces = collections.OrderedDict()
+    for instrumentation in instances:
+        if instrumentation._summaryAtExit:
+            print('SlideService statistics: ' + instrumentation.summary())
+        if instrumentation._traceAtExit:
+            traces.setdefault(instrumentation._traceAtExit, []).append(instrumentation)
+    for path, group in traces.items():
+        origin = min(instrumentation._origin for instrumentation in group)
+        _writeTrace(path, [event for instrumentation in group for event in instrumentation._traceEvents(origin)])
+
+
+class _Timer(object):
+    """_Timer Context manager that passes its start time and duration to a record function"""
+
+    __slots__ = ('_record', '_key', '_phase', '_start')
+
+    def __init__(self, record, key, phase):
+        self._record = record
+        self._key = key
+        self._phase = phase
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._record(self._key, self._phase, self._start, time.perf_counter() - self._start)
+
+
+class _SpanTimer(object):
+    """_SpanTimer Context manager that records a custom span"""
+
+    __slots__ = ('_record', '_name', '_args', '_start')
+
+    def __init__(self, record, name, args):
+        self._record = record
+        self._name = name
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._record(self._name, self._start, time.perf_counter() - self._start, self._args, exc_type is not None)
+
@@ -0,0 +1,72 @@
+import json
+
+
+# Returns the JSON pointer(RFC 6901) of the given path tokens, e.g. pointer(12, 'className') -> '/12/className'.
+# '~' and '/' inside of tokens are escaped as '~0' and '~1'.
+def pointer(*tokens):
+    return ''.join('/' + str(token).replace('~', '~0').replace('/', '~1') for token in tokens)
+
+
+##############################################
+## Builder of RFC 6902 JSON Patch documents ##
+##############################################
+class JsonPatch(object):
+    """JsonPatch Builder of JSON Patch(RFC 6902) documents
+
+    Values are serialized as JSON values of their type(strings are escaped, numbers stay numbers).
+
+    Usage:
+        patch = JsonPatch()
+        patch.replace(pointer(annotation.id, 'className'), 'Tumor')
+        data = patch.toJson()
+    """
+
+    def __init__(self, operations=None):
+        self._operations = list(operations) if operations is not None else []
+
+    def __len__(self):
+        return len(self._operations)
+
+    def __str__(self):
+        return self.toJson()
+
+    # Add an operation. op: 'add', 'remove', 'replace', 'move', 'copy' or 'test'.
+    # from_path: source path of 'move' and 'copy' operations.
+    def append(self, op, path, value=None, from_path=None):
+        if op not in ('add', 'remove', 'replace', 'move', 'copy', 'test'):
+            raise Exception("Unknown JSON Patch operation '{}'.".format(op))
+        operation = {'op': op, 'path': path}
+        if op in ('move', 'copy'):
+            if from_path is None:
+                raise Exception("JSON Patch operation '{}' requires 'from_path'.".format(op))
+            operation['from'] = from_path
+        elif op != 'remove':
+            operation['value'] = value
+        self._operations.append(operation)
+        return self
+
+    def add(self, path, value):
+        return self.append('add', path, value)
+
+    def remove(self, path):
+        return self.append('remove', path)
+
+    def replace(self, path, value):
+        return self.append('replace', path, value)
+
+    def move(self, from_path, path):
+        return self.append('move', path, from_path=from_path)
+
+    def copy(self, from_path, path):
+        return self.append('copy', path, from_path=from_path)
+
+    def test(self, path, value):
+        return self.append('test', path, value)
+
+    # Returns the list of operations as dicts.
+    def operations(self):
+        return list(self._operations)
+
+    # Returns the patch document as JSON string.
+    def toJson(self):
+        return json.dumps(self._operations, separators=(',', ':'))
@@ -0,0 +1,27 @@
+import importlib
+
+
+class LazyModule(object):
+    """LazyModule Stand-in for a module that is imported on first attribute access.
+
+    Keeps heavy dependencies(NumPy, PIL, requests) out of the import time of the MIKAIA modules,
+    so the script service, the console and plugins that don't need them start faster.
+
+    Usage:
+        np = LazyModule('numpy')
+        np.zeros(3)  # numpy is imported here
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __repr__(self):
+        return '{}({}, loaded={})'.format(self.__class__.__name__, self._name, self._module is not None)
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self._module = module
+        return getattr(module, attr)
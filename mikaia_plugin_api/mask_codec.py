@@ -0,0 +1,86 @@
+import base64
+import zlib
+
+import numpy as np
+
+# Compact JSON representation of 'Mask' annotation arrays(mask and label map):
+#   {"encoding": "rle+zlib", "dtype": "<u2", "shape": [h, w], "data": "<base64>"}
+# Encodings:
+#   'bitpack+zlib': binary masks(values 0 and 1) packed to 1 bit per pixel(np.packbits)
+#   'rle+zlib':     run-length encoded label maps: uint32 run lengths followed by the run values
+#   'zlib':         the raw array bytes
+# All arrays are stored little-endian in C order, then compressed with zlib and base64 encoded.
+MASK_ENCODINGS = ['bitpack+zlib', 'rle+zlib', 'zlib']
+
+
+# Returns True if 'value' is an encoded array(see encodeArray()).
+def isEncoded(value):
+    return isinstance(value, dict) and value.get('encoding') in MASK_ENCODINGS
+
+
+# Encode an ndarray(e.g. a binary mask or an instance label map) into its compact JSON representation.
+# encoding: one of MASK_ENCODINGS or 'auto': 'bitpack+zlib' for binary arrays, 'rle+zlib' if the array consists
+#           of long runs of the same value(typical for label maps), 'zlib' otherwise.
+# level: zlib compression level(1 fastest ... 9 smallest).
+def encodeArray(array, encoding='auto', level=6):
+    array = np.asarray(array)
+    dtype = array.dtype.newbyteorder('<') if array.dtype.byteorder == '>' else array.dtype
+    flat = np.ascontiguousarray(array, dtype=dtype).reshape(-1)
+    if encoding == 'auto':
+        encoding = _chooseEncoding(flat)
+    if encoding == 'bitpack+zlib':
+        if flat.dtype != bool and np.any((flat != 0) & (flat != 1)):
+            raise Exception("Encoding 'bitpack+zlib' only supports arrays with values 0 and 1.")
+        payload = np.packbits(flat.astype(bool, copy=False)).tobytes()
+    elif encoding == 'rle+zlib':
+        starts, lengths = _runs(flat)
+        payload = lengths.astype('<u4').tobytes() + flat[starts].tobytes()
+    elif encoding == 'zlib':
+        payload = flat.tobytes()
+    else:
+        raise Exception("Unknown mask encoding '{}'.".format(encoding))
+    return {'encoding': encoding, 'dtype': dtype.str, 'shape': list(array.shape),
+            'data': base64.b64encode(zlib.compress(payload, level)).decode('ascii')}
+
+
+# Decode an encoded array(see encodeArray()). Returns a writable ndarray.
+def decodeArray(value):
+    if not isEncoded(value):
+        raise Exception("Value is not an encoded mask array.")
+    dtype = np.dtype(value['dtype'])
+    shape = tuple(value['shape'])
+    size = int(np.prod(shape))
+    payload = zlib.decompress(base64.b64decode(value['data']))
+    encoding = value['encoding']
+    if encoding == 'bitpack+zlib':
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=size)
+        flat = bits.view(bool) if dtype == bool else bits.astype(dtype)
+    elif encoding == 'rle+zlib':
+        runs = len(payload) // (4 + dtype.itemsize)
+        lengths = np.frombuffer(payload, dtype='<u4', count=runs)
+        values = np.frombuffer(payload, dtype=dtype, count=runs, offset=4 * runs)
+        flat = np.repeat(values, lengths)
+    else:
+        flat = np.frombuffer(payload, dtype=dtype, count=size).copy()
+    if flat.size != size:
+        raise Exception("Encoded mask array has {} values, expected {}.".format(flat.size, size))
+    return flat.reshape(shape)
+
+
+def _runs(flat):
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    return starts, lengths
+
+
+def _chooseEncoding(flat):
+    if flat.size == 0:
+        return 'zlib'
+    if flat.dtype == bool or (flat.dtype.kind in 'iu' and flat.min() >= 0 and flat.max() <= 1):
+        return 'bitpack+zlib'
+    runs = 1 + int(np.count_nonzero(flat[1:] != flat[:-1]))
+    if runs * (4 + flat.dtype.itemsize) * 4 < flat.nbytes:
+        return 'rle+zlib'
+    return 'zlib'
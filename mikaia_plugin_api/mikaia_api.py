@@ -0,0 +1,1516 @@
+from dataclasses import dataclass, field
+from dataclass_wizard import JSONWizard, JSONListWizard
+from typing import Any, List
+import concurrent.futures
+import copy
+import hashlib
+import json
+import threading
+import time
+from io import BytesIO
+from mikaia_plugin_api.http_transport import HttpTransport
+from mikaia_plugin_api.instrumentation import Instrumentation
+from mikaia_plugin_api.json_patch import JsonPatch, pointer
+from mikaia_plugin_api.lazy_module import LazyModule
+from mikaia_plugin_api.telemetry_sender import TelemetrySender
+from mikaia_plugin_api.tile_reader import TileReader
+
+# NumPy and PIL are imported when they are used first
+np = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass
+class PointF(JSONWizard):
+    """PointF 2D point with floating point coordinates"""
+
+    x: float = 0.0
+    """x-coordinate of the 2D point"""
+    y: float = 0.0
+    """y-coordinate of the 2D point"""
+
+    def __str__(self):
+        return 'x: {} y: {}'.format(self.x, self.y)
+
+
+@dataclass
+class SizeF(JSONWizard):
+    """SizeF 2D size with floating point dimensions"""
+
+    width: float = 0.0
+    """width"""
+    height: float = 0.0
+    """height"""
+
+    def __str__(self):
+        return 'w: {} h: {}'.format(self.width, self.height)
+
+
+@dataclass
+class RectF(JSONWizard):
+    """RectF 2D rectangle in floating point coordinates"""
+
+    x: float = 0.0
+    """x-coordinate of the top left corner"""
+    y: float = 0.0
+    """y-coordinate of top left corner"""
+    width: float = 0.0
+    """width of the rectangle"""
+    height: float = 0.0
+    """height of the rectangle"""
+
+    def __str__(self):
+        return 'x: {} y: {}  w: {} h: {}'.format(self.x, self.y, self.width, self.height)
+
+
+@dataclass
+class KeyValuePair(JSONWizard):
+    """RectF 2D rectangle in floating point coordinates"""
+
+    key: str = ''
+    """Key name"""
+    value: str = ''
+    """The value assigned to the key"""
+
+    def __str__(self):
+        return '{} = {}  w: {} h: {}'.format(self.key, self.value)
+
+
+@dataclass
+class Annotation(JSONWizard):
+    """Annotation An MIKAIA annotation object(graphical shape)
+
+    The following MIKAIA annotation objects are supported:
+    'Point', 'Line', 'Rectangle', 'Ellipse', 'Polygon', 'PathWithHoles', 'Mask'
+    """
+    shapeType: str = ''
+    """shape type of the annotation. Supported values: 'Point', 'Line', 'Rectangle', 'Ellipse', 'Polygon', 'PathWithHoles', 'Mask'"""
+
+    mask: Any = field(default_factory=list)
+    """Pixels of a 'Mask' annotation: ndarray, compact encoded array(see mask_codec) or flat list of values"""
+    maskSizeInPx: List = field(default_factory=list)
+    """Size [width, height] of the mask in pixels"""
+    labelMap: Any = field(default_factory=list)
+    """Label map of a 'Mask' annotation: ndarray, compact encoded array(see mask_codec) or list"""
+    coordinates: List[List[float]] = field(default_factory=list)
+    """Coordinates of the shape(outline and optional holes) as lists of 2D point coordinates.
+
+    List of point lists where each point list is a flat array of 2D point coordinates(in 'µm')
+    in the format [x1, y1, x2, y2, ... xn, yn].
+    The 1st point lists contains the coordinates of the outline contour.
+    All further point lists describe the contours of holes lying inside the outline.
+    Holes are only relevant for shapeType 'PathWithHoles'.
+    All other shapes types consist of exactly one point list with the following content:
+    'Point': [x, y] the point coordinates.
+    'Line': [x1, y1, x2, y2]' start point and end point of the line.
+    'Rectangle': [x1, y1, x2, y2]' top left and bottom right coordinates of the rectangle.
+    'Ellipse': [x1, y1, x2, y2]' top left and bottom right coordinates of the bounding rectangle.
+    'Polygon': [x1, y1, ... xn, yn]' coordinates of n polygon points.
+    """
+    id: int = -1
+    """MIKAIA-ID of the annotation. Never change this value!"""
+
+    className: str = ''
+    """Name of the associated annotation class"""
+
+    def __str__(self):
+        return '{}(shapeType={}, id={}, className={}, coordinate lists[{}])'.format(
+            self.__class__.__name__,
+            self.shapeType,
+            self.id,
+            self.className,
+            len(self.coordinates))
+
+    # returns the annotation coordinates as a list of (x, y) tuple lists:
+    # [ [(x1, y1), (x2, y2), ... (xn, yn)], [(x1, y1), (x2, y2), ... (xm, ym)], ...]
+    def toTuples(self):
+        return [list(map(tuple, points.tolist())) for points in self.pointArrays()]
+
+    # returns the annotation coordinates as lists of [x, y] arrays:
+    # [ [[x1, y1], [x2, y2], ... [xn, yn]], [[x1, y1], [x2, y2], ... [xm, ym]], ...]
+    def toArrays(self):
+        return [points.tolist() for points in self.pointArrays()]
+
+    # returns the annotation coordinates as list of read-only (n, 2) float64 ndarrays(outline first, then holes).
+    # The arrays are cached. Call invalidateGeometry() after changing values of the coordinate lists in place.
+    def pointArrays(self):
+        signature = (id(self.coordinates), tuple(len(coord_list) for coord_list in self.coordinates))
+        cache = getattr(self, '_pointArrayCache', None)
+        if cache is None or cache[0] != signature:
+            arrays = []
+            for coord_list in self.coordinates:
+                points = np.array(coord_list[:len(coord_list) // 2 * 2], dtype=np.float64).reshape(-1, 2)
+                points.flags.writeable = False
+                arrays.append(points)
+            cache = (signature, arrays)
+            self._pointArrayCache = cache
+        return cache[1]
+
+    # returns the mask of a 'Mask' annotation as ndarray of shape (height, width), or None if there is no mask.
+    def maskArray(self):
+        return self._decodeMaskField(self.mask, self.maskSizeInPx)
+
+    # returns the label map of a 'Mask' annotation as ndarray, or None if there is no label map.
+    def labelMapArray(self):
+        return self._decodeMaskField(self.labelMap, self.maskSizeInPx)
+
+    # drops the cached coordinate arrays(see pointArrays())
+    def invalidateGeometry(self):
+        self._pointArrayCache = None
+
+    # returns the bounding rectangle of the annotation outline coordinates as RectF instance
+    def boundingRect(self, index=0):
+        arrays = self.pointArrays()
+        if index < 0 or len(arrays) <= index or len(arrays[index]) == 0:
+            return RectF(0, 0, 0, 0)
+        min_x, min_y = arrays[index].min(axis=0)
+        max_x, max_y = arrays[index].max(axis=0)
+        return RectF(float(min_x), float(min_y), float(max_x - min_x), float(max_y - min_y))
+
+    # returns the area of the annotation in um^2(outline area minus the area of the holes).
+    # 'Point' and 'Line' annotations have no area.
+    def area(self):
+        arrays = self.pointArrays()
+        if len(arrays) == 0 or len(arrays[0]) == 0:
+            return 0.0
+        if self.shapeType in ('Rectangle', 'Ellipse'):
+            br = self.boundingRect()
+            return br.width * br.height * (np.pi / 4.0 if self.shapeType == 'Ellipse' else 1.0)
+        if self.shapeType not in ('Polygon', 'PathWithHoles'):
+            return 0.0
+        area = abs(self._signedArea(arrays[0]))
+        for hole in arrays[1:]:
+            area -= abs(self._signedArea(hole))
+        return float(area)
+
+    # returns the centroid of the annotation as PointF instance(holes are taken into account).
+    def centroid(self):
+        arrays = self.pointArrays()
+        if len(arrays) == 0 or len(arrays[0]) == 0:
+            return PointF(0.0, 0.0)
+        if self.shapeType in ('Polygon', 'PathWithHoles'):
+            sum_area = 0.0
+            sum_x = sum_y = 0.0
+            for i, points in enumerate(arrays):
+                area = self._signedArea(points)
+                if area == 0.0:
+                    continue
+                x, y = points[:, 0], points[:, 1]
+                xn, yn = np.roll(x, -1), np.roll(y, -1)
+                cross = x * yn - xn * y
+                cx = np.sum((x + xn) * cross) / (6.0 * area)
+                cy = np.sum((y + yn) * cross) / (6.0 * area)
+                weight = abs(area) if i == 0 else -abs(area)
+                sum_area += weight
+                sum_x += cx * weight
+                sum_y += cy * weight
+            if sum_area != 0.0:
+                return PointF(float(sum_x / sum_area), float(sum_y / sum_area))
+            center = arrays[0].mean(axis=0)
+        else:
+            center = (arrays[0].min(axis=0) + arrays[0].max(axis=0)) / 2.0
+        return PointF(float(center[0]), float(center[1]))
+
+    # returns True if the point (x, y) lies inside the annotation(and not inside one of its holes).
+    def containsPoint(self, x, y):
+        return bool(self.containsPoints(np.array([[x, y]], dtype=np.float64))[0])
+
+    # returns a boolean array that tells for each of the (n, 2) 'points' whether it lies inside the annotation.
+    # 'Point' and 'Line' annotations don't contain any points.
+    def containsPoints(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        arrays = self.pointArrays()
+        if len(arrays) == 0 or len(arrays[0]) == 0 or self.shapeType in ('Point', 'Line'):
+            return np.zeros(len(points), dtype=bool)
+        px, py = points[:, 0], points[:, 1]
+        if self.shapeType in ('Rectangle', 'Ellipse'):
+            br = self.boundingRect()
+            if self.shapeType == 'Rectangle':
+                return (px >= br.x) & (px <= br.x + br.width) & (py >= br.y) & (py <= br.y + br.height)
+            if br.width == 0 or br.height == 0:
+                return np.zeros(len(points), dtype=bool)
+            dx = (px - (br.x + br.width / 2.0)) / (br.width / 2.0)
+            dy = (py - (br.y + br.height / 2.0)) / (br.height / 2.0)
+            return dx * dx + dy * dy <= 1.0
+        # even-odd rule over the edges of the outline and all holes
+        inside = np.zeros(len(points), dtype=bool)
+        for contour in arrays:
+            x0, y0 = contour[:, 0], contour[:, 1]
+            x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+            crosses = (y0[None, :] > py[:, None]) != (y1[None, :] > py[:, None])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x0[None, :] + (py[:, None] - y0[None, :]) * (x1 - x0)[None, :] / (y1 - y0)[None, :]
+            inside ^= (np.count_nonzero(crosses & (px[:, None] < x_cross), axis=1) % 2).astype(bool)
+        return inside
+
+    @staticmethod
+    def _decodeMaskField(value, size_px):
+        from mikaia_plugin_api import mask_codec
+        if mask_codec.isEncoded(value):
+            return mask_codec.decodeArray(value)
+        if value is None or len(value) == 0:
+            return None
+        array = np.asarray(value)
+        if array.ndim == 1 and len(size_px) == 2 and array.size == size_px[0] * size_px[1]:
+            array = array.reshape(int(size_px[1]), int(size_px[0]))
+        return array
+
+    @staticmethod
+    def _signedArea(points):
+        if len(points) < 3:
+            return 0.0
+        x, y = points[:, 0], points[:, 1]
+        return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+# @@dataclass
+# @class AnnotationList(JSONWizard):
+# @    items: list[Annotation] = field(default_factory=list)
+
+
+@dataclass
+class AnnotationClass((JSONWizard)):
+    className: str = ''
+    classDescription: str = ''
+    groupName: str = ''
+    tags: List = field(default_factory=list)
+    id: int = -1  # Internal class Id created by MIKAIA
+
+    outlineWidth: int = -1  # Outline width(in screen pixels) for annotations associated with this annotation class
+    outlineColor: str = ''  # Outline color for annotations associated with this annotation class
+    fillColor: str = ''  # Fill color for annotations associated with this annotation class
+    opacity: float = 1.0  # Opacity for annotations associated with this annotation class(0.0(fully transparent) to 1.0(fully opaque))
+
+    def __str__(self):
+        return '{}(className="{}" description="{}" group="{}" tags="{}" id={} outlineWidth={} outlineColor="{}" fillColor="{}" opacity="{:.3f}")'.format(
+            self.__class__.__name__,
+            self.className,
+            self.classDescription,
+            self.groupName,
+            len(self.tags),
+            self.id,
+            self.outlineWidth,
+            self.outlineColor,
+            self.fillColor,
+            self.opacity)
+
+
+# @dataclass
+# class AnnotationClassList(JSONWizard):
+#    items: list[AnnotationClass] = field(default_factory=list)
+
+@dataclass
+class ChannelInfo(JSONWizard):
+    name: str = ''
+    type: str = ''  # supported values: 'Brightfield', 'Fluorescence', 'Other', 'Unspecified'
+    index: int = -1
+
+    def __str__(self):
+        return '{}(type={}, name={}, index={})'.format(
+            self.__class__.__name__,
+            self.type,
+            self.name,
+            self.index)
+
+
+@dataclass
+class SlideInfo(JSONWizard):
+    name: str
+    slideRect: RectF
+    nativeResolution: SizeF
+    channels: List[ChannelInfo] = field(default_factory=list)
+
+    def __str__(self):
+        return 'Slide name: {}\r\nSlide area: {} um\r\nNative resolution: {} um\r\nchannels[{}]'.format(
+            self.name,
+            self.slideRect,
+            self.nativeResolution,
+            len(self.channels))
+
+
+@dataclass
+class AnalysisRoi(JSONWizard):
+    roi: List[Annotation] = field(default_factory=list)
+
+    def __str__(self):
+        return 'AnalysisRoi: {}\r\nroi[{}]\r\n'.format(
+            self.__class__.__name__,
+            self.roi)
+
+
+@dataclass
+class ProgressInfo(JSONWizard):
+    progressRatio: float = 1.0  # Progress info as value between 0.0(start of session) and 1.0(end of session)
+    progressAmount: int = -1  # Progress as integer value(Use it when a 'progressRatio' value cannot be provided)
+    message: str = ''  # Optional message text
+
+    def __str__(self):
+        return '{}(progressRatio={}, progressAmount={}, message={})'.format(
+            self.__class__.__name__,
+            self.progressRatio,
+            self.progressAmount,
+            self.message)
+
+
+@dataclass
+class DiagramDataSeries(JSONWizard):
+    name: str = ''
+    color: str = ''
+    classID: str = ''
+    unit: str = ''
+    values: List = field(default_factory=list)
+
+    def __str__(self):
+        return '{}(name={}, color={}, classID={}, values={}, unit={})'.format(
+            self.__class__.__name__,
+            self.name,
+            self.color,
+            self.classID,
+            self.values,
+            self.unit
+        )
+
+
+@dataclass
+class DiagramData(JSONWizard):
+    title: str = ''
+    subtitle: str = ''
+    diagramType: str = ''
+    dataSeries: List = field(default_factory=list)
+    valueGroupNames: List = field(default_factory=list)
+
+    def __str__(self):
+        return '{}(title={}, subtitle={}, diagramType={}, dataSeries={})'.format(
+            self.__class__.__name__,
+            self.title,
+            self.subtitle,
+            self.diagramType,
+            self.dataSeries,
+            self.valueGroupNames
+        )
+
+@dataclass
+class ResultsCaption(JSONWizard):
+    caption: str = ''
+    subcaption: str = ''
+    
+    def __str__(self):
+        return '{}(caption={}, subcaption={})'.format(
+            self.__class__.__name__,
+            str(self.caption),
+            str(self.subcaption)
+        )
+        
+@dataclass
+class Csv(JSONWizard):
+    csv: List[str] = field(default_factory=list)
+    
+    def __str__(self):
+        return '{}(csv={})'.format(
+            self.__class__.__name__,
+            str(self.csv)
+        )
+
+
+###############################################
+## Python client for MIKAIA SlideService API ##
+###############################################
+class SlideService(object):
+    # slidePath: root path of the MIKAIA SlideService session(SlideService URL + session id).
+    # transport: optional HttpTransport instance(pool size, timeouts, retries, gzip).
+    #            If omitted a transport with default settings is created.
+    #            A SlideService instance and its transport can be shared by several threads.
+    # tile_cache: optional TileCache instance. If provided, the pixel data returned by getThumbnail(), getROI(),
+    #             getNativeROI() and their ndarray variants is cached per slide, so repeated runs on the same slide
+    #             don't fetch the same pixels again.
+    # telemetry_rate_hz: maximum rate of progress updates sent to MIKAIA. sendProgress() and sendMessage() only queue
+    #                    the update, a background thread sends it(intermediate progress values are skipped).
+    #                    Pending updates are sent by flushTelemetry(), close() and at exit.
+    #                    0 sends every update synchronously.
+    # instrumentation: optional Instrumentation instance that records the requests(e.g. shared by several SlideService
+    #                  instances). If omitted a new one is created, see getRequestStats() and span().
+    # mask_encoding: how ndarray masks and label maps of 'Mask' annotations are sent: 'auto'(compact binary encoding,
+    #                see mask_codec), one of mask_codec.MASK_ENCODINGS, or 'list' for plain JSON number lists
+    #                (for MIKAIA versions without support for the compact encoding).
+    # metadata_cache: keep the slide information, analysis ROI, user parameters and annotation class table in memory
+    #                 after the first request, see invalidateMetadata() and getMetadataCacheStats().
+    #                 False sends a request for every call.
+    def __init__(self, slidePath: str, transport=None, tile_cache=None, telemetry_rate_hz=5.0, instrumentation=None,
+                 mask_encoding='auto', metadata_cache=True):
+        self._rootPath = slidePath
+        self._slideInfoPath = self._rootPath + "/slideinfo"
+        self._analysisRoi = self._rootPath + "/analysisroi"
+        self._thumbnailPath = self._rootPath + "/thumbnail"
+        self._roiPath = self._rootPath + "/roi"
+        self._nativeRoiPath = self._rootPath + "/nativeroi"
+        self._annoPath = self._rootPath + "/annotation"
+        self._annoClassPath = self._rootPath + "/annotationclass"
+        self._progressPath = self._rootPath + "/progress"
+        self._userParamPath = self._rootPath + "/userparameters"
+        self._addDiagramPath = self._rootPath + "/diagram"
+        self._setResultsCaption = self._rootPath + "/resultscaption"
+        self._csvPath = self._rootPath + "/csv"
+        self._annoShapeTypes = ['Point', 'Line', 'Rectangle', 'Ellipse', 'Polygon', 'PathWithHoles', 'Mask']
+        # uncompressed pixels are preferred for the ndarray variants of the ROI requests, if the server supports them
+        self._rawPixelsContentType = 'application/octet-stream'
+        self._pixelArrayHeaders = {'Accept': 'application/octet-stream, image/png;q=0.9, image/*;q=0.8'}
+        self._transport = transport if transport is not None else HttpTransport()
+        self._tileCache = tile_cache
+        self._slideCacheKey = None
+        self._slideCacheKeyLock = threading.Lock()
+        self._requestCounter = 0
+        self._requestCounterLock = threading.Lock()
+        self._threadState = threading.local()  # last request/response of the calling thread
+        self._instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self._telemetryRateHz = telemetry_rate_hz
+        self._telemetry = None  # TelemetrySender, created by the first update
+        self._telemetryLock = threading.Lock()
+        self._maskEncoding = mask_encoding
+        # last known server state of the updatable fields, used by updateAnnotations() to send only changes
+        self._annotationFields = ('className',)
+        self._annotationClassFields = ('classDescription', 'outlineWidth', 'outlineColor', 'fillColor', 'opacity')
+        self._knownAnnotations = {}  # id -> tuple of the values of _annotationFields
+        self._knownAnnotationClasses = {}  # id -> tuple of the values of _annotationClassFields
+        self._knownStateLock = threading.Lock()
+        self._bulkPatch = None  # True/False once it is known whether the server supports bulk PATCH requests
+        # session metadata cache: name -> server response, the user parameters are read by the first request
+        self._metadataNames = ('slideinfo', 'analysisroi', 'userparameters', 'annotationclasses')
+        self._metadataCache = metadata_cache
+        self._metadata = {}
+        self._metadataStats = {'hits': dict.fromkeys(self._metadataNames, 0),
+                               'fetches': dict.fromkeys(self._metadataNames, 0), 'skipped_classes': 0,
+                               'skipped_requests': 0}
+        self._metadataPending = {}  # name -> Event of the request in flight
+        self._metadataGeneration = dict.fromkeys(self._metadataNames, 0)  # incremented when a name is invalidated
+        self._metadataLock = threading.Lock()  # not held while requesting
+
+    def __str__(self):
+        return '  Root path: {}\r\n  Request count: {}'.format(self._rootPath, self._requestCounter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Send the pending progress updates and messages, then close the HTTP transport(and its pooled connections)
+    # of this SlideService.
+    def close(self):
+        with self._telemetryLock:
+            telemetry, self._telemetry = self._telemetry, None
+        if telemetry is not None:
+            telemetry.close()
+        self._transport.close()
+
+    # The last request/response are tracked per thread, so concurrent requests don't overwrite each other.
+    @property
+    def _lastRequest(self):
+        return getattr(self._threadState, 'request', None)
+
+    @_lastRequest.setter
+    def _lastRequest(self, value):
+        self._threadState.request = value
+
+    @property
+    def _lastRequestParams(self):
+        return getattr(self._threadState, 'requestParams', None)
+
+    @_lastRequestParams.setter
+    def _lastRequestParams(self, value):
+        self._threadState.requestParams = value
+
+    @property
+    def _lastResponse(self):
+        return getattr(self._threadState, 'response', None)
+
+    @_lastResponse.setter
+    def _lastResponse(self, value):
+        self._threadState.response = value
+
+    def _countRequest(self):
+        with self._requestCounterLock:
+            self._requestCounter += 1
+
+    # The Instrumentation instance that records the requests of this SlideService.
+    @property
+    def instrumentation(self):
+        return self._instrumentation
+
+    # Returns the request statistics per endpoint and of the custom spans(see Instrumentation.snapshot()).
+    # reset: reset the statistics after taking the snapshot.
+    def getRequestStats(self, reset=False):
+        return self._instrumentation.snapshot(reset)
+
+    # Reset the request statistics and the timeline.
+    def resetRequestStats(self):
+        self._instrumentation.reset()
+
+    # Context manager that records a custom span, so plugin steps show up next to the requests, e.g.
+    #     with ss.span('model.predict'):
+    #         predictions = model.predict(batch)
+    def span(self, name, **args):
+        return self._instrumentation.span(name, **args)
+
+    # Write the timeline of requests and spans in Chrome trace format(chrome://tracing, https://ui.perfetto.dev).
+    def exportTrace(self, path):
+        self._instrumentation.exportChromeTrace(path)
+
+    # Returns the instrumentation key of a request, e.g. 'GET /roi' or 'PATCH /annotation'.
+    def _requestKey(self, method, req_url):
+        endpoint = req_url[len(self._rootPath):] if req_url.startswith(self._rootPath) else req_url
+        return method + ' /' + endpoint.lstrip('/').split('/', 1)[0]
+
+    # Send a request via 'send' and record it. Streamed response bodies are counted by their Content-Length.
+    def _sendRequest(self, key, send, bytes_sent, stream=False):
+        start = time.perf_counter()
+        try:
+            response = send()
+        except Exception:
+            self._instrumentation.recordRequest(key, start, time.perf_counter() - start, bytes_sent, 0, True)
+            raise
+        duration = time.perf_counter() - start
+        if stream:
+            bytes_received = int(response.headers.get('Content-Length', 0))
+        else:
+            bytes_received = len(response.content) if response.content is not None else 0
+        self._instrumentation.recordRequest(key, start, duration, bytes_sent, bytes_received,
+                                            response.status_code >= 400)
+        return response
+
+    # Send a GET request to the MIKAIA 'SlideService'
+    def _makeGetRequest(self, req_url, req_params, log=False, headers=None, stream=False):
+        self._lastResponse = None
+        self._lastRequest = req_url
+        self._lastRequestParams = req_params
+        if log:
+            self.printLastRequest()
+        self._countRequest()
+        self._lastResponse = self._sendRequest(
+            self._requestKey('GET', req_url),
+            lambda: self._transport.get(req_url, params=req_params, headers=headers, stream=stream), 0, stream)
+        if log:
+            self.printLastResponse()
+        return self._lastResponse
+
+    # Send a POST request to the MIKAIA 'SlideService'
+    def _makePostRequest(self, req_url, data_to_post, log=True):
+        self._lastResponse = None
+        self._lastRequest = req_url
+        self._lastRequestParams = data_to_post
+        if log:
+            self.printLastRequest()
+
+        self._countRequest()
+
+        key = self._requestKey('POST', req_url)
+        if issubclass(type(data_to_post), JSONWizard):
+            with self._instrumentation.measure(key, 'serialize'):
+                data_to_post = data_to_post.to_json()
+        self._lastResponse = self._sendRequest(key, lambda: self._transport.post(req_url, data=data_to_post),
+                                               len(data_to_post))
+
+        if log:
+            self.printLastResponse()
+        return self._lastResponse
+
+    # Send a PATCH request to the MIKAIA 'SlideService'
+    def _makePatchRequest(self, req_url, patch_data, log=False):
+        self._lastResponse = None
+        json_patch_data = self._patchDataToJson(patch_data)
+        self._lastRequest = req_url
+        self._lastRequestParams = json_patch_data
+        if log:
+            self.printLastRequest()
+
+        self._countRequest()
+        self._lastResponse = self._sendRequest(self._requestKey('PATCH', req_url),
+                                               lambda: self._transport.patch(req_url, data=json_patch_data),
+                                               len(json_patch_data))
+
+        if log:
+            self.printLastResponse()
+        return self._lastResponse
+
+    # patch_data: JsonPatch instance, list of [op, path, value] items or an already serialized JSON string.
+    def _patchDataToJson(self, patch_data):
+        if isinstance(patch_data, str):
+            return patch_data
+        if isinstance(patch_data, JsonPatch):
+            return patch_data.toJson()
+        patch = JsonPatch()
+        for patch_item in patch_data:
+            if len(patch_item) != 3:
+                raise Exception(f'Insufficient patch data {patch_item} - three items required')
+            patch.append(patch_item[0], patch_item[1], patch_item[2])
+        return patch.toJson()
+
+    # Print last request(url and parameters) sent to the MIKAIA 'SlideService'
+    def printLastRequest(self):
+        print('Request url: {}'.format(self._lastRequest))
+        print('Request params: {}'.format(self._lastRequestParams))
+
+    # Print last response(status code and headers) received from the MIKAIA 'SlideService'
+    def printLastResponse(self):
+        self._printResponse(self._lastResponse, "")
+
+    def _printResponse(self, response, title):
+        if title != None and len(title) > 0:
+            print(title)
+        print('Response - Statuscode: {}  {}'.format(response.status_code, response.reason))
+        print('Response - Headers:')
+        print(response.headers)
+
+    # Read the pixels of a 'roi'/'nativeroi' response into a C-contiguous uint8 ndarray.
+    # Uncompressed pixel data('application/octet-stream') is streamed directly into the destination buffer,
+    # image formats(PNG, JPEG, ...) are decoded without keeping an intermediate PIL image around.
+    # shape: expected (height, width, channels), used if the response doesn't provide the image dimensions.
+    # out: optional destination buffer, otherwise a new array is allocated.
+    def _readPixelArray(self, response, shape, out):
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type == self._rawPixelsContentType:
+            height = int(response.headers.get('X-Image-Height', shape[0]))
+            width = int(response.headers.get('X-Image-Width', shape[1]))
+            channels = int(response.headers.get('X-Image-Channels', shape[2]))
+            out = self._pixelBuffer((height, width) if channels == 1 else (height, width, channels), out)
+            response.raw.decode_content = True
+            if out.flags.c_contiguous:
+                buffer = memoryview(out).cast('B')
+                pos = 0
+                while pos < len(buffer):
+                    count = response.raw.readinto(buffer[pos:])
+                    if not count:
+                        raise Exception(f'Incomplete pixel data: {pos} of {len(buffer)} bytes received.')
+                    pos += count
+            else:
+                np.copyto(out, np.frombuffer(response.content, dtype=np.uint8).reshape(out.shape))
+            return out
+
+        img = Image.open(BytesIO(response.content))
+        if img.mode not in ('L', 'RGB', 'RGBA'):
+            img = img.convert('L' if len(img.getbands()) == 1 else 'RGB')
+        # a read-only view of the decoded pixels(a single copy), copied once more only into a given 'out'
+        pixels = np.asarray(img)
+        if out is None:
+            return pixels
+        np.copyto(self._pixelBuffer(pixels.shape, out), pixels)
+        return out
+
+    # Returns 'out' after checking that it fits the given pixel shape, or a new uint8 array.
+    def _pixelBuffer(self, shape, out):
+        if out is None:
+            return np.empty(shape, dtype=np.uint8)
+        if out.dtype != np.uint8 or out.shape != shape:
+            raise Exception(f"Parameter 'out' shall be a uint8 array of shape {shape}, got {out.dtype} array of shape {out.shape}.")
+        return out
+
+    # convert array of 2D points [[x1, y1], [x2, y2], .... [xn, yn]] to flat array of float values [x1, y1, x2, y2, .... xn, yn ]
+    def _ptArray2FloatArray(self, pt_array):
+        float_array = []
+        for pt in pt_array:
+            float_array += pt
+        return float_array
+
+    # convert an ndarray mask or label map to the representation selected by 'mask_encoding'. Other values are unchanged.
+    def _encodeMaskField(self, value):
+        if isinstance(value, (list, dict)) or not hasattr(value, '__array_interface__'):
+            return value
+        if self._maskEncoding == 'list':
+            return np.asarray(value).reshape(-1).tolist()
+        from mikaia_plugin_api import mask_codec
+        return mask_codec.encodeArray(value, self._maskEncoding)
+
+    # Returns the annotation with encoded mask and label map fields. ndarray fields are encoded into a shallow copy,
+    # so the caller's annotation keeps its arrays(e.g. for a retry of a failed upload).
+    def _encodeMasks(self, anno):
+        if anno.shapeType != "Mask":
+            return anno
+        mask = self._encodeMaskField(anno.mask)
+        label_map = self._encodeMaskField(anno.labelMap)
+        if mask is anno.mask and label_map is anno.labelMap:
+            return anno
+        anno = copy.copy(anno)
+        anno.mask = mask
+        anno.labelMap = label_map
+        return anno
+
+    # remember the values of 'fields' of the given annotations or annotation classes as last known server state.
+    def _rememberState(self, known, fields, items):
+        with self._knownStateLock:
+            for item in items:
+                if item.id >= 0:
+                    known[item.id] = tuple(getattr(item, name) for name in fields)
+
+    # Send the changed fields of 'items' to the collection 'path' with bulk JSON Patch requests(see updateAnnotations()).
+    def _updateItems(self, path, known, fields, items, max_chunk_operations, workers, log):
+        result = {'updated': 0, 'unchanged': 0, 'operations': 0, 'requests': 0, 'bytes': 0, 'failed': []}
+        chunks = []
+        chunk = []
+        chunk_operations = 0
+        with self._knownStateLock:
+            for item in items:
+                values = tuple(getattr(item, name) for name in fields)
+                previous = known.get(item.id)
+                changed = [(name, value) for i, (name, value) in enumerate(zip(fields, values))
+                           if (previous is None or previous[i] != value) and not (name == 'outlineWidth' and value < 0)]
+                if not changed:
+                    result['unchanged'] += 1
+                    continue
+                if chunk and chunk_operations + len(changed) > max_chunk_operations:
+                    chunks.append(chunk)
+                    chunk = []
+                    chunk_operations = 0
+                chunk.append((item, values, changed))
+                chunk_operations += len(changed)
+        if chunk:
+            chunks.append(chunk)
+
+        for chunk in chunks:
+            if self._bulkPatch is not False:
+                patch = JsonPatch()
+                for item, values, changed in chunk:
+                    for name, value in changed:
+                        patch.replace(pointer(item.id, name), value)
+                json_patch_data = patch.toJson()
+                response = self._makePatchRequest(path, json_patch_data, log)
+                result['requests'] += 1
+                result['operations'] += len(patch)
+                result['bytes'] += len(json_patch_data)
+                if response.status_code == 200:
+                    self._bulkPatch = True
+                    self._rememberChanges(known, chunk)
+                    result['updated'] += len(chunk)
+                    continue
+                if self._bulkPatch is None and response.status_code in (404, 405, 501):
+                    self._bulkPatch = False  # the server only supports PATCH requests of single items
+                else:
+                    self._printResponse(response, "Unexpected response:")
+                    result['failed'] += [item.id for item, values, changed in chunk]
+                    continue
+            self._updateEach(path, known, chunk, workers, result, log)
+        return result
+
+    # Send one PATCH request per item of 'chunk', 'workers' requests at a time over the pooled transport.
+    def _updateEach(self, path, known, chunk, workers, result, log):
+        def update(change):
+            item, values, changed = change
+            # single item requests use the value format of updateAnnotation() and updateAnnotationClass()
+            patch_data = [['replace', name, '{:.3f}'.format(value) if name == 'opacity' else
+                           value if isinstance(value, str) else str(value)] for name, value in changed]
+            json_patch_data = self._patchDataToJson(patch_data)
+            return self._makePatchRequest(path + '/' + str(item.id), json_patch_data, log), len(json_patch_data)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for change, (response, size) in zip(chunk, executor.map(update, chunk)):
+                result['requests'] += 1
+                result['operations'] += len(change[2])
+                result['bytes'] += size
+                if response.status_code == 200:
+                    self._rememberChanges(known, [change])
+                    result['updated'] += 1
+                else:
+                    self._printResponse(response, "Unexpected response:")
+                    result['failed'].append(change[0].id)
+
+    def _rememberChanges(self, known, chunk):
+        with self._knownStateLock:
+            for item, values, changed in chunk:
+                known[item.id] = values
+
+    # decode the compact encoded mask and label map of a 'Mask' annotation to ndarrays.
+    @staticmethod
+    def _decodeMaskFields(anno):
+        from mikaia_plugin_api import mask_codec
+        if mask_codec.isEncoded(anno.mask):
+            anno.mask = mask_codec.decodeArray(anno.mask)
+        if mask_codec.isEncoded(anno.labelMap):
+            anno.labelMap = mask_codec.decodeArray(anno.labelMap)
+
+    # Create a 'AnnotationClass' class instance from given parameters.
+    # class_name: unique name that identifies the annotation class.
+    # line_width_px: Outline width(in screen pixels) for annotations associated with this annotation class.
+    # line_color: Outline color for annotations associated with this annotation class.
+    #             RGB color definition as hexadecimal HTML '#AARRGGBB' string(e.g. '#ffc280de').
+    # fill_color: Fill color for annotations associated with this annotation class.
+    #             RGB color definition as hexadecimal HTML '#AARRGGBB' string(e.g. '#ffc280de').
+    # Opacity for annotations associated with this annotation class(0.0(fully transparent) to 1.0(fully opaque))
+    def createAnnotationClass(self, class_name, description="", group_name="", tags=[], line_width_px=-1, line_color="", fill_color="",
+                              opacity=1.0):
+        annoClass = AnnotationClass(className=class_name, classDescription=description)
+        annoClass.outlineWidth = line_width_px
+        annoClass.outlineColor = line_color
+        annoClass.fillColor = fill_color
+        annoClass.opacity = opacity
+        annoClass.groupName = group_name
+        annoClass.tags  = tags
+        return annoClass
+
+    # Create a 'Annotation' class instance from given parameters.
+    # shape_type: string that identifies the shape type - one of {'Point', 'Line', 'Rectangle', 'Ellipse', 'Polygon', 'PathWithHoles', 'Mask'}
+    # outline: annotation outline contour as 2D-coordinate list(slide scene coordinates in um) e.g. [[250.0, 300.0], [555.5, 300.0] ... [250.0, 800.0]]
+    # mask: pixels of a 'Mask' annotation, e.g. a binary mask or an instance label map as 2D ndarray(height, width).
+    #       ndarrays are stored in the compact encoding selected by 'mask_encoding'(see SlideService()).
+    # maskSize_px: size [width, height] of the mask in pixels. Taken from the array shape if omitted.
+    # holes: hole contours as list of 2D-coordinate lists
+    # labelMap: label map of a 'Mask' annotation, ndarray or list.
+    # class_name: optional name of a annotation class to which the annotation should be assigned
+    def createAnnotation(self, shape_type, outline=[], mask=[], maskSize_px=[], holes=[], labelMap=[], class_name=""):
+        if shape_type not in self._annoShapeTypes:
+            raise Exception("Unknown shapeType '" + shape_type + "'.")
+
+        anno = Annotation(shapeType=shape_type, coordinates=[], className=class_name)
+        if shape_type != "Mask":
+            anno.coordinates.append(self._ptArray2FloatArray(outline))
+        else:
+            anno.coordinates.append(self._ptArray2FloatArray(outline))
+            if not maskSize_px and hasattr(mask, 'shape') and len(mask.shape) >= 2:
+                maskSize_px = [int(mask.shape[1]), int(mask.shape[0])]
+            anno.mask = self._encodeMaskField(mask)
+            anno.maskSizeInPx = maskSize_px
+            anno.labelMap = self._encodeMaskField(labelMap)
+        for hole in holes:
+            anno.coordinates.append(self._ptArray2FloatArray(hole))
+        return anno
+
+    ###############################################
+    ## MIKAIA 'SlideService' interface functions ##
+    ###############################################
+
+    # Get slide informations.
+    # The result is cached for the session(see 'metadata_cache'), refresh: request it again.
+    def getSlideInfo(self, log=False, refresh=False):
+        def fetch():
+            response = self._makeGetRequest(self._slideInfoPath, "", log)
+            if (response.status_code == 200):
+                return SlideInfo.from_json(response.content)
+            self._printResponse(response, "Unexpected response:")
+            return None
+        return self._cachedMetadata('slideinfo', fetch, refresh)
+
+    # Get the analysis ROI(the shapes selected for the analysis), cached like getSlideInfo().
+    def getAnalysisRoi(self, log=False, refresh=False):
+        def fetch():
+            response = self._makeGetRequest(self._analysisRoi, "", log)
+            if (response.status_code == 200):
+                return AnalysisRoi.from_json(response.content)
+            self._printResponse(response, "Unexpected response:")
+            return None
+        return self._cachedMetadata('analysisroi', fetch, refresh)
+
+    # Get the user parameters as dict key -> value, cached like getSlideInfo().
+    def getUserParameters(self, log=False, refresh=False):
+        def fetch():
+            response = self._makeGetRequest(self._userParamPath, "", log)
+            if (response.status_code == 200):
+                return {item.key: item.value for item in KeyValuePair.from_json(response.content)}
+            self._printResponse(response, "Unexpected response:")
+            return None
+        key_value_map = self._cachedMetadata('userparameters', fetch, refresh)
+        return key_value_map if key_value_map is not None else {}
+
+    # Returns a copy of the metadata 'name'. It is requested with fetch() by the first call, after
+    # invalidateMetadata() or if 'refresh' is set, and kept until then. Failed requests(None) aren't cached.
+    # Concurrent first calls wait for a single request. A response is dropped if the metadata was invalidated while
+    # it was requested.
+    def _cachedMetadata(self, name, fetch, refresh):
+        if not self._metadataCache:
+            self._metadataStats['fetches'][name] += 1
+            return fetch()
+        while True:
+            with self._metadataLock:
+                if not refresh and name in self._metadata:
+                    self._metadataStats['hits'][name] += 1
+                    return copy.deepcopy(self._metadata[name])
+                pending = self._metadataPending.get(name)
+                if pending is None:
+                    pending = self._metadataPending[name] = threading.Event()
+                    generation = self._metadataGeneration[name]
+                    self._metadataStats['fetches'][name] += 1
+                    break
+            # another thread requests it, a refresh takes its response
+            pending.wait()
+            refresh = False
+        value = None
+        try:
+            value = fetch()
+            cached = copy.deepcopy(value) if value is not None else None
+            with self._metadataLock:
+                if cached is not None and generation == self._metadataGeneration[name]:
+                    self._metadata[name] = cached
+        finally:
+            with self._metadataLock:
+                del self._metadataPending[name]
+            pending.set()
+        return value
+
+    # Drop cached metadata, e.g. after the annotation classes were changed by another client. The next call of the
+    # getter requests it again.
+    # names: any of 'slideinfo', 'analysisroi', 'userparameters', 'annotationclasses'. All if none is given.
+    def invalidateMetadata(self, *names):
+        for name in names:
+            if name not in self._metadataNames:
+                raise Exception("Unknown metadata '{}', use one of {}.".format(name, self._metadataNames))
+        with self._metadataLock:
+            for name in names or self._metadataNames:
+                self._metadata.pop(name, None)
+                self._metadataGeneration[name] += 1
+
+    # Returns the metadata cache statistics: 'hits' and 'fetches'(requests sent) per metadata name, the names of the
+    # 'cached' metadata, the 'skipped_classes' not sent again by ensureAnnotationClasses() and the total number of
+    # 'avoided_requests'.
+    def getMetadataCacheStats(self):
+        with self._metadataLock:
+            hits = dict(self._metadataStats['hits'])
+            return {'hits': hits, 'fetches': dict(self._metadataStats['fetches']),
+                    'cached': [name for name in self._metadataNames if name in self._metadata],
+                    'skipped_classes': self._metadataStats['skipped_classes'],
+                    'avoided_requests': sum(hits.values()) + self._metadataStats['skipped_requests']}
+
+    # Provide progress information.
+    # The update is sent in the background(see 'telemetry_rate_hz'), so it is cheap to call this per tile.
+    def sendProgress(self, progress_0to1, progress_amount=0, progress_message="", log=False):
+        progressInfo = ProgressInfo(progressRatio=progress_0to1, progressAmount=progress_amount,
+                                    message=progress_message)
+        telemetry = self._getTelemetrySender()
+        if telemetry is None:
+            self._postProgress((progressInfo, log))
+        elif progress_0to1 < 0:
+            telemetry.message((progressInfo, log))
+        else:
+            telemetry.progress((progressInfo, log))
+
+    # Provide a message.
+    # Messages are never skipped, but they are sent in the background as well.
+    def sendMessage(self, message, log=False):
+        self.sendProgress(-1.0, -1, message, log)
+
+    # Wait until the pending progress updates and messages have been sent. Returns False on timeout.
+    def flushTelemetry(self, timeout=None):
+        telemetry = self._telemetry
+        return telemetry.flush(timeout) if telemetry is not None else True
+
+    def _getTelemetrySender(self):
+        if self._telemetryRateHz <= 0:
+            return None
+        with self._telemetryLock:
+            if self._telemetry is None:
+                self._telemetry = TelemetrySender(self._postProgress, self._telemetryRateHz,
+                                                  drop_notice=self._droppedMessagesNotice)
+            return self._telemetry
+
+    def _postProgress(self, item):
+        progressInfo, log = item
+        json_data = ProgressInfo.to_json(progressInfo)
+        response = self._makePostRequest(self._progressPath, json_data, log)
+        if (response.status_code != 200):
+            self._printResponse(response, "Unexpected response:")
+
+    @staticmethod
+    def _droppedMessagesNotice(count):
+        return ProgressInfo(progressRatio=-1.0, progressAmount=-1,
+                            message='{} message(s) dropped(too many messages)'.format(count)), False
+
+    # Get thumbnail image of the slide.
+    # max_width: maximum width of the thumbnail image in pixels.
+    # max_height: maximum height of the thumbnail image in pixels.
+    def getThumbnail(self, max_width=512, max_height=512, log=False):
+        req_params = {'max_width': max_width, 'max_height': max_height}
+        return self._getImage(self._thumbnailPath, req_params, log)
+
+    # Get a rectangular ROI of the slide as (PIL-)image.
+    # x_um, y_um: location of the ROI(top left corner, in um).
+    # w_um, h_um: width and height of the ROI in um.
+    # px_width_um, px_height_um: desired pixel resolution of the returned ROI image in um/pixel.
+    # px_format: pixel format of the  ROI image 'BGR', 'RGB' or 'Gray'.
+    # channel_idx: index of a pixel color channel. Useful to extract a certain color channel of a fluorescence slide.
+    #              Default is -1(use all channels).
+    #              Available indices are listed in the channels[] array of the SlideInfo class that can be obtained by method getSlideInfo()
+    def getROI(self, x_um, y_um, w_um, h_um, px_width_um, px_height_um=0, px_format='RGB', channel_idx=-1, log=False):
+        if px_height_um == 0:
+            px_height_um = px_width_um
+        req_params = {'x': x_um, 'y': y_um, 'w': w_um, 'h': h_um, 'px_width_um': px_width_um,
+                      'px_height_um': px_height_um, 'px_format': px_format, 'channel_idx': channel_idx}
+        return self._getImage(self._roiPath, req_params, log)
+
+    # Get a rectangular ROI of the slide as (PIL-)image.
+    # The returned image has the native slide pixel resolution(as returned from getSlideInfo())
+    # x_um, y_um: location of the ROI(top left corner, in um).
+    # w_px, h_px: width and height of the ROI image in pixels.
+    # w_px, h_px: width and height of the ROI image in pixels.
+    # px_format: pixel format of the  ROI image 'BGR', 'RGB' or 'Gray'.
+    # channel_idx: index of a pixel color channel. Useful to extract a certain color channel of a fluorescence slide.
+    #              Default is -1(use all channels).
+    #              Available indices are listed in the channels[] array of the SlideInfo class that can be obtained by method getSlideInfo()
+    def getNativeROI(self, x_um, y_um, w_px, h_px, px_format='RGB', channel_idx=-1, log=False):
+        req_params = {'x': x_um, 'y': y_um, 'w': w_px, 'h': h_px, 'px_format': px_format, 'channel_idx': channel_idx}
+        return self._getImage(self._nativeRoiPath, req_params, log)
+
+    def _getImage(self, req_url, req_params, log):
+        cache_key = self._tileCacheKey(req_url, req_params, 'image')
+        if cache_key is not None:
+            data = self._tileCache.get(cache_key)
+            if data is not None:
+                return Image.open(BytesIO(data))
+
+        response = self._makeGetRequest(req_url, req_params, log)
+        if (response.status_code == 200):
+            if cache_key is not None:
+                self._tileCache.put(cache_key, np.frombuffer(response.content, dtype=np.uint8))
+            return Image.open(BytesIO(response.content))
+        else:
+            self._printResponse(response, "Unexpected response:")
+        return None
+
+    # Get a rectangular ROI of the slide as uint8 ndarray of shape (height, width, channels)
+    # or (height, width) for single channel images.
+    # Same parameters as getROI().
+    # out: optional uint8 array the pixels are written to(e.g. one entry of a preallocated batch array).
+    # Returns the ndarray('out' if provided) or None if the request failed. Without 'out' the ndarray of an encoded
+    # image(PNG, JPEG) is read-only.
+    def getROIArray(self, x_um, y_um, w_um, h_um, px_width_um, px_height_um=0, px_format='RGB', channel_idx=-1,
+                    out=None, log=False):
+        if px_height_um == 0:
+            px_height_um = px_width_um
+        req_params = {'x': x_um, 'y': y_um, 'w': w_um, 'h': h_um, 'px_width_um': px_width_um,
+                      'px_height_um': px_height_um, 'px_format': px_format, 'channel_idx': channel_idx}
+        shape = (int(round(h_um / px_height_um)), int(round(w_um / px_width_um)),
+                 1 if px_format == 'Gray' or channel_idx >= 0 else 3)
+        return self._getPixelArray(self._roiPath, req_params, shape, out, log)
+
+    # Get a rectangular ROI of the slide at native slide pixel resolution as uint8 ndarray of shape
+    # (height, width, channels) or (height, width) for single channel images.
+    # Same parameters as getNativeROI().
+    # out: optional uint8 array the pixels are written to(e.g. one entry of a preallocated batch array).
+    # Returns the ndarray('out' if provided) or None if the request failed. Without 'out' the ndarray of an encoded
+    # image(PNG, JPEG) is read-only.
+    def getNativeROIArray(self, x_um, y_um, w_px, h_px, px_format='RGB', channel_idx=-1, out=None, log=False):
+        req_params = {'x': x_um, 'y': y_um, 'w': w_px, 'h': h_px, 'px_format': px_format, 'channel_idx': channel_idx}
+        shape = (h_px, w_px, 1 if px_format == 'Gray' or channel_idx >= 0 else 3)
+        return self._getPixelArray(self._nativeRoiPath, req_params, shape, out, log)
+
+    def _getPixelArray(self, req_url, req_params, shape, out, log):
+        cache_key = self._tileCacheKey(req_url, req_params, 'array')
+        if cache_key is not None:
+            pixels = self._tileCache.get(cache_key)
+            if pixels is not None:
+                out = self._pixelBuffer(pixels.shape, out)
+                np.copyto(out, pixels)
+                return out
+
+        response = self._makeGetRequest(req_url, req_params, log, headers=self._pixelArrayHeaders, stream=True)
+        try:
+            if (response.status_code == 200):
+                # includes reading the streamed response body
+                with self._instrumentation.measure(self._requestKey('GET', req_url), 'decode'):
+                    out = self._readPixelArray(response, shape, out)
+                if cache_key is not None:
+                    self._tileCache.put(cache_key, out)
+                return out
+            else:
+                self._printResponse(response, "Unexpected response:")
+        finally:
+            response.close()
+        return None
+
+    # Returns the statistics of the tile cache(see TileCache.stats()) or None if no tile cache is used.
+    def getTileCacheStats(self):
+        if self._tileCache is None:
+            return None
+        return self._tileCache.stats()
+
+    # Returns the tile cache key of a pixel request or None if no tile cache is used.
+    # The key consists of the slide identity, the endpoint, all request parameters(region, resolution,
+    # px_format, channel_idx, ...) and the variant('image' or 'array').
+    def _tileCacheKey(self, req_url, req_params, variant):
+        if self._tileCache is None:
+            return None
+        slide_key = self.slideIdentity()
+        if slide_key is None:
+            return None
+        endpoint = req_url[len(self._rootPath):]
+        params = '&'.join('{}={!r}'.format(key, req_params[key]) for key in sorted(req_params))
+        return '{}{}?{}#{}'.format(slide_key, endpoint, params, variant)
+
+    # Returns a string that identifies the slide of this session(hash of the slide information), e.g. to key
+    # caches or run journals per slide. None if the slide information can't be read.
+    def slideIdentity(self):
+        with self._slideCacheKeyLock:
+            if self._slideCacheKey is None:
+                slide_info = self.getSlideInfo()
+                if slide_info is None:
+                    return None
+                self._slideCacheKey = hashlib.sha1(slide_info.to_json().encode('utf-8')).hexdigest()
+            return self._slideCacheKey
+
+    # Iterate over tiles of the slide while the following tiles are fetched in background threads.
+    # This overlaps the network round trips with the processing(e.g. model inference) of the current tile.
+    # tiles: list of tile coordinates [[x0_um, y0_um], [x1_um, y1_um]](top left and bottom right corner in um).
+    # w_px, h_px: size of the tile images in pixels. Tiles are read at native resolution with getNativeROI().
+    # px_width_um, px_height_um: if provided, tiles are read with getROI() at this pixel resolution instead.
+    # max_in_flight: maximum number of tiles that are requested in advance.
+    # ordered: if True tiles are returned in the order of 'tiles', otherwise in the order they arrive.
+    # Returns a TileReader that yields tuples (tile, image as ndarray). The image is None if a tile couldn't be read.
+    # Leaving the loop early(or calling close() on the TileReader) cancels all pending requests.
+    def iterTiles(self, tiles, w_px=0, h_px=0, px_width_um=0, px_height_um=0, px_format='RGB', channel_idx=-1,
+                  max_in_flight=8, ordered=True):
+        if px_width_um <= 0 and (w_px <= 0 or h_px <= 0):
+            raise Exception("Either the tile size 'w_px', 'h_px' or the pixel resolution 'px_width_um' shall be provided.")
+
+        def fetchTile(tile):
+            x_um, y_um = tile[0]
+            if px_width_um > 0:
+                return self.getROIArray(x_um, y_um, tile[1][0] - x_um, tile[1][1] - y_um, px_width_um, px_height_um,
+                                        px_format, channel_idx)
+            return self.getNativeROIArray(x_um, y_um, w_px, h_px, px_format, channel_idx)
+
+        return TileReader(fetchTile, tiles, max_in_flight=max_in_flight, ordered=ordered)
+
+    # Get a list of annotation items(see class Annotation) from the slide.
+    # shape_type: if provided, only annotations of the specified shape type are returned.
+    # class_name: if provided, only annotations which belong to the specified annotation class are returned.
+    # Returns a array of 'class Annotation' items.
+    def getAnnotations(self, shape_type="", class_name="", log=False):
+        # class_name = class_name.replace(" ", "%20")
+        req_params = {'shape_type': shape_type, 'class_name': class_name}
+        response = self._makeGetRequest(self._annoPath, req_params, log)
+        if (response.status_code == 200):
+            with self._instrumentation.measure('GET /annotation', 'decode'):
+                annoList = Annotation.from_json(response.content)
+                for anno in annoList:
+                    if anno.shapeType == "Mask":
+                        self._decodeMaskFields(anno)
+            self._rememberState(self._knownAnnotations, self._annotationFields, annoList)
+            return annoList
+        else:
+            self._printResponse(response, "Unexpected response:")
+        return []
+
+    # Create a 'Annotation' instance from given parameters and add it to the slide.
+    # shape_type: string that identifies the shape type - one of {'Point', 'Line', 'Rectangle', 'Ellipse'. 'Polygon'}
+    # outline: annotation outline contour as 2D-coordinate list(slide scene coordinates in um) e.g. [[250.0, 300.0], [555.5, 300.0] ... [250.0, 800.0]]
+    # holes: hole contours as list of 2D-coordinate lists
+    # class_name: optional name of a annotation class to which the annotation should be assigned.
+    #             If a class_name is provided and such a annotation class doesn't exist,
+    #             a new annotation class with this name will be created automatically.
+    def addAnnotation(self, shape_type, outline, holes, class_name="", log=False):
+        anno = self.createAnnotation(shape_type, outline, holes, class_name)
+        ret = self.addAnnotations([anno], log)
+        if ret != None:
+            ret = ret[0]
+        return ret
+
+    # Add one or more annotation objects(of class Annotation) to the slide.
+    # annotations: list of annotation objects of type 'Annotation'.
+    # Note 1: Use method createAnnotation() to create instances of class 'Annotation'.
+    # Note 2: if the className member of an annotation is set and such a annotation class doesn't exist,
+    #         a new annotation class with this name will be created automatically.
+    def addAnnotations(self, annotations, log=False):
+        if not isinstance(annotations, list):
+            raise Exception("Parameter 'annotations' shall be a list of instances of class Annotation.")
+        for anno in annotations:
+            if not isinstance(anno, Annotation):
+                raise Exception("'annotations' list contains item(s) that are not instances of class Annotation.")
+            if anno.shapeType not in self._annoShapeTypes:
+                raise Exception("'annotations' list contains item(s) with unknown shapeType '" + anno.shapeType + "'.")
+
+        with self._instrumentation.measure('POST /annotation', 'serialize'):
+            json_data = Annotation.list_to_json([self._encodeMasks(anno) for anno in annotations])
+
+        response = self._makePostRequest(self._annoPath, json_data, log)
+        if (response.status_code == 200):
+            with self._instrumentation.measure('POST /annotation', 'decode'):
+                anno_list_response = Annotation.from_json(response.content)
+            if annotations[0].shapeType == "Mask":
+                self._checkClassNames(anno.className for anno in annotations)
+                return annotations
+            else:
+                for i in range(len(anno_list_response)):
+                    annotations[i].id = anno_list_response[i].id
+                    annotations[i].className = anno_list_response[i].className
+                self._rememberState(self._knownAnnotations, self._annotationFields,
+                                    annotations[:len(anno_list_response)])
+                self._checkClassNames(anno.className for anno in annotations)
+                return annotations
+        else:
+            self._printResponse(response, "Unexpected response:")
+        return None
+
+    # Add all annotations of an AnnotationBatch to the slide.
+    # Large batches are split into several POST requests of bounded size.
+    # batch: AnnotationBatch instance, e.g. created with AnnotationBatch.fromContours().
+    # max_chunk_bytes: approximate maximum size of a single POST request.
+    # max_chunk_annotations: maximum number of annotations of a single POST request.
+    # On success the MIKAIA-IDs assigned by the server are stored in batch.ids and the batch is returned.
+    # Returns None if a request failed(the IDs of all annotations sent before stay valid).
+    def addAnnotationBatch(self, batch, max_chunk_bytes=4 * 1024 * 1024, max_chunk_annotations=20000, log=False):
+        from mikaia_plugin_api.annotation_batch import AnnotationBatch
+        if not isinstance(batch, AnnotationBatch):
+            raise Exception("Parameter 'batch' shall be an instance of class AnnotationBatch.")
+
+        chunks = batch.iterJsonChunks(max_chunk_bytes, max_chunk_annotations)
+        while True:
+            with self._instrumentation.measure('POST /annotation', 'serialize'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            first, end, json_data = chunk
+            response = self._makePostRequest(self._annoPath, json_data, log)
+            if (response.status_code != 200):
+                self._printResponse(response, "Unexpected response:")
+                self._checkClassNames(batch.classNames)
+                return None
+            with self._instrumentation.measure('POST /annotation', 'decode'):
+                anno_list_response = orjson.loads(response.content) if orjson is not None else json.loads(response.content)
+            batch.setIds(first, [item['id'] for item in anno_list_response[:end - first]])
+        self._checkClassNames(batch.classNames)
+        return batch
+
+    # Updates the content of an already existing annotation item(see class Annotation).
+    # Currently only the 'className' is supported by this update operation.
+    # annotation: an annotation object of type 'Annotation'.
+    def updateAnnotation(self, annotation, log=False):
+        if not isinstance(annotation, Annotation):
+            raise Exception("Given annotation item isn't an instance of class Annotation.")
+
+        # provide data to update(currently only the 'className' is supported)
+        patch_data = []
+        patch_item = ['replace', 'className', annotation.className]
+        patch_data.append(patch_item)
+
+        request_path = self._annoPath + '/' + str(annotation.id)
+        response = self._makePatchRequest(request_path, patch_data, log)
+        if (response.status_code == 200):
+            self._rememberState(self._knownAnnotations, self._annotationFields, [annotation])
+            self._checkClassNames([annotation.className])
+            return True
+        else:
+            self._printResponse(response, "Unexpected response:")
+        return False
+
+    # Updates several annotation items(see class Annotation) at once. Like updateAnnotation(), only the 'className'
+    # is supported.
+    # Annotations whose values equal the last state known from the server(getAnnotations(), addAnnotations() or a
+    # previous update) are skipped. The changes are sent as JSON Patch(RFC 6902) documents of at most
+    # 'max_chunk_operations' operations to the annotation collection:
+    #     [{"op": "replace", "path": "/42/className", "value": "Tumor"}, ...]
+    # If the server doesn't support bulk PATCH requests, one request per annotation is sent('workers' at a time).
+    # Returns a dict with the number of 'updated' and 'unchanged' annotations, the 'operations', 'requests' and
+    # 'bytes' sent and the list of the ids of the annotations that 'failed' to update.
+    def updateAnnotations(self, annotations, max_chunk_operations=5000, workers=8, log=False):
+        for annotation in annotations:
+            if not isinstance(annotation, Annotation):
+                raise Exception("'annotations' list contains item(s) that are not instances of class Annotation.")
+        result = self._updateItems(self._annoPath, self._knownAnnotations, self._annotationFields, annotations,
+                                   max_chunk_operations, workers, log)
+        self._checkClassNames(anno.className for anno in annotations)
+        return result
+
+    # Get a list of all annotation class items(see class AnnotationClass) of the slide.
+    # The class table is cached like getSlideInfo() and kept up to date by the add/update methods of this
+    # SlideService. Adding annotations with a class name that isn't in the table drops the table, because the
+    # server creates the new class. refresh: request the table again.
+    def getAnnotationClasses(self, log=False, refresh=False):
+        def fetch():
+            response = self._makeGetRequest(self._annoClassPath, "", log)
+            if (response.status_code == 200):
+                annoClassList = AnnotationClass.from_json(response.content)
+                self._rememberState(self._knownAnnotationClasses, self._annotationClassFields, annoClassList)
+                return annoClassList
+            self._printResponse(response, "Unexpected response:")
+            return None
+        annoClassList = self._cachedMetadata('annotationclasses', fetch, refresh)
+        return annoClassList if annoClassList is not None else []
+
+    # Makes sure that the annotation classes exist, only the classes whose name isn't in the class table
+    # (see getAnnotationClasses()) are added. Calling it again, e.g. per tile or per run, costs no request.
+    # anno_classes: list of AnnotationClass objects(see createAnnotationClass()) or class names.
+    # Returns the AnnotationClass items of the slide in the order of 'anno_classes'(existing classes keep their
+    # attributes), or None if adding the missing classes failed.
+    def ensureAnnotationClasses(self, anno_classes, log=False):
+        if not isinstance(anno_classes, list):
+            raise Exception("Parameter 'anno_classes' shall be a list of instances of class AnnotationClass or names.")
+        anno_classes = [self.createAnnotationClass(item) if isinstance(item, str) else item for item in anno_classes]
+        for anno_class in anno_classes:
+            if not isinstance(anno_class, AnnotationClass):
+                raise Exception("'anno_classes' list contains items which are not instances of class AnnotationClass.")
+
+        table = {anno_class.className: anno_class for anno_class in self.getAnnotationClasses(log)}
+        missing = []
+        for anno_class in anno_classes:
+            if anno_class.className not in table and all(anno_class.className != m.className for m in missing):
+                missing.append(anno_class)
+        if missing:
+            added = self.addAnnotationClasses(missing, log)
+            if added is None:
+                return None
+            table.update({anno_class.className: anno_class for anno_class in added})
+        else:
+            with self._metadataLock:
+                self._metadataStats['skipped_requests'] += 1
+        with self._metadataLock:
+            self._metadataStats['skipped_classes'] += len(anno_classes) - len(missing)
+        return [table.get(anno_class.className, anno_class) for anno_class in anno_classes]
+
+    # Apply added or updated annotation classes to the cached class table, matched by 'key'('className' or 'id').
+    def _updateCachedClasses(self, anno_classes, key):
+        if not self._metadataCache:
+            return
+        with self._metadataLock:
+            table = self._metadata.get('annotationclasses')
+            if table is None:
+                # a class table requested meanwhile may not contain them yet
+                self._metadataGeneration['annotationclasses'] += 1
+                return
+            positions = {getattr(anno_class, key): i for i, anno_class in enumerate(table)}
+            for anno_class in anno_classes:
+                i = positions.get(getattr(anno_class, key))
+                if i is not None:
+                    table[i] = copy.deepcopy(anno_class)
+                elif key == 'className':
+                    positions[anno_class.className] = len(table)
+                    table.append(copy.deepcopy(anno_class))
+
+    # Drops the cached class table if annotations use class names that aren't in it(the server adds those classes).
+    def _checkClassNames(self, class_names):
+        if not self._metadataCache:
+            return
+        class_names = set(filter(None, class_names))
+        with self._metadataLock:
+            table = self._metadata.get('annotationclasses')
+            if table is None or not class_names <= {c.className for c in table}:
+                self._metadata.pop('annotationclasses', None)
+                self._metadataGeneration['annotationclasses'] += 1
+
+    # Adds an annotation class to the slide.
+    # class_name: unique name of the annotation class.
+    # description: optional description of the annotation class.
+    # line_color: Outline color for annotations associated with this annotation class.
+    #             RGB color definition as hexadecimal HTML '#AARRGGBB' string(e.g. '#ffc280de').
+    # fill_color: Fill color for annotations associated with this annotation class.
+    #             RGB color definition as hexadecimal HTML '#AARRGGBB' string(e.g. '#ffc280de').
+    # Opacity for annotations associated with this annotation class(0.0(transparent) to 1.0(full opaque))
+    def addAnnotationClass(self, class_name, description="", groupName="", tags=[], line_width_px=-1, line_color="", fill_color="",
+                           opacity=1.0, log=False):
+        annotationClass = self.createAnnotationClass(class_name, description, line_width_px, line_color, fill_color,
+                                                     opacity)
+        ret = self.addAnnotationClasses([annotationClass], log)
+        if ret != None:
+            ret = ret[0]
+        return ret
+
+    # Adds one or more annotation class objects(of class AnnotationClass) to the slide.
+    # anno_classes: list of annotation class objects of type 'AnnotationClass'.
+    # Note 1: Use method createAnnotationClass() to create instances of class 'AnnotationClass'.
+    def addAnnotationClasses(self, anno_classes, log=False):
+        if not isinstance(anno_classes, list):
+            raise Exception("Parameter 'anno_classes' shall be a list of instances of class AnnotationClass.")
+        for anno_class in anno_classes:
+            if not isinstance(anno_class, AnnotationClass):
+                raise Exception("'anno_classes' list contains items which are not instances of class AnnotationClass.")
+
+        json_data = AnnotationClass.list_to_json(anno_classes)
+
+        response = self._makePostRequest(self._annoClassPath, json_data, log)
+        if (response.status_code == 200):
+            anno_class_list_response = AnnotationClass.from_json(response.content)
+            for i in range(len(anno_class_list_response)):
+                anno_classes[i].className = anno_class_list_response[i].className
+                anno_classes[i].classDescription = anno_class_list_response[i].classDescription
+                anno_classes[i].id = anno_class_list_response[i].id
+                anno_classes[i].outlineWidth = anno_class_list_response[i].outlineWidth
+                anno_classes[i].outlineColor = anno_class_list_response[i].outlineColor
+                anno_classes[i].fillColor = anno_class_list_response[i].fillColor
+                anno_classes[i].opacity = anno_class_list_response[i].opacity
+            self._rememberState(self._knownAnnotationClasses, self._annotationClassFields,
+                                anno_classes[:len(anno_class_list_response)])
+            self._updateCachedClasses(anno_classes[:len(anno_class_list_response)], 'className')
+            return anno_classes
+        else:
+            self._printResponse(response, "Unexpected response:")
+        return None
+
+    # Updates the content of an already existing annotation class item(see class AnnotationClass).
+    # Currently the following attributes of class AnnotationClass are supported:
+    # - classDescription
+    # - outlineWidth
+    # - outlineColor
+    # - fillColor
+    # - opacity
+    # annotation_class: an annotation_class object of type 'AnnotationClass'.
+    def updateAnnotationClass(self, annotation_class, log=False):
+        if not isinstance(annotation_class, AnnotationClass):
+            raise Exception("Parameter 'annotation_class' isn't an instance of class AnnotationClass.")
+
+        # provide data to update supported attributes
+        patch_data = []
+        patch_item = ['replace', 'classDescription', annotation_class.classDescription]
+        patch_data.append(patch_item)
+        if annotation_class.outlineWidth >= 0:
+            patch_item = ['replace', 'outlineWidth', str(annotation_class.outlineWidth)]
+            patch_data.append(patch_item)
+        patch_item = ['replace', 'outlineColor', annotation_class.outlineColor]
+        patch_data.append(patch_item)
+        patch_item = ['replace', 'fillColor', annotation_class.fillColor]
+        patch_data.append(patch_item)
+        if annotation_class.outlineWidth >= 0:
+            patch_item = ['replace', 'opacity', '{:.3f}'.format(annotation_class.opacity)]
+            patch_data.append(patch_item)
+
+        request_path = self._annoClassPath + '/' + str(annotation_class.id)
+        response = self._makePatchRequest(request_path, patch_data, log)
+        if (response.status_code == 200):
+            self._rememberState(self._knownAnnotationClasses, self._annotationClassFields, [annotation_class])
+            self._updateCachedClasses([annotation_class], 'id')
+            return True
+        else:
+            self._printResponse(response, "Unexpected response:")
+        return False
+
+    # Updates several annotation class items(see class AnnotationClass) at once, see updateAnnotations().
+    # The same attributes as by updateAnnotationClass() are supported.
+    def updateAnnotationClasses(self, annotation_classes, max_chunk_operations=5000, workers=8, log=False):
+        for annotation_class in annotation_classes:
+            if not isinstance(annotation_class, AnnotationClass):
+                raise Exception("'annotation_classes' list contains items which are not instances of class AnnotationClass.")
+        result = self._updateItems(self._annoClassPath, self._knownAnnotationClasses, self._annotationClassFields,
+                                   annotation_classes, max_chunk_operations, workers, log)
+        failed = set(result['failed'])
+        self._updateCachedClasses([item for item in annotation_classes if item.id not in failed], 'id')
+        return result
+
+    def setResultsCaption(self, caption, subcaption=''):    
+        cap  = ResultsCaption(caption=caption, subcaption=subcaption)
+        json_data = ResultsCaption.to_json(cap)
+
+        response = self._makePostRequest(self._setResultsCaption, json_data)
+        if (response.status_code != 200):
+            self._printResponse(response, "Unexpected response:")
+            
+    def createDiagramDataSeries(self, class_name, color, classID, values, unit):
+        ret = DiagramDataSeries(name=class_name, color=color, classID=classID, values=values, unit=unit)
+        return ret
+
+    def addResultDiagram(self, title, subtitle, dataSeries, valueGroupNames=[], diagramType="VerticalBarChart"):
+        if not isinstance(dataSeries, list):
+            raise Exception("Parameter 'data_series' shall be a list of instances of class DiagramDataSeries.")
+        for result in dataSeries:
+            if not isinstance(result, DiagramDataSeries):
+                raise Exception("'dataSeries' list contains items which are not instances of class DiagramDataSeries.")
+
+        diagram = DiagramData(title=title, subtitle=subtitle, dataSeries=dataSeries,valueGroupNames=valueGroupNames, diagramType=diagramType)
+        json_data = DiagramData.to_json(diagram)
+
+        response = self._makePostRequest(self._addDiagramPath, json_data)
+        if (response.status_code != 200):
+            self._printResponse(response, "Unexpected response:")
+
+    def setCsv(self, csv_arrayOfStringArrays):
+        csv_obj = Csv(csv_arrayOfStringArrays)
+        json_data = Csv.to_json(csv_obj)
+        response = self._makePostRequest(self._csvPath, json_data)
+        if (response.status_code != 200):
+            self._printResponse(response, "Unexpected response:")
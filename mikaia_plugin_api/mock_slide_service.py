@@ -0,0 +1,577 @@
+import argparse
+import collections
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from PIL import Image
+
+BACKGROUND_RGB = (242, 242, 240)
+
+
+##################################
+## Pixel sources of mock slides ##
+##################################
+class SyntheticSlide(object):
+    """SyntheticSlide Procedural brightfield slide of arbitrary size.
+
+    Tissue regions(a few large blobs) are filled with a periodic H&E-like texture, the rest is glass.
+    Pixels are computed on the fly at any resolution, so the slide behaves like a pyramidal image
+    without storing one. The same slide coordinates always give the same pixels.
+    """
+
+    # width_px, height_px: size of the slide at native resolution.
+    # px_size_um: native pixel size in um.
+    # blobs: number of tissue regions.
+    def __init__(self, width_px=50000, height_px=40000, px_size_um=0.25, seed=0, blobs=6, name='synthetic.svs'):
+        self.name = name
+        self.width = width_px
+        self.height = height_px
+        self.pxSizeUm = px_size_um
+        rng = np.random.default_rng(seed)
+        size = min(width_px, height_px)
+        self._blobs = [(rng.uniform(0.2, 0.8) * width_px, rng.uniform(0.2, 0.8) * height_px,
+                        rng.uniform(0.08, 0.16) * size, rng.uniform(0.08, 0.16) * size) for i in range(blobs)]
+        # RGBA texture as uint32, so pixels can be selected with a single np.where()
+        self._texture = self._rgba32(self._createTexture(rng, 512))
+        self._background = self._rgba32(np.array([[BACKGROUND_RGB]], dtype=np.uint8))[0, 0]
+
+    def __str__(self):
+        return '{}(name={}, size={}x{} px, px_size_um={})'.format(self.__class__.__name__, self.name, self.width,
+                                                                  self.height, self.pxSizeUm)
+
+    # Returns the region [x0, x1) x [y0, y1)(native pixels) resampled to out_w x out_h as uint8 RGB ndarray.
+    def readRegion(self, x0, y0, x1, y1, out_w, out_h):
+        xs = x0 + (np.arange(out_w) + 0.5) * ((x1 - x0) / out_w)
+        ys = y0 + (np.arange(out_h) + 0.5) * ((y1 - y0) / out_h)
+        # separable gaussian blobs, regions far from all blobs are glass
+        blobs = []
+        for cx, cy, sx, sy in self._blobs:
+            gx = np.exp(-0.5 * ((xs - cx) / sx) ** 2).astype(np.float32)
+            gy = np.exp(-0.5 * ((ys - cy) / sy) ** 2).astype(np.float32)
+            blobs.append((gx, gy))
+        if sum(gx.max() * gy.max() for gx, gy in blobs) <= 0.5:
+            pixels = np.full((out_h, out_w), self._background, dtype=np.uint32)
+        else:
+            field = np.zeros((out_h, out_w), dtype=np.float32)
+            for gx, gy in blobs:
+                field += gy[:, None] * gx[None, :]
+            tissue = field > 0.5
+            tissue &= ((ys >= 0) & (ys < self.height))[:, None]
+            tissue &= ((xs >= 0) & (xs < self.width))[None, :]
+            size = len(self._texture)
+            tx = np.floor(xs).astype(np.int64) % size
+            ty = np.floor(ys).astype(np.int64) % size
+            pixels = np.where(tissue, np.take(np.take(self._texture, ty, axis=0), tx, axis=1), self._background)
+        rgba = pixels.view(np.uint8).reshape(out_h, out_w, 4)
+        rgb = np.empty((out_h, out_w, 3), dtype=np.uint8)
+        for channel in range(3):
+            rgb[:, :, channel] = rgba[:, :, channel]
+        return rgb
+
+    @staticmethod
+    def _rgba32(rgb):
+        rgba = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+        rgba[:, :, :3] = rgb
+        rgba[:, :, 3] = 255
+        return rgba.view(np.uint32)[:, :, 0]
+
+    @staticmethod
+    def _createTexture(rng, size):
+        # pink stroma with purple nuclei
+        texture = np.empty((size, size, 3), dtype=np.float32)
+        texture[:] = (228, 150, 196)
+        texture += rng.normal(0.0, 8.0, (size, size, 1)).astype(np.float32)
+        nuclei = np.zeros((size, size), dtype=bool)
+        offsets = np.arange(-8, 9)
+        for cx, cy, r in zip(rng.uniform(0, size, 400), rng.uniform(0, size, 400), rng.uniform(3, 7, 400)):
+            # window around the nucleus, wrapped around so the texture tiles seamlessly
+            xs = np.floor(cx).astype(np.int64) + offsets
+            ys = np.floor(cy).astype(np.int64) + offsets
+            disk = (xs - cx)[None, :] ** 2 + (ys - cy)[:, None] ** 2 <= r * r
+            nuclei[np.ix_(ys % size, xs % size)] |= disk
+        texture[nuclei] = (96, 60, 140)
+        return np.clip(texture, 0, 255).astype(np.uint8)
+
+
+class ArraySlide(object):
+    """ArraySlide Mock slide backed by an RGB image(ndarray, .npy file or image file).
+
+    Lower resolutions are served from a pyramid of 2x downsampled levels which are computed on first use.
+    """
+
+    # pixels: (height, width, 3) uint8 array, e.g. np.load(path, mmap_mode='r').
+    # px_size_um: native pixel size in um.
+    def __init__(self, pixels, px_size_um=0.25, name='array.tif'):
+        if pixels.ndim != 3 or pixels.shape[2] != 3:
+            raise Exception("Parameter 'pixels' shall be an array of shape (height, width, 3).")
+        self.name = name
+        self.width = pixels.shape[1]
+        self.height = pixels.shape[0]
+        self.pxSizeUm = px_size_um
+        self._levels = [pixels]
+        self._levelsLock = threading.Lock()
+
+    def __str__(self):
+        return '{}(name={}, size={}x{} px, px_size_um={})'.format(self.__class__.__name__, self.name, self.width,
+                                                                  self.height, self.pxSizeUm)
+
+    # Create an ArraySlide from a .npy file(memory-mapped) or an image file that PIL can read.
+    @classmethod
+    def fromFile(cls, path, px_size_um=0.25):
+        if path.endswith('.npy'):
+            pixels = np.load(path, mmap_mode='r')
+        else:
+            with Image.open(path) as img:
+                pixels = np.asarray(img.convert('RGB'))
+        return cls(pixels, px_size_um, path.replace('\\', '/').split('/')[-1])
+
+    # Returns the region [x0, x1) x [y0, y1)(native pixels) resampled to out_w x out_h as uint8 RGB ndarray.
+    def readRegion(self, x0, y0, x1, y1, out_w, out_h):
+        scale = min((x1 - x0) / out_w, (y1 - y0) / out_h)
+        level = 0
+        while 2 ** (level + 1) <= scale and min(self.width, self.height) >> (level + 1) > 0:
+            level += 1
+        pixels = self._level(level)
+        factor = 2 ** level
+        xs = np.floor((x0 + (np.arange(out_w) + 0.5) * ((x1 - x0) / out_w)) / factor).astype(np.int64)
+        ys = np.floor((y0 + (np.arange(out_h) + 0.5) * ((y1 - y0) / out_h)) / factor).astype(np.int64)
+        valid_x = (xs >= 0) & (xs < pixels.shape[1])
+        valid_y = (ys >= 0) & (ys < pixels.shape[0])
+        out = np.empty((out_h, out_w, 3), dtype=np.uint8)
+        out[:] = BACKGROUND_RGB
+        out[np.ix_(valid_y, valid_x)] = pixels[np.ix_(ys[valid_y], xs[valid_x])]
+        return out
+
+    def _level(self, level):
+        with self._levelsLock:
+            while len(self._levels) <= level:
+                src = self._levels[-1]
+                h, w = src.shape[0] // 2 * 2, src.shape[1] // 2 * 2
+                blocks = np.asarray(src[:h, :w], dtype=np.uint16).reshape(h // 2, 2, w // 2, 2, 3)
+                self._levels.append(((blocks.sum(axis=(1, 3)) + 2) // 4).astype(np.uint8))
+            return self._levels[level]
+
+
+##########################################
+## Local stand-in for the MIKAIA server ##
+##########################################
+class MockSlideService(object):
+    """MockSlideService Local HTTP server that implements the SlideService endpoints used by SlideService.
+
+    Serves slideinfo, analysisroi, thumbnail, roi, nativeroi, annotation, annotationclass, progress,
+    userparameters, diagram, resultscaption and csv for one mock slide, so plugins can be developed,
+    tested and benchmarked without a running MIKAIA instance. Posted annotations, progress updates,
+    diagrams etc. are kept in memory and can be inspected.
+
+    Usage:
+        with MockSlideService(SyntheticSlide(), latency_s=0.002) as server:
+            ss = mikaia_api.SlideService(server.url)
+            ...
+    """
+
+    # slide: SyntheticSlide or ArraySlide instance. Default: SyntheticSlide().
+    # latency_s: delay added to every response.
+    # bandwidth_mbps: if > 0, request and response bodies are transferred at this rate(Mbit/s).
+    # raw_pixels: serve uncompressed pixels if the client accepts 'application/octet-stream'.
+    # image_format: format of encoded images('PNG' or 'JPEG').
+    # analysis_roi: list of Annotation instances. Default: a rectangle over the central part of the slide.
+    # user_parameters: dict of user parameters.
+    # cache_mb: if > 0, pixel responses are cached(LRU), so repeated requests cost the server next to nothing.
+    # host, port: address to listen on. Port 0 picks a free port.
+    # bulk_patch: accept JSON Patch documents for whole collections(PATCH /annotation, PATCH /annotationclass).
+    #             False answers them with 405 like MIKAIA versions that only support single item updates.
+    def __init__(self, slide=None, latency_s=0.0, bandwidth_mbps=0.0, raw_pixels=True, image_format='PNG',
+                 analysis_roi=None, user_parameters=None, cache_mb=0, host='127.0.0.1', port=0,
+                 session_id='0000000000000001', bulk_patch=True):
+        self.slide = slide if slide is not None else SyntheticSlide()
+        self.latencyS = latency_s
+        self.bandwidthMbps = bandwidth_mbps
+        self.rawPixels = raw_pixels
+        self.imageFormat = image_format
+        self.bulkPatch = bulk_patch
+        self.userParameters = dict(user_parameters or {})
+        self.annotations = {}
+        self.annotationClasses = {}
+        self.progress = []
+        self.diagrams = []
+        self.csv = []
+        self.resultsCaptions = []
+        self.requestCount = 0
+        self._lock = threading.Lock()
+        self._nextId = 1
+        self._cache = collections.OrderedDict()
+        self._cacheBytes = 0
+        self._cacheMaxBytes = int(cache_mb * 1024 * 1024)
+        if analysis_roi is None:
+            width_um = self.slide.width * self.slide.pxSizeUm
+            height_um = self.slide.height * self.slide.pxSizeUm
+            analysis_roi = [{'shapeType': 'Rectangle', 'mask': [], 'maskSizeInPx': [], 'labelMap': [],
+                             'coordinates': [[width_um * 0.25, height_um * 0.25, width_um * 0.75, height_um * 0.75]],
+                             'id': 0, 'className': 'Analysis ROI'}]
+        self._analysisRoi = [a if isinstance(a, dict) else json.loads(a.to_json()) for a in analysis_roi]
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._rootPath = '/MIKAIA/SlideService/v1/' + session_id
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self):
+        return '{}(url={}, slide={})'.format(self.__class__.__name__, self.url, self.slide)
+
+    # SlideService URL including the session id, pass it to mikaia_api.SlideService().
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, self._rootPath)
+
+    # Start serving in a background thread.
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, args=(0.1,), name='MockSlideService',
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    # Serve in the calling thread until close() is called(from another thread) or Ctrl+C.
+    def serveForever(self):
+        self._server.serve_forever()
+
+    def close(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    # Delay the current request according to 'latency_s' and 'bandwidth_mbps' for a body of 'size' bytes.
+    def _delay(self, size):
+        if self.bandwidthMbps > 0 and size > 0:
+            time.sleep(size * 8.0 / (self.bandwidthMbps * 1e6))
+
+    def _cacheGet(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cachePut(self, key, value):
+        size = len(value[0])
+        if size > self._cacheMaxBytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = value
+            self._cacheBytes += size
+            while self._cacheBytes > self._cacheMaxBytes:
+                old_key, old_value = self._cache.popitem(last=False)
+                self._cacheBytes -= len(old_value[0])
+
+    def _newIds(self, count):
+        with self._lock:
+            first = self._nextId
+            self._nextId += count
+        return range(first, first + count)
+
+    def _slideInfo(self):
+        slide = self.slide
+        return {'name': slide.name,
+                'slideRect': {'x': 0.0, 'y': 0.0, 'width': slide.width * slide.pxSizeUm,
+                              'height': slide.height * slide.pxSizeUm},
+                'nativeResolution': {'width': slide.pxSizeUm, 'height': slide.pxSizeUm},
+                'channels': [{'name': 'RGB', 'type': 'Brightfield', 'index': 0}]}
+
+    # Returns the pixels of the slide area (x_um, y_um, w_um, h_um) as out_w x out_h image.
+    def _region(self, x_um, y_um, w_um, h_um, out_w, out_h, px_format, channel_idx):
+        px = self.slide.pxSizeUm
+        pixels = self.slide.readRegion(x_um / px, y_um / px, (x_um + w_um) / px, (y_um + h_um) / px, out_w, out_h)
+        if channel_idx >= 0:
+            return np.ascontiguousarray(pixels[:, :, min(channel_idx, 2)])
+        if px_format == 'Gray':
+            return ((pixels.astype(np.uint16) @ np.array([77, 150, 29], dtype=np.uint16)) >> 8).astype(np.uint8)
+        if px_format == 'BGR':
+            return np.ascontiguousarray(pixels[:, :, ::-1])
+        return pixels
+
+    def _thumbnail(self, max_width, max_height):
+        slide = self.slide
+        scale = min(max_width / slide.width, max_height / slide.height)
+        out_w, out_h = max(1, int(round(slide.width * scale))), max(1, int(round(slide.height * scale)))
+        return slide.readRegion(0, 0, slide.width, slide.height, out_w, out_h)
+
+    def _queryAnnotations(self, shape_type, class_name):
+        with self._lock:
+            items = list(self.annotations.values())
+        return [a for a in items
+                if (not shape_type or a['shapeType'] == shape_type) and (not class_name or a['className'] == class_name)]
+
+    def _addAnnotations(self, items):
+        for item, new_id in zip(items, self._newIds(len(items))):
+            item['id'] = new_id
+            self._ensureClass(item.get('className', ''))
+        with self._lock:
+            for item in items:
+                self.annotations[item['id']] = item
+        return items
+
+    def _ensureClass(self, class_name):
+        if not class_name:
+            return
+        with self._lock:
+            if any(c['className'] == class_name for c in self.annotationClasses.values()):
+                return
+        self._addAnnotationClasses([{'className': class_name}])
+
+    def _addAnnotationClasses(self, items):
+        ret = []
+        for item in items:
+            anno_class = {'className': '', 'classDescription': '', 'groupName': '', 'tags': [], 'id': -1,
+                          'outlineWidth': 2, 'outlineColor': '#ff00ff00', 'fillColor': '#00000000', 'opacity': 1.0}
+            anno_class.update(item)
+            with self._lock:
+                existing = [c for c in self.annotationClasses.values() if c['className'] == anno_class['className']]
+                if existing:
+                    ret.append(existing[0])
+                    continue
+                anno_class['id'] = self._nextId
+                self._nextId += 1
+                self.annotationClasses[anno_class['id']] = anno_class
+            ret.append(anno_class)
+        return ret
+
+    # Apply JSON patch 'replace' operations to the annotation(class) 'item_id' of 'items'.
+    def _patch(self, items, item_id, operations):
+        with self._lock:
+            item = items.get(item_id)
+            if item is None:
+                return False
+            for op in operations:
+                if op.get('op') != 'replace':
+                    continue
+                key = op['path'].lstrip('/')
+                value = op['value']
+                if isinstance(item.get(key), (int, float)) and isinstance(value, str):
+                    value = type(item[key])(float(value))
+                item[key] = value
+        return True
+
+    # Apply a JSON Patch document with paths '/<id>/<field>' to a collection. All or nothing, like RFC 6902.
+    def _patchCollection(self, items, operations):
+        with self._lock:
+            by_item = collections.OrderedDict()
+            for op in operations:
+                tokens = op['path'].split('/')
+                if op.get('op') != 'replace' or len(tokens) != 3 or tokens[0] != '':
+                    raise ValueError('unsupported operation {}'.format(op))
+                item_id = int(tokens[1])
+                if item_id not in items:
+                    raise KeyError(item_id)
+                field = tokens[2].replace('~1', '/').replace('~0', '~')
+                by_item.setdefault(item_id, []).append({'op': 'replace', 'path': field, 'value': op['value']})
+        for item_id, item_operations in by_item.items():
+            self._patch(items, item_id, item_operations)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """_MockHandler Request handler of MockSlideService"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def _handle(self, method):
+        mock = self.server.mock
+        with mock._lock:
+            mock.requestCount += 1
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        if not url.path.startswith(mock._rootPath):
+            return self._send(404, b'Unknown session')
+        parts = url.path[len(mock._rootPath):].strip('/').split('/')
+        body = self._readBody()
+        if mock.latencyS > 0:
+            time.sleep(mock.latencyS)
+        mock._delay(len(body))
+        handler = getattr(self, '_{}_{}'.format(method.lower(), parts[0]), None)
+        if handler is None:
+            return self._send(404, 'Unknown endpoint {} {}'.format(method, url.path).encode('utf-8'))
+        try:
+            handler(mock, query, body, parts[1:])
+        except (KeyError, ValueError) as e:
+            self._send(400, 'Bad request: {}'.format(e).encode('utf-8'))
+
+    def _readBody(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        if self.headers.get('Content-Encoding', '') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status, body, content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        mock = self.server.mock
+        if mock.bandwidthMbps > 0:
+            chunk_size = 65536
+            for pos in range(0, len(body), chunk_size):
+                chunk = body[pos:pos + chunk_size]
+                mock._delay(len(chunk))
+                self.wfile.write(chunk)
+        else:
+            self.wfile.write(body)
+
+    def _sendJson(self, value):
+        self._send(200, json.dumps(value).encode('utf-8'), 'application/json')
+
+    # Send the pixels returned by render() uncompressed or as encoded image.
+    def _sendPixels(self, render):
+        mock = self.server.mock
+        raw = mock.rawPixels and 'application/octet-stream' in self.headers.get('Accept', '')
+        key = (self.path, raw)
+        response = mock._cacheGet(key) if mock._cacheMaxBytes > 0 else None
+        if response is None:
+            pixels = render()
+            if raw:
+                channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+                response = (pixels.tobytes(), 'application/octet-stream',
+                            {'X-Image-Width': str(pixels.shape[1]), 'X-Image-Height': str(pixels.shape[0]),
+                             'X-Image-Channels': str(channels)})
+            else:
+                buffer = BytesIO()
+                # fast PNG compression, so the mock server doesn't dominate client side measurements
+                Image.fromarray(pixels).save(buffer, mock.imageFormat, compress_level=1)
+                response = (buffer.getvalue(), 'image/' + mock.imageFormat.lower(), None)
+            if mock._cacheMaxBytes > 0:
+                mock._cachePut(key, response)
+        self._send(200, response[0], response[1], response[2])
+
+    def _get_slideinfo(self, mock, query, body, args):
+        self._sendJson(mock._slideInfo())
+
+    def _get_analysisroi(self, mock, query, body, args):
+        self._sendJson({'roi': mock._analysisRoi})
+
+    def _get_userparameters(self, mock, query, body, args):
+        self._sendJson([{'key': key, 'value': str(value)} for key, value in mock.userParameters.items()])
+
+    def _get_thumbnail(self, mock, query, body, args):
+        self._sendPixels(lambda: mock._thumbnail(int(query.get('max_width', 512)), int(query.get('max_height', 512))))
+
+    def _get_roi(self, mock, query, body, args):
+        w_um, h_um = float(query['w']), float(query['h'])
+        px_w = float(query['px_width_um'])
+        px_h = float(query.get('px_height_um', 0)) or px_w
+        self._sendPixels(lambda: mock._region(float(query['x']), float(query['y']), w_um, h_um,
+                                              max(1, int(round(w_um / px_w))), max(1, int(round(h_um / px_h))),
+                                              query.get('px_format', 'RGB'), int(query.get('channel_idx', -1))))
+
+    def _get_nativeroi(self, mock, query, body, args):
+        w_px, h_px = int(query['w']), int(query['h'])
+        px = mock.slide.pxSizeUm
+        self._sendPixels(lambda: mock._region(float(query['x']), float(query['y']), w_px * px, h_px * px, w_px, h_px,
+                                              query.get('px_format', 'RGB'), int(query.get('channel_idx', -1))))
+
+    def _get_annotation(self, mock, query, body, args):
+        self._sendJson(mock._queryAnnotations(query.get('shape_type', ''), query.get('class_name', '')))
+
+    def _post_annotation(self, mock, query, body, args):
+        self._sendJson(mock._addAnnotations(json.loads(body)))
+
+    def _patch_annotation(self, mock, query, body, args):
+        if not args:
+            if not mock.bulkPatch:
+                return self._send(405, b'Method not allowed')
+            operations = json.loads(body)
+            mock._patchCollection(mock.annotations, operations)
+            for class_name in set(op['value'] for op in operations if op['path'].endswith('/className')):
+                mock._ensureClass(class_name)
+            return self._send(200, b'')
+        if not mock._patch(mock.annotations, int(args[0]), json.loads(body)):
+            return self._send(404, b'Unknown annotation')
+        mock._ensureClass(mock.annotations[int(args[0])]['className'])
+        self._send(200, b'')
+
+    def _get_annotationclass(self, mock, query, body, args):
+        with mock._lock:
+            self._sendJson(list(mock.annotationClasses.values()))
+
+    def _post_annotationclass(self, mock, query, body, args):
+        self._sendJson(mock._addAnnotationClasses(json.loads(body)))
+
+    def _patch_annotationclass(self, mock, query, body, args):
+        if not args:
+            if not mock.bulkPatch:
+                return self._send(405, b'Method not allowed')
+            mock._patchCollection(mock.annotationClasses, json.loads(body))
+            return self._send(200, b'')
+        if not mock._patch(mock.annotationClasses, int(args[0]), json.loads(body)):
+            return self._send(404, b'Unknown annotation class')
+        self._send(200, b'')
+
+    def _post_progress(self, mock, query, body, args):
+        mock.progress.append(json.loads(body))
+        self._send(200, b'')
+
+    def _post_diagram(self, mock, query, body, args):
+        mock.diagrams.append(json.loads(body))
+        self._send(200, b'')
+
+    def _post_csv(self, mock, query, body, args):
+        mock.csv.append(json.loads(body))
+        self._send(200, b'')
+
+    def _post_resultscaption(self, mock, query, body, args):
+        mock.resultsCaptions.append(json.loads(body))
+        self._send(200, b'')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the MIKAIA SlideService.')
+    parser.add_argument('--port', type=int, default=9980, help='0 picks a free port')
+    parser.add_argument('--slide', default='', help='.npy or image file. Default: synthetic slide.')
+    parser.add_argument('--px-size-um', type=float, default=0.25)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0.0)
+    parser.add_argument('--cache-mb', type=float, default=0.0, help='cache pixel responses')
+    args = parser.parse_args()
+
+    slide = ArraySlide.fromFile(args.slide, args.px_size_um) if args.slide else SyntheticSlide(px_size_um=args.px_size_um)
+    server = MockSlideService(slide, args.latency_ms / 1000.0, args.bandwidth_mbps, cache_mb=args.cache_mb,
+                              port=args.port)
+    print('Mock SlideService listening on {}'.format(server.url), flush=True)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+
+
+if __name__ == '__main__':
+    main()
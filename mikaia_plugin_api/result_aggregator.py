@@ -0,0 +1,263 @@
+import threading
+import time
+
+import numpy as np
+
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+
+# default histogram bin edges: area in um^2 and size(equivalent circle diameter) in um, typical for cells and nuclei
+DEFAULT_AREA_BINS = [10, 25, 50, 100, 200, 400, 800, 1600, 5000]
+DEFAULT_SIZE_BINS = [2, 4, 6, 8, 10, 12, 15, 20, 30, 50]
+
+
+#################################################
+## Running per-class statistics of the results ##
+#################################################
+class ResultAggregator(object):
+    """ResultAggregator Per-class statistics of the annotations of a run, updated batch by batch.
+
+    Every batch of annotations passed to add() updates, per annotation class:
+        count, total area   number of annotations and the sum of their areas(um^2)
+        area histogram      annotations per area bin(um^2)
+        size histogram      annotations per size bin(equivalent circle diameter in um)
+        value histogram     optional, values passed to addValues(), e.g. the mean intensity or the model
+                            probability of every annotation
+    The areas are computed for a whole batch at once(AnnotationBatch.areas()) and only the histogram
+    counts are kept, so the memory doesn't grow with the number of annotations or tiles.
+    The statistics are sent to MIKAIA as CSV table(setCsv()) every 'interval_s' seconds while the run is
+    going on. finish() sends the final table and the result diagrams(addResultDiagram()): every diagram
+    sent is added to the results, so partial results only replace the table.
+
+    BatchRunner and ShardCoordinator feed an aggregator passed as 'aggregator' with the uploaded
+    annotations and call finish() at the end of the run.
+
+    Usage:
+        aggregator = ResultAggregator(ss, value_bins=np.linspace(0, 255, 18), value_name='Mean intensity')
+        runner = BatchRunner(ss, model, postprocess=toAnnotations, ..., aggregator=aggregator)
+        runner.run(tiles)
+        print(aggregator.summary())
+    """
+
+    # slide_service: SlideService instance the diagrams and the CSV table are sent to.
+    # title: prefix of the diagram titles.
+    # area_bins, size_bins, value_bins: ascending histogram bin edges. Values below the first or above the last
+    #                                   edge are counted in an extra bin at either end. value_bins=None: no value
+    #                                   histogram.
+    # value_name, value_unit: name and unit of the values passed to addValues().
+    # interval_s: minimum time between two partial results(CSV table only), 0 to send only the final result.
+    def __init__(self, slide_service, title='Results', area_bins=DEFAULT_AREA_BINS, size_bins=DEFAULT_SIZE_BINS,
+                 value_bins=None, value_name='Value', value_unit='', interval_s=30.0):
+        self._ss = slide_service
+        self._title = title
+        self._areaBins = np.asarray(area_bins, dtype=np.float64)
+        self._sizeBins = np.asarray(size_bins, dtype=np.float64)
+        self._valueBins = np.asarray(value_bins, dtype=np.float64) if value_bins is not None else None
+        self._valueName = value_name
+        self._valueUnit = value_unit
+        self._intervalS = interval_s
+        self._lock = threading.Lock()
+        self._classNames = []
+        self._classIndex = {}  # class name -> row of the statistics arrays
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._areas = np.zeros(0, dtype=np.float64)
+        self._areaHistogram = np.zeros((0, len(self._areaBins) + 1), dtype=np.int64)
+        self._sizeHistogram = np.zeros((0, len(self._sizeBins) + 1), dtype=np.int64)
+        self._valueHistogram = np.zeros((0, len(self._valueBins) + 1 if self._valueBins is not None else 0),
+                                        dtype=np.int64)
+        self._valueSums = np.zeros(0, dtype=np.float64)
+        self._valueCounts = np.zeros(0, dtype=np.int64)
+        self._tiles = 0
+        self._published = 0
+        self._lastPublish = time.monotonic()
+
+    def __str__(self):
+        return '{}(title={}, classes={}, annotations={}, tiles={})'.format(
+            self.__class__.__name__, self._title, len(self._classNames), int(self._counts.sum()), self._tiles)
+
+    # Add the annotations of a batch to the statistics. Sends a partial result if 'interval_s' has passed.
+    # annotations: AnnotationBatch, list of Annotation items or None.
+    # tiles: number of tiles the annotations belong to(only counted).
+    def add(self, annotations, tiles=0):
+        if isinstance(annotations, AnnotationBatch):
+            class_indices = self._mapClasses(annotations.classNames)[annotations.classIndices] \
+                if len(annotations) > 0 else np.zeros(0, dtype=np.int64)
+            areas = annotations.areas()
+        elif annotations:
+            class_indices = self._mapClasses([anno.className for anno in annotations])
+            areas = np.array([anno.area() for anno in annotations], dtype=np.float64)
+        else:
+            class_indices = np.zeros(0, dtype=np.int64)
+            areas = np.zeros(0, dtype=np.float64)
+        sizes = np.sqrt(4.0 * areas / np.pi)
+        with self._lock:
+            class_count = len(self._classNames)
+            self._counts += np.bincount(class_indices, minlength=class_count)
+            self._areas += np.bincount(class_indices, weights=areas, minlength=class_count)
+            self._areaHistogram += self._histogram(class_indices, areas, self._areaBins, class_count)
+            self._sizeHistogram += self._histogram(class_indices, sizes, self._sizeBins, class_count)
+            self._tiles += tiles
+        self._publishIfDue()
+
+    # Add values(e.g. the mean intensity of every annotation) to the value histogram.
+    # values: one value per annotation.
+    # class_names: annotation class of all values, or one class name per value.
+    def addValues(self, values, class_names):
+        if self._valueBins is None:
+            raise Exception("The aggregator has no value histogram, create it with 'value_bins'.")
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if isinstance(class_names, str):
+            class_indices = np.full(len(values), self._mapClasses([class_names])[0], dtype=np.int64)
+        else:
+            class_indices = self._mapClasses(list(class_names))
+        with self._lock:
+            class_count = len(self._classNames)
+            self._valueHistogram += self._histogram(class_indices, values, self._valueBins, class_count)
+            self._valueSums += np.bincount(class_indices, weights=values, minlength=class_count)
+            self._valueCounts += np.bincount(class_indices, minlength=class_count)
+        self._publishIfDue()
+
+    # Send the final result.
+    def finish(self):
+        self.publish(final=True)
+
+    # Send the current statistics as CSV table and, if 'final', as result diagrams.
+    # final: False for a partial result. MIKAIA adds every diagram to the results instead of replacing it, so only
+    #        the final result is sent as diagrams.
+    def publish(self, final=False):
+        with self._lock:
+            self._lastPublish = time.monotonic()
+            stats = self._stats()
+        self._ss.setCsv(self.table(stats))
+        with self._lock:
+            self._published += 1
+        if not final:
+            return
+        anno_classes = {anno_class.className: anno_class for anno_class in self._ss.getAnnotationClasses()}
+        subtitle = '{} annotations in {} tiles'.format(sum(item['count'] for item in stats['classes'].values()),
+                                                       stats['tiles'])
+        class_names = list(stats['classes'])
+
+        def series(values_of, unit):
+            ret = []
+            for class_name in class_names:
+                anno_class = anno_classes.get(class_name)
+                color = (anno_class.fillColor or anno_class.outlineColor) if anno_class is not None else ''
+                class_id = str(anno_class.id) if anno_class is not None else ''
+                ret.append(self._ss.createDiagramDataSeries(class_name, color, class_id,
+                                                            values_of(stats['classes'][class_name]), unit))
+            return ret
+
+        self._ss.addResultDiagram(self._title + ': annotations per class', subtitle,
+                                  series(lambda item: [item['count']], 'annotations'), ['Annotations'])
+        self._ss.addResultDiagram(self._title + ': area', subtitle,
+                                  series(lambda item: item['area_histogram'], 'annotations'),
+                                  self._binNames(self._areaBins, 'um²'))
+        self._ss.addResultDiagram(self._title + ': size', subtitle,
+                                  series(lambda item: item['size_histogram'], 'annotations'),
+                                  self._binNames(self._sizeBins, 'um'))
+        if self._valueBins is not None:
+            self._ss.addResultDiagram('{}: {}'.format(self._title, self._valueName), subtitle,
+                                      series(lambda item: item['value_histogram'], 'annotations'),
+                                      self._binNames(self._valueBins, self._valueUnit))
+
+    # Returns the statistics as CSV table(list of rows of strings): one row per annotation class with count, total
+    # and mean area(and the mean value), followed by the histograms.
+    # stats: result of stats(). Default: the current statistics.
+    def table(self, stats=None):
+        stats = stats if stats is not None else self.stats()
+        header = ['Class', 'Count', 'Total area [um²]', 'Mean area [um²]']
+        if self._valueBins is not None:
+            header.append('Mean {}{}'.format(self._valueName.lower(), ' [{}]'.format(self._valueUnit)
+                                             if self._valueUnit else ''))
+        rows = [header]
+        for class_name, item in stats['classes'].items():
+            row = [class_name, str(item['count']), '{:.2f}'.format(item['area_um2']),
+                   '{:.2f}'.format(item['mean_area_um2'])]
+            if self._valueBins is not None:
+                row.append('{:.4g}'.format(item['mean_value']) if item['values'] > 0 else '')
+            rows.append(row)
+        histograms = [('Area [um²]', 'area_histogram', self._areaBins, 'um²'),
+                      ('Size [um]', 'size_histogram', self._sizeBins, 'um')]
+        if self._valueBins is not None:
+            histograms.append((self._valueName, 'value_histogram', self._valueBins, self._valueUnit))
+        for name, key, bins, unit in histograms:
+            rows.append([])
+            rows.append([name] + self._binNames(bins, unit))
+            for class_name, item in stats['classes'].items():
+                rows.append([class_name] + [str(count) for count in item[key]])
+        return rows
+
+    # Statistics per class: count, area_um2, mean_area_um2, area_histogram, size_histogram and, with a value
+    # histogram, value_histogram, values and mean_value. Plus the number of 'tiles' and of 'published' results.
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    # One-line summary of stats().
+    def summary(self):
+        stats = self.stats()
+        parts = ['{} {}({:.1f} um² mean area)'.format(class_name, item['count'], item['mean_area_um2'])
+                 for class_name, item in stats['classes'].items()]
+        return '{} annotations in {} tiles, {} results sent | {}'.format(
+            sum(item['count'] for item in stats['classes'].values()), stats['tiles'], stats['published'],
+            ' | '.join(parts))
+
+    def _stats(self):
+        classes = {}
+        for index, class_name in enumerate(self._classNames):
+            count = int(self._counts[index])
+            item = {'count': count, 'area_um2': float(self._areas[index]),
+                    'mean_area_um2': float(self._areas[index]) / count if count > 0 else 0.0,
+                    'area_histogram': self._areaHistogram[index].tolist(),
+                    'size_histogram': self._sizeHistogram[index].tolist()}
+            if self._valueBins is not None:
+                values = int(self._valueCounts[index])
+                item.update({'value_histogram': self._valueHistogram[index].tolist(), 'values': values,
+                             'mean_value': float(self._valueSums[index]) / values if values > 0 else 0.0})
+            classes[class_name] = item
+        return {'classes': classes, 'tiles': self._tiles, 'published': self._published}
+
+    def _publishIfDue(self):
+        if self._intervalS <= 0:
+            return
+        with self._lock:
+            if time.monotonic() - self._lastPublish < self._intervalS:
+                return
+            # claims this publish, concurrent callers return
+            self._lastPublish = time.monotonic()
+        self.publish(final=False)
+
+    # Returns the statistics row of every class name, new classes get new rows.
+    def _mapClasses(self, class_names):
+        with self._lock:
+            unique_names = list(dict.fromkeys(class_names))
+            new_names = [class_name for class_name in unique_names if class_name not in self._classIndex]
+            for class_name in new_names:
+                self._classIndex[class_name] = len(self._classNames)
+                self._classNames.append(class_name)
+            if new_names:
+                grow = len(new_names)
+                self._counts = np.concatenate([self._counts, np.zeros(grow, dtype=np.int64)])
+                self._areas = np.concatenate([self._areas, np.zeros(grow)])
+                self._valueSums = np.concatenate([self._valueSums, np.zeros(grow)])
+                self._valueCounts = np.concatenate([self._valueCounts, np.zeros(grow, dtype=np.int64)])
+                for name in ('_areaHistogram', '_sizeHistogram', '_valueHistogram'):
+                    histogram = getattr(self, name)
+                    setattr(self, name, np.concatenate([histogram, np.zeros((grow, histogram.shape[1]),
+                                                                            dtype=np.int64)]))
+            return np.array([self._classIndex[class_name] for class_name in class_names], dtype=np.int64)
+
+    # (classes, bins + 1) counts of the values per class and bin, for all values at once
+    @staticmethod
+    def _histogram(class_indices, values, bins, class_count):
+        bin_count = len(bins) + 1
+        flat = class_indices * bin_count + np.searchsorted(bins, values, side='right')
+        return np.bincount(flat, minlength=class_count * bin_count).reshape(class_count, bin_count)
+
+    @staticmethod
+    def _binNames(bins, unit):
+        suffix = ' ' + unit if unit else ''
+        names = ['< {:g}{}'.format(bins[0], suffix)]
+        names += ['{:g} - {:g}{}'.format(low, high, suffix) for low, high in zip(bins[:-1], bins[1:])]
+        names.append('>= {:g}{}'.format(bins[-1], suffix))
+        return names
@@ -0,0 +1,255 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+
+# Returns the Otsu threshold of a uint8 image(the value that best separates its histogram into two classes).
+def otsuThreshold(values):
+    histogram = np.bincount(np.asarray(values, dtype=np.uint8).reshape(-1), minlength=256).astype(np.float64)
+    total = histogram.sum()
+    if total == 0:
+        return 0
+    levels = np.arange(256, dtype=np.float64)
+    weight_low = np.cumsum(histogram)
+    weight_high = total - weight_low
+    sum_low = np.cumsum(histogram * levels)
+    mean_low = sum_low / np.maximum(weight_low, 1)
+    mean_high = (sum_low[-1] - sum_low) / np.maximum(weight_high, 1)
+    between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return int(np.argmax(between))
+
+
+# Returns a boolean tissue mask of the same size as 'thumbnail'(PIL image or RGB ndarray).
+# Tissue is separated from glass and the dark area outside the scan by an Otsu threshold on the color saturation.
+# min_saturation: lower limit of the threshold(0..255), keeps slides without tissue from being split by noise.
+# Gray or single channel thumbnails have no saturation and raise an exception(use RoiTiler(tissue=False) for them).
+def tissueMask(thumbnail, min_saturation=20):
+    if isinstance(thumbnail, Image.Image):
+        thumbnail = thumbnail.convert('RGB')
+    rgb = np.asarray(thumbnail, dtype=np.int32)
+    if rgb.ndim != 3 or rgb.shape[2] < 3:
+        raise Exception('The tissue mask needs a color thumbnail, use tissue=False for gray or single channel slides.')
+    max_value = rgb.max(axis=2)
+    min_value = rgb.min(axis=2)
+    if np.array_equal(max_value, min_value):
+        raise Exception('The thumbnail is gray, use tissue=False for gray or single channel slides.')
+    saturation = ((max_value - min_value) * 255 // np.maximum(max_value, 1)).astype(np.uint8)
+    return saturation > max(otsuThreshold(saturation), min_saturation)
+
+
+####################################################
+## ROI tiler with tissue-mask background skipping ##
+####################################################
+class RoiTiler(object):
+    """RoiTiler Splits the analysis ROIs into tiles, skipping tiles that lie outside the ROI shapes or on glass.
+
+    The ROI shapes(including holes of 'PathWithHoles' annotations) are rasterized at low resolution on a grid
+    that covers their union and intersected with a tissue mask computed from the slide thumbnail.
+    Only tiles whose covered fraction reaches 'min_coverage' are kept.
+    Tile coordinates use the same format as the tile lists of the examples:
+    [[x0_um, y0_um], [x1_um, y1_um]] (top left and bottom right corner in um).
+
+    Usage:
+        tiler = RoiTiler(ss, 224 * res.width, 224 * res.height)
+        for tile, img in ss.iterTiles(tiler.tiles(), ...):
+            ...
+    """
+
+    # slide_service: SlideService instance.
+    # tile_w_um, tile_h_um: tile size in um. tile_h_um defaults to tile_w_um.
+    # stride_w_um, stride_h_um: distance between neighbouring tiles in um. Default: tile size(no overlap).
+    # rois: list of Annotation or RectF instances or an AnalysisRoi. Default: SlideService.getAnalysisRoi().
+    #       The whole slide is tiled if there are no ROIs.
+    # min_coverage: minimum fraction(0..1) of a tile that has to lie inside the ROIs(and the tissue).
+    # tissue: True to compute the tissue mask from the slide thumbnail, False to tile the ROIs only, or a
+    #         boolean ndarray that covers the slide area(e.g. the result of tissueMask()).
+    # thumbnail_px: maximum thumbnail size used for the tissue mask.
+    # samples: number of mask samples per stride and dimension used to estimate the coverage.
+    # max_mask_mb: memory limit of the rasterized mask. 'samples' is reduced for large ROIs.
+    # slide_info: SlideInfo of the slide. Fetched if not provided.
+    def __init__(self, slide_service, tile_w_um, tile_h_um=0, stride_w_um=0, stride_h_um=0, rois=None,
+                 min_coverage=0.5, tissue=True, thumbnail_px=2048, samples=8, max_mask_mb=64, slide_info=None):
+        self._tileW = float(tile_w_um)
+        self._tileH = float(tile_h_um) if tile_h_um > 0 else self._tileW
+        self._strideX = float(stride_w_um) if stride_w_um > 0 else self._tileW
+        self._strideY = float(stride_h_um) if stride_h_um > 0 else self._tileH
+        if min(self._tileW, self._tileH, self._strideX, self._strideY) <= 0:
+            raise Exception("Tile size and stride shall be positive.")
+
+        if slide_info is None:
+            slide_info = slide_service.getSlideInfo()
+        slide_rect = slide_info.slideRect
+        if rois is None:
+            analysis_roi = slide_service.getAnalysisRoi()
+            rois = analysis_roi.roi if analysis_roi is not None else []
+        elif hasattr(rois, 'roi'):
+            rois = rois.roi
+        elif not isinstance(rois, (list, tuple)):
+            rois = [rois]
+        self._rois = list(rois) if len(rois) > 0 else [slide_rect]
+
+        # tile grid over the union of the ROI bounding rectangles
+        rects = [self._boundingRect(roi) for roi in self._rois]
+        self._x0 = min(rect.x for rect in rects)
+        self._y0 = min(rect.y for rect in rects)
+        width = max(rect.x + rect.width for rect in rects) - self._x0
+        height = max(rect.y + rect.height for rect in rects) - self._y0
+        self._cols = self._tileCount(width, self._tileW, self._strideX)
+        self._rows = self._tileCount(height, self._tileH, self._strideY)
+
+        # mask lattice: 'samples' points per stride, a tile spans 'span' points
+        max_points = max_mask_mb * 1024 * 1024 / 8  # mask, integral image and temporary buffers
+        fitting = int(math.sqrt(max_points / (self._rows * self._cols)))
+        self._samples = max(1, min(int(samples), fitting))
+        self._pitchX = self._strideX / self._samples
+        self._pitchY = self._strideY / self._samples
+        span_x = max(1, int(round(self._tileW / self._pitchX)))
+        span_y = max(1, int(round(self._tileH / self._pitchY)))
+        lattice_w = (self._cols - 1) * self._samples + span_x
+        lattice_h = (self._rows - 1) * self._samples + span_y
+
+        mask = np.zeros((lattice_h, lattice_w), dtype=bool)
+        for roi in self._rois:
+            self._rasterize(roi, mask)
+        if tissue is not False and tissue is not None:
+            if tissue is True:
+                tissue = tissueMask(slide_service.getThumbnail(thumbnail_px, thumbnail_px))
+            mask &= self._sampleTissue(np.asarray(tissue, dtype=bool), slide_rect, lattice_w, lattice_h)
+
+        # covered fraction of every tile from the integral image of the mask
+        integral = np.zeros((lattice_h + 1, lattice_w + 1), dtype=np.int64)
+        np.cumsum(np.cumsum(mask, axis=0), axis=1, out=integral[1:, 1:])
+        y0 = np.arange(self._rows) * self._samples
+        x0 = np.arange(self._cols) * self._samples
+        y1, x1 = y0 + span_y, x0 + span_x
+        counts = (integral[y1[:, None], x1[None, :]] - integral[y0[:, None], x1[None, :]]
+                  - integral[y1[:, None], x0[None, :]] + integral[y0[:, None], x0[None, :]])
+        self._coverage = counts / float(span_x * span_y)
+        self._coverage.flags.writeable = False
+
+        rows, cols = np.nonzero(self._coverage >= min_coverage - 1e-9)
+        self._selected = list(zip(rows.tolist(), cols.tolist()))
+
+    def __len__(self):
+        return len(self._selected)
+
+    def __str__(self):
+        return '{}(tiles={}, grid={}x{}, samples={})'.format(
+            self.__class__.__name__, len(self), self._cols, self._rows, self._samples)
+
+    # Yields tuples (tile, coverage) of the selected tiles in row-major order.
+    def __iter__(self):
+        for row, col in self._selected:
+            yield self._tile(row, col), float(self._coverage[row, col])
+
+    # Returns the coordinates of the selected tiles [[x0_um, y0_um], [x1_um, y1_um]] in row-major order.
+    def tiles(self):
+        return [self._tile(row, col) for row, col in self._selected]
+
+    # Returns the covered fractions of the selected tiles(in the order of tiles()).
+    def coverages(self):
+        return [float(self._coverage[row, col]) for row, col in self._selected]
+
+    # Returns the grid positions (row, col) of the selected tiles(in the order of tiles()).
+    def gridIndices(self):
+        return list(self._selected)
+
+    # Returns the covered fraction of every tile of the grid as read-only ndarray of shape (rows, cols).
+    def coverageMap(self):
+        return self._coverage
+
+    # Returns the number of tiles of the full grid over the ROI bounding rectangles(selected or not).
+    def gridTileCount(self):
+        return self._rows * self._cols
+
+    def _tile(self, row, col):
+        x_um = self._x0 + col * self._strideX
+        y_um = self._y0 + row * self._strideY
+        return [[x_um, y_um], [x_um + self._tileW, y_um + self._tileH]]
+
+    # draw the shape into the mask lattice(lattice point (i, j) is the center of cell (i, j))
+    def _rasterize(self, roi, mask):
+        if not hasattr(roi, 'pointArrays'):  # RectF
+            shape_type = 'Rectangle'
+            rect = roi
+        else:
+            shape_type = roi.shapeType
+            if shape_type not in ('Rectangle', 'Ellipse', 'Mask', 'Polygon', 'PathWithHoles'):
+                return  # 'Point' and 'Line' have no area
+            rect = roi.boundingRect()
+
+        # only the part of the lattice covered by the bounding rectangle is touched
+        left = max(0, int(math.floor((rect.x - self._x0) / self._pitchX)))
+        top = max(0, int(math.floor((rect.y - self._y0) / self._pitchY)))
+        right = min(mask.shape[1], int(math.ceil((rect.x + rect.width - self._x0) / self._pitchX)) + 1)
+        bottom = min(mask.shape[0], int(math.ceil((rect.y + rect.height - self._y0) / self._pitchY)) + 1)
+        if right <= left or bottom <= top:
+            return
+        x_um = self._x0 + (np.arange(left, right) + 0.5) * self._pitchX
+        y_um = self._y0 + (np.arange(top, bottom) + 0.5) * self._pitchY
+
+        if shape_type in ('Rectangle', 'Mask'):
+            inside_x = (x_um >= rect.x) & (x_um < rect.x + rect.width)
+            inside_y = (y_um >= rect.y) & (y_um < rect.y + rect.height)
+            shape_mask = inside_y[:, None] & inside_x[None, :]
+        elif shape_type == 'Ellipse':
+            if rect.width <= 0 or rect.height <= 0:
+                return
+            dx = (x_um - (rect.x + rect.width / 2.0)) / (rect.width / 2.0)
+            dy = (y_um - (rect.y + rect.height / 2.0)) / (rect.height / 2.0)
+            shape_mask = dy[:, None] ** 2 + dx[None, :] ** 2 <= 1.0
+        else:
+            contours = [np.column_stack(((points[:, 0] - self._x0) / self._pitchX - 0.5 - left,
+                                         (points[:, 1] - self._y0) / self._pitchY - 0.5 - top))
+                        for points in roi.pointArrays()]
+            shape_mask = self._fillEvenOdd(contours, bottom - top, right - left)
+        mask[top:bottom, left:right] |= shape_mask
+
+    # Scanline fill of the contours with the even-odd rule(holes are removed), same rule as
+    # Annotation.containsPoints(). The contours are given in lattice coordinates.
+    @staticmethod
+    def _fillEvenOdd(contours, height, width):
+        # every crossing of a row with an edge toggles all points right of the crossing
+        toggles = np.zeros((height, width + 1), dtype=np.uint8)
+        for points in contours:
+            if len(points) < 3:
+                continue
+            x0, y0 = points[:, 0], points[:, 1]
+            x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+            first = np.clip(np.ceil(np.minimum(y0, y1)), 0, height).astype(np.int64)
+            end = np.clip(np.ceil(np.maximum(y0, y1)), 0, height).astype(np.int64)
+            counts = end - first
+            edges = np.repeat(np.arange(len(points)), counts)
+            if len(edges) == 0:
+                continue
+            rows = first[edges] + np.arange(len(edges)) - np.repeat(np.cumsum(counts) - counts, counts)
+            x_cross = x0[edges] + (rows - y0[edges]) * (x1 - x0)[edges] / (y1 - y0)[edges]
+            cols = np.clip(np.floor(x_cross) + 1, 0, width).astype(np.int64)
+            np.add.at(toggles, (rows, cols), 1)
+        return (np.cumsum(toggles, axis=1)[:, :width] & 1).astype(bool)
+
+    # sample the tissue mask(covering the slide area) at the lattice points
+    def _sampleTissue(self, tissue, slide_rect, lattice_w, lattice_h):
+        height, width = tissue.shape[:2]
+        if slide_rect.width <= 0 or slide_rect.height <= 0 or width == 0 or height == 0:
+            return np.ones((lattice_h, lattice_w), dtype=bool)
+        x_um = self._x0 + (np.arange(lattice_w) + 0.5) * self._pitchX
+        y_um = self._y0 + (np.arange(lattice_h) + 0.5) * self._pitchY
+        cols = np.floor((x_um - slide_rect.x) * width / slide_rect.width).astype(np.int64)
+        rows = np.floor((y_um - slide_rect.y) * height / slide_rect.height).astype(np.int64)
+        inside_x = (cols >= 0) & (cols < width)
+        inside_y = (rows >= 0) & (rows < height)
+        sampled = tissue[np.clip(rows, 0, height - 1)[:, None], np.clip(cols, 0, width - 1)[None, :]]
+        return sampled & inside_y[:, None] & inside_x[None, :]
+
+    @staticmethod
+    def _boundingRect(roi):
+        return roi.boundingRect() if hasattr(roi, 'boundingRect') else roi
+
+    # number of tiles needed to cover 'length'
+    @staticmethod
+    def _tileCount(length, tile, stride):
+        if length <= tile:
+            return 1
+        return int(math.ceil((length - tile) / stride - 1e-9)) + 1
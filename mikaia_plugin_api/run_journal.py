@@ -0,0 +1,292 @@
+import copy
+import hashlib
+import json
+import os
+import sys
+import threading
+
+# states of the tiles of a run, in order
+FETCHED = 'fetched'
+INFERRED = 'inferred'
+UPLOADED = 'uploaded'
+
+# the journal is rewritten when it is opened if more than this share of it are results that were uploaded already
+_COMPACT_RATIO = 0.5
+
+
+# Default directory of the run journals: ~/.mikaia_plugin/journals
+def defaultJournalDirectory():
+    return os.path.join(os.path.expanduser('~'), '.mikaia_plugin', 'journals')
+
+
+###########################################
+## Journal of the tile progress of a run ##
+###########################################
+class RunJournal(object):
+    """RunJournal Append-only local journal of an analysis run, so an interrupted run can be resumed.
+
+    Every line of the journal file is a JSON record that tells which tiles were fetched, inferred or
+    uploaded. The results of inferred tiles(the annotations to upload) are written to the journal before
+    they are uploaded, the ids returned by the server once they were uploaded. When a run is started again
+    for the same slide, script and parameters, completed tiles are skipped and results that were never
+    acknowledged by the server are uploaded without running the model again.
+    A crash while a record is written leaves an incomplete last line, which is ignored.
+
+    Usage:
+        with RunJournal.forRun(ss, params={'tile_px': 224, 'model': 'effnet_b0'}) as journal:
+            journal.resumeUploads(ss)
+            tiles = journal.remaining(tiles)
+            print(journal.summary())
+            for batch_tiles, results in ...:
+                journal.upload(ss, batch_tiles, annotations)
+
+    Note: results whose upload succeeded right before a crash, but wasn't recorded any more, are uploaded again.
+    """
+
+    # path: journal file. Created if it doesn't exist, otherwise the recorded progress is loaded.
+    # header: optional dict that describes the run, written as first record of a new journal.
+    # durable: if True every record is synced to disk(os.fsync), so it survives a crash of the whole system.
+    def __init__(self, path, header=None, durable=False):
+        self._path = os.path.abspath(path)
+        self._durable = durable
+        self._lock = threading.Lock()
+        self._fetched = set()
+        self._uploaded = set()  # keys of uploaded tiles
+        self._pending = {}  # record number -> inferred record that wasn't uploaded yet
+        self._nextRecord = 0
+        self._stats = {'completed': 0, 'pending': 0, 'fetched': 0, 'skipped': 0, 'remaining': 0, 'reuploaded': 0}
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        exists = os.path.exists(self._path) and os.path.getsize(self._path) > 0
+        if exists:
+            self._load()
+        self._stats['completed'] = len(self._uploaded)
+        self._stats['pending'] = sum(len(record['tiles']) for record in self._pending.values())
+        self._stats['fetched'] = len(self._fetched - self._uploaded)
+        self._file = open(self._path, 'ab')
+        if exists and not self._endsWithNewline():
+            # terminate the incomplete record of a crashed run, so the next records start on a line of their own
+            self._file.write(b'\n')
+        if not exists and header is not None:
+            self._write(dict(header, s='run'))
+
+    # Open the journal of a run. The journal file is named after the slide identity, the script and the parameters,
+    # so the same run on the same slide continues where it stopped, while any change of them starts a new journal.
+    # slide_service: SlideService instance of the slide.
+    # params: dict of everything that changes the results, e.g. tile size, stride, resolution, model version.
+    # script: name of the script. Default: file name of the running script.
+    # directory: directory of the journal files. Default: defaultJournalDirectory().
+    @classmethod
+    def forRun(cls, slide_service, params=None, script=None, directory=None, durable=False):
+        if script is None:
+            script = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'interactive'
+        slide = slide_service.slideIdentity()
+        if slide is None:
+            raise Exception('The slide identity could not be read from the SlideService.')
+        header = {'slide': slide, 'script': script, 'params': params or {}}
+        run_key = hashlib.sha1(json.dumps(header, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:20]
+        name = '{}-{}.jsonl'.format(os.path.splitext(script)[0] or 'run', run_key)
+        return cls(os.path.join(directory or defaultJournalDirectory(), name), header, durable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self):
+        return '{}(path={}, uploaded tiles={}, pending uploads={})'.format(
+            self.__class__.__name__, self._path, len(self._uploaded), len(self._pending))
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    # Returns the key of a tile [[x0_um, y0_um], [x1_um, y1_um]] in the journal.
+    @staticmethod
+    def tileKey(tile):
+        (x0, y0), (x1, y1) = tile
+        return '{!r},{!r},{!r},{!r}'.format(float(x0), float(y0), float(x1), float(y1))
+
+    # Returns True if the results of the tile were uploaded.
+    def isDone(self, tile):
+        return self.tileKey(tile) in self._uploaded
+
+    # Returns the tiles that still have to be processed: all but the uploaded tiles and the tiles with
+    # pending results(see resumeUploads()).
+    def remaining(self, tiles):
+        with self._lock:
+            pending = set(key for record in self._pending.values() for key in record['tiles'])
+            ret = [tile for tile in tiles if self.tileKey(tile) not in self._uploaded and self.tileKey(tile) not in pending]
+            self._stats['skipped'] += len(tiles) - len(ret)
+            self._stats['remaining'] += len(ret)
+        return ret
+
+    # Record that the tiles were fetched.
+    def markFetched(self, tiles):
+        keys = [self.tileKey(tile) for tile in tiles]
+        with self._lock:
+            self._fetched.update(keys)
+            self._write({'s': FETCHED, 'tiles': keys})
+
+    # Record the results of the tiles before they are uploaded.
+    # annotations: list of Annotation instances, AnnotationBatch or None if there is nothing to upload.
+    # Returns the record number to pass to markUploaded().
+    def markInferred(self, tiles, annotations):
+        from mikaia_plugin_api.annotation_batch import AnnotationBatch
+        from mikaia_plugin_api.mikaia_api import Annotation
+        keys = [self.tileKey(tile) for tile in tiles]
+        if isinstance(annotations, AnnotationBatch):
+            kind, document = 'batch', annotations.toJson().decode('utf-8')
+        elif annotations:
+            kind, document = 'list', Annotation.list_to_json([self._encodeMasks(anno) for anno in annotations])
+        else:
+            kind, document = 'none', '[]'
+        with self._lock:
+            number = self._nextRecord
+            self._nextRecord += 1
+            record = {'s': INFERRED, 'n': number, 'tiles': keys, 'kind': kind, 'annotations': document}
+            self._pending[number] = record
+            self._write(record)
+        return number
+
+    # Record that the results of record 'number'(see markInferred()) were uploaded.
+    # ids: MIKAIA-IDs of the uploaded annotations.
+    def markUploaded(self, number, ids=()):
+        with self._lock:
+            record = self._pending.pop(number)
+            self._uploaded.update(record['tiles'])
+            self._write({'s': UPLOADED, 'n': number, 'tiles': record['tiles'], 'ids': [int(i) for i in ids]})
+
+    # Record the results of the tiles, upload them and record the returned ids.
+    # annotations: list of Annotation instances, AnnotationBatch or None.
+    # Returns False if the upload failed(the results stay pending and are uploaded by resumeUploads() of a rerun).
+    def upload(self, slide_service, tiles, annotations):
+        number = self.markInferred(tiles, annotations)
+        return self.uploadInferred(slide_service, number, annotations)
+
+    # Upload the results that were recorded, but never acknowledged by the server(e.g. because the previous run
+    # crashed). Returns the number of tiles whose results were uploaded.
+    def resumeUploads(self, slide_service):
+        from mikaia_plugin_api.annotation_batch import AnnotationBatch
+        from mikaia_plugin_api.mask_codec import isEncoded
+        from mikaia_plugin_api.mikaia_api import Annotation
+        with self._lock:
+            pending = list(self._pending.values())
+        count = 0
+        for record in pending:
+            annotations = Annotation.from_json(record['annotations']) if record['kind'] != 'none' else None
+            if record['kind'] == 'batch':
+                annotations = AnnotationBatch.fromAnnotations(annotations)
+            elif annotations:
+                # masks are encoded again by addAnnotations(), as configured for the SlideService
+                for anno in annotations:
+                    anno.mask = anno.maskArray() if isEncoded(anno.mask) else anno.mask
+                    anno.labelMap = anno.labelMapArray() if isEncoded(anno.labelMap) else anno.labelMap
+            if self.uploadInferred(slide_service, record['n'], annotations):
+                count += len(record['tiles'])
+        with self._lock:
+            self._stats['reuploaded'] += count
+        return count
+
+    # Statistics of the journal: tiles 'completed' and with 'pending' uploads when it was opened,
+    # tiles 'fetched' but not completed by the previous runs, tiles 'skipped' and 'remaining'(see remaining())
+    # and tiles 'reuploaded' by resumeUploads().
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    # One-line summary of the work saved by resuming the run.
+    def summary(self):
+        stats = self.stats()
+        if stats['completed'] == 0 and stats['pending'] == 0:
+            return 'New run: {} tiles to process'.format(stats['remaining'])
+        total = stats['skipped'] + stats['remaining']
+        return 'Resumed run: {} of {} tiles already done({} re-uploaded without inference), {} tiles to process'.format(
+            stats['skipped'], total, stats['reuploaded'], stats['remaining'])
+
+    # Upload the results of record 'number'(see markInferred()) and record the returned ids.
+    # Returns False if the upload failed.
+    def uploadInferred(self, slide_service, number, annotations):
+        from mikaia_plugin_api.annotation_batch import AnnotationBatch
+        if isinstance(annotations, AnnotationBatch):
+            if len(annotations) > 0 and slide_service.addAnnotationBatch(annotations) is None:
+                return False
+            ids = annotations.ids.tolist()
+        elif annotations:
+            annotations = list(annotations)
+            if slide_service.addAnnotations(annotations) is None:
+                return False
+            ids = [anno.id for anno in annotations if anno.id is not None]
+        else:
+            ids = []
+        self.markUploaded(number, ids)
+        return True
+
+    # Returns the annotation with numpy mask and label map arrays encoded(see mask_codec), so it can be serialized.
+    # The annotation itself is left unchanged.
+    @staticmethod
+    def _encodeMasks(anno):
+        from mikaia_plugin_api.mask_codec import encodeArray
+        arrays = [name for name in ('mask', 'labelMap') if hasattr(getattr(anno, name), '__array_interface__')]
+        if not arrays:
+            return anno
+        anno = copy.copy(anno)
+        for name in arrays:
+            setattr(anno, name, encodeArray(getattr(anno, name)))
+        return anno
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+        self._file.flush()
+        if self._durable:
+            os.fsync(self._file.fileno())
+
+    def _endsWithNewline(self):
+        with open(self._path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _load(self):
+        records = []
+        with open(self._path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # incomplete record of a crashed run
+        uploaded_numbers = set(record['n'] for record in records if record.get('s') == UPLOADED)
+        dead_bytes = 0
+        for record in records:
+            state = record.get('s')
+            if state == FETCHED:
+                self._fetched.update(record['tiles'])
+            elif state == INFERRED:
+                if record['n'] in uploaded_numbers:
+                    dead_bytes += len(record['annotations'])
+                else:
+                    self._pending[record['n']] = record
+            elif state == UPLOADED:
+                self._uploaded.update(record['tiles'])
+            if 'n' in record:
+                self._nextRecord = max(self._nextRecord, record['n'] + 1)
+        if dead_bytes > _COMPACT_RATIO * os.path.getsize(self._path):
+            self._compact(records, uploaded_numbers)
+
+    # Rewrite the journal without the results that were uploaded already.
+    def _compact(self, records, uploaded_numbers):
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for record in records:
+                if record.get('s') == INFERRED and record['n'] in uploaded_numbers:
+                    continue
+                if record.get('s') == FETCHED:
+                    continue
+                f.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path)
@@ -0,0 +1,140 @@
+import connexion
+import flask
+import six
+from typing import Dict
+from typing import Tuple
+from typing import Union
+
+from mikaia_plugin_api.script_service_server.controllers.mikaia_script_service import ScriptService
+from mikaia_plugin_api.script_service_server.models.script_execution_info import ScriptExecutionInfo  # noqa: E501
+from mikaia_plugin_api.script_service_server.models.script_info import ScriptInfo  # noqa: E501
+from mikaia_plugin_api.script_service_server import util
+
+
+
+ss=ScriptService('*.py')
+
+
+def execute_get(script_execution_id):  # noqa: E501
+    """Get execution state of a script
+
+    Returns the current execution state of a script/application started by the POST command # noqa: E501
+
+    :param script_execution_id: The execution Id of the script. This Id is obtained in response to a POST command(that starts the execution of a script/application).
+    :type script_execution_id: str
+
+    :rtype: Union[str, Tuple[str, int], Tuple[str, int, Dict[str, str]]
+    """
+    # clients that accept JSON get the resource usage of the execution as well
+    if connexion.request.accept_mimetypes.best_match(['text/plain', 'application/json']) == 'application/json':
+        success, info = ss.getScriptExecutionInfo(script_execution_id)
+        if success == False:
+            return flask.Response(info, status=500, mimetype='text/plain')
+        return info, 200
+
+    result_tuple = ss.getScriptExecutionStatus(script_execution_id, False)
+    
+    http_code = 200
+    if result_tuple[0] == False:
+        http_code = 500
+    return result_tuple[1], http_code
+
+
+def execute_delete(script_execution_id):  # noqa: E501
+    """Cancel a script execution
+
+    Removes a queued script execution from the queue or terminates a running one # noqa: E501
+
+    :param script_execution_id: The execution Id of the script.
+    :type script_execution_id: str
+
+    :rtype: Union[str, Tuple[str, int], Tuple[str, int, Dict[str, str]]
+    """
+    result_tuple = ss.cancelScriptExecution(script_execution_id)
+
+    http_code = 200
+    if result_tuple[0] == False:
+        http_code = 404
+    return result_tuple[1], http_code
+
+
+def execute_log_get(script_execution_id, offset=None, max_lines=None, follow=None):  # noqa: E501
+    """Get the output of a script execution
+
+    Returns the captured output lines of a script execution # noqa: E501
+
+    :param script_execution_id: The execution Id of the script.
+    :type script_execution_id: str
+    :param offset: Number of the first line to return. Negative values return the last lines.
+    :type offset: int
+    :param max_lines: Maximum number of lines to return.
+    :type max_lines: int
+    :param follow: Keep the response open and stream new lines until the execution has finished.
+    :type follow: bool
+
+    :rtype: Union[str, Tuple[str, int], Tuple[str, int, Dict[str, str]]
+    """
+    success, log = ss.getScriptExecutionLog(script_execution_id)
+    if success == False:
+        return log, 404
+    offset = offset if offset is not None else 0
+    max_lines = max_lines if max_lines is not None else 1000
+
+    if not follow:
+        lines, next_offset = log.read(offset, max_lines)
+        text = ''.join(line + '\n' for line in lines)
+        return flask.Response(text, status=200, mimetype='text/plain', headers={'X-Log-Offset': str(next_offset)})
+
+    def stream(offset):
+        while True:
+            lines, offset = log.read(offset, max_lines)
+            if lines:
+                yield ''.join(line + '\n' for line in lines)
+            elif log.closed:
+                return
+            else:
+                log.wait(offset, 15.0)
+
+    return flask.Response(flask.stream_with_context(stream(offset)), status=200, mimetype='text/plain')
+
+
+#def execute_post(script_name, script_execution_info):  # noqa: E501
+def execute_post(script_name, priority=None):  # noqa: E501
+    """Execute a script
+
+    Starts the execution of the specified script/application # noqa: E501
+
+    :param script_name: Name of the script/application to be executed.
+    :type script_name: str
+    :param priority: Executions with higher priority are started first(if the service uses a priority queue).
+    :type priority: int
+    :param script_execution_info: data needed to start a MIKAIA script
+    :type script_execution_info: dict | bytes
+
+    :rtype: Union[str, Tuple[str, int], Tuple[str, int, Dict[str, str]]
+    """
+    #if connexion.request.is_json:
+    script_execution_info = ScriptExecutionInfo.from_dict(connexion.request.get_json())  # noqa: E501
+    
+    slide_service_path = script_execution_info.slide_service_server
+    session_id = script_execution_info.slide_id
+    result_tuple = ss.executeScript(script_name, slide_service_path, session_id, True,
+                                    priority if priority is not None else 0)
+    
+    http_code = 200
+    if result_tuple[0] == False:
+        http_code = 500
+    return result_tuple[1], http_code
+
+
+def scripts_get():  # noqa: E501
+    """Returns a list of available srcipts/applications
+
+    Returns a list of all available srcipts/applications which use the MIKAIA OpenAPI interface &#39;SlideInterface&#39; # noqa: E501
+
+
+    :rtype: Union[List[ScriptInfo], Tuple[List[ScriptInfo], int], Tuple[List[ScriptInfo], int, Dict[str, str]]
+    """
+    file_names = ss.getScriptFileNames(True)
+    script_list = [ScriptInfo(file, "") for file in file_names]
+    return script_list, 200
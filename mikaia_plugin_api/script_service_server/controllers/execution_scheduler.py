@@ -0,0 +1,429 @@
+import collections
+import heapq
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+# Returns (cpu time in s, peak resident memory in bytes) of a running process or (None, None).
+def processUsage(pid):
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        cpu = process.cpu_times()
+        memory = process.memory_info()
+        return cpu.user + cpu.system, getattr(memory, 'peak_wset', memory.rss)
+    except ImportError:
+        pass
+    except Exception:
+        return None, None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        peak_rss = None
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    peak_rss = int(line.split()[1]) * 1024
+        return cpu_time, peak_rss
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None, None
+
+
+#############################
+## Captured execution logs ##
+#############################
+class ExecutionLog(object):
+    """ExecutionLog Output of a script execution, kept as ring buffer in memory and in a size-capped log file.
+
+    Lines are numbered from 0. Readers pass the number of the next line they want(offset), so the log
+    can be tailed by repeated requests. Lines that dropped out of the ring buffer are skipped.
+    The log file is rotated(one backup file '<path>.1') when it exceeds 'max_file_bytes'.
+    """
+
+    # path: path of the log file or None(memory only).
+    # max_memory_bytes: size of the in-memory ring buffer.
+    # max_file_bytes: size at which the log file is rotated.
+    # echo_prefix: if not None, every line is also printed to the console of the script service with this prefix.
+    def __init__(self, path=None, max_memory_bytes=256 * 1024, max_file_bytes=8 * 1024 * 1024, echo_prefix=None):
+        self.path = path
+        self._maxMemoryBytes = max_memory_bytes
+        self._maxFileBytes = max_file_bytes
+        self._echoPrefix = echo_prefix
+        self._changed = threading.Condition()
+        self._lines = collections.deque()
+        self._memoryBytes = 0
+        self._first = 0  # number of the oldest line in the ring buffer
+        self._partial = ''
+        self._closed = False
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, 'w', encoding='utf-8', errors='replace')
+
+    # Append text(may contain several or partial lines).
+    def write(self, text):
+        with self._changed:
+            if self._closed:
+                return
+            parts = (self._partial + text).split('\n')
+            self._partial = parts.pop()
+            for line in parts:
+                self._append(line.rstrip('\r'))
+            if parts:
+                self._changed.notify_all()
+
+    # Returns (lines, next_offset): at most 'max_lines' lines starting at line number 'offset'.
+    # A negative offset returns the last -offset lines.
+    def read(self, offset=0, max_lines=1000):
+        with self._changed:
+            end = self._first + len(self._lines)
+            if offset < 0:
+                offset = end + offset
+            start = min(max(offset, self._first), end)
+            stop = min(end, start + max_lines)
+            lines = list(itertools.islice(self._lines, start - self._first, stop - self._first))
+            return lines, stop
+
+    # Waits until there are lines from 'offset' on or the log is closed. Returns False on timeout.
+    def wait(self, offset, timeout=None):
+        with self._changed:
+            return self._changed.wait_for(lambda: self._closed or self._first + len(self._lines) > offset, timeout)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    # Flush the last partial line and close the log file. The ring buffer stays readable.
+    def close(self):
+        with self._changed:
+            if self._closed:
+                return
+            if self._partial:
+                self._append(self._partial)
+                self._partial = ''
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+            self._changed.notify_all()
+
+    # Close the log and remove its files.
+    def remove(self):
+        self.close()
+        if self.path is not None:
+            for path in (self.path, self.path + '.1'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _append(self, line):
+        if self._echoPrefix is not None:
+            print(self._echoPrefix + line)
+        self._lines.append(line)
+        self._memoryBytes += len(line) + 1
+        while self._memoryBytes > self._maxMemoryBytes and len(self._lines) > 1:
+            self._memoryBytes -= len(self._lines.popleft()) + 1
+            self._first += 1
+        if self._file is not None:
+            self._file.write(line + '\n')
+            self._file.flush()
+            if self._file.tell() > self._maxFileBytes:
+                self._file.close()
+                os.replace(self.path, self.path + '.1')
+                self._file = open(self.path, 'w', encoding='utf-8', errors='replace')
+
+
+class ProcessHandle(object):
+    """ProcessHandle Script process started by the scheduler(wraps subprocess.Popen)"""
+
+    # process: subprocess.Popen instance.
+    # log: ExecutionLog that receives the output of the process(requires stdout=PIPE) or None.
+    # measure: if True, CPU time and peak memory of the process are tracked.
+    def __init__(self, process, log=None, measure=True):
+        self.process = process
+        self._measure = measure
+        self._usage = (None, None)
+        self._pump = None
+        if log is not None and process.stdout is not None:
+            self._pump = threading.Thread(target=self._pumpOutput, args=(process.stdout, log), daemon=True)
+            self._pump.start()
+
+    # Returns the exit code of the process or None while it is running.
+    def poll(self):
+        if self.process.returncode is not None:
+            return self.process.returncode
+        if self._measure and hasattr(os, 'wait4'):
+            # reap the process ourselves to get its resource usage
+            try:
+                pid, status, rusage = os.wait4(self.process.pid, os.WNOHANG)
+            except ChildProcessError:
+                return self.process.poll()
+            if pid == 0:
+                self._usage = processUsage(self.process.pid)
+                return None
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss may include the memory of the forked service process before exec(), the high-water mark
+            # sampled while the script was running is preferred
+            peak_rss = self._usage[1]
+            if peak_rss is None:
+                peak_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            self._usage = (rusage.ru_utime + rusage.ru_stime, peak_rss)
+            return self.process.returncode
+        if self._measure:
+            self._usage = processUsage(self.process.pid)
+        return self.process.poll()
+
+    # Returns (cpu time in s, peak resident memory in bytes), values may be None.
+    def usage(self):
+        return self._usage
+
+    # Terminate the process.
+    def cancel(self):
+        if self.process.returncode is None:
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+
+    # Waits until the output of the process has been read completely.
+    def join(self, timeout=None):
+        if self._pump is not None:
+            self._pump.join(timeout)
+
+    @staticmethod
+    def _pumpOutput(stream, log):
+        try:
+            for data in iter(lambda: stream.readline(), b''):
+                log.write(data.decode('utf-8', errors='replace'))
+        finally:
+            stream.close()
+
+
+class ScheduledExecution(object):
+    """ScheduledExecution State and resource usage of a script execution"""
+
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    FINISHED = 'FINISHED'
+
+    def __init__(self, execution_id, script_name, start, priority=0, log=None):
+        self.executionId = execution_id
+        self.scriptName = script_name
+        self.priority = priority
+        self.status = self.QUEUED
+        self.returnCode = None
+        self.cancelled = False
+        self.error = None
+        self.log = log
+        self.queuedTime = time.time()
+        self.startTime = None
+        self.endTime = None
+        self.cpuTime = None
+        self.peakRss = None
+        self.handle = None
+        self._start = start  # callable() -> handle with poll(), usage() and cancel()
+
+    def __str__(self):
+        return '{}(id={}, status={}, return code={})'.format(
+            self.__class__.__name__, self.executionId, self.status, self.returnCode)
+
+    # Returns the run time in s(up to now for running executions, None for queued ones).
+    def wallTime(self):
+        if self.startTime is None:
+            return None
+        return (self.endTime if self.endTime is not None else time.time()) - self.startTime
+
+    # Returns the execution state as dict(see schema 'ScriptExecutionStatus' of openapi.yaml).
+    def toDict(self):
+        return {'script_execution_id': self.executionId,
+                'script_name': self.scriptName,
+                'status': self.status,
+                'return_code': self.returnCode,
+                'cancelled': self.cancelled,
+                'error': self.error,
+                'priority': self.priority,
+                'queued_at': self.queuedTime,
+                'wall_time_s': self.wallTime(),
+                'cpu_time_s': self.cpuTime,
+                'peak_rss_bytes': self.peakRss}
+
+
+#####################################
+## Run queue for script executions ##
+#####################################
+class ExecutionScheduler(object):
+    """ExecutionScheduler Run queue that limits the number of concurrently running script executions.
+
+    Executions are started in submission order(policy 'fifo') or by descending priority and then in
+    submission order(policy 'priority'). A monitor thread polls the running executions, records their
+    resource usage, starts queued executions when slots become free and forgets finished executions
+    after 'keep_finished_s' seconds(or when more than 'max_finished' have accumulated).
+    """
+
+    # max_concurrent: maximum number of running executions(0: unlimited).
+    # policy: 'fifo' or 'priority'.
+    # keep_finished_s: time in s for which the state of a finished execution can be queried.
+    # max_finished: maximum number of finished executions kept.
+    # poll_interval_s: polling interval of the monitor thread.
+    def __init__(self, max_concurrent=0, policy='fifo', keep_finished_s=3600, max_finished=1000, poll_interval_s=0.25):
+        if policy not in ('fifo', 'priority'):
+            raise Exception("Unknown queue policy '{}' - use 'fifo' or 'priority'.".format(policy))
+        self._maxConcurrent = max_concurrent
+        self._policy = policy
+        self._keepFinished = keep_finished_s
+        self._maxFinished = max_finished
+        self._pollInterval = poll_interval_s
+        self._lock = threading.Condition()
+        self._queue = []  # heap of (sort key, ScheduledExecution)
+        self._sequence = itertools.count()
+        self._running = []
+        self._finished = collections.OrderedDict()  # execution id -> ScheduledExecution in finishing order
+        self._executions = {}  # execution id -> ScheduledExecution(all states)
+        self._closed = False
+        self._monitor = threading.Thread(target=self._monitorLoop, name='ExecutionScheduler', daemon=True)
+        self._monitor.start()
+
+    def __str__(self):
+        with self._lock:
+            return '{}(queued={}, running={}, finished={}, max concurrent={}, policy={})'.format(
+                self.__class__.__name__, len(self._queue), len(self._running), len(self._finished),
+                self._maxConcurrent, self._policy)
+
+    # Queue an execution.
+    # start: callable() that starts the execution and returns a handle with the methods poll() (exit code or None),
+    #        usage() ((cpu time, peak rss) or (None, None)) and cancel(). Called by the monitor thread.
+    # priority: higher values are started first(policy 'priority' only).
+    # log: ExecutionLog of the execution or None.
+    def submit(self, execution_id, script_name, start, priority=0, log=None):
+        execution = ScheduledExecution(execution_id, script_name, start, priority, log)
+        with self._lock:
+            if self._closed:
+                raise Exception('The scheduler has been closed.')
+            key = (-priority if self._policy == 'priority' else 0, next(self._sequence))
+            heapq.heappush(self._queue, (key, execution))
+            self._executions[execution_id] = execution
+            self._startQueued()
+            self._lock.notify_all()
+        return execution
+
+    # Returns the ScheduledExecution with the given id or None.
+    def get(self, execution_id):
+        with self._lock:
+            return self._executions.get(execution_id)
+
+    # Returns all known executions(queued, running and finished).
+    def executions(self):
+        with self._lock:
+            return list(self._executions.values())
+
+    # Cancel a queued or running execution.
+    # returns tuple (success, msg)
+    def cancel(self, execution_id):
+        with self._lock:
+            execution = self._executions.get(execution_id)
+            if execution is None:
+                return False, "No entry found for script execution id '{}'".format(execution_id)
+            if execution.status == ScheduledExecution.FINISHED:
+                return False, "Script execution '{}' has already finished".format(execution_id)
+            execution.cancelled = True
+            if execution.status == ScheduledExecution.QUEUED:
+                self._queue = [item for item in self._queue if item[1] is not execution]
+                heapq.heapify(self._queue)
+                self._finish(execution, -1)
+                return True, "Script execution '{}' removed from the queue".format(execution_id)
+            handle = execution.handle
+        handle.cancel()
+        with self._lock:
+            self._lock.notify_all()
+        return True, "Script execution '{}' cancelled".format(execution_id)
+
+    # Cancel all executions and stop the monitor thread.
+    def close(self):
+        for execution in self.executions():
+            if execution.status != ScheduledExecution.FINISHED:
+                self.cancel(execution.executionId)
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._monitor.join(5.0)
+
+    def _startQueued(self):
+        while self._queue and (self._maxConcurrent <= 0 or len(self._running) < self._maxConcurrent):
+            key, execution = heapq.heappop(self._queue)
+            execution.status = ScheduledExecution.RUNNING
+            execution.startTime = time.time()
+            try:
+                execution.handle = execution._start()
+            except Exception as e:
+                execution.error = 'Failed to start script {}: {}'.format(execution.scriptName, e)
+                print(execution.error)
+                self._finish(execution, -1)
+                continue
+            self._running.append(execution)
+
+    def _finish(self, execution, return_code):
+        execution.returnCode = return_code
+        execution.endTime = time.time()
+        if execution.startTime is None:
+            execution.startTime = execution.endTime
+        execution.status = ScheduledExecution.FINISHED
+        self._finished[execution.executionId] = execution
+        if execution.log is not None and not isinstance(execution.handle, ProcessHandle):
+            execution.log.close()
+
+    def _monitorLoop(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                running = list(self._running)
+            finished = []
+            for execution in running:
+                return_code = execution.handle.poll()
+                cpu_time, peak_rss = execution.handle.usage()
+                if cpu_time is not None:
+                    execution.cpuTime = cpu_time
+                if peak_rss is not None:
+                    execution.peakRss = peak_rss if execution.peakRss is None else max(execution.peakRss, peak_rss)
+                if return_code is not None:
+                    finished.append((execution, return_code))
+            for execution, return_code in finished:
+                if isinstance(execution.handle, ProcessHandle):
+                    execution.handle.join(5.0)  # read the remaining output
+                    if execution.log is not None:
+                        execution.log.close()
+            with self._lock:
+                for execution, return_code in finished:
+                    self._running.remove(execution)
+                    self._finish(execution, return_code)
+                    print('Script execution [{}] finished: return code {}, wall time {:.1f} s'.format(
+                        execution.executionId, return_code, execution.wallTime()))
+                self._startQueued()
+                self._reap()
+                self._lock.wait(self._pollInterval)
+
+    # forget finished executions that are older than 'keep_finished_s' or exceed 'max_finished'
+    def _reap(self):
+        now = time.time()
+        while self._finished:
+            execution_id, execution = next(iter(self._finished.items()))
+            if now - execution.endTime < self._keepFinished and len(self._finished) <= self._maxFinished:
+                break
+            del self._finished[execution_id]
+            del self._executions[execution_id]
+            execution.handle = None
+            if execution.log is not None:
+                execution.log.remove()
+
+
+# Start a script as child process of the script service(no terminal window) and capture its output into 'log'.
+def startHeadlessProcess(args, working_dir, log):
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    process = subprocess.Popen(args, cwd=working_dir, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return ProcessHandle(process, log)
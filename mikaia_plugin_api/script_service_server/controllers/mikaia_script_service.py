@@ -0,0 +1,297 @@
+import os
+import platform
+import glob
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from importlib.metadata import version
+from mikaia_plugin_api.script_service_server.controllers.execution_scheduler import ExecutionLog, ExecutionScheduler, \
+    ProcessHandle, startHeadlessProcess
+from mikaia_plugin_api.script_service_server.controllers.worker_pool import WorkerPool, isWorkerScript
+
+
+s_pythonConsoleAliasName = "MIKAIA Python Console"
+
+
+class ScriptService(object):
+    # wildcard: pattern of the script files offered to MIKAIA.
+    # worker_mode: if True, scripts that declare 'MIKAIA_RESIDENT_WORKER = True' and a 'run(slide_service)' function
+    #              (and optionally an 'init()' function) are executed by resident, pre-warmed worker processes instead
+    #              of a new process per execution. Other scripts always get a new process. See class WorkerPool.
+    # workers_per_script: maximum number of worker processes(= concurrent executions) per script.
+    # max_runs_per_worker: number of executions after which a worker process is recycled(0: unlimited).
+    # max_worker_memory_mb: worker memory after an execution above which the worker is recycled(0: unlimited).
+    # worker_idle_timeout_s: idle time after which a worker process is stopped(0: never).
+    # prewarm_workers: if True, a worker process is started for each worker script at startup.
+    # backend: 'terminal' starts each script in a new terminal/console window(via runScript.sh/runScript.bat),
+    #          'headless' starts scripts directly as child processes and captures their output(see getScriptExecutionLog()),
+    #          'auto' uses 'headless' on systems without display or gnome-terminal and 'terminal' otherwise.
+    # max_concurrent_executions: maximum number of running script executions, further executions are queued(0: unlimited).
+    # queue_policy: 'fifo' or 'priority'(executions with higher priority are started first).
+    # log_dir: directory of the execution log files. Default: 'mikaia_script_service_logs' in the temp directory.
+    # keep_finished_s: time in s for which the state and the log of a finished execution are kept.
+    def __init__(self, wildcard: str, worker_mode=True, workers_per_script=1, max_runs_per_worker=100,
+                 max_worker_memory_mb=0, worker_idle_timeout_s=900, prewarm_workers=False, backend='auto',
+                 max_concurrent_executions=0, queue_policy='fifo', log_dir=None, keep_finished_s=3600):
+        self._system = platform.system().upper()
+        self._workingDir = os.getcwd()
+        self._wildcard = wildcard
+        self._execScript = ""
+        self._processCounter = 0
+        self._processCounterLock = threading.Lock()
+        self._scheduler = ExecutionScheduler(max_concurrent_executions, queue_policy, keep_finished_s)
+        self._logDir = log_dir if log_dir is not None else os.path.join(tempfile.gettempdir(), 'mikaia_script_service_logs')
+        if backend == 'auto':
+            has_display = self._system != "LINUX" or bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+            has_terminal = self._system != "LINUX" or shutil.which('gnome-terminal') is not None
+            backend = 'terminal' if has_display and has_terminal else 'headless'
+        if backend not in ('terminal', 'headless'):
+            raise Exception(f"Unknown execution backend '{backend}' - use 'terminal', 'headless' or 'auto'")
+        self._backend = backend
+        self._workerMode = worker_mode
+        self._workerPoolArgs = {'size': workers_per_script, 'max_runs': max_runs_per_worker,
+                                'max_memory_mb': max_worker_memory_mb, 'idle_timeout_s': worker_idle_timeout_s}
+        self._workerPools = {}  # dictionary <script name, (script file mtime, WorkerPool)>
+        self._workerPoolsLock = threading.Lock()
+
+        # set title of console window
+        pkg_version = version('mikaia_plugin_api')
+        console_title = 'MIKAIA Script Service({})  {}  {}'.format(pkg_version, self._workingDir, self._wildcard)
+        
+        # select execution script depending on operation system
+        # (path of the package 'mikaia_plugin_api', without importing the heavy 'mikaia_api' module)
+        sourceFilePath = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if self._system == "LINUX":
+            print(f"\x1B]0;{console_title}\x07") # set title of terminal window
+            self._execScript = os.path.realpath(sourceFilePath + '/scripts/Linux/runScript.sh')
+        else:
+            os.system('title ' + console_title) # set title of console window
+            self._execScript = os.path.realpath(sourceFilePath + '/scripts/Windows/runScript.bat')
+
+        # check existence of batch file 'runScript.bat'/'runScript.sh' that is required to start the script
+        self._execScript
+        if not os.path.isfile(self._execScript):
+            msg = f"Missing required execution script: '{self._execScript}'"
+            raise Exception(msg)
+ 
+        print('MIKAIA ScriptService - running on {} system, {} backend, {}'.format(self._system, self._backend, self._scheduler))
+        # print('Execution script: {}'.format(self._execScript))
+        file_names = self.getScriptFileNames(True)
+        if self._workerMode and prewarm_workers:
+            for file_name in file_names:
+                pool = self._getWorkerPool(file_name)
+                if pool is not None:
+                    pool.prewarm()
+        
+    def __str__(self):
+        return '  Working directory: {}\r\n  wildcard: {}'.format(self._workingDir, self._wildcard)
+        
+    
+    ################################################
+    ## MIKAIA 'ScriptService' interface functions ##
+    ################################################
+    
+    # Return list of files which match the specified wildcard pattern.
+    def getScriptFileNames(self, log = False):
+        file_names = glob.glob(self._wildcard) # get files which match the specified wildcard pattern.
+        file_names.append(s_pythonConsoleAliasName) # Append an entry for the 'MIKAIA Python Console'
+
+        if log:
+            print('getScriptFileNames()')
+            print('Working directory: {}'.format(self._workingDir))
+            print('Wildcard: {}'.format(self._wildcard))
+            print('Files:')
+            print(file_names)
+        return file_names
+
+
+    # Executes a Mikaia script file.
+    # script_name: name of the script file.
+    # slide_server_path: path of the MIKAIA SlideServer REST API.
+    # session_id: MIKAIA SlideServer session id
+    # priority: executions with higher priority are started first(queue policy 'priority' only).
+    # returns tuple (success, msg) where
+    # success: True or False
+    # msg: script execution id on success, error message otherwise
+    # The execution is queued if the maximum number of concurrent executions is reached.
+    def executeScript(self, script_name, slide_server_path, session_id, log = False, priority = 0):
+        if log:
+            print('executeScript({}, {}, {})'.format(script_name, slide_server_path, session_id))
+        
+        # check existence of the given script file
+        script_file_path = self._workingDir + '/' + script_name
+        if script_name != s_pythonConsoleAliasName:
+            if not os.path.isfile(script_file_path):
+                msg = f"Script file doesn't exist: '{script_name}'"
+                return False, msg
+        elif self._backend == 'headless':
+            msg = f"'{s_pythonConsoleAliasName}' requires a terminal and isn't available with the headless backend"
+            return False, msg
+
+        # check existence of batch file 'runScript.bat'/'runScript.sh' that is required to start the script
+        execScriptFilePath = self._execScript
+        if not os.path.isfile(execScriptFilePath):
+            msg = f"Missing required execution script: '{self._execScript}'"
+            return False, msg
+
+        if self._backend == 'terminal' and self._system not in ("WINDOWS", "LINUX"):
+            msg = f"MIKAIA ScriptService - unsupported system: {self._system}"
+            print(msg)
+            return False, msg
+        
+        # queue the script execution
+        success = True
+        try:
+            with self._processCounterLock:
+                self._processCounter += 1
+                script_execution_id = script_name + "_" + f"{self._processCounter:05d}"
+            slideServiceRootPath = slide_server_path + "/" + session_id
+
+            # Dispatch the execution to a resident worker process, if the script supports it
+            pool = self._getWorkerPool(script_name) if self._workerMode else None
+            if pool is not None:
+                execution_log = self._createLog(script_execution_id)
+                start = lambda: pool.execute(script_execution_id, slideServiceRootPath, execution_log)
+            elif self._backend == 'headless':
+                execution_log = self._createLog(script_execution_id)
+                args = [sys.executable, '-u', script_file_path, slideServiceRootPath]
+                start = lambda: self._startProcess(script_execution_id, args, execution_log)
+            else:
+                execution_log = None
+                start = lambda: self._startTerminalProcess(script_execution_id, script_name, slideServiceRootPath)
+
+            execution = self._scheduler.submit(script_execution_id, script_name, start, priority, execution_log)
+            msg = script_execution_id
+            print(f"Script execution [{script_execution_id}] {execution.status}")
+            
+        except Exception as e:
+            success = False
+            msg = f"Failed to start script {script_name}: {e}"
+
+        if log:
+            print('executeScript({}) returns: ({}, {})'.format(script_name, success, msg))
+            
+        return success, msg
+        
+
+    # Returns the execution status of a Mikaia script file.
+    # script_execution_id: execution id of the script(returned form executeScript() call).
+    # returns tuple (success, status, return_code) where
+    # success: True or False
+    # status: "QUEUED", "RUNNING" or "FINISHED" on success, error message otherwise
+    # return_code: script exit code on success, None otherwise
+    def getScriptExecutionStatus(self, script_execution_id, log = False):
+        if log:
+            print('getScriptExecutionStatus({})'.format(script_execution_id))
+        
+        success = False
+        status = ""
+        return_code = None
+        
+        execution = self._scheduler.get(script_execution_id)
+        if execution is None:
+            status = f"No entry found for script execution id '{script_execution_id}'"
+        else:
+            success = True
+            status = execution.status
+            return_code = execution.returnCode
+
+        if log:
+            print('getScriptExecutionStatus({}) returns: ({}, {}, {},)'.format(script_execution_id, success, status, return_code))
+            
+        return success, status, return_code
+
+
+    # Returns the execution state of a Mikaia script file including its resource usage.
+    # returns tuple (success, info) where
+    # success: True or False
+    # info: dict with status, return code, wall time, CPU time and peak memory on success(see ScheduledExecution.toDict()),
+    #       error message otherwise
+    def getScriptExecutionInfo(self, script_execution_id):
+        execution = self._scheduler.get(script_execution_id)
+        if execution is None:
+            return False, f"No entry found for script execution id '{script_execution_id}'"
+        return True, execution.toDict()
+
+
+    # Cancels a queued or running script execution.
+    # returns tuple (success, msg)
+    def cancelScriptExecution(self, script_execution_id, log = False):
+        success, msg = self._scheduler.cancel(script_execution_id)
+        if log or success:
+            print('cancelScriptExecution({}) returns: ({}, {})'.format(script_execution_id, success, msg))
+        return success, msg
+
+
+    # Returns the ExecutionLog with the captured output of a script execution.
+    # returns tuple (success, log) where
+    # log: ExecutionLog on success, error message otherwise
+    # The output is only captured by the headless backend and by worker processes.
+    def getScriptExecutionLog(self, script_execution_id):
+        execution = self._scheduler.get(script_execution_id)
+        if execution is None:
+            return False, f"No entry found for script execution id '{script_execution_id}'"
+        if execution.log is None:
+            return False, f"The output of script execution '{script_execution_id}' isn't captured(terminal backend)"
+        return True, execution.log
+
+
+    # Cancel all script executions and stop all resident worker processes.
+    def close(self):
+        self._scheduler.close()
+        with self._workerPoolsLock:
+            pools = [pool for mtime, pool in self._workerPools.values()]
+            self._workerPools.clear()
+        for pool in pools:
+            pool.close()
+
+    # Returns the worker pool of the script or None if it isn't a resident worker script(see isWorkerScript()).
+    # The pool is replaced if the script file has been changed since the pool was created.
+    def _getWorkerPool(self, script_name):
+        if script_name == s_pythonConsoleAliasName:
+            return None
+        script_file_path = os.path.join(self._workingDir, script_name)
+        try:
+            mtime = os.path.getmtime(script_file_path)
+        except OSError:
+            return None
+        with self._workerPoolsLock:
+            entry = self._workerPools.get(script_name)
+            if entry is not None and entry[0] == mtime:
+                return entry[1]
+            if entry is not None:
+                print(f"Script '{script_name}' changed - restarting its worker processes")
+                entry[1].close(wait=False)
+                del self._workerPools[script_name]
+            if not isWorkerScript(script_file_path):
+                return None
+            pool = WorkerPool(script_name, self._workingDir, **self._workerPoolArgs)
+            self._workerPools[script_name] = (mtime, pool)
+            return pool
+
+    def _createLog(self, script_execution_id):
+        file_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in script_execution_id) + '.log'
+        return ExecutionLog(os.path.join(self._logDir, file_name), echo_prefix=f"[{script_execution_id}] ")
+
+    def _startProcess(self, script_execution_id, args, execution_log):
+        print(f"Starting process [{script_execution_id}]: {args}")
+        return startHeadlessProcess(args, self._workingDir, execution_log)
+
+    # Start script in a new terminal/console window(the output isn't captured)
+    def _startTerminalProcess(self, script_execution_id, script_name, slideServiceRootPath):
+        execScriptFilePath = self._execScript
+        # Start script on Windows system (in cmd.exe console)
+        if self._system == "WINDOWS":
+            args = ["cmd.exe", "/C", execScriptFilePath, script_name, slideServiceRootPath]
+            process = subprocess.Popen(args, creationflags=subprocess.CREATE_NEW_CONSOLE)
+        # Start script on LINUX system (in gnome-terminal)
+        else:
+            cmd = f"source {execScriptFilePath} '{script_name}' {slideServiceRootPath}"
+            #args = ['xterm', '-e', cmd]
+            args = ['gnome-terminal', '--wait', '--', 'bash', '-c', cmd]
+            process = subprocess.Popen(args)
+        print(f"Starting process [{script_execution_id}]: {args}")
+        # the resource usage of the terminal process doesn't tell anything about the script
+        return ProcessHandle(process, measure=False)
@@ -0,0 +1,383 @@
+import ast
+import collections
+import importlib.util
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+# Returns True if the script file opts in to resident workers with a top level 'MIKAIA_RESIDENT_WORKER = True' and
+# declares a top level 'run(slide_service)' function. A 'run' function alone isn't enough: the worker skips the
+# script's '__main__' block and calls run() with a SlideService.
+# An optional top level 'init()' function is called once when a worker process starts.
+def isWorkerScript(script_file_path):
+    try:
+        with open(script_file_path, 'rb') as f:
+            tree = ast.parse(f.read(), filename=script_file_path)
+    except (OSError, SyntaxError, ValueError):
+        return False
+    resident = any(isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) and node.value.value is True
+                   and any(isinstance(target, ast.Name) and target.id == 'MIKAIA_RESIDENT_WORKER'
+                           for target in node.targets)
+                   for node in tree.body)
+    return resident and any(isinstance(node, ast.FunctionDef) and node.name == 'run' for node in tree.body)
+
+
+# Returns the resident memory of the calling process in bytes or None if it can't be determined.
+def currentRssBytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+# Peak resident memory of the calling process in bytes or None.
+def _peakRssBytes():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    except ImportError:
+        return currentRssBytes()
+
+
+class _PipeWriter(object):
+    """_PipeWriter Replaces sys.stdout/sys.stderr of a worker during an execution and sends the output lines over the pipe"""
+
+    def __init__(self, conn, lock):
+        self._conn = conn
+        self._lock = lock
+        self._buffer = ''
+
+    def write(self, text):
+        with self._lock:
+            self._buffer += text
+            if '\n' in self._buffer:
+                end = self._buffer.rindex('\n') + 1
+                self._send(self._buffer[:end])
+                self._buffer = self._buffer[end:]
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                self._send(self._buffer)
+                self._buffer = ''
+
+    def isatty(self):
+        return False
+
+    def _send(self, text):
+        try:
+            self._conn.send(('log', text))
+        except (EOFError, OSError):
+            pass
+
+
+# Entry point of a worker process: load the script once, call init() and then execute run() for every
+# request received over 'conn' until the 'stop' request.
+def _workerMain(script_file_path, working_dir, conn):
+    from mikaia_plugin_api import mikaia_api
+
+    try:
+        os.chdir(working_dir)
+        script_dir = os.path.dirname(os.path.abspath(script_file_path))
+        if script_dir not in sys.path:
+            sys.path.insert(0, script_dir)
+        spec = importlib.util.spec_from_file_location('mikaia_worker_script', script_file_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)  # the "if __name__ == '__main__':" block of the script is not executed
+        if hasattr(module, 'init'):
+            module.init()
+    except BaseException as e:
+        traceback.print_exc()
+        conn.send(('error', '{}: {}'.format(type(e).__name__, e)))
+        conn.close()
+        return
+    conn.send(('ready', os.getpid()))
+    conn_lock = threading.Lock()
+    stdout, stderr = sys.stdout, sys.stderr
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request[0] == 'stop':
+            break
+        execution_id, slide_service_path = request[1], request[2]
+        print('[Worker {}] Run [{}]'.format(os.getpid(), execution_id))
+        sys.argv = [script_file_path, slide_service_path]
+        sys.stdout = sys.stderr = writer = _PipeWriter(conn, conn_lock)
+        cpu_start = time.process_time()
+        return_code = 0
+        try:
+            with mikaia_api.SlideService(slide_service_path) as slide_service:
+                result = module.run(slide_service)
+                if isinstance(result, int) and not isinstance(result, bool):
+                    return_code = result
+        except SystemExit as e:
+            return_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except BaseException:
+            traceback.print_exc()
+            return_code = 1
+        writer.flush()
+        sys.stdout, sys.stderr = stdout, stderr
+        usage = {'rss': currentRssBytes(), 'cpu_time': time.process_time() - cpu_start, 'peak_rss': _peakRssBytes()}
+        try:
+            with conn_lock:
+                conn.send(('done', execution_id, return_code, usage))
+        except (EOFError, OSError):
+            break
+    conn.close()
+
+
+class WorkerExecution(object):
+    """WorkerExecution A script execution dispatched to a worker process.
+
+    Provides the poll() method of subprocess.Popen, so the ScriptService can track it like a script process.
+    """
+
+    def __init__(self, pool, execution_id, slide_service_path, log=None):
+        self.executionId = execution_id
+        self.slideServicePath = slide_service_path
+        self.log = log
+        self._pool = pool
+        self._returnCode = None
+        self._usage = (None, None)
+        self._done = threading.Event()
+
+    # Returns the exit code of the execution or None while it is queued or running.
+    def poll(self):
+        return self._returnCode
+
+    # Returns (cpu time in s, peak resident memory of the worker process in bytes) after the execution has finished.
+    def usage(self):
+        return self._usage
+
+    # Cancel the execution. A running execution is stopped by terminating its worker process.
+    def cancel(self):
+        self._pool.cancel(self)
+
+    # Waits for the end of the execution and returns its exit code(None on timeout).
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self._returnCode
+
+    def _finish(self, return_code, usage=None):
+        if usage is not None:
+            self._usage = (usage['cpu_time'], usage['peak_rss'])
+        self._returnCode = return_code
+        self._done.set()
+
+
+class _Worker(object):
+    """_Worker One pre-warmed worker process and the thread that feeds it with executions"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.runs = 0
+        self.execution = None  # the running WorkerExecution
+        self.process = None
+        self.conn = None
+        self.thread = threading.Thread(target=self._loop, name='ScriptWorker', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        pool = self._pool
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_workerMain, args=(pool.scriptFilePath, pool.workingDir, child_conn),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        try:
+            message = parent_conn.recv()
+        except (EOFError, OSError):
+            message = ('error', 'worker process exited with code {}'.format(self.process.exitcode))
+        if message[0] != 'ready':
+            pool._workerFailed(self, message[1])
+            self._stop()
+            return
+        print('[{}] worker process {} ready'.format(pool.scriptName, message[1]))
+
+        recycle_reason = None
+        while recycle_reason is None:
+            execution = pool._nextExecution(self)
+            if execution is None:
+                recycle_reason = 'idle timeout'
+                break
+            self.execution = execution
+            try:
+                parent_conn.send(('run', execution.executionId, execution.slideServicePath))
+                message = parent_conn.recv()
+                while message[0] == 'log':
+                    if execution.log is not None:
+                        execution.log.write(message[1])
+                    else:
+                        sys.stdout.write(message[1])
+                    message = parent_conn.recv()
+            except (EOFError, OSError):
+                self.process.join(1.0)
+                return_code = self.process.exitcode if self.process.exitcode is not None else -1
+                self.execution = None
+                execution._finish(return_code)
+                pool._workerDone(self, 'worker process died', replace=True)
+                return
+            self.execution = None
+            execution._finish(message[2], message[3])
+            self.runs += 1
+            recycle_reason = pool._recycleReason(self, message[3]['rss'])
+        self._stop()
+        pool._workerDone(self, recycle_reason, replace=recycle_reason != 'idle timeout')
+
+    def _stop(self):
+        try:
+            self.conn.send(('stop',))
+        except (EOFError, OSError, AttributeError):
+            pass
+        self.process.join(10.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5.0)
+        if self.conn is not None:
+            self.conn.close()
+
+
+#####################################
+## Pool of resident script workers ##
+#####################################
+class WorkerPool(object):
+    """WorkerPool Pre-warmed worker processes for one script that declares init()/run(slide_service) hooks.
+
+    A worker process imports the script and calls its init() function once(e.g. to load the AI model),
+    then it executes run(slide_service) for each execution dispatched to it over a local pipe.
+    So only the first execution pays interpreter start, imports and model load.
+    Workers are recycled after 'max_runs' executions, when their memory exceeds 'max_memory_mb'
+    or when they were idle for 'idle_timeout_s' seconds. A recycled worker is replaced by a new
+    pre-warmed one, except after an idle timeout.
+    """
+
+    # script_name: name of the script file(relative to working_dir).
+    # working_dir: working directory of the worker processes.
+    # size: maximum number of worker processes(= concurrent executions) of the script.
+    # max_runs: number of executions after which a worker is recycled(0: unlimited).
+    # max_memory_mb: resident memory after an execution above which a worker is recycled(0: unlimited).
+    # idle_timeout_s: time without executions after which a worker is stopped(0: never).
+    def __init__(self, script_name, working_dir, size=1, max_runs=100, max_memory_mb=0, idle_timeout_s=900):
+        self.scriptName = script_name
+        self.workingDir = working_dir
+        self.scriptFilePath = os.path.join(working_dir, script_name)
+        self._size = max(1, size)
+        self._maxRuns = max_runs
+        self._maxMemoryBytes = max_memory_mb * 1024 * 1024
+        self._idleTimeout = idle_timeout_s if idle_timeout_s > 0 else None
+        self._lock = threading.Condition()
+        self._queue = collections.deque()  # WorkerExecution instances waiting for a worker
+        self._workers = []
+        self._idleWorkers = 0
+        self._closed = False
+
+    def __str__(self):
+        return '{}(script={}, workers={}, queued={})'.format(
+            self.__class__.__name__, self.scriptName, len(self._workers), len(self._queue))
+
+    # Start a worker process in advance, so that even the first execution finds a warm worker.
+    def prewarm(self):
+        with self._lock:
+            if not self._closed and len(self._workers) == 0:
+                self._workers.append(_Worker(self))
+
+    # Queue an execution of the script and return its WorkerExecution.
+    # log: ExecutionLog that receives the output of the execution. Default: console of the script service.
+    def execute(self, execution_id, slide_service_path, log=None):
+        execution = WorkerExecution(self, execution_id, slide_service_path, log)
+        with self._lock:
+            if self._closed:
+                raise Exception("Worker pool of script '{}' is closed.".format(self.scriptName))
+            self._queue.append(execution)
+            if self._idleWorkers < len(self._queue) and len(self._workers) < self._size:
+                self._workers.append(_Worker(self))
+            self._lock.notify()
+        return execution
+
+    # Cancel a queued or running execution.
+    def cancel(self, execution):
+        with self._lock:
+            if execution in self._queue:
+                self._queue.remove(execution)
+                queued = True
+            else:
+                queued = False
+                processes = [worker.process for worker in self._workers if worker.execution is execution]
+        if queued:
+            execution._finish(-1)
+            return
+        for process in processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    # Stop all worker processes. Queued executions are finished with exit code -1.
+    def close(self, wait=True):
+        with self._lock:
+            self._closed = True
+            queued = list(self._queue)
+            self._queue.clear()
+            workers = list(self._workers)
+            self._lock.notify_all()
+        for execution in queued:
+            execution._finish(-1)
+        if wait:
+            for worker in workers:
+                worker.thread.join()
+
+    def _nextExecution(self, worker):
+        with self._lock:
+            deadline = time.monotonic() + self._idleTimeout if self._idleTimeout is not None else None
+            self._idleWorkers += 1
+            try:
+                while not self._queue and not self._closed:
+                    timeout = deadline - time.monotonic() if deadline is not None else None
+                    if timeout is not None and timeout <= 0:
+                        return None
+                    self._lock.wait(timeout)
+                return self._queue.popleft() if self._queue else None
+            finally:
+                self._idleWorkers -= 1
+
+    def _recycleReason(self, worker, rss_bytes):
+        if self._closed:
+            return 'pool closed'
+        if self._maxRuns > 0 and worker.runs >= self._maxRuns:
+            return '{} executions'.format(worker.runs)
+        if self._maxMemoryBytes > 0 and rss_bytes is not None and rss_bytes > self._maxMemoryBytes:
+            return 'memory {:.0f} MB'.format(rss_bytes / 1048576)
+        return None
+
+    def _workerDone(self, worker, reason, replace):
+        print('[{}] worker process recycled: {}'.format(self.scriptName, reason))
+        with self._lock:
+            self._workers.remove(worker)
+            if not self._closed and (replace or self._queue) and len(self._workers) < self._size:
+                self._workers.append(_Worker(self))
+
+    def _workerFailed(self, worker, msg):
+        print('[{}] worker process failed to start: {}'.format(self.scriptName, msg))
+        with self._lock:
+            self._workers.remove(worker)
+            if self._workers:
+                return
+            # no other worker can take over: fail the queued executions instead of letting them wait forever
+            queued = list(self._queue)
+            self._queue.clear()
+        for execution in queued:
+            execution._finish(1)
@@ -0,0 +1,7 @@
+# coding: utf-8
+
+# flake8: noqa
+from __future__ import absolute_import
+# import models into model package
+from mikaia_plugin_api.script_service_server.models.script_execution_info import ScriptExecutionInfo
+from mikaia_plugin_api.script_service_server.models.script_info import ScriptInfo
@@ -0,0 +1,122 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from datetime import date, datetime  # noqa: F401
+
+from typing import List, Dict  # noqa: F401
+
+from mikaia_plugin_api.script_service_server.models.base_model_ import Model
+from mikaia_plugin_api.script_service_server import util
+
+
+class ScriptExecutionInfo(Model):
+    """NOTE: This class is auto generated by OpenAPI Generator (https://openapi-generator.tech).
+
+    Do not edit the class manually.
+    """
+
+    def __init__(self, script_name=None, slide_id=None, slide_service_server=None):  # noqa: E501
+        """ScriptExecutionInfo - a model defined in OpenAPI
+
+        :param script_name: The script_name of this ScriptExecutionInfo.  # noqa: E501
+        :type script_name: str
+        :param slide_id: The slide_id of this ScriptExecutionInfo.  # noqa: E501
+        :type slide_id: str
+        :param slide_service_server: The slide_service_server of this ScriptExecutionInfo.  # noqa: E501
+        :type slide_service_server: str
+        """
+        self.openapi_types = {
+            'script_name': str,
+            'slide_id': str,
+            'slide_service_server': str
+        }
+
+        self.attribute_map = {
+            'script_name': 'script_name',
+            'slide_id': 'slide_id',
+            'slide_service_server': 'slide_service_server'
+        }
+
+        self.script_name = script_name
+        self.slide_id = slide_id
+        self.slide_service_server = slide_service_server
+
+    @classmethod
+    def from_dict(cls, dikt) -> 'ScriptExecutionInfo':
+        """Returns the dict as a model
+
+        :param dikt: A dict.
+        :type: dict
+        :return: The ScriptExecutionInfo of this ScriptExecutionInfo.  # noqa: E501
+        :rtype: ScriptExecutionInfo
+        """
+        return util.deserialize_model(dikt, cls)
+
+    @property
+    def script_name(self):
+        """Gets the script_name of this ScriptExecutionInfo.
+
+        Name of the script to be started  # noqa: E501
+
+        :return: The script_name of this ScriptExecutionInfo.
+        :rtype: str
+        """
+        return self._script_name
+
+    @script_name.setter
+    def script_name(self, script_name):
+        """Sets the script_name of this ScriptExecutionInfo.
+
+        Name of the script to be started  # noqa: E501
+
+        :param script_name: The script_name of this ScriptExecutionInfo.
+        :type script_name: str
+        """
+
+        self._script_name = script_name
+
+    @property
+    def slide_id(self):
+        """Gets the slide_id of this ScriptExecutionInfo.
+
+        Slide identifier  # noqa: E501
+
+        :return: The slide_id of this ScriptExecutionInfo.
+        :rtype: str
+        """
+        return self._slide_id
+
+    @slide_id.setter
+    def slide_id(self, slide_id):
+        """Sets the slide_id of this ScriptExecutionInfo.
+
+        Slide identifier  # noqa: E501
+
+        :param slide_id: The slide_id of this ScriptExecutionInfo.
+        :type slide_id: str
+        """
+
+        self._slide_id = slide_id
+
+    @property
+    def slide_service_server(self):
+        """Gets the slide_service_server of this ScriptExecutionInfo.
+
+        The server for 'MIKAIA Slide Service' requests  # noqa: E501
+
+        :return: The slide_service_server of this ScriptExecutionInfo.
+        :rtype: str
+        """
+        return self._slide_service_server
+
+    @slide_service_server.setter
+    def slide_service_server(self, slide_service_server):
+        """Sets the slide_service_server of this ScriptExecutionInfo.
+
+        The server for 'MIKAIA Slide Service' requests  # noqa: E501
+
+        :param slide_service_server: The slide_service_server of this ScriptExecutionInfo.
+        :type slide_service_server: str
+        """
+
+        self._slide_service_server = slide_service_server
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+from datetime import date, datetime  # noqa: F401
+
+from typing import List, Dict  # noqa: F401
+
+from mikaia_plugin_api.script_service_server.models.base_model_ import Model
+from mikaia_plugin_api.script_service_server import util
+
+
+class ScriptInfo(Model):
+    """NOTE: This class is auto generated by OpenAPI Generator (https://openapi-generator.tech).
+
+    Do not edit the class manually.
+    """
+
+    def __init__(self, name=None, description=None):  # noqa: E501
+        """ScriptInfo - a model defined in OpenAPI
+
+        :param name: The name of this ScriptInfo.  # noqa: E501
+        :type name: str
+        :param description: The description of this ScriptInfo.  # noqa: E501
+        :type description: str
+        """
+        self.openapi_types = {
+            'name': str,
+            'description': str
+        }
+
+        self.attribute_map = {
+            'name': 'name',
+            'description': 'description'
+        }
+
+        self.name = name
+        self.description = description
+
+    @classmethod
+    def from_dict(cls, dikt) -> 'ScriptInfo':
+        """Returns the dict as a model
+
+        :param dikt: A dict.
+        :type: dict
+        :return: The ScriptInfo of this ScriptInfo.  # noqa: E501
+        :rtype: ScriptInfo
+        """
+        return util.deserialize_model(dikt, cls)
+
+    @property
+    def name(self):
+        """Gets the name of this ScriptInfo.
+
+        Name of the script  # noqa: E501
+
+        :return: The name of this ScriptInfo.
+        :rtype: str
+        """
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        """Sets the name of this ScriptInfo.
+
+        Name of the script  # noqa: E501
+
+        :param name: The name of this ScriptInfo.
+        :type name: str
+        """
+
+        self._name = name
+
+    @property
+    def description(self):
+        """Gets the description of this ScriptInfo.
+
+        Description of the script  # noqa: E501
+
+        :return: The description of this ScriptInfo.
+        :rtype: str
+        """
+        return self._description
+
+    @description.setter
+    def description(self, description):
+        """Sets the description of this ScriptInfo.
+
+        Description of the script  # noqa: E501
+
+        :param description: The description of this ScriptInfo.
+        :type description: str
+        """
+
+        self._description = description
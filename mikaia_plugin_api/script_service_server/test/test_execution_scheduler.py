@@ -0,0 +1,146 @@
+# coding: utf-8
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from mikaia_plugin_api.script_service_server.controllers.execution_scheduler import ExecutionLog, \
+    ExecutionScheduler, ScheduledExecution, startHeadlessProcess
+
+
+class _FakeHandle(object):
+    """Execution that runs until finish() is called"""
+
+    def __init__(self, name, started):
+        self.returnCode = None
+        self.cancelled = False
+        started.append(name)
+
+    def poll(self):
+        return self.returnCode
+
+    def usage(self):
+        return 1.5, 1024
+
+    def cancel(self):
+        self.cancelled = True
+        self.returnCode = -15
+
+    def finish(self):
+        self.returnCode = 0
+
+
+def _waitFor(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timeout')
+        time.sleep(0.02)
+
+
+class TestExecutionLog(unittest.TestCase):
+
+    def test_ring_buffer_and_offsets(self):
+        directory = tempfile.mkdtemp()
+        try:
+            log = ExecutionLog(os.path.join(directory, 'run.log'), max_memory_bytes=100, max_file_bytes=200)
+            log.write('first line\nsecond')
+            lines, offset = log.read()
+            self.assertEqual((lines, offset), (['first line'], 1))
+            log.write(' line\n')
+            self.assertEqual(log.read(offset), (['second line'], 2))
+            for i in range(50):
+                log.write('line {}\n'.format(i))
+            lines, offset = log.read(0)
+            self.assertEqual(offset, 52)
+            self.assertEqual(lines[-1], 'line 49')
+            self.assertLess(len(lines), 20)  # older lines dropped out of the ring buffer
+            self.assertEqual(log.read(-2)[0], ['line 48', 'line 49'])
+            self.assertFalse(log.wait(offset, 0.01))
+            log.close()
+            self.assertTrue(log.wait(offset, 0.01))
+            self.assertTrue(os.path.isfile(log.path + '.1'))  # rotated
+            self.assertLessEqual(os.path.getsize(log.path), 220)
+            log.remove()
+            self.assertFalse(os.path.exists(log.path))
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestExecutionScheduler(unittest.TestCase):
+
+    def test_concurrency_limit_and_priority(self):
+        started = []
+        handles = {}
+        scheduler = ExecutionScheduler(max_concurrent=1, policy='priority', poll_interval_s=0.01)
+        try:
+            def start(name):
+                handles[name] = _FakeHandle(name, started)
+                return handles[name]
+
+            first = scheduler.submit('a', 'a.py', lambda: start('a'))
+            low = scheduler.submit('b', 'b.py', lambda: start('b'), priority=0)
+            high = scheduler.submit('c', 'c.py', lambda: start('c'), priority=5)
+            self.assertEqual(first.status, ScheduledExecution.RUNNING)
+            self.assertEqual(low.status, ScheduledExecution.QUEUED)
+            self.assertEqual(high.status, ScheduledExecution.QUEUED)
+
+            handles['a'].finish()
+            _waitFor(lambda: first.status == ScheduledExecution.FINISHED and 'c' in started)
+            self.assertEqual(started, ['a', 'c'])
+            self.assertEqual(first.returnCode, 0)
+            self.assertEqual(first.cpuTime, 1.5)
+            self.assertEqual(first.peakRss, 1024)
+            self.assertIsNotNone(first.toDict()['wall_time_s'])
+
+            # cancel the queued and the running execution
+            self.assertTrue(scheduler.cancel('b')[0])
+            self.assertEqual(low.status, ScheduledExecution.FINISHED)
+            self.assertTrue(low.cancelled)
+            self.assertTrue(scheduler.cancel('c')[0])
+            _waitFor(lambda: high.status == ScheduledExecution.FINISHED)
+            self.assertTrue(handles['c'].cancelled)
+            self.assertEqual(started, ['a', 'c'])
+            self.assertFalse(scheduler.cancel('c')[0])
+            self.assertFalse(scheduler.cancel('unknown')[0])
+        finally:
+            scheduler.close()
+
+    def test_reaping(self):
+        scheduler = ExecutionScheduler(max_concurrent=0, keep_finished_s=0.05, poll_interval_s=0.01)
+        try:
+            started = []
+            execution = scheduler.submit('a', 'a.py', lambda: _FakeHandle('a', started))
+            execution.handle.finish()
+            _waitFor(lambda: scheduler.get('a') is None)
+            self.assertEqual(execution.status, ScheduledExecution.FINISHED)
+        finally:
+            scheduler.close()
+
+    def test_headless_process(self):
+        directory = tempfile.mkdtemp()
+        scheduler = ExecutionScheduler(max_concurrent=2, poll_interval_s=0.02)
+        try:
+            script = os.path.join(directory, 'script.py')
+            with open(script, 'w') as f:
+                f.write('import sys\nprint("hello", sys.argv[1])\ndata = bytearray(50 * 1024 * 1024)\nsys.exit(3)\n')
+            log = ExecutionLog(os.path.join(directory, 'script.log'))
+            args = [sys.executable, script, 'http://localhost/session']
+            execution = scheduler.submit('s', 'script.py', lambda: startHeadlessProcess(args, directory, log), log=log)
+            _waitFor(lambda: execution.status == ScheduledExecution.FINISHED, 30.0)
+            self.assertEqual(execution.returnCode, 3)
+            self.assertEqual(log.read()[0], ['hello http://localhost/session'])
+            self.assertTrue(log.closed)
+            if hasattr(os, 'wait4'):
+                self.assertGreater(execution.peakRss, 50 * 1024 * 1024)
+                self.assertIsNotNone(execution.cpuTime)
+        finally:
+            scheduler.close()
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# coding: utf-8
+
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mikaia_plugin_api.script_service_server.controllers.worker_pool import WorkerPool, isWorkerScript
+
+
+_SCRIPT = '''
+import os
+
+MIKAIA_RESIDENT_WORKER = True
+
+_state = {'init': 0}
+
+
+def init():
+    _state['init'] += 1
+    with open('init.log', 'a') as f:
+        f.write('{}\\n'.format(os.getpid()))
+
+
+def run(slide_service):
+    with open('run.log', 'a') as f:
+        f.write('{} {}\\n'.format(os.getpid(), _state['init']))
+    slide_service.getUserParameters()
+    return 7
+
+
+if __name__ == '__main__':
+    raise SystemExit('must not be executed by the worker')
+'''
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = b'[]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'plugin.py'), 'w') as f:
+            f.write(_SCRIPT)
+        with open(os.path.join(self.dir, 'classic.py'), 'w') as f:
+            f.write('import sys\nprint(sys.argv)\n')
+        # a run() function alone doesn't opt in to resident workers
+        with open(os.path.join(self.dir, 'unmarked.py'), 'w') as f:
+            f.write('def run(args):\n    print(args)\n\n\nif __name__ == "__main__":\n    run([])\n')
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/MIKAIA/SlideService/v1/session'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_is_worker_script(self):
+        self.assertTrue(isWorkerScript(os.path.join(self.dir, 'plugin.py')))
+        self.assertFalse(isWorkerScript(os.path.join(self.dir, 'classic.py')))
+        self.assertFalse(isWorkerScript(os.path.join(self.dir, 'unmarked.py')))
+        self.assertFalse(isWorkerScript(os.path.join(self.dir, 'missing.py')))
+
+    def test_warm_worker_is_reused_and_recycled(self):
+        pool = WorkerPool('plugin.py', self.dir, size=1, max_runs=2)
+        try:
+            for i in range(3):
+                execution = pool.execute('plugin.py_{:05d}'.format(i), self.url)
+                self.assertEqual(execution.wait(60), 7)
+        finally:
+            pool.close()
+        with open(os.path.join(self.dir, 'run.log')) as f:
+            runs = [line.split() for line in f.read().splitlines()]
+        with open(os.path.join(self.dir, 'init.log')) as f:
+            inits = f.read().splitlines()
+        self.assertEqual(len(runs), 3)
+        # init() is called once per worker process, the first two runs share the first worker
+        self.assertEqual(runs[0][0], runs[1][0])
+        self.assertNotEqual(runs[1][0], runs[2][0])
+        self.assertTrue(all(count == '1' for pid, count in runs))
+        self.assertIn(len(inits), (2, 3))  # the replacement of the second worker may already be warming up
+
+    def test_failing_init(self):
+        with open(os.path.join(self.dir, 'broken.py'), 'w') as f:
+            f.write('def init():\n    raise RuntimeError("no model")\n\ndef run(slide_service):\n    return 0\n')
+        pool = WorkerPool('broken.py', self.dir)
+        try:
+            self.assertEqual(pool.execute('broken.py_00001', self.url).wait(60), 1)
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
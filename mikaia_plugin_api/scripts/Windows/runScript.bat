@@ -0,0 +1,65 @@
+@echo off
+
+REM activate virtual python environment
+REM place here the full path to your virtual python environment if the 'mikaia_plugin_api' package has been installed to an virtual python environment
+REM or comment it out, if the 'mikaia_plugin_api' package has been installed to your regular python installation
+REM call C:\Path\to\your\virtual\python\environment\Scripts\activate
+REM call B:\Dev\FHG\MikaiaScripts\mikaia_venv\Scripts\activate
+
+if [%1]==[] goto noArgument
+if [%2]==[] goto noArgument
+
+set arg1=%1
+set arg2=%2
+set exit_code=-1
+
+REM echo arg1: %arg1%    arg2: %arg2%
+REM pause
+
+if %arg1%=="MIKAIA Python Console" goto openConsole
+
+REM echo start script
+REM pause
+title MIKAIA Slide Service    %arg1%
+python %arg1% %arg2%
+REM pwsh -ExecutionPolicy Bypass -Command python %arg1% %arg2%
+set exit_code=%ERRORLEVEL%
+goto finish
+
+:openConsole
+REM echo open MIKAIA Slide Service console
+REM pause
+python -i -m mikaia_plugin_api.console %arg2%
+REM pwsh -ExecutionPolicy Bypass -Command python -i -m mikaia_plugin_api.console %arg2%
+set exit_code=%ERRORLEVEL%
+goto finish
+
+:noArgument
+if not [%1]==[] goto argError
+if not [%2]==[] goto argError
+REM Called without arguments ==> Start MIKAIA Script Service
+REM @echo starting MIKAIA Script Service
+REM pause
+REM title MIKAIA Script Service    %~dp0*.py
+python -m mikaia_plugin_api.script_service_server
+set exit_code=0
+goto finish
+
+:argError
+@echo "Missing arguments - two required(Script name, MIKAIA SlideService root path)
+goto finish
+
+:finish
+REM Handle special exit code 100 of MIKAIA python scripts which means: 
+REM Everythig Ok, but don't wait for user input to exit the console window
+@echo exit with code: %exit_code%
+if %ERRORLEVEL% neq 0 (
+    echo An error occurred in the Python script.
+    pause
+)
+if %exit_code%==100 goto exit
+REM By default we wait for user input to exit the console window
+goto exit
+
+:exit
+exit exit_code
@@ -0,0 +1,254 @@
+import collections
+import math
+
+import numpy as np
+
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.annotation_index import AnnotationIndex
+
+
+# Returns (tile_w_um, tile_h_um, stride_w_um, stride_h_um) of an overlapped tiling: neighbouring tiles overlap by
+# 2 * margin_um, so every tile has a core of tile size - 2 * margin_um that no other tile's core overlaps.
+# Pass them to RoiTiler or CoarseToFine.
+def overlappedTiling(tile_w_um, tile_h_um, margin_um):
+    stride_w_um = tile_w_um - 2.0 * margin_um
+    stride_h_um = tile_h_um - 2.0 * margin_um
+    if margin_um < 0 or stride_w_um <= 0 or stride_h_um <= 0:
+        raise Exception('The margin shall be positive and less than half the tile size.')
+    return tile_w_um, tile_h_um, stride_w_um, stride_h_um
+
+
+###################################################
+## Stitching of instances over overlapping tiles ##
+###################################################
+class SeamStitcher(object):
+    """SeamStitcher Removes the cut and the duplicate instances(e.g. cells) of a segmentation on overlapping tiles.
+
+    The tiles overlap by 2 * margin(see overlappedTiling()). Every instance found in a tile is assigned
+    to the tile whose center is closest to the center of the instance's bounding box: an instance is
+    only kept by the tile whose core contains its center. Cells cut by a tile border have their center
+    in the margin of that tile, where the neighbouring tile sees them completely, so they are dropped.
+    This requires margin >= diameter of the largest instance + seam_um.
+
+    Instances whose center lies within 'seam_um' of the border between two cores are kept by both tiles
+    and deduplicated: they wait in a spatial hash until the neighbouring tile has been added(the
+    centers of the two copies may differ by up to 'seam_um', so instances up to 2 * seam_um before the
+    border wait, too). Of two instances whose bounding boxes overlap by at least 'iou_threshold'
+    (intersection over union), the larger one is kept. add() returns the instances that are final, ready for upload, so results
+    stream out tile by tile and only instances along the open seams are held back.
+
+    A resumed run(see RunJournal) passes the tiles completed by the previous run as 'done'. Their instances
+    along the seams to the remaining tiles were still held back when the previous run stopped, so the
+    remaining tiles keep these instances instead, up to 2 * seam_um beyond the border.
+
+    Usage:
+        tile_w, tile_h, stride_w, stride_h = overlappedTiling(512 * res.width, 512 * res.height, 40 * res.width)
+        tiles = RoiTiler(ss, tile_w, tile_h, stride_w, stride_h).tiles()
+        stitcher = SeamStitcher(tiles, 40 * res.width)
+        for tile, pixels in ss.iterTiles(tiles, ...):
+            ss.addAnnotationBatch(stitcher.add(tile, AnnotationBatch.fromContours(segment(pixels), 'Cells')))
+        ss.addAnnotationBatch(stitcher.flush())
+    """
+
+    # tiles: all tiles of the run [[x0_um, y0_um], [x1_um, y1_um]], in any order.
+    # margin_um: overlap of the tiles on each side(half the overlap of neighbouring tiles).
+    # seam_um: distance to the border between two cores within which instances are deduplicated. Default: margin / 4.
+    # iou_threshold: minimum bounding box intersection over union of two instances to be duplicates.
+    # hash_um: cell size of the spatial hash of the instances waiting at a seam. Default: margin.
+    # done: tiles of 'tiles' whose results were uploaded by a previous run with the same tiles and margin.
+    #       They can't be added, the other tiles take over their instances along the seams.
+    def __init__(self, tiles, margin_um, seam_um=0, iou_threshold=0.3, hash_um=0, done=()):
+        self._tiles = np.asarray(tiles, dtype=np.float64).reshape(-1, 4)
+        self._tileIndex = {tuple(row): i for i, row in enumerate(self._tiles.tolist())}
+        self._centers = (self._tiles[:, :2] + self._tiles[:, 2:]) / 2.0
+        self._tileTree = AnnotationIndex.fromBoxes(self._tiles)
+        self._seam = float(seam_um) if seam_um > 0 else margin_um / 4.0
+        self._iouThreshold = iou_threshold
+        self._hashSize = float(hash_um) if hash_um > 0 else max(float(margin_um), 1e-3)
+        self._added = np.zeros(len(self._tiles), dtype=bool)
+        self._done = np.zeros(len(self._tiles), dtype=bool)
+        for tile in done:
+            self._done[self._index(tile)] = True
+        self._added |= self._done
+        self._pending = {}  # id -> _Pending
+        self._hash = collections.defaultdict(set)  # hash cell -> ids of pending instances
+        self._waiting = collections.defaultdict(set)  # tile -> ids of pending instances waiting for it
+        self._nextId = 0
+        self._stats = {'tiles': 0, 'instances': 0, 'outside_core': 0, 'duplicates': 0, 'released': 0,
+                       'max_pending': 0}
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __str__(self):
+        return '{}(tiles={}, seam_um={}, pending={})'.format(self.__class__.__name__, len(self), self._seam,
+                                                             len(self._pending))
+
+    # Add the instances found in a tile.
+    # tile: one of the tiles passed to the constructor.
+    # annotations: AnnotationBatch or list of Annotation items in slide coordinates, or None.
+    # Returns an AnnotationBatch with the instances that are final now(of this and of earlier tiles).
+    def add(self, tile, annotations):
+        index = self._index(tile)
+        if self._added[index]:
+            raise Exception('The tile {} was already added.'.format(tile))
+        self._added[index] = True
+        if not isinstance(annotations, AnnotationBatch):
+            annotations = AnnotationBatch.fromAnnotations(annotations or [])
+        self._stats['tiles'] += 1
+        self._stats['instances'] += len(annotations)
+
+        boxes = annotations.boundingBoxes()
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2.0
+        neighbours = self._neighbours(index)
+        # signed distance of every center beyond the border between this tile's core and a neighbour's core
+        # (perpendicular bisector of the tile centers), only for neighbours that contain the center
+        own = self._centers[index]
+        other = self._centers[neighbours]
+        spacing = np.maximum(np.linalg.norm(other - own, axis=1), 1e-9)
+        offsets = centers[:, None, :]
+        beyond = (np.sum((offsets - own) ** 2, axis=2) - np.sum((offsets - other) ** 2, axis=2)) / (2.0 * spacing)
+        rects = self._tiles[neighbours]
+        inside = np.all((offsets >= rects[:, :2]) & (offsets <= rects[:, 2:]), axis=2)
+        beyond = np.where(inside, beyond, -np.inf)
+        # the instances along the seams of a done tile were never uploaded by it
+        limits = np.where(self._done[neighbours], 2.0 * self._seam, self._seam)
+        keep = np.all(beyond <= limits, axis=1)
+        self._stats['outside_core'] += int(np.count_nonzero(~keep))
+        # the neighbour may keep its copy of the instance, too: its center can differ by up to 'seam_um'
+        near = beyond >= -2.0 * self._seam
+
+        at_seam = np.any(near, axis=1)
+        # instances away from the seams are final at once
+        released = [(annotations, np.flatnonzero(keep & ~at_seam))]
+        seam_instances = np.flatnonzero(keep & at_seam)
+        areas = annotations.areas() if len(seam_instances) > 0 else None
+        for i in seam_instances:
+            if self._isDuplicate(boxes[i], areas[i], index):
+                continue
+            waiting = {int(neighbours[j]) for j in np.flatnonzero(near[i]) if not self._added[neighbours[j]]}
+            if waiting:
+                self._hold(annotations, i, boxes[i], areas[i], index, waiting)
+            else:
+                released.append((annotations, [i]))
+        for pending_id in self._waiting.pop(index, ()):
+            pending = self._pending[pending_id]
+            pending.waiting.discard(index)
+            if not pending.waiting:
+                released.append(self._drop(pending_id))
+        return self._collect(released)
+
+    # Returns all instances that are still waiting for a tile, e.g. for tiles that were skipped or failed.
+    def flush(self):
+        released = [self._drop(pending_id) for pending_id in sorted(self._pending)]
+        self._waiting.clear()
+        return self._collect(released)
+
+    # Number of added tiles and instances, instances dropped because their center is 'outside_core', 'duplicates'
+    # removed at the seams, 'released' instances, the instances 'pending' now and the 'max_pending' ones.
+    def stats(self):
+        return dict(self._stats, pending=len(self._pending))
+
+    # One-line summary of stats().
+    def summary(self):
+        stats = self.stats()
+        return '{} instances in {} tiles: {} released, {} outside the tile core, {} duplicates, {} pending(max {})'\
+            .format(stats['instances'], stats['tiles'], stats['released'], stats['outside_core'],
+                    stats['duplicates'], stats['pending'], stats['max_pending'])
+
+    def _index(self, tile):
+        index = self._tileIndex.get(tuple(np.asarray(tile, dtype=np.float64).reshape(4).tolist()))
+        if index is None:
+            raise Exception('The tile {} is not one of the tiles of the SeamStitcher.'.format(tile))
+        return index
+
+    # indices of the tiles that overlap tile 'index'
+    def _neighbours(self, index):
+        x0, y0, x1, y1 = self._tiles[index]
+        candidates = self._tileTree.queryRectIndices(x0, y0, x1 - x0, y1 - y0)
+        tiles = self._tiles[candidates]
+        overlap = ((np.minimum(tiles[:, 2], x1) - np.maximum(tiles[:, 0], x0) > 0)
+                   & (np.minimum(tiles[:, 3], y1) - np.maximum(tiles[:, 1], y0) > 0))
+        return np.sort(candidates[overlap & (candidates != index)])
+
+    # Compares the instance with the pending instances of other tiles. The smaller one of a duplicate pair is dropped.
+    # Returns True if the instance itself is dropped.
+    def _isDuplicate(self, box, area, tile):
+        candidates = set()
+        for cell in self._hashCells(box):
+            candidates |= self._hash.get(cell, set())
+        best_id, best_iou = None, self._iouThreshold
+        for pending_id in candidates:
+            if self._pending[pending_id].tile == tile:
+                continue
+            iou = self._iou(box, self._pending[pending_id].box)
+            if iou >= best_iou:
+                best_id, best_iou = pending_id, iou
+        if best_id is None:
+            return False
+        self._stats['duplicates'] += 1
+        if self._pending[best_id].area >= area:
+            return True
+        pending = self._pending[best_id]
+        self._drop(best_id)
+        for tile in pending.waiting:
+            self._waiting[tile].discard(best_id)
+        return False
+
+    def _hold(self, annotations, i, box, area, tile, waiting):
+        pending_id = self._nextId
+        self._nextId += 1
+        self._pending[pending_id] = _Pending(annotations, i, box, area, tile, waiting)
+        for cell in self._hashCells(box):
+            self._hash[cell].add(pending_id)
+        for waiting_tile in waiting:
+            self._waiting[waiting_tile].add(pending_id)
+        self._stats['max_pending'] = max(self._stats['max_pending'], len(self._pending))
+
+    # removes a pending instance, returns (batch, [index]) of it
+    def _drop(self, pending_id):
+        pending = self._pending.pop(pending_id)
+        for cell in self._hashCells(pending.box):
+            ids = self._hash[cell]
+            ids.discard(pending_id)
+            if not ids:
+                del self._hash[cell]
+        return pending.batch, [pending.index]
+
+    def _hashCells(self, box):
+        x0, y0 = int(math.floor(box[0] / self._hashSize)), int(math.floor(box[1] / self._hashSize))
+        x1, y1 = int(math.floor(box[2] / self._hashSize)), int(math.floor(box[3] / self._hashSize))
+        return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+    @staticmethod
+    def _iou(a, b):
+        w = min(a[2], b[2]) - max(a[0], b[0])
+        h = min(a[3], b[3]) - max(a[1], b[1])
+        if w <= 0 or h <= 0:
+            return 0.0
+        intersection = w * h
+        union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+        return intersection / union if union > 0 else 0.0
+
+    # one batch with the released instances, grouped by the batch they came from
+    def _collect(self, released):
+        groups = collections.OrderedDict()
+        for batch, indices in released:
+            groups.setdefault(id(batch), (batch, []))[1].extend(indices)
+        result = AnnotationBatch()
+        for batch, indices in groups.values():
+            result.extend(batch.select(indices))
+        self._stats['released'] += len(result)
+        return result
+
+
+class _Pending(object):
+    """_Pending Instance held back at a seam until the tiles in 'waiting' have been added"""
+
+    def __init__(self, batch, index, box, area, tile, waiting):
+        self.batch = batch
+        self.index = index
+        self.box = box
+        self.area = area
+        self.tile = tile
+        self.waiting = waiting
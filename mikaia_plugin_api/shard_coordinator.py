@@ -0,0 +1,426 @@
+import argparse
+import collections
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+
+
+class _Worker(object):
+    """_Worker State and statistics of one connected worker"""
+
+    def __init__(self, worker_id, name):
+        self.id = worker_id
+        self.name = name
+        self.shard = None  # index of the shard the worker takes its chunks from
+        self.inFlight = None  # chunk the worker is processing
+        self.chunks = 0
+        self.tiles = 0
+        self.busyS = 0.0
+        self.steals = 0
+        self.connected = True
+
+    def toDict(self):
+        return {'name': self.name, 'chunks': self.chunks, 'tiles': self.tiles, 'busy_s': self.busyS,
+                'steals': self.steals, 'tiles_per_s': self.tiles / self.busyS if self.busyS > 0 else 0.0}
+
+
+########################################################
+## Analysis of one slide sharded over several workers ##
+########################################################
+class ShardCoordinator(object):
+    """ShardCoordinator Runs one analysis on several worker processes, locally or on other hosts.
+
+    The tiles are partitioned into contiguous shards, one per worker. Every worker has its own
+    SlideService connection to the same session and requests its tiles chunk by chunk. A worker
+    whose shard is finished steals the second half of the largest remaining shard, so fast workers
+    take over the work of slow ones. The chunk a worker was processing when it disconnected is
+    handed to another worker. The workers return their annotations to the coordinator, which merges
+    them into few large uploads and sends one progress stream to MIKAIA.
+
+    The work is defined by a factory: factory(slide_service) is called once per worker(e.g. to load
+    the model) and returns a function process(tiles) -> list of Annotation items, AnnotationBatch or None.
+    The factory must be a top level function of a module the workers can import.
+    Workers on other hosts are started with
+        python -m mikaia_plugin_api.shard_coordinator <host>:<port> <authkey> [--slide-url <url>]
+    with the address and the hex authkey of the coordinator(see address and authkey). They connect to
+    the session URL 'slide_url' of the coordinator, or to the one given with --slide-url. The connection
+    is authenticated, but not encrypted: only use it within a trusted network.
+
+    Usage:
+        def setupCellpose(ss):
+            model = loadModel()
+            return lambda tiles: segment(ss, model, tiles)
+
+        coordinator = ShardCoordinator(ss, setupCellpose, workers=4)
+        coordinator.run(tiles)
+        print(coordinator.summary())
+
+    In a daemonic process(e.g. a resident script worker) no child processes can be started, there
+    the local workers run in threads of the calling process instead.
+    """
+
+    # slide_service: SlideService instance of the session. Used for the uploads and the progress updates,
+    #                the workers connect to the same session URL.
+    # factory: factory(slide_service) -> process(tiles), see above.
+    # workers: number of local worker processes. 0 if all workers run on other hosts.
+    # shards: number of shards the tiles are split into. Default: number of local workers(at least 1).
+    # chunk_tiles: number of tiles a worker requests at once.
+    # address: (host, port) the coordinator listens on. Default: a free port on localhost(local workers only).
+    #          Use e.g. ('0.0.0.0', 7700) to accept workers on other hosts, together with 'slide_url'.
+    # slide_url: session URL the workers on other hosts connect to,
+    #            e.g. 'http://10.54.75.161:9980/MIKAIA/SlideService/v1/<id>'.
+    #            The URL of 'slide_service' is usually 'http://localhost:...', which only works on this host.
+    #            Default: the URL of 'slide_service'. Local workers always use the URL of 'slide_service'.
+    # authkey: bytes the workers have to know to connect. Default: random.
+    # merge_annotations: the annotations returned by the workers are uploaded once this many are collected.
+    # progress: (start, end) range of the progress updates sent while running, or None for no progress updates.
+    # aggregator: ResultAggregator that is fed with the annotations returned by the workers, or None. Its final
+    #             result is sent at the end of run().
+    def __init__(self, slide_service, factory, workers=None, shards=None, chunk_tiles=8, address=None, authkey=None,
+                 merge_annotations=20000, progress=(0.0, 1.0), aggregator=None, slide_url=None):
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        if chunk_tiles < 1:
+            raise Exception("Parameter 'chunk_tiles' shall be at least 1.")
+        self._ss = slide_service
+        self._factory = factory
+        self._slideUrl = slide_url if slide_url else slide_service._rootPath
+        self._localWorkers = workers
+        self._shardCount = shards if shards is not None else max(1, workers)
+        self._chunkTiles = chunk_tiles
+        self._authkey = authkey if authkey is not None else os.urandom(16)
+        self._mergeAnnotations = merge_annotations
+        self._progress = progress
+        self._aggregator = aggregator
+        self._localOnly = address is None
+        self._listener = Listener(address if address is not None else ('127.0.0.1', 0), authkey=self._authkey)
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._chunks = []
+        self._shards = []
+        self._owners = []  # worker id per shard, or None
+        self._results = queue.Queue()
+        self._errors = []
+        self._completedTiles = 0
+        self._total = 0
+        self._finished = threading.Event()
+        self._requeued = 0
+        self._uploads = 0
+        self._wallS = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __str__(self):
+        return '{}(address={}, local workers={}, shards={}, chunk_tiles={})'.format(
+            self.__class__.__name__, self.address, self._localWorkers, self._shardCount, self._chunkTiles)
+
+    # (host, port) the coordinator listens on.
+    @property
+    def address(self):
+        return self._listener.address
+
+    # authkey of the coordinator as hex string, to pass to remote workers.
+    @property
+    def authkey(self):
+        return self._authkey.hex()
+
+    def close(self):
+        self._finished.set()
+        self._listener.close()
+
+    # Process all tiles. Can be called once per ShardCoordinator.
+    # tiles: list of tile coordinates [[x0_um, y0_um], [x1_um, y1_um]] or any iterable of them, e.g. a RoiTiler.
+    # Returns the number of processed tiles. An exception raised by a worker stops the run and is raised again here.
+    def run(self, tiles):
+        tiles = [tile for tile in tiles]
+        self._total = len(tiles)
+        self._chunks = [tiles[i:i + self._chunkTiles] for i in range(0, len(tiles), self._chunkTiles)]
+        per_shard = -(-len(self._chunks) // self._shardCount)
+        self._shards = [collections.deque(range(i, min(i + per_shard, len(self._chunks))))
+                        for i in range(0, len(self._chunks), per_shard)] if self._chunks else []
+        self._owners = [None] * len(self._shards)
+        if not self._chunks:
+            self._finished.set()
+
+        start = time.perf_counter()
+        accepter = threading.Thread(target=self._accept, name='ShardCoordinator-accept', daemon=True)
+        accepter.start()
+        local = self._startLocalWorkers()
+        batch = AnnotationBatch()
+        annotations = []
+        processed = 0
+        try:
+            while True:
+                try:
+                    item = self._results.get(timeout=0.1)
+                except queue.Empty:
+                    item = None
+                if item is not None:
+                    tile_count, result = item
+                    processed += tile_count
+                    if isinstance(result, AnnotationBatch):
+                        batch.extend(result)
+                    elif result:
+                        annotations.extend(result)
+                    if self._aggregator is not None:
+                        self._aggregator.add(result, tiles=tile_count)
+                    if len(batch) + len(annotations) >= self._mergeAnnotations:
+                        batch, annotations = self._upload(batch, annotations)
+                    self._sendProgress(processed)
+                elif self._finished.is_set():
+                    break
+                elif (self._localOnly and local and not any(worker.is_alive() for worker in local)
+                      and not self._connectedWorkers()):
+                    raise Exception('All local workers exited before the run was finished.')
+            if self._errors:
+                raise self._errors[0]
+            self._upload(batch, annotations)
+            if self._aggregator is not None:
+                self._aggregator.finish()
+        finally:
+            self._finished.set()
+            for worker in local:
+                worker.join(timeout=10)
+                if hasattr(worker, 'terminate') and worker.is_alive():
+                    worker.terminate()
+            self._listener.close()
+            self._wallS = time.perf_counter() - start
+        return self._completedTiles
+
+    # Statistics per worker: name, chunks, tiles, busy_s(time spent in process(tiles)), steals and tiles_per_s
+    # (while busy), plus 'wall_s', 'tiles', 'tiles_per_s' of the whole run, chunks 'requeued' after a worker
+    # disconnected and the number of annotation 'uploads'.
+    def stats(self):
+        with self._lock:
+            workers = {worker.id: worker.toDict() for worker in self._workers.values()}
+            return {'workers': workers, 'wall_s': self._wallS, 'tiles': self._completedTiles,
+                    'tiles_per_s': self._completedTiles / self._wallS if self._wallS > 0 else 0.0,
+                    'steals': sum(worker['steals'] for worker in workers.values()), 'requeued': self._requeued,
+                    'uploads': self._uploads}
+
+    # One-line summary of stats().
+    def summary(self):
+        stats = self.stats()
+        parts = ['{} {} tiles {:.1f} tiles/s {} steals'.format(worker['name'], worker['tiles'], worker['tiles_per_s'],
+                                                                worker['steals'])
+                 for worker in stats['workers'].values()]
+        return '{} tiles in {:.2f} s({:.1f} tiles/s) on {} workers, {} steals, {} requeued, {} uploads | {}'.format(
+            stats['tiles'], stats['wall_s'], stats['tiles_per_s'], len(parts), stats['steals'], stats['requeued'],
+            stats['uploads'], ' | '.join(parts))
+
+    def _startLocalWorkers(self):
+        workers = []
+        use_threads = multiprocessing.current_process().daemon
+        context = multiprocessing.get_context('spawn')
+        for i in range(self._localWorkers):
+            name = 'local-{}'.format(i)
+            if use_threads:
+                worker = threading.Thread(target=runWorker,
+                                          args=(self.address, self._authkey, name, self._ss._rootPath),
+                                          name='ShardCoordinator-' + name, daemon=True)
+            else:
+                worker = context.Process(target=runWorker,
+                                         args=(self.address, self._authkey, name, self._ss._rootPath),
+                                         name='ShardCoordinator-' + name, daemon=True)
+            worker.start()
+            workers.append(worker)
+        return workers
+
+    def _upload(self, batch, annotations):
+        if len(batch) > 0:
+            if self._ss.addAnnotationBatch(batch) is None:
+                raise Exception('Upload of {} annotations failed.'.format(len(batch)))
+            self._uploads += 1
+        if annotations:
+            if self._ss.addAnnotations(annotations) is None:
+                raise Exception('Upload of {} annotations failed.'.format(len(annotations)))
+            self._uploads += 1
+        return AnnotationBatch(), []
+
+    def _sendProgress(self, processed):
+        if self._progress is None or self._total == 0:
+            return
+        progress_start, progress_end = self._progress
+        self._ss.sendProgress(progress_start + (progress_end - progress_start) * processed / self._total, 0,
+                              '{} of {} tiles processed'.format(processed, self._total))
+
+    def _connectedWorkers(self):
+        with self._lock:
+            return sum(1 for worker in self._workers.values() if worker.connected)
+
+    ##############
+    ## Protocol ##
+    ##############
+
+    def _accept(self):
+        while not self._finished.is_set():
+            try:
+                conn = self._listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            except OSError:
+                return  # listener closed
+            threading.Thread(target=self._serve, args=(conn,), name='ShardCoordinator-connection',
+                             daemon=True).start()
+
+    # Messages of a worker: ('hello', name), then ('next', finished chunk or None, annotations, busy seconds)
+    # until it receives ('done',), or ('error', chunk, traceback).
+    def _serve(self, conn):
+        worker = None
+        try:
+            message = conn.recv()
+            if message[0] != 'hello':
+                return
+            with self._lock:
+                worker = _Worker(len(self._workers), message[1] or 'worker-{}'.format(len(self._workers)))
+                self._workers[worker.id] = worker
+            conn.send(('config', worker.id, self._slideUrl, self._factory))
+            while True:
+                message = conn.recv()
+                if message[0] == 'error':
+                    self._errors.append(Exception('Worker {} failed on chunk {}:\n{}'.format(
+                        worker.name, message[1], message[2])))
+                    self._finished.set()
+                    conn.send(('done',))
+                    return
+                _, chunk_id, annotations, busy_s = message
+                if chunk_id is not None:
+                    self._complete(worker, chunk_id, annotations, busy_s)
+                conn.send(self._nextChunk(worker))
+        except (EOFError, OSError):
+            pass
+        finally:
+            if worker is not None:
+                self._release(worker)
+            conn.close()
+
+    def _complete(self, worker, chunk_id, annotations, busy_s):
+        with self._lock:
+            if worker.inFlight != chunk_id:
+                return
+            worker.inFlight = None
+            tile_count = len(self._chunks[chunk_id])
+            worker.chunks += 1
+            worker.tiles += tile_count
+            worker.busyS += busy_s
+            self._completedTiles += tile_count
+            self._results.put((tile_count, annotations))
+            if self._completedTiles == self._total:
+                self._finished.set()
+
+    def _nextChunk(self, worker):
+        with self._lock:
+            if self._finished.is_set():
+                return ('done',)
+            if worker.shard is None or not self._shards[worker.shard]:
+                self._claimShard(worker)
+            if worker.shard is None:
+                return ('wait',)  # the last chunks are in flight, one of them may be requeued
+            chunk_id = self._shards[worker.shard].popleft()
+            worker.inFlight = chunk_id
+            return ('chunk', chunk_id, self._chunks[chunk_id])
+
+    # take an unowned shard or steal the second half of the largest shard of another worker
+    def _claimShard(self, worker):
+        if worker.shard is not None:
+            self._owners[worker.shard] = None
+            worker.shard = None
+        free = [i for i, shard in enumerate(self._shards) if shard and self._owners[i] is None]
+        if free:
+            index = max(free, key=lambda i: len(self._shards[i]))
+        else:
+            owned = [i for i, shard in enumerate(self._shards) if shard]
+            if not owned:
+                return
+            victim = self._shards[max(owned, key=lambda i: len(self._shards[i]))]
+            stolen = collections.deque(victim.pop() for i in range((len(victim) + 1) // 2))
+            stolen.reverse()
+            self._shards.append(stolen)
+            self._owners.append(None)
+            index = len(self._shards) - 1
+            worker.steals += 1
+        self._owners[index] = worker.id
+        worker.shard = index
+
+    # hand the shard and the chunk in flight of a disconnected worker to the other workers
+    def _release(self, worker):
+        with self._lock:
+            worker.connected = False
+            if worker.shard is not None:
+                self._owners[worker.shard] = None
+                worker.shard = None
+            if worker.inFlight is not None:
+                self._shards.append(collections.deque([worker.inFlight]))
+                self._owners.append(None)
+                worker.inFlight = None
+                self._requeued += 1
+
+
+# Connect to a ShardCoordinator and process chunks of tiles until the run is finished.
+# address: (host, port) of the coordinator.
+# authkey: authkey of the coordinator as bytes or hex string.
+# name: name of the worker in the statistics. Default: host name and process id.
+def runWorker(address, authkey, name=None, slide_url=None):
+    from mikaia_plugin_api import mikaia_api
+    if isinstance(authkey, str):
+        authkey = bytes.fromhex(authkey)
+    conn = Client(tuple(address), authkey=authkey)
+    try:
+        conn.send(('hello', name or '{}-{}'.format(os.uname().nodename if hasattr(os, 'uname') else 'host',
+                                                   os.getpid())))
+        _, worker_id, slide_path, factory = conn.recv()
+        ss = mikaia_api.SlideService(slide_url or slide_path, telemetry_rate_hz=0)
+        try:
+            process = factory(ss)
+            chunk_id, annotations, busy_s = None, None, 0.0
+            while True:
+                conn.send(('next', chunk_id, annotations, busy_s))
+                reply = conn.recv()
+                chunk_id, annotations, busy_s = None, None, 0.0
+                if reply[0] == 'done':
+                    return
+                if reply[0] == 'wait':
+                    time.sleep(0.05)
+                    continue
+                _, chunk_id, tiles = reply
+                start = time.perf_counter()
+                try:
+                    annotations = process(tiles)
+                except Exception:
+                    conn.send(('error', chunk_id, traceback.format_exc()))
+                    conn.recv()
+                    return
+                busy_s = time.perf_counter() - start
+        finally:
+            ss.close()
+    except EOFError:
+        pass  # the coordinator finished or stopped
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker of a mikaia_plugin_api ShardCoordinator.')
+    parser.add_argument('address', help='<host>:<port> of the coordinator')
+    parser.add_argument('authkey', help='authkey of the coordinator(hex)')
+    parser.add_argument('--name', default=None, help='name of the worker in the statistics')
+    parser.add_argument('--slide-url', default=None,
+                        help='session URL of the SlideService as seen from this host(default: the URL sent by the '
+                             'coordinator)')
+    args = parser.parse_args()
+    host, port = args.address.rsplit(':', 1)
+    runWorker((host, int(port)), args.authkey, args.name, args.slide_url)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import atexit
+import collections
+import threading
+import time
+import weakref
+
+
+#################################################
+## Background sender for progress and messages ##
+#################################################
+class TelemetrySender(object):
+    """TelemetrySender Sends progress updates and messages from a background thread.
+
+    Progress updates are coalesced: only the latest value is kept and it is sent at most
+    'rate_hz' times per second. Messages are queued(bounded, the oldest are dropped when
+    the queue is full) and sent in order. Neither call blocks the caller, so progress can
+    be reported per tile at virtually no cost.
+    Pending updates are flushed by flush(), close() and at interpreter exit.
+    """
+
+    # send: callable(item) that transmits one progress update or message. Called from the sender thread only.
+    # rate_hz: maximum number of progress updates per second.
+    # max_messages: maximum number of queued messages.
+    # drop_notice: callable(count) -> item that reports dropped messages or None.
+    def __init__(self, send, rate_hz=5.0, max_messages=1000, drop_notice=None):
+        if rate_hz <= 0:
+            raise Exception("Parameter 'rate_hz' shall be positive.")
+        self._send = send
+        self._interval = 1.0 / rate_hz
+        self._dropNotice = drop_notice
+        self._lock = threading.Condition()
+        self._messages = collections.deque(maxlen=max_messages)
+        self._dropped = 0
+        self._progress = None  # latest progress update not sent yet
+        self._lastProgressTime = 0.0
+        self._busy = False  # the sender thread is transmitting
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='TelemetrySender', daemon=True)
+        self._thread.start()
+        # flush at interpreter exit, without keeping the sender alive
+        self._atexit = _AtexitFlush(weakref.ref(self))
+        atexit.register(self._atexit)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Replace the pending progress update by 'item'.
+    def progress(self, item):
+        with self._lock:
+            if self._closed:
+                return
+            self._progress = item
+            self._lock.notify()
+
+    # Queue the message 'item'.
+    def message(self, item):
+        with self._lock:
+            if self._closed:
+                return
+            if len(self._messages) == self._messages.maxlen:
+                self._dropped += 1
+            self._messages.append(item)
+            self._lock.notify()
+
+    # Wait until all pending updates have been sent. Returns False on timeout.
+    def flush(self, timeout=None):
+        with self._lock:
+            self._lastProgressTime = 0.0  # don't wait for the rate limit
+            self._lock.notify()
+            return self._lock.wait_for(self._idle, timeout)
+
+    # Send the pending updates and stop the sender thread.
+    def close(self, timeout=10.0):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._lastProgressTime = 0.0
+            self._lock.notify_all()
+        self._thread.join(timeout)
+        atexit.unregister(self._atexit)
+
+    def _idle(self):
+        return not self._busy and not self._messages and self._progress is None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._messages:
+                        break
+                    if self._progress is not None:
+                        wait = self._lastProgressTime + self._interval - time.monotonic()
+                        if wait <= 0 or self._closed:
+                            break
+                        self._lock.wait(wait)
+                        continue
+                    if self._closed:
+                        return
+                    self._lock.wait()
+                items = list(self._messages)
+                self._messages.clear()
+                dropped, self._dropped = self._dropped, 0
+                progress, self._progress = self._progress, None
+                if progress is not None:
+                    self._lastProgressTime = time.monotonic()
+                self._busy = True
+
+            if dropped > 0 and self._dropNotice is not None:
+                items.insert(0, self._dropNotice(dropped))
+            if progress is not None:
+                items.append(progress)
+            for item in items:
+                try:
+                    self._send(item)
+                except Exception as e:
+                    print('TelemetrySender: failed to send update: {}'.format(e))
+
+            with self._lock:
+                self._busy = False
+                self._lock.notify_all()
+
+
+class _AtexitFlush(object):
+    """_AtexitFlush Closes the referenced TelemetrySender at interpreter exit(if it still exists)"""
+
+    def __init__(self, sender_ref):
+        self._senderRef = sender_ref
+
+    def __call__(self):
+        sender = self._senderRef()
+        if sender is not None:
+            sender.close()
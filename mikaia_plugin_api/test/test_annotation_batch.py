@@ -0,0 +1,108 @@
+# coding: utf-8
+
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mikaia_plugin_api import annotation_batch, mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+def _contours(count):
+    rng = np.random.default_rng(0)
+    return [rng.uniform(0, 50000, size=(int(rng.integers(3, 40)), 1, 2)).astype(np.float32) for i in range(count)]
+
+
+class TestAnnotationBatch(unittest.TestCase):
+
+    def _checkJson(self):
+        contours = _contours(20)
+        batch = AnnotationBatch.fromContours(contours, 'Cells')
+        batch.addAnnotation('PathWithHoles', [[0, 0], [10, 0], [10, 10]], [[[1, 1], [2, 1], [2, 2]]], 'Holes "1"')
+        expected = [mikaia_api.Annotation(shapeType='Polygon', className='Cells',
+                                          coordinates=[c.reshape(-1).tolist()]) for c in contours]
+        expected.append(mikaia_api.Annotation(shapeType='PathWithHoles', className='Holes "1"',
+                                              coordinates=[[0, 0, 10, 0, 10, 10], [1, 1, 2, 1, 2, 2]]))
+        encoded = json.loads(batch.toJson())
+        reference = json.loads(mikaia_api.Annotation.list_to_json(expected))
+        self.assertEqual(len(encoded), len(reference))
+        for item, ref in zip(encoded, reference):
+            self.assertEqual(set(item), set(ref))
+            self.assertEqual(item['className'], ref['className'])
+            for coords, ref_coords in zip(item['coordinates'], ref['coordinates']):
+                np.testing.assert_allclose(coords, ref_coords, rtol=1e-6)
+
+    def test_json(self):
+        self._checkJson()
+
+    def test_json_without_orjson(self):
+        with mock.patch.object(annotation_batch, 'orjson', None):
+            self._checkJson()
+
+    def test_round_trip(self):
+        annotations = [mikaia_api.Annotation(shapeType='Rectangle', className='A', coordinates=[[1.0, 2.0, 3.0, 4.0]]),
+                       mikaia_api.Annotation(shapeType='Point', className='B', coordinates=[[5.5, 6.5]])]
+        result = AnnotationBatch.fromAnnotations(annotations).toAnnotations()
+        self.assertEqual([(a.shapeType, a.className, a.coordinates) for a in result],
+                         [(a.shapeType, a.className, a.coordinates) for a in annotations])
+
+    def test_extend(self):
+        first = AnnotationBatch.fromContours(_contours(3), 'Cells')
+        second = AnnotationBatch.fromContours(_contours(2), 'Nuclei')
+        second.addAnnotation('PathWithHoles', [[0, 0], [10, 0], [10, 10]], [[[1, 1], [2, 1], [2, 2]]], 'Cells')
+        expected = first.toAnnotations() + second.toAnnotations()
+        merged = first.extend(second).extend(AnnotationBatch())
+        self.assertEqual(len(merged), 6)
+        self.assertEqual(merged.classNames, ['Cells', 'Nuclei'])
+        self.assertEqual([(a.shapeType, a.className, a.coordinates) for a in merged.toAnnotations()],
+                         [(a.shapeType, a.className, a.coordinates) for a in expected])
+        self.assertTrue(np.all(merged.ids == -1))
+
+    def test_areas(self):
+        rng = np.random.default_rng(1)
+        batch = AnnotationBatch.fromContours(_contours(20), 'Cells')
+        batch.addAnnotation('PathWithHoles', [[0, 0], [10, 0], [10, 10]], [[[1, 1], [2, 1], [2, 2]]], 'Holes')
+        for shape_type, points in (('Point', 1), ('Line', 2), ('Rectangle', 2), ('Ellipse', 2), ('Polygon', 0)):
+            batch.addAnnotation(shape_type, rng.uniform(0, 100, size=(points, 2)), class_name='Shapes')
+        expected = [anno.area() for anno in batch.toAnnotations()]
+        np.testing.assert_allclose(batch.areas(), expected, rtol=1e-5)
+        self.assertEqual(batch.areas()[20], 50.0 - 0.5)
+        self.assertEqual(len(AnnotationBatch().areas()), 0)
+
+    def test_bounding_boxes_and_select(self):
+        batch = AnnotationBatch.fromContours(_contours(5), 'Cells')
+        batch.addAnnotation('PathWithHoles', [[0, 0], [10, 0], [10, 10]], [[[1, 1], [2, 1], [2, 2]]], 'Holes')
+        batch.addAnnotation('Polygon', np.zeros((0, 2)), class_name='Empty')
+        annotations = batch.toAnnotations()
+        rects = [anno.boundingRect() for anno in annotations]
+        np.testing.assert_allclose(batch.boundingBoxes(),
+                                   [[r.x, r.y, r.x + r.width, r.y + r.height] for r in rects], rtol=1e-6)
+        selected = batch.select([5, 2, 0])
+        self.assertEqual(selected.classNames, ['Cells', 'Holes'])
+        self.assertEqual([(a.shapeType, a.className, a.coordinates) for a in selected.toAnnotations()],
+                         [(a.shapeType, a.className, a.coordinates) for a in (annotations[5], annotations[2],
+                                                                              annotations[0])])
+        self.assertEqual(len(batch.select([])), 0)
+
+    def test_chunked_upload_maps_ids(self):
+        batch = AnnotationBatch.fromContours(_contours(500), 'Cells')
+        chunks = list(batch.iterJsonChunks(max_chunk_bytes=20000))
+        self.assertGreater(len(chunks), 5)
+        for first, end, data in chunks:
+            self.assertLess(len(data), 2 * 20000)
+        with MockSlideService(SyntheticSlide(1000, 1000, 0.25)) as server:
+            ss = mikaia_api.SlideService(server.url, telemetry_rate_hz=0)
+            self.assertIs(ss.addAnnotationBatch(batch, max_chunk_bytes=20000), batch)
+            self.assertEqual(server.requestCount, len(chunks))
+            self.assertEqual(sorted(server.annotations), list(batch.ids))
+            # every id belongs to the annotation it was assigned to
+            for anno_id, anno in zip(batch.ids, batch.toAnnotations()):
+                np.testing.assert_allclose(server.annotations[anno_id]['coordinates'][0], anno.coordinates[0], rtol=1e-6)
+            ss.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# coding: utf-8
+
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_index import AnnotationIndex
+
+
+class TestAnnotationGeometry(unittest.TestCase):
+
+    def test_path_with_holes(self):
+        anno = mikaia_api.Annotation(shapeType='PathWithHoles',
+                                     coordinates=[[0, 0, 10, 0, 10, 10, 0, 10], [2, 2, 4, 2, 4, 4, 2, 4]])
+        self.assertEqual(anno.area(), 96.0)
+        centroid = anno.centroid()
+        self.assertAlmostEqual(centroid.x, 488.0 / 96.0)
+        self.assertTrue(anno.containsPoint(1.0, 1.0))
+        self.assertFalse(anno.containsPoint(3.0, 3.0))
+        self.assertFalse(anno.containsPoint(11.0, 3.0))
+        br = anno.boundingRect()
+        self.assertEqual((br.x, br.y, br.width, br.height), (0.0, 0.0, 10.0, 10.0))
+        self.assertEqual(anno.toArrays()[1], [[2, 2], [4, 2], [4, 4], [2, 4]])
+
+    def test_rectangle_and_ellipse(self):
+        rect = mikaia_api.Annotation(shapeType='Rectangle', coordinates=[[10.0, 20.0, 30.0, 60.0]])
+        ellipse = mikaia_api.Annotation(shapeType='Ellipse', coordinates=[[10.0, 20.0, 30.0, 60.0]])
+        self.assertEqual(rect.area(), 800.0)
+        self.assertAlmostEqual(ellipse.area(), np.pi * 10.0 * 20.0)
+        self.assertTrue(ellipse.containsPoint(20.0, 40.0))
+        self.assertFalse(ellipse.containsPoint(11.0, 21.0))
+        self.assertTrue(rect.containsPoint(11.0, 21.0))
+
+    def test_cache_follows_coordinate_changes(self):
+        anno = mikaia_api.Annotation(shapeType='Polygon', coordinates=[[0, 0, 1, 0, 1, 1]])
+        self.assertEqual(anno.boundingRect().width, 1.0)
+        anno.coordinates = [[0, 0, 5, 0, 5, 5]]
+        self.assertEqual(anno.boundingRect().width, 5.0)
+
+
+class TestAnnotationIndex(unittest.TestCase):
+
+    def test_queries_match_brute_force(self):
+        rng = np.random.default_rng(1)
+        annotations = []
+        for i in range(5000):
+            x, y = rng.uniform(0, 10000, 2)
+            size = rng.uniform(1, 40)
+            annotations.append(mikaia_api.Annotation(shapeType='Polygon',
+                                                     coordinates=[[x, y, x + size, y, x, y + size]]))
+        index = AnnotationIndex(annotations)
+        self.assertEqual(len(index), 5000)
+        for i in range(50):
+            x, y = rng.uniform(0, 10000, 2)
+            expected = [a for a in annotations
+                        if a.boundingRect().x <= x + 300 and a.boundingRect().x + a.boundingRect().width >= x
+                        and a.boundingRect().y <= y + 200 and a.boundingRect().y + a.boundingRect().height >= y]
+            self.assertEqual(sorted(map(id, index.queryRect(x, y, 300, 200))), sorted(map(id, expected)))
+
+            px, py = rng.uniform(0, 10000, 2)
+            expected = [a for a in annotations if a.containsPoint(px, py)]
+            self.assertEqual(sorted(map(id, index.queryPoint(px, py))), sorted(map(id, expected)))
+
+    def test_empty(self):
+        index = AnnotationIndex([])
+        self.assertEqual(len(index.queryRectIndices(0, 0, 10, 10)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
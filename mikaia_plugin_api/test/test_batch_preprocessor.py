@@ -0,0 +1,85 @@
+# coding: utf-8
+
+import gc
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.batch_preprocessor import BatchPreprocessor, scaleToMinusOneOne, scaleToZeroOne
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+class TestBatchPreprocessor(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockSlideService(SyntheticSlide(8000, 8000, 0.5)).start()
+        cls.ss = mikaia_api.SlideService(cls.server.url, telemetry_rate_hz=0)
+        cls.tiles = [[[x * 32.0, y * 32.0], [x * 32.0 + 32.0, y * 32.0 + 32.0]] for y in range(3) for x in range(3)]
+        cls.expected = [cls.ss.getNativeROIArray(t[0][0], t[0][1], 64, 64) for t in cls.tiles]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ss.close()
+        cls.server.close()
+
+    def check(self, preprocessor, transform):
+        seen = []
+        for batch_tiles, batch, ok in preprocessor:
+            self.assertEqual(len(batch_tiles), len(batch))
+            self.assertTrue(ok.all())
+            for tile, pixels in zip(batch_tiles, batch):
+                index = self.tiles.index(tile)
+                np.testing.assert_allclose(pixels, transform(self.expected[index]), atol=1e-2)
+                seen.append(index)
+        self.assertEqual(seen, list(range(len(self.tiles))))
+
+    def test_processes(self):
+        preprocessor = BatchPreprocessor(self.ss, self.tiles, 4, 64, 64, transform=scaleToMinusOneOne, workers=2)
+        self.assertEqual(len(preprocessor), 3)
+        self.check(preprocessor, lambda pixels: pixels / 127.5 - 1.0)
+        self.assertEqual(preprocessor._sharedMemory, [])
+
+    def test_threads(self):
+        with BatchPreprocessor(self.ss, self.tiles, 2, px_width_um=0.5, transform=scaleToZeroOne, dtype='float16',
+                               workers=0) as preprocessor:
+            self.check(preprocessor, lambda pixels: pixels / 255.0)
+
+    def test_uint8(self):
+        with BatchPreprocessor(self.ss, self.tiles, 9, 64, 64, dtype='uint8', workers=1) as preprocessor:
+            batches = [batch.copy() for batch_tiles, batch, ok in preprocessor]
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].dtype, np.uint8)
+        np.testing.assert_array_equal(batches[0], np.stack(self.expected))
+
+    def test_region_requests(self):
+        # the neighbouring tiles of a batch in the same row are read with one request: [0 1 2][3] [4 5][6 7] [8]
+        requests = self.server.requestCount
+        self.check(BatchPreprocessor(self.ss, self.tiles, 4, 64, 64, workers=0), lambda pixels: pixels)
+        self.assertEqual(self.server.requestCount - requests, 5)
+        requests = self.server.requestCount
+        self.check(BatchPreprocessor(self.ss, self.tiles, 4, 64, 64, workers=0, region_tiles=1), lambda pixels: pixels)
+        self.assertEqual(self.server.requestCount - requests, 9)
+
+    def test_batch_after_loop(self):
+        # the last batch is still readable after the iteration closed the preprocessor and it was released
+        for batch_tiles, batch, ok in BatchPreprocessor(self.ss, self.tiles, 4, 64, 64, workers=2):
+            pass
+        gc.collect()
+        np.testing.assert_array_equal(batch, self.expected[8][None])
+        batches = list(BatchPreprocessor(self.ss, self.tiles, 4, 64, 64, dtype='uint8', workers=2))
+        gc.collect()
+        self.assertEqual([len(batch) for batch_tiles, batch, ok in batches], [4, 4, 1])
+
+    def test_early_break(self):
+        preprocessor = BatchPreprocessor(self.ss, self.tiles, 2, 64, 64, workers=2)
+        for batch_tiles, batch, ok in preprocessor:
+            break
+        preprocessor.close()
+        self.assertEqual(preprocessor._sharedMemory, [])
+        self.assertFalse(any(worker.is_alive() for worker in preprocessor._workers))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# coding: utf-8
+
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.batch_runner import BatchRunner
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+class TestBatchRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(8000, 8000, 0.5)).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        # two "ROIs" of 7 and 4 tiles
+        self.tiles = [[[x * 16.0, y * 16.0], [x * 16.0 + 16.0, y * 16.0 + 16.0]] for y in range(2) for x in range(7)]
+        self.tiles = self.tiles[:7] + self.tiles[10:]
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+
+    def test_results(self):
+        batch_sizes = []
+
+        def model(batch):
+            batch_sizes.append(len(batch))
+            return batch.mean(axis=(1, 2, 3))
+
+        runner = BatchRunner(self.ss, model, preprocess=lambda pixels: pixels / 255.0, batch_size=4, w_px=32, h_px=32)
+        results = runner.run(self.tiles)
+        # batches are formed across the ROIs, only the last one is partial
+        self.assertEqual(batch_sizes, [4, 4, 3])
+        expected = [self.ss.getNativeROIArray(t[0][0], t[0][1], 32, 32).mean() / 255.0 for t in self.tiles]
+        np.testing.assert_allclose(results, expected)
+
+        stats = runner.stats()
+        self.assertEqual(stats['tiles'], 11)
+        self.assertEqual(stats['stages']['predict']['items'], 3)
+        self.assertEqual(stats['stages']['fetch']['tiles'], 11)
+        self.assertIn(stats['bottleneck'], stats['stages'])
+        self.assertTrue(runner.summary().startswith('11 tiles in '))
+
+    def test_pad_and_upload(self):
+        def model(batch):
+            self.assertEqual(batch.shape, (4, 32, 32, 3))
+            self.assertEqual(batch.dtype, np.float16)
+            return np.arange(len(batch))
+
+        def postprocess(batch_tiles, results):
+            self.assertEqual(len(batch_tiles), len(results))
+            return [self.ss.createAnnotation('Rectangle', tile, class_name='Class{}'.format(r))
+                    for tile, r in zip(batch_tiles, results)]
+
+        runner = BatchRunner(self.ss, model, postprocess=postprocess, batch_size=4, w_px=32, h_px=32, pad=True,
+                             dtype='float16', progress=(0.1, 0.9))
+        self.assertEqual(runner.run(self.tiles), 11)
+        self.assertEqual(len(self.server.annotations), 11)
+        self.assertAlmostEqual(self.server.progress[-1]['progressRatio'], 0.9)
+
+    def test_annotation_batch(self):
+        def postprocess(batch_tiles, results):
+            contours = [np.array(tile, dtype=np.float32).reshape(-1, 1, 2)[[0, 1, 1]] for tile in batch_tiles]
+            return AnnotationBatch.fromContours(contours, 'Cells')
+
+        runner = BatchRunner(self.ss, lambda batch: batch, postprocess=postprocess, batch_size=5, px_width_um=1.0)
+        self.assertEqual(runner.run(iter(self.tiles)), 11)
+        self.assertEqual(len(self.server.annotations), 11)
+
+    def test_bottleneck(self):
+        def model(batch):
+            time.sleep(0.05)
+            return batch
+
+        runner = BatchRunner(self.ss, model, batch_size=2, w_px=16, h_px=16)
+        runner.run(self.tiles)
+        stats = runner.stats()
+        self.assertEqual(stats['bottleneck'], 'predict')
+        self.assertGreaterEqual(stats['stages']['predict']['busy_s'], 0.3)
+        # the other stages waited for the model
+        self.assertGreater(stats['stages']['preprocess']['blocked_s'], 0.0)
+
+    def test_error(self):
+        def model(batch):
+            return batch
+
+        def postprocess(batch_tiles, results):
+            raise ValueError('postprocess failed')
+
+        runner = BatchRunner(self.ss, model, postprocess=postprocess, batch_size=2, w_px=16, h_px=16, queue_size=1)
+        with self.assertRaises(ValueError):
+            runner.run(self.tiles * 20)
+
+    def test_failed_upload(self):
+        def postprocess(batch_tiles, results):
+            return AnnotationBatch.fromContours([np.zeros((3, 2), dtype=np.float32)] * len(batch_tiles), 'Cells')
+
+        runner = BatchRunner(self.ss, lambda batch: batch, postprocess=postprocess, batch_size=4, w_px=16, h_px=16)
+        with mock.patch.object(self.ss, 'addAnnotationBatch', return_value=None):
+            with self.assertRaisesRegex(Exception, 'Upload of 4 annotations failed'):
+                runner.run(self.tiles)
+        self.assertEqual(runner.stats()['tiles'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# coding: utf-8
+
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.coarse_to_fine import CoarseToFine, tissueFraction
+from mikaia_plugin_api.mikaia_api import RectF
+from mikaia_plugin_api.mock_slide_service import BACKGROUND_RGB, MockSlideService, SyntheticSlide
+from mikaia_plugin_api.roi_tiler import RoiTiler
+
+
+class TestCoarseToFine(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.slide = SyntheticSlide(20000, 16000, 0.5)
+        cls.server = MockSlideService(cls.slide).start()
+        cls.ss = mikaia_api.SlideService(cls.server.url, telemetry_rate_hz=0)
+        cls.tile_um = 256 * 0.5
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ss.close()
+        cls.server.close()
+
+    def test_tissue_fraction(self):
+        thumbnails = np.empty((2, 4, 4, 3), dtype=np.uint8)
+        thumbnails[0] = BACKGROUND_RGB
+        thumbnails[1] = [180, 90, 160]
+        thumbnails[1, :2] = BACKGROUND_RGB
+        np.testing.assert_allclose(tissueFraction(thumbnails), [0.0, 0.5])
+        # no saturation in a single channel
+        with self.assertRaises(Exception):
+            tissueFraction(thumbnails[..., :1])
+        with self.assertRaises(Exception):
+            CoarseToFine(self.ss, self.tile_um, px_format='Gray')
+        with self.assertRaises(Exception):
+            CoarseToFine(self.ss, self.tile_um, channel_idx=0)
+
+    def test_selection(self):
+        selection = CoarseToFine(self.ss, self.tile_um, tissue=False, min_coverage=0.05)
+        tiler = selection.tiler()
+        stats = selection.stats()
+        self.assertEqual(stats['candidates'], len(tiler))
+        self.assertLess(stats['selected'], stats['candidates'])
+        self.assertGreater(stats['saved'], 0.2)
+        self.assertEqual(stats['coarse_requests'], int(np.ceil(tiler.coverageMap().shape[0] / 16))
+                         * int(np.ceil(tiler.coverageMap().shape[1] / 16)))
+        self.assertIn('coarse requests', selection.summary())
+
+        # the selected tiles are the tissue tiles at native resolution
+        for tile, score in list(selection)[::25]:
+            self.assertGreaterEqual(score, 0.05)
+            (x0, y0), (x1, y1) = tile
+            pixels = self.slide.readRegion(x0 / 0.5, y0 / 0.5, x1 / 0.5, y1 / 0.5, 64, 64)
+            self.assertGreater(tissueFraction(pixels[None])[0], 0.0)
+        self.assertEqual(selection.tiles(), [tile for tile, score in selection])
+        self.assertEqual(len(selection.scores()), len(selection))
+
+        score_map = selection.scoreMap()
+        self.assertEqual(score_map.shape, tiler.coverageMap().shape)
+        self.assertEqual(np.count_nonzero(score_map >= 0.05), len(selection))
+
+        # agrees with the thumbnail tissue mask of the RoiTiler
+        tissue_tiles = RoiTiler(self.ss, self.tile_um, min_coverage=0.5).tiles()
+        selected = set(map(str, selection.tiles()))
+        self.assertGreater(np.mean([str(tile) in selected for tile in tissue_tiles]), 0.95)
+
+    def test_max_tiles(self):
+        roi = RectF(x=2000.0, y=2000.0, width=4000.0, height=3000.0)
+        selection = CoarseToFine(self.ss, self.tile_um, rois=[roi], tissue=False, threshold=0.0, max_tiles=50,
+                                 block_tiles=4)
+        all_scores = selection.scoreMap()[~np.isnan(selection.scoreMap())]
+        self.assertEqual(len(selection), 50)
+        self.assertEqual(selection.stats()['above_threshold'], len(all_scores))
+        self.assertGreaterEqual(min(selection.scores()), np.sort(all_scores)[-50])
+        tiles = selection.tiles()
+        self.assertEqual(tiles, sorted(tiles, key=lambda tile: (tile[0][1], tile[0][0])))
+        self.assertIn('limited by max_tiles', selection.summary())
+
+    def test_score_function(self):
+        roi = RectF(x=0.0, y=0.0, width=2000.0, height=2000.0)
+        calls = []
+
+        def score(thumbnails):
+            calls.append(thumbnails.shape)
+            return np.arange(len(thumbnails)) % 2
+
+        selection = CoarseToFine(self.ss, self.tile_um, rois=[roi], tissue=False, score=score, threshold=0.5,
+                                 coarse_tile_px=8, block_tiles=8)
+        self.assertEqual(calls[0][1:], (8, 8, 3))
+        self.assertEqual(sum(shape[0] for shape in calls), selection.stats()['candidates'])
+        self.assertEqual(selection.scores(), [1.0] * len(selection))
+        with self.assertRaises(Exception):
+            CoarseToFine(self.ss, self.tile_um, rois=[roi], tissue=False, score=lambda thumbnails: [1.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
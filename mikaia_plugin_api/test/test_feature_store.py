@@ -0,0 +1,116 @@
+# coding: utf-8
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.feature_store import FeatureStore
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+def _clusters(count, dims, seed=0):
+    # three well separated clusters
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(3, dims)) * 10
+    labels = np.arange(count) % 3
+    return centers[labels] + rng.normal(size=(count, dims)), labels
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tiles = [[[x, y], [x + 50, y + 50]] for y in range(0, 1500, 50) for x in range(0, 1000, 50)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_reopen(self):
+        features, labels = _clusters(len(self.tiles), 16)
+        with FeatureStore(self.directory, dims=16, dtype='float32', flush_rows=100) as store:
+            for start in range(0, len(self.tiles), 64):
+                self.assertEqual(store.append(self.tiles[start:start + 64], features[start:start + 64]), start)
+            self.assertEqual(store.rowOf(self.tiles[77]), 77)
+        with FeatureStore(self.directory) as store:
+            self.assertEqual(len(store), 600)
+            np.testing.assert_array_equal(store.features(), features.astype(np.float32))
+            self.assertEqual(store.tiles(), [[[float(x), float(y)] for x, y in tile] for tile in self.tiles])
+            self.assertEqual(store.remaining(self.tiles + [[[0, 5000], [50, 5050]]]), [[[0, 5000], [50, 5050]]])
+            self.assertEqual(store.rowOf([[950, 1450], [1000, 1500]]), 599)
+            with self.assertRaises(Exception):
+                store.features()[0, 0] = 1.0
+            with self.assertRaises(Exception):
+                store.append(self.tiles[:2], features[:2, :8])
+        with self.assertRaises(Exception):
+            FeatureStore(self.directory, dims=8)
+
+    def test_unflushed_rows_are_dropped(self):
+        features, labels = _clusters(300, 4)
+        store = FeatureStore(self.directory, dims=4, flush_rows=128)
+        store.append(self.tiles[:100], features[:100])
+        store.append(self.tiles[100:200], features[100:200])
+        store.append(self.tiles[200:250], features[200:250])
+        # crash: the last 50 rows were not committed
+        reopened = FeatureStore(self.directory)
+        self.assertEqual(len(reopened), 200)
+        np.testing.assert_array_equal(reopened.features(), features[:200].astype(np.float16))
+
+    def test_nearest(self):
+        features, labels = _clusters(len(self.tiles), 32)
+        store = FeatureStore(self.directory, dims=32, dtype='float32')
+        store.append(self.tiles, features)
+        queries = features[[5, 300]]
+        for metric in ('l2', 'cosine'):
+            rows, distances = store.nearest(queries, k=7, metric=metric, chunk_rows=50)
+            if metric == 'l2':
+                reference = np.sum((queries[:, None] - features[None]) ** 2, axis=2)
+            else:
+                normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+                reference = 1.0 - normalized[[5, 300]] @ normalized.T
+            np.testing.assert_array_equal(rows, np.argsort(reference, axis=1)[:, :7])
+            np.testing.assert_allclose(distances, np.sort(reference, axis=1)[:, :7], rtol=1e-3, atol=1e-3)
+            self.assertEqual(rows[:, 0].tolist(), [5, 300])
+
+    def test_kmeans(self):
+        features, labels = _clusters(len(self.tiles), 24)
+        store = FeatureStore(self.directory, dims=24)
+        store.append(self.tiles, features)
+        for metric in ('l2', 'cosine'):
+            centers, found = store.kmeans(3, batch_size=64, metric=metric, chunk_rows=100)
+            self.assertEqual(centers.shape, (3, 24))
+            self.assertEqual(len(found), 600)
+            # the clusters are found up to a permutation of the labels
+            for label in range(3):
+                self.assertEqual(len(np.unique(found[labels == label])), 1)
+            self.assertEqual(len(np.unique(found)), 3)
+        with self.assertRaises(Exception):
+            store.kmeans(601)
+
+    def test_for_slide_and_export(self):
+        server = MockSlideService(SyntheticSlide(4000, 4000, 0.5)).start()
+        ss = mikaia_api.SlideService(server.url, telemetry_rate_hz=0)
+        try:
+            with FeatureStore.forSlide(ss, {'model': 'UNI'}, dims=8, directory=self.directory) as store:
+                path = store.path
+                store.append(self.tiles[:10], np.ones((10, 8)))
+            with FeatureStore.forSlide(ss, {'model': 'UNI'}, directory=self.directory) as store:
+                self.assertEqual(store.path, path)
+                self.assertEqual(len(store), 10)
+                labels = np.arange(10) % 2
+                self.assertEqual(store.exportClusters(ss, labels, class_names=['Stroma', 'Tumor'],
+                                                      max_chunk_annotations=4), 10)
+            with FeatureStore.forSlide(ss, {'model': 'CONCH'}, dims=8, directory=self.directory) as store:
+                self.assertNotEqual(store.path, path)
+            annotations = sorted(server.annotations.values(), key=lambda anno: anno['coordinates'][0][0])
+            self.assertEqual([anno['className'] for anno in annotations], ['Stroma', 'Tumor'] * 5)
+            self.assertEqual({anno['shapeType'] for anno in annotations}, {'Rectangle'})
+        finally:
+            ss.close()
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
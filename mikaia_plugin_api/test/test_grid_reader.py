@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.grid_reader import GridReader
+from mikaia_plugin_api.mock_slide_service import ArraySlide, MockSlideService
+
+
+class TestGridReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 0.5 um/pixel
+        y, x = np.mgrid[0:4000, 0:4000]
+        cls.slide = np.stack([x % 251, y % 241, (x * 7 + y) % 256], axis=-1).astype(np.uint8)
+        cls.server = MockSlideService(ArraySlide(cls.slide, px_size_um=0.5)).start()
+        cls.ss = mikaia_api.SlideService(cls.server.url, telemetry_rate_hz=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ss.close()
+        cls.server.close()
+
+    def test_patches_match_slide_pixels(self):
+        roi = mikaia_api.RectF(10.0, 20.0, 700.0, 500.0)
+        reader = GridReader(self.ss, roi, 224, memory_budget_mb=1)
+        requests = self.server.requestCount
+        patches = list(reader)
+        requests = self.server.requestCount - requests
+        self.assertEqual(len(patches), len(reader))
+        self.assertEqual(len(reader), 7 * 5)
+        self.assertEqual(sorted(tile for tile, patch in patches), sorted(reader.tiles()))
+        self.assertEqual(requests, len(reader.regions()))
+        self.assertLess(requests, len(reader))
+        for tile, patch in patches:
+            x = int(round(tile[0][0] / 0.5))
+            y = int(round(tile[0][1] / 0.5))
+            self.assertEqual(tile[1][0] - tile[0][0], 112.0)
+            np.testing.assert_array_equal(patch, self.slide[y:y + 224, x:x + 224])
+
+    def test_stride_and_budget(self):
+        roi = mikaia_api.RectF(0.0, 0.0, 1000.0, 1000.0)
+        reader = GridReader(self.ss, roi, (256, 128), stride_px=(128, 64), memory_budget_mb=64)
+        requests = self.server.requestCount
+        self.assertEqual(len(reader.regions()), 1)
+        for region, tiles, patches in reader.iterRegions():
+            self.assertEqual(patches.shape[2:], (128, 256, 3))
+            self.assertFalse(patches.flags.writeable)
+            np.testing.assert_array_equal(patches[1, 2], self.slide[64:192, 256:512])
+        self.assertEqual(self.server.requestCount - requests, 1)
+
+    def test_undersized_native_region(self):
+        # e.g. clipped at the slide border: the missing pixels are zero
+        roi = mikaia_api.RectF(0.0, 0.0, 200.0, 200.0)
+        reader = GridReader(self.ss, roi, 128)
+        small = np.full((10, 10, 3), 7, dtype=np.uint8)
+        with mock.patch.object(self.ss, 'getNativeROIArray', return_value=small):
+            regions = list(reader.iterRegions())
+        self.assertEqual(len(regions), 1)
+        patches = regions[0][2]
+        self.assertEqual(patches.shape, (4, 4, 128, 128, 3))
+        np.testing.assert_array_equal(patches[0, 0, :10, :10], small)
+        self.assertEqual(int(patches[0, 0, 10:].max()), 0)
+        self.assertEqual(int(patches[3, 3].max()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
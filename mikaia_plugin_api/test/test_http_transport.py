@@ -0,0 +1,90 @@
+# coding: utf-8
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.http_transport import HttpTransport
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.clients.add(self.client_address)
+            fail = server.failures > 0
+            if fail:
+                server.failures -= 1
+        if fail:
+            body = b'busy'
+            self.send_response(503)
+        elif self.path.endswith('/userparameters'):
+            body = b'[]'
+            self.send_response(200)
+        else:
+            body = self.path.encode('utf-8')
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.failures = 0
+        self.server.clients = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/MIKAIA/SlideService/v1/0001'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        with HttpTransport() as transport:
+            for i in range(20):
+                self.assertEqual(transport.get(self.url + '/roi').status_code, 200)
+        self.assertEqual(self.server.requests, 20)
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_transient_errors_are_retried(self):
+        self.server.failures = 2
+        with HttpTransport(retries=3, backoff_factor=0.0) as transport:
+            response = transport.get(self.url + '/roi')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_last_response_is_tracked_per_thread(self):
+        ss = mikaia_api.SlideService(self.url, HttpTransport(pool_size=4))
+        errors = []
+
+        def worker(name):
+            for i in range(10):
+                path = '{}/{}-{}'.format(self.url, name, i)
+                ss._makeGetRequest(path, '')
+                if ss._lastRequest != path or ss._lastResponse.content.decode('utf-8') not in path:
+                    errors.append(path)
+
+        threads = [threading.Thread(target=worker, args=('t{}'.format(n),)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        ss.close()
+        self.assertEqual(errors, [])
+        self.assertEqual(ss._requestCounter, 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.instrumentation import Instrumentation
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(1000, 1000, 0.25)).start()
+        ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        ss.addAnnotations([mikaia_api.Annotation(shapeType='Rectangle', coordinates=[[0, 0, 10, 10]])] * 10)
+        ss.close()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_percentiles(self):
+        instrumentation = Instrumentation()
+        for i in range(1, 101):
+            instrumentation.recordRequest('GET /roi', 0.0, i / 1000.0, 0, 1000)
+        stats = instrumentation.snapshot()['requests']['GET /roi']
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['bytes_received'], 100000)
+        self.assertAlmostEqual(stats['mean_ms'], 50.5)
+        self.assertAlmostEqual(stats['max_ms'], 100.0)
+        # histogram buckets are sqrt(2) wide
+        self.assertTrue(50.0 <= stats['p50_ms'] <= 50.0 * 2 ** 0.5)
+        self.assertTrue(99.0 <= stats['p99_ms'] <= 100.0)
+        self.assertEqual(sum(n for upper, n in stats['histogram']), 100)
+
+    def test_spans_and_reset(self):
+        instrumentation = Instrumentation()
+        with instrumentation.span('model.predict', batch=4):
+            time.sleep(0.01)
+        with self.assertRaises(ValueError):
+            with instrumentation.span('model.predict'):
+                raise ValueError()
+        stats = instrumentation.snapshot(reset=True)['spans']['model.predict']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertGreaterEqual(stats['max_ms'], 10.0)
+        self.assertEqual(instrumentation.snapshot()['spans'], {})
+        self.assertEqual(instrumentation.traceEvents(), [])
+
+    def test_slide_service_requests(self):
+        ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        self.assertEqual(len(ss.getAnnotations()), 10)
+        ss.addAnnotations([mikaia_api.Annotation(shapeType='Rectangle', coordinates=[[0, 0, 5, 5]])])
+        ss.updateAnnotation(mikaia_api.Annotation(shapeType='Rectangle', id=min(self.server.annotations),
+                                                  className='Tumor'))
+        ss.sendProgress(0.5)
+        ss._makeGetRequest(self.server.url + '/missing', {})
+        with ss.span('model.predict'):
+            pass
+        requests = ss.getRequestStats()['requests']
+        self.assertEqual(set(requests), {'GET /annotation', 'POST /annotation', 'PATCH /annotation', 'POST /progress',
+                                         'GET /missing'})
+        self.assertEqual(requests['GET /annotation']['count'], 1)
+        self.assertGreater(requests['GET /annotation']['bytes_received'], 0)
+        self.assertGreater(requests['GET /annotation']['decode_s'], 0.0)
+        self.assertGreater(requests['POST /annotation']['bytes_sent'], 0)
+        self.assertGreater(requests['POST /annotation']['serialize_s'], 0.0)
+        self.assertEqual(requests['GET /missing']['errors'], 1)
+        self.assertEqual(ss.getRequestStats()['spans']['model.predict']['count'], 1)
+        summary = ss.instrumentation.summary()
+        self.assertTrue(summary.startswith('5 requests in '))
+        self.assertIn('(1 failed)', summary)
+        self.assertIn('GET /annotation 1x', summary)
+        self.assertIn('model.predict 1x', summary)
+
+    def test_chrome_trace(self):
+        instrumentation = Instrumentation()
+        ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0, instrumentation=instrumentation)
+
+        barrier = threading.Barrier(3)
+
+        def work():
+            for i in range(5):
+                with ss.span('tile'):
+                    ss.getAnnotations()
+            barrier.wait()  # keep the thread ids distinct
+
+        threads = [threading.Thread(target=work) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.json')
+            ss.exportTrace(path)
+            with open(path) as f:
+                trace = json.load(f)
+        events = trace['traceEvents']
+        self.assertEqual(sum(1 for e in events if e['name'] == 'tile'), 15)
+        self.assertEqual(sum(1 for e in events if e['name'] == 'GET /annotation'), 15)
+        self.assertEqual(sum(1 for e in events if e['cat'] == 'decode'), 15)
+        self.assertEqual(len(set(e['tid'] for e in events if e['name'] == 'tile')), 3)
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertGreaterEqual(event['dur'], 0)
+        # the requests are nested in their spans
+        spans = [e for e in events if e['name'] == 'tile']
+        for request in (e for e in events if e['name'] == 'GET /annotation'):
+            self.assertTrue(any(s['tid'] == request['tid'] and s['ts'] <= request['ts'] and
+                                request['ts'] + request['dur'] <= s['ts'] + s['dur'] + 1 for s in spans))
+
+    def test_trace_capacity(self):
+        instrumentation = Instrumentation(trace_capacity=10)
+        for i in range(100):
+            instrumentation.recordSpan('step', 0.0, 0.001)
+        self.assertEqual(len(instrumentation.traceEvents()), 10)
+        self.assertEqual(instrumentation.snapshot()['spans']['step']['count'], 100)
+
+    def test_summary_at_exit(self):
+        code = ('from mikaia_plugin_api.instrumentation import Instrumentation\n'
+                'instrumentation = Instrumentation()\n'
+                'instrumentation.recordRequest("GET /roi", 0.0, 0.02, 0, 2000000)\n')
+        env = dict(os.environ, MIKAIA_PLUGIN_STATS='1', PYTHONPATH=PACKAGE_ROOT)
+        output = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(),
+                         'SlideService statistics: 1 requests in 0.0 s, 2.0 MB in, 0.0 MB out | GET /roi 1x p50 20.0 ms p99 20.0 ms')
+
+
+    def test_trace_at_exit(self):
+        # one trace file with the timelines of all instances that still exist at exit
+        code = ('import gc\n'
+                'from mikaia_plugin_api.instrumentation import Instrumentation\n'
+                'first, released, last = Instrumentation(), Instrumentation(), Instrumentation()\n'
+                'first.recordSpan("first", 0.0, 0.01)\n'
+                'released.recordSpan("released", 0.0, 0.01)\n'
+                'last.recordSpan("last", 0.0, 0.01)\n'
+                'del released\n'
+                'gc.collect()\n')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'trace.json')
+            env = dict(os.environ, MIKAIA_PLUGIN_TRACE=path, PYTHONPATH=PACKAGE_ROOT)
+            subprocess.run([sys.executable, '-c', code], env=env, check=True)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        self.assertEqual([event['name'] for event in events], ['first', 'last'])
+        self.assertLessEqual(events[0]['ts'], events[1]['ts'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+import json
+import unittest
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.json_patch import JsonPatch, pointer
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+class TestJsonPatch(unittest.TestCase):
+
+    def test_builder(self):
+        patch = JsonPatch()
+        patch.replace(pointer(12, 'className'), 'Tumor "A"\\B')
+        patch.replace(pointer(12, 'opacity'), 0.5)
+        patch.add(pointer('a/b~c'), [1, 2])
+        patch.remove('/x').move('/x', '/y').copy('/y', '/z').test('/z', None)
+        self.assertEqual(len(patch), 7)
+        operations = json.loads(patch.toJson())
+        self.assertEqual(operations[0], {'op': 'replace', 'path': '/12/className', 'value': 'Tumor "A"\\B'})
+        self.assertEqual(operations[1]['value'], 0.5)
+        self.assertEqual(operations[2]['path'], '/a~1b~0c')
+        self.assertEqual(operations[3], {'op': 'remove', 'path': '/x'})
+        self.assertEqual(operations[4], {'op': 'move', 'path': '/y', 'from': '/x'})
+        self.assertEqual(operations[6], {'op': 'test', 'path': '/z', 'value': None})
+        with self.assertRaises(Exception):
+            patch.append('merge', '/x', 1)
+        with self.assertRaises(Exception):
+            patch.append('copy', '/x')
+
+    def test_patch_data_escaping(self):
+        ss = mikaia_api.SlideService.__new__(mikaia_api.SlideService)
+        data = ss._patchDataToJson([['replace', 'className', 'Class "quoted"']])
+        self.assertEqual(json.loads(data), [{'op': 'replace', 'path': 'className', 'value': 'Class "quoted"'}])
+        with self.assertRaises(Exception):
+            ss._patchDataToJson([['replace', 'className']])
+
+
+class TestBulkUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(4000, 4000, 0.5)).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        self.annotations = self.ss.addAnnotations([
+            self.ss.createAnnotation('Rectangle', [[i, 0], [i + 1, 1]], class_name='Tumor') for i in range(50)])
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+
+    def test_update_annotations(self):
+        # unchanged annotations aren't sent
+        result = self.ss.updateAnnotations(self.annotations)
+        self.assertEqual((result['updated'], result['unchanged'], result['requests']), (0, 50, 0))
+
+        for anno in self.annotations[:30]:
+            anno.className = 'Stroma "x"'
+        requests = self.server.requestCount
+        result = self.ss.updateAnnotations(self.annotations, max_chunk_operations=20)
+        self.assertEqual((result['updated'], result['unchanged'], result['operations']), (30, 20, 30))
+        self.assertEqual(result['requests'], 2)
+        self.assertEqual(self.server.requestCount - requests, 2)
+        self.assertGreater(result['bytes'], 0)
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(len(self.ss.getAnnotations(class_name='Stroma "x"')), 30)
+        self.assertEqual(self.ss.updateAnnotations(self.annotations)['requests'], 0)
+
+        # annotations loaded by another SlideService instance are diffed against the downloaded state
+        ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        annotations = ss.getAnnotations()
+        annotations[0].className = 'Necrosis'
+        result = ss.updateAnnotations(annotations)
+        self.assertEqual((result['updated'], result['unchanged']), (1, 49))
+        ss.close()
+
+    def test_fallback_to_single_updates(self):
+        self.server.bulkPatch = False
+        for anno in self.annotations[:10]:
+            anno.className = 'Stroma'
+        result = self.ss.updateAnnotations(self.annotations, workers=4)
+        # one rejected bulk request, then one request per annotation
+        self.assertEqual((result['updated'], result['requests']), (10, 11))
+        self.assertEqual(len(self.ss.getAnnotations(class_name='Stroma')), 10)
+        self.assertFalse(self.ss._bulkPatch)
+
+    def test_unknown_annotation(self):
+        anno = self.annotations[0]
+        anno.className = 'Stroma'
+        unknown = mikaia_api.Annotation(shapeType='Rectangle', id=999999, className='Stroma')
+        result = self.ss.updateAnnotations([anno, unknown])
+        self.assertEqual(result['failed'], [anno.id, 999999])
+        self.assertEqual(result['updated'], 0)
+
+    def test_update_annotation_classes(self):
+        classes = self.ss.getAnnotationClasses()
+        self.assertEqual(self.ss.updateAnnotationClasses(classes)['requests'], 0)
+        classes[0].opacity = 0.25
+        classes[0].outlineColor = '#ffff0000'
+        result = self.ss.updateAnnotationClasses(classes)
+        self.assertEqual((result['updated'], result['operations']), (1, 2))
+        stored = self.server.annotationClasses[classes[0].id]
+        self.assertEqual((stored['opacity'], stored['outlineColor']), (0.25, '#ffff0000'))
+
+        self.server.bulkPatch = False
+        self.ss._bulkPatch = None
+        classes[0].outlineWidth = 5
+        self.assertEqual(self.ss.updateAnnotationClasses(classes)['updated'], 1)
+        self.assertEqual(self.server.annotationClasses[classes[0].id]['outlineWidth'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
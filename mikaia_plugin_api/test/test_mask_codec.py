@@ -0,0 +1,103 @@
+# coding: utf-8
+
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.mask_codec import decodeArray, encodeArray, isEncoded
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+def labelMap(height=256, width=320, count=40, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = np.zeros((height, width), dtype=np.uint16)
+    yy, xx = np.mgrid[0:height, 0:width]
+    for label in range(1, count + 1):
+        cy, cx, r = rng.integers(0, height), rng.integers(0, width), rng.integers(3, 10)
+        labels[(yy - cy) ** 2 + (xx - cx) ** 2 < r * r] = label
+    return labels
+
+
+class TestMaskCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        labels = labelMap()
+        arrays = [labels, labels > 0, (labels > 0).astype(np.uint8), labels.astype(np.int32),
+                  labels.astype('>u2'), np.random.default_rng(1).random((17, 9)).astype(np.float32),
+                  np.zeros((0, 5), dtype=np.uint8), np.full((3, 4), 7, dtype=np.uint8)]
+        for array in arrays:
+            binary = array.dtype.kind in 'biu' and array.max(initial=0) <= 1
+            for encoding in ['auto', 'rle+zlib', 'zlib'] + (['bitpack+zlib'] if binary else []):
+                value = json.loads(json.dumps(encodeArray(array, encoding)))
+                self.assertTrue(isEncoded(value))
+                decoded = decodeArray(value)
+                self.assertEqual(decoded.shape, array.shape)
+                self.assertEqual(decoded.dtype, array.dtype.newbyteorder('='))
+                np.testing.assert_array_equal(decoded, array)
+
+    def test_auto_encoding(self):
+        labels = labelMap()
+        self.assertEqual(encodeArray(labels)['encoding'], 'rle+zlib')
+        self.assertEqual(encodeArray(labels > 0)['encoding'], 'bitpack+zlib')
+        noise = np.random.default_rng(2).integers(0, 1000, (64, 64), dtype=np.uint16)
+        self.assertEqual(encodeArray(noise)['encoding'], 'zlib')
+        # much smaller than the plain JSON number list
+        self.assertLess(len(json.dumps(encodeArray(labels))) * 20, len(json.dumps(labels.reshape(-1).tolist())))
+
+    def test_errors(self):
+        with self.assertRaises(Exception):
+            encodeArray(np.array([0, 2]), 'bitpack+zlib')
+        with self.assertRaises(Exception):
+            encodeArray(np.array([0.0, 0.5]), 'bitpack+zlib')
+        with self.assertRaises(Exception):
+            encodeArray(np.array([0, 1]), 'png')
+        with self.assertRaises(Exception):
+            decodeArray([0, 1])
+
+    def test_slide_service(self):
+        server = MockSlideService(SyntheticSlide(4000, 4000, 0.5)).start()
+        ss = mikaia_api.SlideService(server.url, telemetry_rate_hz=0)
+        try:
+            labels = labelMap()
+            anno = ss.createAnnotation('Mask', [[0, 0], [160, 0], [160, 128], [0, 128]], mask=labels,
+                                       labelMap=np.arange(41, dtype=np.uint16), class_name='Cells')
+            self.assertEqual(anno.maskSizeInPx, [320, 256])
+            self.assertEqual(anno.mask['encoding'], 'rle+zlib')
+            np.testing.assert_array_equal(anno.maskArray(), labels)
+            ss.addAnnotations([anno])
+            self.assertEqual(server.annotations[next(iter(server.annotations))]['mask']['encoding'], 'rle+zlib')
+
+            # ndarray masks assigned later are encoded on upload, too
+            anno = ss.createAnnotation('Mask', [[0, 0], [10, 0], [10, 10]], class_name='Cells')
+            anno.mask = labels > 0
+            anno.maskSizeInPx = [320, 256]
+            # the caller's annotation keeps its arrays, also if the upload fails
+            failed = mock.Mock(status_code=500, reason='Internal Server Error', content=b'', headers={})
+            with mock.patch.object(ss, '_makePostRequest', return_value=failed):
+                self.assertIsNone(ss.addAnnotations([anno]))
+            self.assertIsInstance(anno.mask, np.ndarray)
+            ss.addAnnotations([anno])
+            self.assertIsInstance(anno.mask, np.ndarray)
+
+            masks = ss.getAnnotations(shape_type='Mask')
+            self.assertEqual(len(masks), 2)
+            np.testing.assert_array_equal(masks[0].mask, labels)
+            np.testing.assert_array_equal(masks[0].labelMap, np.arange(41))
+            np.testing.assert_array_equal(masks[1].maskArray(), labels > 0)
+
+            # plain lists for MIKAIA versions without the compact encoding
+            ss_list = mikaia_api.SlideService(server.url, telemetry_rate_hz=0, mask_encoding='list')
+            anno = ss_list.createAnnotation('Mask', [[0, 0], [10, 0], [10, 10]], mask=labels[:4, :5])
+            self.assertEqual(anno.mask, labels[:4, :5].reshape(-1).tolist())
+            np.testing.assert_array_equal(anno.maskArray(), labels[:4, :5])
+            ss_list.close()
+        finally:
+            ss.close()
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
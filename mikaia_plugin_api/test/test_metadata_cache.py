@@ -0,0 +1,128 @@
+# coding: utf-8
+
+import threading
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(4000, 4000, 0.5), user_parameters={'threshold': 0.5}).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+
+    def test_slide_metadata(self):
+        # nothing is requested before it is used
+        self.assertEqual(self.server.requestCount, 0)
+        for i in range(3):
+            info = self.ss.getSlideInfo()
+            self.assertEqual(len(self.ss.getAnalysisRoi().roi), 1)
+            self.assertEqual(self.ss.getUserParameters(), {'threshold': '0.5'})
+        self.assertEqual(self.server.requestCount, 3)
+        # the cached items are copies
+        info.nativeResolution.width = 99.0
+        self.assertEqual(self.ss.getSlideInfo().nativeResolution.width, 0.5)
+
+        self.ss.getSlideInfo(refresh=True)
+        self.ss.invalidateMetadata('analysisroi')
+        self.ss.getAnalysisRoi()
+        self.ss.getAnalysisRoi()
+        self.assertEqual(self.server.requestCount, 5)
+        stats = self.ss.getMetadataCacheStats()
+        self.assertEqual(stats['hits'], {'slideinfo': 3, 'analysisroi': 3, 'userparameters': 2, 'annotationclasses': 0})
+        self.assertEqual(stats['fetches']['analysisroi'], 2)
+        self.assertEqual(stats['cached'], ['slideinfo', 'analysisroi', 'userparameters'])
+        self.assertEqual(stats['avoided_requests'], 8)
+        self.ss.invalidateMetadata()
+        self.assertEqual(self.ss.getMetadataCacheStats()['cached'], [])
+        with self.assertRaises(Exception):
+            self.ss.invalidateMetadata('slide')
+
+        ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0, metadata_cache=False)
+        requests = self.server.requestCount
+        ss.getSlideInfo()
+        ss.getSlideInfo()
+        self.assertEqual(self.server.requestCount - requests, 2)
+        ss.close()
+
+    def test_concurrent_requests(self):
+        # the slide info request hangs until 'release' is set
+        release, started = threading.Event(), threading.Event()
+        make_get_request = self.ss._makeGetRequest
+
+        def slowGetRequest(path, *args):
+            if path == self.ss._slideInfoPath:
+                started.set()
+                release.wait(10)
+            return make_get_request(path, *args)
+        self.ss._makeGetRequest = slowGetRequest
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.ss.getSlideInfo()), daemon=True)
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(started.wait(10))
+        # other metadata doesn't wait for the slide info
+        self.assertEqual(self.ss.getUserParameters(), {'threshold': '0.5'})
+        self.assertEqual(self.ss.getMetadataCacheStats()['cached'], ['userparameters'])
+        release.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([info.nativeResolution.width for info in results], [0.5] * 3)
+        self.assertEqual(self.server.requestCount, 2)
+        self.assertEqual(self.ss.getMetadataCacheStats()['fetches']['slideinfo'], 1)
+
+        # a response requested before invalidateMetadata() isn't cached
+        release.clear()
+        started.clear()
+        thread = threading.Thread(target=lambda: self.ss.getSlideInfo(refresh=True), daemon=True)
+        thread.start()
+        self.assertTrue(started.wait(10))
+        self.ss.invalidateMetadata('slideinfo')
+        release.set()
+        thread.join(10)
+        self.assertNotIn('slideinfo', self.ss.getMetadataCacheStats()['cached'])
+
+    def test_annotation_classes(self):
+        classes = self.ss.ensureAnnotationClasses(['Cells', self.ss.createAnnotationClass('Tumor', fill_color='#ffff0000'),
+                                                   'Cells'])
+        # one request for the class table, one for the missing classes
+        self.assertEqual(self.server.requestCount, 2)
+        self.assertEqual([c.className for c in classes], ['Cells', 'Tumor', 'Cells'])
+        self.assertEqual(sorted(c['className'] for c in self.server.annotationClasses.values()), ['Cells', 'Tumor'])
+        again = self.ss.ensureAnnotationClasses([self.ss.createAnnotationClass('Tumor'), 'Cells'])
+        self.assertEqual(self.server.requestCount, 2)
+        self.assertEqual([(c.id, c.fillColor) for c in again], [(classes[1].id, '#ffff0000'), (classes[0].id, '')])
+        stats = self.ss.getMetadataCacheStats()
+        self.assertEqual((stats['skipped_classes'], stats['avoided_requests']), (3, 2))
+
+        # updates are applied to the cached table
+        classes[1].opacity = 0.25
+        self.assertTrue(self.ss.updateAnnotationClass(classes[1]))
+        classes[0].outlineColor = '#ff00ff00'
+        self.ss.updateAnnotationClasses(classes[:1])
+        requests = self.server.requestCount
+        table = {c.className: c for c in self.ss.getAnnotationClasses()}
+        self.assertEqual((table['Tumor'].opacity, table['Cells'].outlineColor), (0.25, '#ff00ff00'))
+        self.assertEqual(self.server.requestCount, requests)
+
+        # annotations of known classes keep the table, a new class name drops it
+        self.ss.addAnnotationBatch(AnnotationBatch.fromContours([np.zeros((3, 2), dtype=np.float32)], 'Cells'))
+        self.ss.getAnnotationClasses()
+        self.assertEqual(self.server.requestCount, requests + 1)
+        self.ss.addAnnotations([self.ss.createAnnotation('Rectangle', [[0, 0], [5, 5]], class_name='Stroma')])
+        self.assertEqual(sorted(c.className for c in self.ss.getAnnotationClasses()), ['Cells', 'Stroma', 'Tumor'])
+        self.assertEqual(self.server.requestCount, requests + 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.http_transport import HttpTransport
+from mikaia_plugin_api.mock_slide_service import ArraySlide, MockSlideService, SyntheticSlide
+from mikaia_plugin_api.roi_tiler import RoiTiler
+
+
+class TestMockSlideService(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(20000, 16000, 0.5), user_parameters={'threshold': 0.5}).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+
+    def test_slide(self):
+        info = self.ss.getSlideInfo()
+        self.assertEqual(info.slideRect.width, 10000.0)
+        self.assertEqual(info.slideRect.height, 8000.0)
+        self.assertEqual(info.nativeResolution.width, 0.5)
+        self.assertEqual(self.ss.getUserParameters(), {'threshold': '0.5'})
+        roi = self.ss.getAnalysisRoi().roi
+        self.assertEqual(len(roi), 1)
+        self.assertEqual(roi[0].shapeType, 'Rectangle')
+        self.assertEqual(self.ss.getThumbnail(500, 500).size, (500, 400))
+
+    def test_pixels(self):
+        # the same slide area gives the same pixels for all requests and formats
+        tiles = RoiTiler(self.ss, 128.0).tiles()
+        self.assertGreater(len(tiles), 0)
+        x, y = tiles[0][0]
+        raw = self.ss.getNativeROIArray(x, y, 256, 256)
+        self.assertEqual(raw.shape, (256, 256, 3))
+        self.assertLess(raw.mean(), 230)  # tissue
+        self.server.rawPixels = False
+        np.testing.assert_array_equal(self.ss.getNativeROIArray(x, y, 256, 256), raw)
+        np.testing.assert_array_equal(np.asarray(self.ss.getNativeROI(x, y, 256, 256)), raw)
+        np.testing.assert_array_equal(self.ss.getROIArray(x, y, 128.0, 128.0, 0.5), raw)
+        np.testing.assert_array_equal(self.ss.getNativeROIArray(x, y, 256, 256, px_format='BGR'), raw[:, :, ::-1])
+        self.assertEqual(self.ss.getROIArray(x, y, 128.0, 128.0, 1.0).shape, (128, 128, 3))
+        self.assertEqual(self.ss.getNativeROIArray(x, y, 64, 32, px_format='Gray').shape, (32, 64))
+
+    def test_array_slide(self):
+        pixels = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'slide.npy')
+            np.save(path, pixels)
+            slide = ArraySlide.fromFile(path, 1.0)
+            np.testing.assert_array_equal(slide.readRegion(10, 20, 110, 70, 100, 50), pixels[20:70, 10:110])
+            # 2x downsampled level
+            level = slide.readRegion(0, 0, 400, 300, 200, 150)
+            expected = (pixels.astype(np.uint16).reshape(150, 2, 200, 2, 3).sum(axis=(1, 3)) + 2) // 4
+            np.testing.assert_array_equal(level, expected)
+            # outside of the slide
+            self.assertTrue((slide.readRegion(390, 0, 410, 10, 20, 10)[:, 10:] == (242, 242, 240)).all())
+            del slide
+
+    def test_annotations(self):
+        anno = self.ss.addAnnotations([self.ss.createAnnotation('Polygon', [[0, 0], [10, 0], [10, 10]],
+                                                                class_name='Tumor')])[0]
+        self.assertGreater(anno.id, 0)
+        batch = AnnotationBatch.fromContours([np.array([[[i, 0]], [[i + 1, 0]], [[i, 1]]], dtype=np.float32)
+                                              for i in range(100)], 'Cells')
+        self.ss.addAnnotationBatch(batch, max_chunk_annotations=30)
+        self.assertEqual(len(set(batch.ids.tolist())), 100)
+        self.assertEqual(len(self.ss.getAnnotations()), 101)
+        self.assertEqual(len(self.ss.getAnnotations(class_name='Cells')), 100)
+        anno.className = 'Stroma'
+        self.assertTrue(self.ss.updateAnnotation(anno))
+        self.assertEqual([a.className for a in self.ss.getAnnotations(class_name='Stroma')], ['Stroma'])
+        self.assertEqual(sorted(c.className for c in self.ss.getAnnotationClasses()), ['Cells', 'Stroma', 'Tumor'])
+
+        anno_class = self.ss.addAnnotationClasses([self.ss.createAnnotationClass('Necrosis', line_color='#ff0000ff')])[0]
+        anno_class.opacity = 0.25
+        anno_class.outlineWidth = 4
+        self.assertTrue(self.ss.updateAnnotationClass(anno_class))
+        stored = self.server.annotationClasses[anno_class.id]
+        self.assertEqual((stored['opacity'], stored['outlineWidth']), (0.25, 4))
+
+    def test_results(self):
+        self.ss.sendProgress(0.5, 0, 'half')
+        self.ss.sendMessage('hello')
+        self.ss.setResultsCaption('Caption')
+        self.ss.setCsv([['a', 'b'], ['1', '2']])
+        self.ss.addResultDiagram('Title', '', [self.ss.createDiagramDataSeries('Cells', '#ff00ff00', '1', [1, 2], '')])
+        self.assertEqual([p['message'] for p in self.server.progress], ['half', 'hello'])
+        self.assertEqual(self.server.resultsCaptions[0]['caption'], 'Caption')
+        self.assertEqual(len(self.server.csv), 1)
+        self.assertEqual(self.server.diagrams[0]['title'], 'Title')
+
+    def test_latency_and_gzip(self):
+        self.server.latencyS = 0.05
+        start = time.perf_counter()
+        self.ss.getSlideInfo()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.server.latencyS = 0.0
+
+        ss = mikaia_api.SlideService(self.server.url, transport=HttpTransport(gzip_requests=True, gzip_min_size=0))
+        batch = AnnotationBatch.fromContours([np.zeros((3, 1, 2), dtype=np.float32)] * 10, 'Cells')
+        ss.addAnnotationBatch(batch)
+        self.assertEqual(len(self.server.annotations), 10)
+        ss.close()
+
+    def test_bandwidth(self):
+        self.server.bandwidthMbps = 80.0  # 10 MB/s
+        start = time.perf_counter()
+        self.ss.getNativeROIArray(0.0, 0.0, 512, 512)  # 0.79 MB
+        self.assertGreaterEqual(time.perf_counter() - start, 0.07)
+
+    def test_unknown_endpoint(self):
+        response = self.ss._makeGetRequest(self.server.url + '/unknown', {})
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
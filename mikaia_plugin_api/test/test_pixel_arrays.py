@@ -0,0 +1,102 @@
+# coding: utf-8
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from PIL import Image
+
+from mikaia_plugin_api import mikaia_api
+
+
+def _pixels(w, h):
+    y, x = np.mgrid[0:h, 0:w]
+    return np.stack([x % 256, y % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        headers = {}
+        if url.path.endswith('/userparameters'):
+            body = b'[]'
+            headers['Content-Type'] = 'application/json'
+        else:
+            pixels = _pixels(int(query['w'][0]), int(query['h'][0]))
+            if self.server.raw and 'application/octet-stream' in self.headers.get('Accept', ''):
+                body = pixels.tobytes()
+                headers['Content-Type'] = 'application/octet-stream'
+                headers['X-Image-Width'] = str(pixels.shape[1])
+                headers['X-Image-Height'] = str(pixels.shape[0])
+                headers['X-Image-Channels'] = '3'
+            else:
+                buffer = BytesIO()
+                Image.fromarray(pixels).save(buffer, 'PNG')
+                body = buffer.getvalue()
+                headers['Content-Type'] = 'image/png'
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestPixelArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.raw = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}/MIKAIA/SlideService/v1/0001'.format(self.server.server_address[1])
+        self.ss = mikaia_api.SlideService(url)
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _check(self):
+        expected = _pixels(40, 30)
+        arr = self.ss.getNativeROIArray(0.0, 0.0, 40, 30)
+        self.assertTrue(arr.flags.c_contiguous)
+        self.assertEqual(arr.dtype, np.uint8)
+        np.testing.assert_array_equal(arr, expected)
+
+        batch = np.zeros((2, 30, 40, 3), dtype=np.uint8)
+        ret = self.ss.getNativeROIArray(0.0, 0.0, 40, 30, out=batch[1])
+        self.assertTrue(np.shares_memory(ret, batch))
+        np.testing.assert_array_equal(batch[1], expected)
+        np.testing.assert_array_equal(batch[0], 0)
+
+        with self.assertRaises(Exception):
+            self.ss.getNativeROIArray(0.0, 0.0, 40, 30, out=np.zeros((30, 40, 3), dtype=np.float32))
+
+    def test_encoded_image(self):
+        self._check()
+        # a view of the decoded image, not copied again
+        self.assertFalse(self.ss.getNativeROIArray(0.0, 0.0, 40, 30).flags.writeable)
+
+    def test_raw_pixels(self):
+        self.server.raw = True
+        self._check()
+
+    def test_iter_tiles(self):
+        tiles = [[[float(i), 0.0], [float(i) + 1.0, 1.0]] for i in range(5)]
+        result = list(self.ss.iterTiles(tiles, 16, 8))
+        self.assertEqual([tile for tile, img in result], tiles)
+        for tile, img in result:
+            np.testing.assert_array_equal(img, _pixels(16, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+import time
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.batch_runner import BatchRunner
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+from mikaia_plugin_api.result_aggregator import ResultAggregator
+
+
+def _squares(sides, x=0.0):
+    return np.array([[[x, 0], [x + side, 0], [x + side, side], [x, side]] for side in sides], dtype=np.float32)
+
+
+class TestResultAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(4000, 4000, 0.5)).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+
+    def test_statistics(self):
+        aggregator = ResultAggregator(self.ss, area_bins=[10, 100], size_bins=[5], value_bins=[0.5],
+                                      value_name='Probability', interval_s=0)
+        aggregator.add(AnnotationBatch.fromContours(_squares([2, 5, 20]), 'Cells'), tiles=2)
+        batch = AnnotationBatch.fromContours(_squares([4]), 'Nuclei')
+        batch.addAnnotation('PathWithHoles', _squares([20])[0], [_squares([10])[0]], 'Cells')
+        aggregator.add(batch, tiles=1)
+        aggregator.add([self.ss.createAnnotation('Rectangle', [[0, 0], [10, 30]], class_name='Nuclei'),
+                        self.ss.createAnnotation('Point', [[5, 5]], class_name='Cells')])
+        aggregator.add(None, tiles=1)
+        aggregator.addValues([0.2, 0.9, 0.7], 'Cells')
+        aggregator.addValues([0.1, 0.8], ['Nuclei', 'Debris'])
+
+        stats = aggregator.stats()
+        self.assertEqual(stats['tiles'], 4)
+        cells, nuclei, debris = (stats['classes'][name] for name in ('Cells', 'Nuclei', 'Debris'))
+        self.assertEqual(cells['count'], 5)
+        self.assertAlmostEqual(cells['area_um2'], 4 + 25 + 400 + 300)
+        self.assertEqual(cells['area_histogram'], [2, 1, 2])
+        self.assertEqual(cells['size_histogram'], [2, 3])
+        self.assertEqual(nuclei['count'], 2)
+        self.assertAlmostEqual(nuclei['mean_area_um2'], (16 + 300) / 2)
+        self.assertEqual(nuclei['area_histogram'], [0, 1, 1])
+        self.assertEqual(cells['value_histogram'], [1, 2])
+        self.assertAlmostEqual(cells['mean_value'], 0.6)
+        self.assertEqual((debris['count'], debris['values']), (0, 1))
+        # one row per class, then the three histograms
+        table = aggregator.table()
+        self.assertEqual(table[0], ['Class', 'Count', 'Total area [um²]', 'Mean area [um²]', 'Mean probability'])
+        self.assertEqual(table[1], ['Cells', '5', '729.00', '145.80', '0.6'])
+        self.assertEqual(table[5], ['Area [um²]', '< 10 um²', '10 - 100 um²', '>= 100 um²'])
+        self.assertEqual(len(table), 4 + 3 * 5)
+        self.assertEqual(self.server.diagrams, [])
+
+        self.ss.addAnnotationClasses([self.ss.createAnnotationClass('Cells', fill_color='#ff00ff00')])
+        aggregator.finish()
+        self.assertEqual([diagram['title'] for diagram in self.server.diagrams],
+                         ['Results: annotations per class', 'Results: area', 'Results: size', 'Results: Probability'])
+        counts = self.server.diagrams[0]
+        self.assertEqual(counts['subtitle'], '7 annotations in 4 tiles')
+        self.assertEqual([(series['name'], series['values']) for series in counts['dataSeries']],
+                         [('Cells', [5]), ('Nuclei', [2]), ('Debris', [0])])
+        self.assertEqual(counts['dataSeries'][0]['color'], '#ff00ff00')
+        self.assertEqual(self.server.diagrams[1]['valueGroupNames'], ['< 10 um²', '10 - 100 um²', '>= 100 um²'])
+        self.assertEqual(self.server.csv[-1]['csv'], table)
+        with self.assertRaises(Exception):
+            ResultAggregator(self.ss).addValues([1.0], 'Cells')
+
+    def test_partial_results(self):
+        aggregator = ResultAggregator(self.ss, interval_s=0.05)
+        aggregator.add(AnnotationBatch.fromContours(_squares([5]), 'Cells'))
+        self.assertEqual(self.server.csv, [])
+        for i in range(3):
+            time.sleep(0.1)
+            aggregator.add(AnnotationBatch.fromContours(_squares([5]), 'Cells'))
+        # partial results only replace the table, the diagrams would pile up in the results
+        self.assertEqual(len(self.server.csv), 3)
+        self.assertEqual(self.server.csv[-1]['csv'][1][:2], ['Cells', '4'])
+        self.assertEqual(self.server.diagrams, [])
+        aggregator.finish()
+        self.assertEqual(len(self.server.diagrams), 3)
+        self.assertEqual(self.server.diagrams[0]['subtitle'], '4 annotations in 0 tiles')
+        self.assertEqual(aggregator.stats()['published'], 4)
+
+    def test_batch_runner(self):
+        tiles = [[[x, y], [x + 100, y + 100]] for y in range(0, 400, 100) for x in range(0, 400, 100)]
+
+        def postprocess(batch_tiles, results):
+            return AnnotationBatch.fromContours([_squares([side], tile[0][0])[0] for tile, side in
+                                                 zip(batch_tiles, results)], 'Cells')
+
+        aggregator = ResultAggregator(self.ss, interval_s=0)
+        runner = BatchRunner(self.ss, lambda batch: [3.0] * len(batch), postprocess=postprocess, batch_size=5,
+                             w_px=16, h_px=16, aggregator=aggregator)
+        self.assertEqual(runner.run(tiles), 16)
+        stats = aggregator.stats()
+        self.assertEqual((stats['tiles'], stats['published']), (16, 1))
+        self.assertEqual(stats['classes']['Cells']['count'], 16)
+        self.assertAlmostEqual(stats['classes']['Cells']['area_um2'], 16 * 9.0)
+        self.assertEqual(self.server.diagrams[0]['subtitle'], '16 annotations in 16 tiles')
+        self.assertIn('Cells 16', aggregator.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# coding: utf-8
+
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.mock_slide_service import ArraySlide, MockSlideService
+from mikaia_plugin_api.roi_tiler import RoiTiler, otsuThreshold, tissueMask
+
+
+def _tissueSlide():
+    # 10 x 10 mm slide with a round piece of tissue in the center
+    y, x = np.mgrid[0:500, 0:500]
+    pixels = np.full((500, 500, 3), 235, dtype=np.uint8)
+    pixels[(x - 250) ** 2 + (y - 250) ** 2 < 150 ** 2] = (180, 80, 160)
+    return ArraySlide(pixels, px_size_um=20.0)
+
+
+class TestRoiTiler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # no analysis ROI: the whole slide
+        cls.server = MockSlideService(_tissueSlide(), analysis_roi=[]).start()
+        cls.ss = mikaia_api.SlideService(cls.server.url, telemetry_rate_hz=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ss.close()
+        cls.server.close()
+
+    def test_otsu_and_tissue_mask(self):
+        values = np.array([10] * 100 + [200] * 50, dtype=np.uint8)
+        threshold = otsuThreshold(values)
+        self.assertTrue(10 <= threshold < 200)
+        mask = tissueMask(self.ss.getThumbnail())
+        self.assertTrue(mask[250, 250])
+        self.assertFalse(mask[10, 10])
+        # no saturation to separate the tissue
+        gray = np.asarray(self.ss.getThumbnail().convert('L'))
+        for thumbnail in (gray, gray[:, :, None], np.stack([gray] * 3, axis=2)):
+            with self.assertRaises(Exception):
+                tissueMask(thumbnail)
+
+    def test_path_with_holes_coverage(self):
+        roi = mikaia_api.Annotation(shapeType='PathWithHoles',
+                                    coordinates=[[1000, 1000, 9000, 1000, 9000, 9000, 1000, 9000],
+                                                 [3000, 3000, 7000, 3000, 7000, 7000, 3000, 7000]])
+        tiler = RoiTiler(self.ss, 200.0, rois=[roi], tissue=False)
+        self.assertEqual(tiler.gridTileCount(), 40 * 40)
+        self.assertEqual(len(tiler), 40 * 40 - 20 * 20)
+        for tile, coverage in tiler:
+            center = ((tile[0][0] + tile[1][0]) / 2.0, (tile[0][1] + tile[1][1]) / 2.0)
+            self.assertTrue(roi.containsPoint(*center))
+            self.assertAlmostEqual(coverage, 1.0)
+        self.assertEqual(tiler.coverageMap().shape, (40, 40))
+
+    def test_partial_coverage(self):
+        roi = mikaia_api.Annotation(shapeType='Polygon', coordinates=[[0, 0, 1000, 0, 0, 1000]])
+        tiler = RoiTiler(self.ss, 1000.0, 500.0, rois=[roi], min_coverage=0.0, tissue=False)
+        coverages = tiler.coverages()
+        self.assertEqual(len(coverages), 2)
+        self.assertAlmostEqual(coverages[0], 0.75, delta=0.05)
+        self.assertAlmostEqual(coverages[1], 0.25, delta=0.05)
+
+    def test_whole_slide_with_tissue(self):
+        tiler = RoiTiler(self.ss, 250.0)
+        tissue_fraction = np.pi * 150 ** 2 / 500 ** 2
+        self.assertEqual(tiler.gridTileCount(), 40 * 40)
+        self.assertAlmostEqual(len(tiler) / tiler.gridTileCount(), tissue_fraction, delta=0.03)
+        self.assertTrue(all(coverage >= 0.5 for coverage in tiler.coverages()))
+
+
+if __name__ == '__main__':
+    unittest.main()
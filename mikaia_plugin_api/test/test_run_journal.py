@@ -0,0 +1,176 @@
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.batch_runner import BatchRunner
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+from mikaia_plugin_api.run_journal import RunJournal
+
+
+class TestRunJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = MockSlideService(SyntheticSlide(4000, 4000, 0.5)).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        self.tiles = [[[x, y], [x + 100, y + 100]] for y in range(0, 400, 100) for x in range(0, 500, 100)]
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def journal(self, **params):
+        return RunJournal.forRun(self.ss, params=dict({'tile_px': 200}, **params), script='test.py',
+                                 directory=self.directory)
+
+    def test_journal_per_run(self):
+        with self.journal() as journal:
+            path = journal.path
+        with self.journal() as journal:
+            self.assertEqual(journal.path, path)
+        with self.journal(tile_px=100) as journal:
+            self.assertNotEqual(journal.path, path)
+        # another session of the same slide
+        ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        self.assertEqual(ss.slideIdentity(), self.ss.slideIdentity())
+        ss.close()
+
+    def test_resume(self):
+        with self.journal() as journal:
+            self.assertEqual(journal.remaining(self.tiles), self.tiles)
+            self.assertTrue(journal.summary().startswith('New run'))
+            for tile in self.tiles[:8]:
+                anno = self.ss.createAnnotation('Rectangle', tile, class_name='Tumor')
+                self.assertTrue(journal.upload(self.ss, [tile], [anno]))
+            # crash: inferred, but never uploaded
+            batch = AnnotationBatch.fromContours([np.array([[0, 0], [5, 0], [5, 5]])], class_name='Cells')
+            journal.markInferred(self.tiles[8:10], batch)
+            journal.markInferred(self.tiles[10:11], [self.ss.createAnnotation('Rectangle', self.tiles[10])])
+            path = journal.path
+        # incomplete record of the crash
+        with open(path, 'ab') as f:
+            f.write(b'{"s":"uploaded","n":1')
+        self.assertEqual(len(self.server.annotations), 8)
+
+        with self.journal() as journal:
+            self.assertEqual(journal.resumeUploads(self.ss), 3)
+            self.assertEqual(len(self.server.annotations), 10)
+            self.assertTrue(journal.isDone(self.tiles[9]))
+            self.assertEqual(journal.remaining(self.tiles), self.tiles[11:])
+            stats = journal.stats()
+            self.assertEqual((stats['completed'], stats['pending'], stats['skipped'], stats['remaining'],
+                              stats['reuploaded']), (8, 3, 11, 9, 3))
+            self.assertIn('11 of 20 tiles already done', journal.summary())
+            # the journal can be appended after the incomplete record
+            journal.upload(self.ss, self.tiles[11:12], None)
+
+        with self.journal() as journal:
+            self.assertEqual(journal.resumeUploads(self.ss), 0)
+            self.assertEqual(journal.remaining(self.tiles), self.tiles[12:])
+        self.assertEqual(len(self.server.annotations), 10)
+
+    def test_pending_masks(self):
+        with self.journal() as journal:
+            anno = self.ss.createAnnotation('Rectangle', self.tiles[0])
+            anno.shapeType = 'Mask'
+            anno.mask = np.ones((4, 4), dtype=np.uint8)
+            anno.maskSizeInPx = [4, 4]
+            journal.markInferred(self.tiles[:1], [anno])
+            # the ndarray mask isn't changed by recording it
+            self.assertIsInstance(anno.mask, np.ndarray)
+            self.assertEqual(journal.stats()['completed'], 0)
+        with self.journal() as journal:
+            self.assertEqual(journal.remaining(self.tiles[:2]), self.tiles[1:2])
+            self.assertEqual(journal.resumeUploads(self.ss), 1)
+        masks = self.ss.getAnnotations(shape_type='Mask')
+        np.testing.assert_array_equal(masks[0].maskArray(), np.ones((4, 4)))
+
+    def test_compaction(self):
+        with self.journal() as journal:
+            for tile in self.tiles:
+                contour = np.array([[tile[0][0], tile[0][1]], [tile[1][0], tile[0][1]], [tile[1][0], tile[1][1]]])
+                journal.upload(self.ss, [tile], AnnotationBatch.fromContours([contour] * 20))
+            path = journal.path
+        size = os.path.getsize(path)
+        with self.journal() as journal:
+            self.assertEqual(journal.remaining(self.tiles), [])
+        self.assertLess(os.path.getsize(path) * 2, size)
+
+    def test_batch_runner(self):
+        def toAnnotations(batch_tiles, results):
+            return [self.ss.createAnnotation('Rectangle', tile, class_name='Class {}'.format(int(result)))
+                    for tile, result in zip(batch_tiles, results)]
+
+        calls = []
+        interrupt = [True]
+
+        def model(batch):
+            calls.append(len(batch))
+            if interrupt[0] and len(calls) == 3:
+                raise Exception('interrupted')
+            return batch.mean(axis=(1, 2, 3))
+
+        with self.journal() as journal:
+            runner = BatchRunner(self.ss, model, postprocess=toAnnotations, batch_size=4, w_px=50, h_px=50,
+                                 journal=journal)
+            with self.assertRaises(Exception):
+                runner.run(self.tiles)
+        # the batches predicted before the interruption are uploaded or pending in the journal
+        uploaded = len(self.server.annotations)
+        self.assertLessEqual(uploaded, 8)
+
+        calls.clear()
+        interrupt[0] = False
+        with self.journal() as journal:
+            runner = BatchRunner(self.ss, model, postprocess=toAnnotations, batch_size=4, w_px=50, h_px=50,
+                                 journal=journal)
+            processed = runner.run(self.tiles)
+            stats = journal.stats()
+        self.assertEqual(stats['skipped'], uploaded + stats['reuploaded'])
+        self.assertEqual(processed, 20 - stats['skipped'])
+        self.assertEqual(sum(calls), processed)
+        # no tile was uploaded twice
+        self.assertEqual(len(self.server.annotations), 20)
+        with self.assertRaises(Exception):
+            BatchRunner(self.ss, model, w_px=50, h_px=50, journal=journal)
+
+    def test_unreadable_tiles_are_retried(self):
+        def postprocess(batch_tiles, results):
+            return AnnotationBatch.fromContours([np.array(tile, dtype=np.float32).reshape(-1, 2)[[0, 1, 1]]
+                                                 for tile in batch_tiles], 'Cells')
+
+        iter_tiles = self.ss.iterTiles
+        failing = self.tiles[3]
+
+        def unreliableTiles(tiles, **args):
+            for tile, pixels in iter_tiles(tiles, **args):
+                yield tile, None if tile == failing else pixels
+
+        with self.journal() as journal:
+            runner = BatchRunner(self.ss, lambda batch: batch, postprocess=postprocess, batch_size=4, w_px=16,
+                                 h_px=16, journal=journal)
+            with mock.patch.object(self.ss, 'iterTiles', side_effect=unreliableTiles):
+                self.assertEqual(runner.run(self.tiles), len(self.tiles) - 1)
+            self.assertEqual(runner.failedTiles(), [failing])
+            self.assertEqual(runner.stats()['failed_tiles'], 1)
+            self.assertIn('1 failed', runner.summary())
+        # the rerun reads the failed tile again
+        with self.journal() as journal:
+            self.assertEqual(journal.remaining(self.tiles), [failing])
+            runner = BatchRunner(self.ss, lambda batch: batch, postprocess=postprocess, batch_size=4, w_px=16,
+                                 h_px=16, journal=journal)
+            self.assertEqual(runner.run(self.tiles), 1)
+        self.assertEqual(len(self.server.annotations), len(self.tiles))
+
+
+if __name__ == '__main__':
+    unittest.main()
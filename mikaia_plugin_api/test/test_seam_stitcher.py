@@ -0,0 +1,122 @@
+# coding: utf-8
+
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.seam_stitcher import SeamStitcher, overlappedTiling
+
+
+def _cells(count, size_um, seed=0):
+    # non-overlapping round cells, 4 to 10 um radius
+    rng = np.random.default_rng(seed)
+    centers, radii = [], []
+    while len(centers) < count:
+        center, radius = rng.uniform(15, size_um - 15, 2), rng.uniform(4, 10)
+        if all(np.hypot(*(center - other)) > radius + other_radius + 1 for other, other_radius in zip(centers, radii)):
+            centers.append(center)
+            radii.append(radius)
+    return np.array(centers), np.array(radii)
+
+
+def _segment(tile, centers, radii, rng):
+    # cells cut by the tile border are clipped to the tile, every tile sees slightly different outlines
+    (x0, y0), (x1, y1) = tile
+    angles = np.linspace(0, 2 * np.pi, 16, endpoint=False)
+    contours = []
+    for center, radius in zip(centers, radii):
+        if center[0] + radius < x0 or center[0] - radius > x1 or center[1] + radius < y0 or center[1] - radius > y1:
+            continue
+        outline = center + (radius + rng.normal(0, 0.3)) * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        outline = np.clip(outline + rng.normal(0, 0.2, 2), [x0, y0], [x1, y1])
+        if np.ptp(outline[:, 0]) > 0.5 and np.ptp(outline[:, 1]) > 0.5:
+            contours.append(outline)
+    return AnnotationBatch.fromContours(contours, 'Cells')
+
+
+class TestSeamStitcher(unittest.TestCase):
+
+    def setUp(self):
+        self.centers, self.radii = _cells(400, 1000)
+        tile_w, tile_h, stride_w, stride_h = overlappedTiling(300, 300, 30)
+        self.assertEqual((stride_w, stride_h), (240, 240))
+        self.tiles = [[[x, y], [x + tile_w, y + tile_h]] for y in range(0, 1000, 240) for x in range(0, 1000, 240)]
+
+    def stitch(self, stitcher, order, seed=1):
+        rng = np.random.default_rng(seed)
+        result = AnnotationBatch()
+        for i in order:
+            result.extend(stitcher.add(self.tiles[i], _segment(self.tiles[i], self.centers, self.radii, rng)))
+        return result.extend(stitcher.flush())
+
+    def checkCells(self, result):
+        # every cell exactly once and complete
+        boxes = result.boundingBoxes()
+        found = (boxes[:, :2] + boxes[:, 2:]) / 2.0
+        distances = np.linalg.norm(found[:, None, :] - self.centers[None, :, :], axis=2)
+        nearest = np.argmin(distances, axis=1)
+        self.assertLess(np.max(distances[np.arange(len(found)), nearest]), 2.0)
+        self.assertEqual(np.bincount(nearest, minlength=len(self.centers)).tolist(), [1] * len(self.centers))
+        np.testing.assert_array_less(0.6 * np.pi * self.radii[nearest] ** 2, result.areas())
+
+    def test_row_major_order(self):
+        stitcher = SeamStitcher(self.tiles, 30)
+        rng = np.random.default_rng(1)
+        first = stitcher.add(self.tiles[0], _segment(self.tiles[0], self.centers, self.radii, rng))
+        # the interior of the first tile is final at once, the cells along its seams wait for the neighbours
+        self.assertGreater(len(first), 0)
+        self.assertGreater(stitcher.stats()['pending'], 0)
+        result = first.extend(self.stitch(stitcher, range(1, len(self.tiles))))
+        self.checkCells(result)
+        stats = stitcher.stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['released'], len(self.centers))
+        self.assertGreater(stats['outside_core'], 0)
+        self.assertEqual(stats['instances'], stats['released'] + stats['outside_core'] + stats['duplicates'])
+        self.assertIn('duplicates', stitcher.summary())
+
+    def test_any_order_and_wide_seams(self):
+        # with wide seams many cells are found by two tiles and deduplicated
+        stitcher = SeamStitcher(self.tiles, 30, seam_um=10)
+        self.checkCells(self.stitch(stitcher, np.random.default_rng(3).permutation(len(self.tiles))))
+        self.assertGreater(stitcher.stats()['duplicates'], 10)
+
+    def test_skipped_tiles(self):
+        # cells waiting for a tile that is never added are returned by flush()
+        stitcher = SeamStitcher(self.tiles, 30)
+        result = self.stitch(stitcher, [0])
+        self.assertEqual(stitcher.stats()['pending'], 0)
+        (x0, y0), (x1, y1) = self.tiles[0]
+        inside = ((self.centers[:, 0] - self.radii > x0) & (self.centers[:, 0] + self.radii < x1 - 30)
+                  & (self.centers[:, 1] - self.radii > y0) & (self.centers[:, 1] + self.radii < y1 - 30))
+        self.assertGreaterEqual(len(result), np.count_nonzero(inside))
+
+    def test_resumed_run(self):
+        # the first run stops after 9 tiles, without flush(): the cells released so far were uploaded
+        order = np.random.default_rng(5).permutation(len(self.tiles))
+        stitcher = SeamStitcher(self.tiles, 30)
+        rng = np.random.default_rng(1)
+        uploaded = AnnotationBatch()
+        for i in order[:9]:
+            uploaded.extend(stitcher.add(self.tiles[i], _segment(self.tiles[i], self.centers, self.radii, rng)))
+        self.assertGreater(stitcher.stats()['pending'], 0)
+        # the rerun stitches the remaining tiles
+        stitcher = SeamStitcher(self.tiles, 30, done=[self.tiles[i] for i in order[:9]])
+        self.checkCells(uploaded.extend(self.stitch(stitcher, order[9:], seed=2)))
+        with self.assertRaises(Exception):
+            stitcher.add(self.tiles[order[0]], None)
+
+    def test_errors(self):
+        stitcher = SeamStitcher(self.tiles, 30)
+        with self.assertRaises(Exception):
+            stitcher.add([[1, 1], [301, 301]], None)
+        self.assertEqual(len(stitcher.add(self.tiles[0], None)), 0)
+        with self.assertRaises(Exception):
+            stitcher.add(self.tiles[0], None)
+        with self.assertRaises(Exception):
+            overlappedTiling(100, 100, 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
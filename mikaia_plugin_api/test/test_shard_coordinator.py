@@ -0,0 +1,154 @@
+# coding: utf-8
+
+import threading
+import time
+import unittest
+from multiprocessing.connection import Client
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.annotation_batch import AnnotationBatch
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+from mikaia_plugin_api.result_aggregator import ResultAggregator
+from mikaia_plugin_api.shard_coordinator import ShardCoordinator, runWorker
+
+
+# Worker factories are top level functions, the worker processes import them.
+
+# one rectangle per tile, classified by the mean intensity of the tile
+def setupClassifier(ss):
+    def process(tiles):
+        batch = AnnotationBatch()
+        for tile, pixels in ss.iterTiles(tiles, w_px=32, h_px=32):
+            class_name = 'Tissue' if pixels.mean() < 230 else 'Glass'
+            batch.addAnnotation('Rectangle', tile, class_name=class_name)
+        return batch
+    return process
+
+
+# the worker running in thread 'slow' needs much longer per chunk
+def setupStraggler(ss):
+    slow = threading.current_thread().name == 'slow'
+
+    def process(tiles):
+        time.sleep(0.2 if slow else 0.01)
+        return [ss.createAnnotation('Rectangle', tile, class_name='Tile') for tile in tiles]
+    return process
+
+
+def setupFailing(ss):
+    def process(tiles):
+        if any(tile[0][0] == 300 for tile in tiles):
+            raise ValueError('bad tile')
+        return None
+    return process
+
+
+class TestShardCoordinator(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockSlideService(SyntheticSlide(4000, 4000, 0.5)).start()
+        self.ss = mikaia_api.SlideService(self.server.url, telemetry_rate_hz=0)
+        self.tiles = [[[x, y], [x + 50, y + 50]] for y in range(0, 500, 50) for x in range(0, 600, 50)]
+
+    def tearDown(self):
+        self.ss.close()
+        self.server.close()
+
+    def startWorkers(self, coordinator, names, slide_url=None):
+        threads = [threading.Thread(target=runWorker, args=(coordinator.address, coordinator.authkey, name, slide_url),
+                                    name=name, daemon=True) for name in names]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test_local_processes(self):
+        aggregator = ResultAggregator(self.ss, interval_s=0)
+        with ShardCoordinator(self.ss, setupClassifier, workers=2, chunk_tiles=4, aggregator=aggregator) as coordinator:
+            self.assertEqual(coordinator.run(self.tiles), 120)
+        stats = coordinator.stats()
+        self.assertEqual(stats['tiles'], 120)
+        self.assertEqual(sum(worker['tiles'] for worker in stats['workers'].values()), 120)
+        # merged into one upload
+        self.assertEqual(stats['uploads'], 1)
+        uploaded = sorted(tuple(anno['coordinates'][0][:2]) for anno in self.server.annotations.values())
+        self.assertEqual(uploaded, sorted((float(tile[0][0]), float(tile[0][1])) for tile in self.tiles))
+        self.assertEqual(self.server.progress[-1]['message'], '120 of 120 tiles processed')
+        self.assertIn('workers', coordinator.summary())
+        classes = aggregator.stats()['classes']
+        self.assertEqual(sum(item['count'] for item in classes.values()), 120)
+        self.assertAlmostEqual(sum(item['area_um2'] for item in classes.values()), 120 * 2500.0)
+        self.assertEqual(self.server.diagrams[0]['subtitle'], '120 annotations in 120 tiles')
+
+    def test_work_stealing(self):
+        coordinator = ShardCoordinator(self.ss, setupStraggler, workers=0, shards=3, chunk_tiles=2,
+                                       merge_annotations=50)
+        threads = self.startWorkers(coordinator, ['slow', 'fast-1', 'fast-2'])
+        self.assertEqual(coordinator.run(self.tiles), 120)
+        for thread in threads:
+            thread.join()
+        stats = coordinator.stats()
+        workers = {worker['name']: worker for worker in stats['workers'].values()}
+        self.assertGreater(stats['steals'], 0)
+        self.assertLess(workers['slow']['tiles'], 40)
+        self.assertGreater(workers['fast-1']['tiles'] + workers['fast-2']['tiles'], 80)
+        self.assertGreater(stats['uploads'], 1)
+        self.assertEqual(len(self.server.annotations), 120)
+        progress = [update['progressRatio'] for update in self.server.progress]
+        self.assertEqual(progress, sorted(progress))
+
+    def runInThread(self, coordinator):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(coordinator.run(self.tiles)), daemon=True)
+        thread.start()
+        return thread, result
+
+    def test_disconnected_worker(self):
+        coordinator = ShardCoordinator(self.ss, setupStraggler, workers=0, chunk_tiles=4)
+        thread, result = self.runInThread(coordinator)
+        # takes a chunk and disappears
+        conn = Client(coordinator.address, authkey=bytes.fromhex(coordinator.authkey))
+        conn.send(('hello', 'lost'))
+        conn.recv()
+        conn.send(('next', None, None, 0.0))
+        self.assertEqual(conn.recv()[0], 'chunk')
+        conn.close()
+        self.startWorkers(coordinator, ['worker'])
+        thread.join()
+        self.assertEqual(result, [120])
+        self.assertEqual(coordinator.stats()['requeued'], 1)
+        self.assertEqual(len(self.server.annotations), 120)
+
+    def test_slide_url(self):
+        remote_url = 'http://10.0.0.1:9980/MIKAIA/SlideService/v1/remote'
+        coordinator = ShardCoordinator(self.ss, setupStraggler, workers=0, chunk_tiles=4, slide_url=remote_url)
+        thread, result = self.runInThread(coordinator)
+        conn = Client(coordinator.address, authkey=bytes.fromhex(coordinator.authkey))
+        conn.send(('hello', 'remote'))
+        self.assertEqual(conn.recv()[2], remote_url)
+        conn.close()
+        # the URL given to the worker wins over the one of the coordinator
+        self.startWorkers(coordinator, ['worker'], slide_url=self.server.url)
+        thread.join()
+        self.assertEqual(result, [120])
+        self.assertEqual(len(self.server.annotations), 120)
+
+    def test_failure(self):
+        coordinator = ShardCoordinator(self.ss, setupFailing, workers=0, chunk_tiles=4)
+        self.startWorkers(coordinator, ['worker'])
+        with self.assertRaises(Exception) as context:
+            coordinator.run(self.tiles)
+        self.assertIn('bad tile', str(context.exception))
+
+    def test_wrong_authkey(self):
+        coordinator = ShardCoordinator(self.ss, setupStraggler, workers=0, chunk_tiles=40)
+        thread, result = self.runInThread(coordinator)
+        with self.assertRaises(Exception):
+            Client(coordinator.address, authkey=b'wrong')
+        self.startWorkers(coordinator, ['worker'])
+        thread.join()
+        self.assertEqual(result, [120])
+        self.assertEqual(len(coordinator.stats()['workers']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+# Import time budgets in seconds(measured in a fresh interpreter, without the interpreter start itself).
+# Slow machines can scale them with the environment variable MIKAIA_STARTUP_BUDGET_SCALE.
+_BUDGET_SCALE = float(os.environ.get('MIKAIA_STARTUP_BUDGET_SCALE', '1.0'))
+_BUDGETS = {
+    'mikaia_plugin_api.mikaia_api': 0.5,
+    'mikaia_plugin_api.console.__main__': 0.5,
+    'mikaia_plugin_api.script_service_server.controllers.mikaia_script_service': 0.3,
+}
+_HEAVY_MODULES = ['numpy', 'PIL', 'requests', 'pkg_resources']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def _measureImport(module, runs=3):
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=package_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = []
+    with tempfile.TemporaryDirectory() as working_dir:
+        for i in range(runs):
+            output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], cwd=working_dir, env=env,
+                                    stdout=subprocess.PIPE, check=True).stdout
+            results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+    elapsed = sorted(result['elapsed'] for result in results)[len(results) // 2]
+    return elapsed, set(results[0]['modules'])
+
+
+class TestStartup(unittest.TestCase):
+    """Startup benchmark: import times of the modules that are loaded on every plugin/console/service start"""
+
+    def test_import_budgets(self):
+        for module, budget in _BUDGETS.items():
+            elapsed, modules = _measureImport(module)
+            print('import {}: {:.0f} ms(budget {:.0f} ms)'.format(module, elapsed * 1000, budget * _BUDGET_SCALE * 1000))
+            self.assertLess(elapsed, budget * _BUDGET_SCALE, module)
+
+    def test_no_heavy_imports(self):
+        elapsed, modules = _measureImport('mikaia_plugin_api.mikaia_api', runs=1)
+        self.assertEqual([name for name in _HEAVY_MODULES if name in modules], [])
+        elapsed, modules = _measureImport('mikaia_plugin_api.script_service_server.controllers.mikaia_script_service',
+                                          runs=1)
+        self.assertEqual([name for name in _HEAVY_MODULES if name in modules], [])
+        self.assertNotIn('mikaia_plugin_api.mikaia_api', modules)
+
+    def test_get_free_port_skips_used_ports(self):
+        from mikaia_plugin_api.script_service_server.__main__ import get_free_port
+        start = time.perf_counter()
+        try:
+            port = get_free_port()
+        except Exception:
+            self.skipTest('no free port from 9970 to 9979')
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('127.0.0.1', port))
+            s.listen(1)
+            try:
+                self.assertNotEqual(get_free_port(), port)
+            except Exception:
+                pass  # all other ports in use
+        self.assertLess(time.perf_counter() - start, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# coding: utf-8
+
+import threading
+import time
+import unittest
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.http_transport import HttpTransport
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+from mikaia_plugin_api.telemetry_sender import TelemetrySender
+
+
+class TestTelemetrySender(unittest.TestCase):
+
+    def test_progress_is_coalesced(self):
+        sent = []
+        with TelemetrySender(sent.append, rate_hz=10.0) as sender:
+            for i in range(10001):
+                sender.progress(i)
+        self.assertLess(len(sent), 10)
+        self.assertEqual(sent[-1], 10000)
+        self.assertEqual(sent, sorted(sent))
+
+    def test_rate_limit(self):
+        sent = []
+        sender = TelemetrySender(lambda item: sent.append(time.monotonic()), rate_hz=20.0)
+        end = time.monotonic() + 0.5
+        while time.monotonic() < end:
+            sender.progress(0.5)
+            time.sleep(0.001)
+        sender.close()
+        self.assertLessEqual(len(sent), 13)
+        self.assertTrue(all(b - a >= 0.045 for a, b in zip(sent, sent[1:-1])))
+
+    def test_messages_in_order(self):
+        sent = []
+        with TelemetrySender(sent.append, rate_hz=1.0) as sender:
+            for i in range(500):
+                sender.message(i)
+        self.assertEqual(sent, list(range(500)))
+
+    def test_bounded_message_queue(self):
+        release = threading.Event()
+        sent = []
+
+        def send(item):
+            release.wait(5)
+            sent.append(item)
+
+        sender = TelemetrySender(send, max_messages=10, drop_notice=lambda count: 'dropped {}'.format(count))
+        sender.message('first')  # blocks the sender thread
+        time.sleep(0.05)
+        for i in range(25):
+            sender.message(i)
+        release.set()
+        sender.close()
+        self.assertEqual(sent, ['first', 'dropped 15'] + list(range(15, 25)))
+
+    def test_calls_dont_block(self):
+        release = threading.Event()
+        sender = TelemetrySender(lambda item: release.wait(5))
+        sender.progress(0.0)
+        start = time.perf_counter()
+        for i in range(1000):
+            sender.progress(i / 1000)
+            sender.message(str(i))
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertFalse(sender.flush(timeout=0.05))
+        release.set()
+        self.assertTrue(sender.flush(timeout=5))
+        sender.close()
+
+    def test_send_errors_are_reported(self):
+        sent = []
+
+        def send(item):
+            if item == 'bad':
+                raise Exception('connection refused')
+            sent.append(item)
+
+        with TelemetrySender(send) as sender:
+            sender.message('bad')
+            sender.message('good')
+        self.assertEqual(sent, ['good'])
+
+    def test_slide_service(self):
+        # every request takes 10 ms
+        with MockSlideService(SyntheticSlide(1000, 1000, 0.25), latency_s=0.01) as server:
+            transport = HttpTransport()
+            with mikaia_api.SlideService(server.url, transport=transport, telemetry_rate_hz=10.0) as ss:
+                ss.sendMessage('started')
+                for i in range(1000):
+                    ss.sendProgress((i + 1) / 1000, i + 1, 'tile {}'.format(i + 1))
+                ss.sendMessage('finished')
+                self.assertTrue(ss.flushTelemetry(timeout=5))
+                self.assertLess(len(server.progress), 10)
+            self.assertTrue(transport._closed)
+            messages = [p['message'] for p in server.progress if p['progressRatio'] < 0]
+            self.assertEqual(messages, ['started', 'finished'])
+            last = [p for p in server.progress if p['progressRatio'] >= 0][-1]
+            self.assertEqual(last['progressRatio'], 1.0)
+            self.assertEqual(last['message'], 'tile 1000')
+
+    def test_slide_service_synchronous(self):
+        with MockSlideService(SyntheticSlide(1000, 1000, 0.25)) as server:
+            ss = mikaia_api.SlideService(server.url, telemetry_rate_hz=0)
+            for i in range(5):
+                ss.sendProgress(i / 4)
+            self.assertEqual([p['progressRatio'] for p in server.progress], [0.0, 0.25, 0.5, 0.75, 1.0])
+            ss.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
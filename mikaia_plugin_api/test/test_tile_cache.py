@@ -0,0 +1,75 @@
+# coding: utf-8
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from mikaia_plugin_api import mikaia_api
+from mikaia_plugin_api.mock_slide_service import MockSlideService, SyntheticSlide
+from mikaia_plugin_api.tile_cache import TileCache
+
+
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_tiers_and_persistence(self):
+        cache = TileCache(self.directory, max_disk_mb=1, max_memory_mb=1)
+        data = np.arange(1000, dtype=np.uint8)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', data)
+        np.testing.assert_array_equal(cache.get('a'), data)
+        self.assertEqual(cache.stats()['memory_hits'], 1)
+
+        cache = TileCache(self.directory, max_disk_mb=1, max_memory_mb=1)
+        np.testing.assert_array_equal(cache.get('a'), data)
+        np.testing.assert_array_equal(cache.get('a'), data)
+        stats = cache.stats()
+        self.assertEqual((stats['disk_hits'], stats['memory_hits'], stats['misses']), (1, 1, 0))
+
+    def test_lru_eviction(self):
+        cache = TileCache(self.directory, max_disk_mb=1, max_memory_mb=0)
+        block = np.zeros(300 * 1024, dtype=np.uint8)
+        for key in 'abc':
+            cache.put(key, block)
+        cache.get('a')
+        cache.put('d', block)
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.stats()['disk_bytes'], 1024 * 1024)
+
+    def test_slide_service_cache(self):
+        with MockSlideService(SyntheticSlide(1000, 1000, 0.25), raw_pixels=False) as server:
+            ss = mikaia_api.SlideService(server.url, telemetry_rate_hz=0, tile_cache=TileCache(self.directory))
+            ss.getSlideInfo()
+            requests = server.requestCount
+            first = ss.getNativeROIArray(3.0, 0.0, 32, 16)
+            second = ss.getNativeROIArray(3.0, 0.0, 32, 16)
+            np.testing.assert_array_equal(first, second)
+            self.assertTrue(second.flags.writeable)
+            ss.getNativeROIArray(3.0, 0.0, 32, 16, px_format='BGR')
+            img = ss.getNativeROI(3.0, 0.0, 32, 16)
+            img = ss.getNativeROI(3.0, 0.0, 32, 16)
+            self.assertEqual(img.size, (32, 16))
+            self.assertEqual(server.requestCount - requests, 3)
+            ss.close()
+
+            # a new session on the same slide is served from disk
+            ss = mikaia_api.SlideService(server.url, telemetry_rate_hz=0, tile_cache=TileCache(self.directory))
+            ss.getSlideInfo()
+            requests = server.requestCount
+            np.testing.assert_array_equal(ss.getNativeROIArray(3.0, 0.0, 32, 16), first)
+            self.assertEqual(server.requestCount, requests)
+            self.assertEqual(ss.getTileCacheStats()['disk_hits'], 1)
+            ss.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# coding: utf-8
+
+import threading
+import time
+import unittest
+
+from mikaia_plugin_api.tile_reader import TileReader
+
+
+class TestTileReader(unittest.TestCase):
+
+    def test_ordered(self):
+        def fetch(tile):
+            time.sleep(0.001 * (10 - tile))
+            return tile * 2
+
+        result = list(TileReader(fetch, range(10), max_in_flight=4))
+        self.assertEqual(result, [(t, t * 2) for t in range(10)])
+
+    def test_unordered_yields_all_tiles(self):
+        result = list(TileReader(lambda tile: tile, range(50), max_in_flight=8, ordered=False))
+        self.assertEqual(sorted(result), [(t, t) for t in range(50)])
+
+    def test_none_tiles(self):
+        # None is a tile like any other, not the end of the tiles
+        result = list(TileReader(lambda tile: 'img', [1, None, 2], max_in_flight=2))
+        self.assertEqual(result, [(1, 'img'), (None, 'img'), (2, 'img')])
+
+    def test_backpressure(self):
+        lock = threading.Lock()
+        fetched = []
+
+        def fetch(tile):
+            with lock:
+                fetched.append(tile)
+            return tile
+
+        reader = iter(TileReader(fetch, range(100), max_in_flight=3))
+        next(reader)
+        time.sleep(0.05)
+        self.assertLessEqual(len(fetched), 4)
+        reader.close()
+
+    def test_close_cancels_pending_requests(self):
+        started = []
+
+        def fetch(tile):
+            started.append(tile)
+            time.sleep(0.01)
+            return tile
+
+        with TileReader(fetch, range(100), max_in_flight=4, workers=1) as reader:
+            for tile, value in reader:
+                if tile == 2:
+                    break
+        time.sleep(0.05)
+        self.assertLess(len(started), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
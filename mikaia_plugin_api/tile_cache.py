@@ -0,0 +1,172 @@
+import collections
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+
+#####################################################
+## Persistent tile cache for SlideService requests ##
+#####################################################
+class TileCache(object):
+    """TileCache Two-tier LRU cache for pixel data read from the MIKAIA SlideService.
+
+    Entries are uint8 arrays(decoded pixels or encoded image bytes). Each entry is stored as
+    .npy chunk file below 'directory' and memory-mapped when it is read again, so cached pixels
+    survive across plugin runs. A small in-memory hot tier sits in front of the disk store.
+    Both tiers are bounded and evict the least recently used entries.
+    The cache can be shared by several threads.
+    """
+
+    # directory: directory of the on-disk store. Created if it doesn't exist.
+    # max_disk_mb: size cap of the on-disk store in MB.
+    # max_memory_mb: size cap of the in-memory hot tier in MB(0 disables the hot tier).
+    def __init__(self, directory, max_disk_mb=4096, max_memory_mb=256):
+        self._directory = os.path.abspath(directory)
+        self._maxDiskBytes = int(max_disk_mb * 1024 * 1024)
+        self._maxMemoryBytes = int(max_memory_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()  # entry name -> ndarray, in LRU order
+        self._memoryBytes = 0
+        self._disk = collections.OrderedDict()  # entry name -> file size, in LRU order
+        self._diskBytes = 0
+        self.resetStats()
+
+        os.makedirs(self._directory, exist_ok=True)
+        entries = []
+        for root, dirs, files in os.walk(self._directory):
+            for file_name in files:
+                if file_name.endswith('.npy'):
+                    stat = os.stat(os.path.join(root, file_name))
+                    entries.append((stat.st_mtime, file_name[:-4], stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self._disk[name] = size
+            self._diskBytes += size
+        self._evictDisk()
+
+    def __str__(self):
+        return '{}(directory={}, disk={:.1f} MB, memory={:.1f} MB)'.format(
+            self.__class__.__name__, self._directory, self._diskBytes / 1048576, self._memoryBytes / 1048576)
+
+    # Returns the cached read-only array for 'key' or None.
+    # key: string that identifies the entry(see SlideService for the key layout).
+    def get(self, key):
+        name = self._entryName(key)
+        with self._lock:
+            data = self._memory.get(name)
+            if data is not None:
+                self._memory.move_to_end(name)
+                self._memoryHits += 1
+                return data
+            if name not in self._disk:
+                self._misses += 1
+                return None
+            self._disk.move_to_end(name)
+
+        path = self._entryPath(name)
+        try:
+            data = np.load(path, mmap_mode='r')
+            os.utime(path)  # keep the LRU order across runs
+        except (OSError, ValueError):
+            with self._lock:
+                size = self._disk.pop(name, None)
+                if size is not None:
+                    self._diskBytes -= size
+                self._misses += 1
+            return None
+
+        with self._lock:
+            self._diskHits += 1
+            self._addToMemory(name, data)
+        return data
+
+    # Stores a copy of the uint8 array 'data' under 'key' in both tiers.
+    def put(self, key, data):
+        name = self._entryName(key)
+        data = np.array(data, dtype=np.uint8, order='C')
+        data.flags.writeable = False
+
+        path = self._entryPath(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._diskBytes += size - self._disk.pop(name, 0)
+            self._disk[name] = size
+            self._bytesStored += data.nbytes
+            self._addToMemory(name, data)
+            self._evictDisk()
+
+    # Removes all entries from both tiers.
+    def clear(self):
+        with self._lock:
+            for name in self._disk:
+                try:
+                    os.remove(self._entryPath(name))
+                except OSError:
+                    pass
+            self._disk.clear()
+            self._diskBytes = 0
+            self._memory.clear()
+            self._memoryBytes = 0
+
+    # Returns the cache statistics as dict.
+    def stats(self):
+        with self._lock:
+            hits = self._memoryHits + self._diskHits
+            lookups = hits + self._misses
+            return {'memory_hits': self._memoryHits,
+                    'disk_hits': self._diskHits,
+                    'misses': self._misses,
+                    'hit_ratio': hits / lookups if lookups > 0 else 0.0,
+                    'evictions': self._evictions,
+                    'bytes_stored': self._bytesStored,
+                    'memory_entries': len(self._memory),
+                    'memory_bytes': self._memoryBytes,
+                    'disk_entries': len(self._disk),
+                    'disk_bytes': self._diskBytes}
+
+    # Resets the hit/miss counters.
+    def resetStats(self):
+        self._memoryHits = 0
+        self._diskHits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._bytesStored = 0
+
+    def _addToMemory(self, name, data):
+        if data.nbytes > self._maxMemoryBytes:
+            return
+        if isinstance(data, np.memmap):
+            data = np.array(data)
+            data.flags.writeable = False
+        old = self._memory.pop(name, None)
+        if old is not None:
+            self._memoryBytes -= old.nbytes
+        self._memory[name] = data
+        self._memoryBytes += data.nbytes
+        while self._memoryBytes > self._maxMemoryBytes:
+            evicted_name, evicted = self._memory.popitem(last=False)
+            self._memoryBytes -= evicted.nbytes
+
+    def _evictDisk(self):
+        while self._diskBytes > self._maxDiskBytes and self._disk:
+            name, size = self._disk.popitem(last=False)
+            self._diskBytes -= size
+            self._evictions += 1
+            try:
+                os.remove(self._entryPath(name))
+            except OSError:
+                pass
+
+    def _entryPath(self, name):
+        return os.path.join(self._directory, name[:2], name + '.npy')
+
+    @staticmethod
+    def _entryName(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
@@ -0,0 +1,90 @@
+import collections
+import concurrent.futures
+import threading
+
+_END = object()  # end of the tiles, None is a valid tile description
+
+
+######################################################
+## Prefetching tile iterator for SlideService reads ##
+######################################################
+class TileReader(object):
+    """TileReader Fetches tiles in background threads while the caller processes previous tiles.
+
+    At most 'max_in_flight' tile requests are pending at any time. New requests are only
+    issued when the caller consumes a tile(backpressure), so a slow model never causes
+    an unbounded number of tiles to pile up in memory.
+
+    Usage:
+        with TileReader(fetch, tiles, max_in_flight=8) as reader:
+            for tile, img in reader:
+                model.predict(img)
+    """
+
+    # fetch: callable(tile) -> image(ndarray) that reads one tile from the SlideService.
+    #        Called from worker threads, so it must be thread-safe(all SlideService methods are).
+    # tiles: iterable of tile descriptions, e.g. [[x0_um, y0_um], [x1_um, y1_um]] as passed to fetch().
+    # max_in_flight: maximum number of tiles requested but not yet consumed.
+    # workers: number of fetching threads(default: max_in_flight).
+    # ordered: if True tiles are yielded in input order, otherwise as soon as they are fetched.
+    def __init__(self, fetch, tiles, max_in_flight=8, workers=None, ordered=True):
+        if max_in_flight < 1:
+            raise Exception("Parameter 'max_in_flight' shall be at least 1.")
+        self._fetch = fetch
+        self._tiles = iter(tiles)
+        self._maxInFlight = max_in_flight
+        self._ordered = ordered
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or max_in_flight,
+                                                               thread_name_prefix='TileReader')
+        self._pending = collections.deque()  # (tile, future) in submission order
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        try:
+            self._fill()
+            while self._pending:
+                tile, future = self._next()
+                try:
+                    img = future.result()
+                except concurrent.futures.CancelledError:
+                    return  # closed by another thread
+                self._fill()
+                yield tile, img
+        finally:
+            self.close()
+
+    # Cancel all pending requests and stop the worker threads.
+    # Requests that are already being transmitted are completed, but their results are dropped.
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for tile, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False)
+
+    def _fill(self):
+        while not self._closed and len(self._pending) < self._maxInFlight:
+            tile = next(self._tiles, _END)
+            if tile is _END:
+                return
+            self._pending.append((tile, self._executor.submit(self._fetch, tile)))
+
+    def _next(self):
+        if self._ordered:
+            return self._pending.popleft()
+        futures = [future for tile, future in self._pending]
+        concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+        for i, (tile, future) in enumerate(self._pending):
+            if future.done():
+                del self._pending[i]
+                return tile, future